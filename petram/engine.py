@@ -1229,13 +1229,26 @@ class Engine(object):
         '''
         read initial gridfunction from solution
         if init_path is "", then file is read from cwd.
+        init_path can be incremental checkpoint (checkpoint_<solver>#<idx>)
         if file is not found, then it zeroes the gf
         '''
+        from petram.sol.checkpoint import (split_checkpoint_path,
+                                           read_checkpoint_ref)
+
         dprint1("apply_init_from_file", phys, init_path)
         emesh_idx = phys.emesh_idx
         names = phys.dep_vars
         suffix = self.solfile_suffix()
 
+        path = os.path.expanduser(init_path)
+        if path == '':
+            path = os.getcwd()
+        cp_path, cp_idx = split_checkpoint_path(path)
+        cp_data = None
+        if cp_idx is not None:
+            cp_data = read_checkpoint_ref(path, suffix)
+            path = cp_path
+
         for kfes, name in enumerate(phys.dep_vars):
             if not name in self._init_done:
                 self._init_done.append(name)
@@ -1247,14 +1260,6 @@ class Engine(object):
                 igf = None
             fr, fi = self.solfile_name(names[kfes], emesh_idx)
             meshname = 'solmesh_' + str(emesh_idx) + suffix
-            fr = fr + suffix
-            fi = fi + suffix
-
-            path = os.path.expanduser(init_path)
-            if path == '':
-                path = os.getcwd()
-            fr = os.path.join(path, fr)
-            fi = os.path.join(path, fi)
             meshname = os.path.join(path, meshname)
 
             rgf.Assign(0.0)
@@ -1262,6 +1267,22 @@ class Engine(object):
                 igf.Assign(0.0)
             if not os.path.exists(meshname):
                 assert False, "Meshfile for sol does not exist:"+meshname
+
+            if cp_data is not None:
+                # arrays have the same layout as GridFunction saved
+                # in checkpoint (see Engine.save_sol_to_checkpoint)
+                for gf, n in ((rgf, fr), (igf, fi)):
+                    if gf is None:
+                        continue
+                    if not n in cp_data:
+                        assert False, "Solution does not exist in checkpoint:"+n
+                    if len(cp_data[n]) != gf.Size():
+                        assert False, "Solution in checkpoint has different length!!!"
+                    gf.GetDataArray()[:] += cp_data[n]
+                continue
+
+            fr = os.path.join(path, fr + suffix)
+            fi = os.path.join(path, fi + suffix)
             if not os.path.exists(fr):
                 assert False, "Solution (real) does not exist:"+fr
             if igf is not None and not os.path.exists(fi):
@@ -1561,8 +1582,8 @@ class Engine(object):
                 for kfes, name in enumerate(names):
                     if not mm.has_extra_DoF2(kfes, phys2, self.access_idx):
                         continue
-                    gl_ess_tdof1, gl_ess_tdof2 = self.gl_ess_tdofs[name]
-                    gl_ess_tdof = gl_ess_tdof1 + gl_ess_tdof2
+                    gl_ess_tdof = self.get_global_ess_tdofs(name,
+                                                            merge=True)
                     tmp = mm.add_extra_contribution(self,
                                                     ess_tdof=gl_ess_tdof,
                                                     kfes=kfes,
@@ -1627,8 +1648,8 @@ class Engine(object):
                             if not mm.has_aux_op2(phys1, kfes1,
                                                   phys2, kfes2, self.access_idx):
                                 continue
-                            gl_ess_tdof1 = self.gl_ess_tdofs[name1]
-                            gl_ess_tdof2 = self.gl_ess_tdofs[name2]
+                            gl_ess_tdof1 = self.get_global_ess_tdofs(name1)
+                            gl_ess_tdof2 = self.get_global_ess_tdofs(name2)
                             op = mm.get_aux_op(self, phys1, kfes1, phys2, kfes2,
                                                test_ess_tdof=gl_ess_tdof1,
                                                trial_ess_tdof=gl_ess_tdof2)
@@ -1644,8 +1665,7 @@ class Engine(object):
     def assemble_interp(self, phys):
         names = phys.dep_vars
         for name in names:
-            gl_ess_tdof1, gl_ess_tdof2 = self.gl_ess_tdofs[name]
-            gl_ess_tdof = gl_ess_tdof1 + gl_ess_tdof2
+            gl_ess_tdof = self.get_global_ess_tdofs(name, merge=True)
             kfes = names.index(name)
             interp = []
             for mm in phys.walk():
@@ -1913,7 +1933,12 @@ class Engine(object):
                 SM.setDiag(gl_ess_tdof1)
 
                 Ae[j, idx2] = A[j, idx2].dot(SM)
-                A[j, idx2] = A[j, idx2].resetCol(gl_ess_tdof1, inplace=inplace)
+
+                # column elimination needs essentials owned by other
+                # processes, too
+                all_ess_tdof1, void = self.get_global_ess_tdofs(name)
+                A[j, idx2] = A[j, idx2].resetCol(all_ess_tdof1,
+                                                 inplace=inplace)
 
         return A, Ae
 
@@ -2274,6 +2299,30 @@ class Engine(object):
                 i_x = self.i_x[ifes]
                 self.save_solfile_fespace(name, emesh_idx, r_x, i_x)
 
+    def save_sol_to_checkpoint(self, phys_target, writer, icheckpoint, time):
+        '''
+        write GridFunction data to incremental checkpoint
+        (see petram.sol.checkpoint). mesh is not written.
+        '''
+        self.access_idx = 0
+        arrays = {}
+        meta = {}
+        for phys in phys_target:
+            emesh_idx = phys.emesh_idx
+            for name in phys.dep_vars:
+                ifes = self.r_ifes(name)
+                fnamer, fnamei = self.solfile_name(name, emesh_idx)
+                for fname, x in ((fnamer, self.r_x[ifes]),
+                                 (fnamei, self.i_x[ifes])):
+                    if x is None:
+                        continue
+                    fes = x.FESpace()
+                    arrays[fname] = x.GetDataArray().copy()
+                    meta[fname] = {'fec': fes.FEColl().Name(),
+                                   'vdim': fes.GetVDim(),
+                                   'ordering': fes.GetOrdering()}
+        writer.write(icheckpoint, time, arrays, meta)
+
     def extrafile_name(self):
         return 'sol_extended.data'
 
@@ -2324,8 +2373,16 @@ class Engine(object):
         fid.close()
 
     def load_extra_from_file(self, init_path):
+        from petram.sol.checkpoint import split_checkpoint_path
+        from petram.sol.checkpoint import extrafile_name as cp_extrafile_name
+
         sol_extra = {}
-        extrafile_name = self.extrafile_name()+self.solfile_suffix()
+        init_path, cp_idx = split_checkpoint_path(init_path)
+        if cp_idx is None:
+            extrafile_name = self.extrafile_name()
+        else:
+            extrafile_name = cp_extrafile_name(cp_idx)
+        extrafile_name += self.solfile_suffix()
 
         path = os.path.join(init_path, extrafile_name)
 
@@ -2339,8 +2396,8 @@ class Engine(object):
                 name, name2 = line.split(':')[1].strip().split('.')
                 if not name in sol_extra:
                     sol_extra[name] = {}
-            size = long(fid.readline().split(':')[1].strip())
-            dim = long(fid.readline().split(':')[1].strip())
+            size = int(fid.readline().split(':')[1].strip())
+            dim = int(fid.readline().split(':')[1].strip())
             dtype = fid.readline().split(':')[1].strip()
             if dtype.startswith('complex'):
                 data = [complex(fid.readline().split(' ')[1])
@@ -2797,6 +2854,7 @@ class Engine(object):
                             continue
                         if hasattr(o, 'run') and target is not None:
                             self.meshes[idx] = o.run(target)
+                            target = self.meshes[idx]
         self.max_bdrattr = -1
         self.max_attr = -1
 
@@ -3386,6 +3444,15 @@ class SerialEngine(Engine):
     def collect_all_ess_tdof(self):
         self.gl_ess_tdofs = self.ess_tdofs
 
+    def get_global_ess_tdofs(self, name, merge=False):
+        '''
+        essential TDoFs of all processes
+        '''
+        gl_ess_tdof1, gl_ess_tdof2 = self.gl_ess_tdofs[name]
+        if merge:
+            return list(gl_ess_tdof1) + list(gl_ess_tdof2)
+        return gl_ess_tdof1, gl_ess_tdof2
+
     def save_parmesh(self, phys_target):
         # serial engine does not do anything
         return
@@ -3531,10 +3598,13 @@ class ParallelEngine(Engine):
     def __init__(self, modelfile='', model=None):
         super(ParallelEngine, self).__init__(modelfile=modelfile, model=model)
         self.isParallel = True
+        # essential TDoFs of all processes (per level, built on demand)
+        self._all_ess_tdofs = {}
 
     def run_mesh(self, meshmodel=None):
         from mpi4py import MPI
-        from petram.mesh.mesh_model import MeshFile, MFEMMesh
+        from petram.mesh.mesh_model import (MeshFile, MFEMMesh,
+                                            ElementReordering)
         from petram.mesh.mesh_extension import MeshExt
         from petram.mesh.mesh_utils import get_extended_connectivity
 
@@ -3556,42 +3626,47 @@ class ParallelEngine(Engine):
                 if not child.enabled:
                     continue
                 target = None
+                # reordering is done on serial mesh before partitioning
+                serial_ops = [child[k].run for k in child.keys()
+                              if child[k].enabled and
+                              isinstance(child[k], ElementReordering)]
+                p_method = self.get_partitiong_method()
                 for k in child.keys():
                     o = child[k]
                     if not o.enabled:
                         continue
                     dprint1(k)
                     if o.isMeshGenerator:
-                        smesh = o.run()
-                        if len(smesh.GetBdrAttributeArray()) > 0:
+                        pmesh = o.run_parallel(MPI.COMM_WORLD,
+                                               self.get_mesh_partitioning,
+                                               serial_ops=serial_ops,
+                                               partitioning=p_method)
+                        if pmesh is None:
+                            smesh = o.run()
+                            for op in serial_ops:
+                                smesh = op(smesh)
+                            parts = self.get_mesh_partitioning(
+                                smesh, MPI.COMM_WORLD.size)
+                            pmesh = mfem.ParMesh(MPI.COMM_WORLD, smesh, parts)
+                            del smesh
+
+                        # attributes of ParMesh are global
+                        bdr_attrs = pmesh.bdr_attributes.ToList()
+                        if len(bdr_attrs) > 0:
                             self.max_bdrattr = np.max([self.max_bdrattr,
-                                                       max(smesh.GetBdrAttributeArray())])
-                        if len(smesh.GetAttributeArray()) > 0:
+                                                       max(bdr_attrs)])
+                        attrs = pmesh.attributes.ToList()
+                        if len(attrs) > 0:
                             self.max_attr = np.max([self.max_attr,
-                                                    max(smesh.GetAttributeArray())])
-
-                        p_method = self.get_partitiong_method()
-
-                        if p_method == 'by attribute':
-                            attr = list(smesh.GetAttributeArray()-1)
-                            attr_array = mfem.intArray(attr)
-                            parts = attr_array.GetData()
-                        else:
-                            if p_method != 'auto':
-                                dprint1(
-                                    "Unkown partitioning method, fallback to auto !!!")
-                            if smesh.GetNE() < MPI.COMM_WORLD.size*3:
-                                parts = smesh.GeneratePartitioning(
-                                    smesh.GetNE()//1000+1, 1)
-                            else:
-                                parts = None
-
-                        self.base_meshes[idx] = mfem.ParMesh(
-                            MPI.COMM_WORLD, smesh, parts)
+                                                    max(attrs)])
+
+                        self.base_meshes[idx] = pmesh
                         self.meshes[idx] = self.base_meshes[idx]
                         target = self.meshes[idx]
 
                         #self.base_meshes[idx] = self.meshes[idx]
+                    elif isinstance(o, ElementReordering):
+                        continue
                     else:
                         if hasattr(o, 'run') and target is not None:
                             target = self.new_mesh_from_mesh(target)
@@ -3604,6 +3679,24 @@ class ParallelEngine(Engine):
             m.GetEdgeVertexTable()
             get_extended_connectivity(m)
 
+    def get_mesh_partitioning(self, smesh, nparts):
+        '''
+        partitioning of serial mesh (None: MFEM default)
+        '''
+        p_method = self.get_partitiong_method()
+
+        if p_method == 'by attribute':
+            attr = list(smesh.GetAttributeArray()-1)
+            attr_array = mfem.intArray(attr)
+            smesh._attr_array = attr_array  # in order to keep it from freed
+            return attr_array.GetData()
+
+        if p_method != 'auto':
+            dprint1("Unkown partitioning method, fallback to auto !!!")
+        if smesh.GetNE() < nparts*3:
+            return smesh.GeneratePartitioning(smesh.GetNE()//1000+1, 1)
+        return None
+
     def run_assemble_mat(self, phys_target, phys_range, update=False):
         self.is_matrix_distributed = True
         return super(ParallelEngine, self).run_assemble_mat(phys_target,
@@ -3701,26 +3794,44 @@ class ParallelEngine(Engine):
         return sol0
 
     def collect_all_ess_tdof(self, M=None):
-        from mpi4py import MPI
-
-        #gl_ess_tdofs = []
-        # for name in phys.dep_vars:
-        #    fes = self.fespaces[name]
-
+        '''
+        gl_ess_tdofs keeps essential TDoFs owned by this process
+        in global numbering (np.int32). Row operations (elimination,
+        resetRow, setDiag, get/set_elements) need only these. The
+        essentials of all processes are gathered on demand by
+        get_global_ess_tdofs.
+        '''
         for name in self.ess_tdofs:
             tdof1, tdof2 = self.ess_tdofs[name]
             myoffset = self.fespaces[name].GetMyTDofOffset()
-            data1 = (np.array(tdof1) + myoffset).astype(np.int32)
-            data2 = (np.array(tdof2) + myoffset).astype(np.int32)
+            data1 = (np.array(tdof1, dtype=np.int32) + myoffset).astype(np.int32)
+            data2 = (np.array(tdof2, dtype=np.int32) + myoffset).astype(np.int32)
+            self.gl_ess_tdofs[name] = (data1, data2)
+
+        self._all_ess_tdofs[self._level_idx] = {}
+
+    def get_global_ess_tdofs(self, name, merge=False):
+        '''
+        essential TDoFs of all processes (allgather on first call)
+
+        this must be called from all processes.
+        '''
+        from mpi4py import MPI
 
-            gl_ess_tdof1 = allgather_vector(data1, MPI.INT)
-            gl_ess_tdof2 = allgather_vector(data2, MPI.INT)
-            MPI.COMM_WORLD.Barrier()
-            #gl_ess_tdofs.append((name, gl_ess_tdof))
+        cache = self._all_ess_tdofs.setdefault(self._level_idx, {})
+        if not name in cache:
+            data1, data2 = self.gl_ess_tdofs[name]
+            gl_ess_tdof1 = allgather_vector(np.asarray(data1, dtype=np.int32),
+                                            MPI.INT)
+            gl_ess_tdof2 = allgather_vector(np.asarray(data2, dtype=np.int32),
+                                            MPI.INT)
+            cache[name] = (gl_ess_tdof1, gl_ess_tdof2)
+
+        gl_ess_tdof1, gl_ess_tdof2 = cache[name]
+        if merge:
             # TO-DO intArray must accept np.int32
-            gtdofs1 = [int(x) for x in gl_ess_tdof1]
-            gtdofs2 = [int(x) for x in gl_ess_tdof2]
-            self.gl_ess_tdofs[name] = (gtdofs1, gtdofs2)
+            return [int(x) for x in np.hstack((gl_ess_tdof1, gl_ess_tdof2))]
+        return gl_ess_tdof1, gl_ess_tdof2
 
     def mkdir(self, path):
         from mpi4py import MPI
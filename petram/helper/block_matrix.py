@@ -734,7 +734,9 @@ class BlockMatrix(object):
                     rv = ToHypreParVec(v)
                     self[i, j] = chypre.CHypreVec(rv, None)
             else:
-                assert False, "bug. this mode is not supported"
+                # non-distributed block: every node gets the copy
+                v = np.hstack(comm.allgather(np.asarray(v).flatten()))
+                self[i, j] = v.reshape(-1, 1)
 
     def reformat_central_mat(self, mat, ksol, ret, mask):
         '''
@@ -764,6 +766,17 @@ class BlockMatrix(object):
             ret.set_element_from_central_mat(v, j, 0, ref)
         return ret
 
+    def reformat_sol(self, mat, ksol, ret, mask, central=True):
+        '''
+        reformat solution returned from linear solver.
+        central: solution is gathered in root node (MUMPS)
+                 otherwise, each node has its own part of solution
+        '''
+        if central:
+            return self.reformat_central_mat(mat, ksol, ret, mask)
+        else:
+            return self.reformat_distributed_mat(mat, ksol, ret, mask)
+
     def set_element_from_central_mat(self, v, i, j, ref):
         '''
         set element using vector in root node
@@ -783,12 +796,13 @@ class BlockMatrix(object):
                 from mpi4py import MPI
                 comm = MPI.COMM_WORLD
 
-                part = ref.GetColPartArray()
-                v = comm.bcast(v)
-                start_col = part[0]
-                end_col = part[1]
+                from petram.helper.mpi_recipes import scatter_vector
 
-                v = np.ascontiguousarray(v[start_col:end_col])
+                # root sends only the owned range to each rank
+                part = ref.GetColPartArray()
+                if v is not None:
+                    v = np.ascontiguousarray(v.flatten())
+                v = scatter_vector(v, rcounts=part[1] - part[0])
                 if np.iscomplexobj(v):
                     rv = ToHypreParVec(v.real)
                     iv = ToHypreParVec(v.imag)
@@ -1243,36 +1257,6 @@ class BlockMatrix(object):
                             s = self[i, j].shape
                             # if (cp == rp).all() and s[0] == s[1]:
 
-                            '''
-                            if gcsr[0] is not None:
-                                csc = ToScipyCoo(gcsr[0]).tocsc()
-                                csc1 = [csc[:,cstarts[k]:cstarts[k+1]] for k in range(len(cstarts)-1)]
-                                if symmetric:
-                                   csc1m = [-csc[:,cstarts[k]:cstarts[k+1]] for k in range(len(cstarts)-1)]
-                            else:
-                                csc1 = [None]*len(csize)
-                                csc1m = [None]*len(csize)
-
-                            if gcsr[1] is not None:
-                                csc   = ToScipyCoo(gcsr[1]).tocsc()
-                                if not symmetric:
-                                    csc2  = [ csc[:,cstarts[k]:cstarts[k+1]] for k in range(len(cstarts)-1)]
-                                csc2m = [-csc[:,cstarts[k]:cstarts[k+1]] for k in range(len(cstarts)-1)]
-                            else:
-                                csc2  = [None]*len(csize)
-                                csc2m = [None]*len(csize)
-
-                            if symmetric:
-                                csr = scipy.sparse.bmat([sum(zip(csc1, csc2m), ()),
-                                                         sum(zip(csc2m, csc1m),  ())]).tocsr()
-                            else:
-                                csr = scipy.sparse.bmat([sum(zip(csc1, csc2m), ()),
-                                                         sum(zip(csc2, csc1),  ())]).tocsr()
-
-                            cp2 = [(cp*2)[0], (cp*2)[1], np.sum(csize)*2]
-                            #gcsr[1] = ToHypreParCSR(csr, col_starts =cp)
-                            gcsr  = ToHypreParCSR(csr, col_starts =cp2)
-                            '''
                             if gcsr[0] is None:
                                 csr = scipy.sparse.csr_matrix(
                                     (rsize_local, cstarts[-1]), dtype=np.float64)
@@ -1294,14 +1278,6 @@ class BlockMatrix(object):
                                 str(type(self[i, j]))
                     else:
                         if isinstance(self[i, j], ScipyCoo):
-                            '''
-                            if symmetric:
-                                tmp  = scipy.sparse.bmat([[ self[i, j].real, -self[i, j].imag],
-                                                          [-self[i, j].imag, -self[i, j].real]])
-                            else:
-                                tmp  = scipy.sparse.bmat([[self[i, j].real, -self[i, j].imag],
-                                                          [self[i, j].imag,  self[i, j].real]])
-                            '''
                             csra = self[i, j].real.tocsr()
                             csrb = self[i, j].imag.tocsr()
                             csra.eliminate_zeros()
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.sparse import lil_matrix
 import itertools
 from collections import defaultdict, OrderedDict
 from mfem.common.mpi_debug import nicePrint
@@ -109,7 +108,8 @@ def convolve1d(fes1, fes2, kernel=delta, support=None,
     fill linear operator for convolution
     \int phi_test(x) func(x-x') phi_trial(x') dx
     '''
-    mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex)
+    mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex,
+                                mode='sum')
 
     eltrans1 = fes1.GetElementTransformation(0)
     ir = get_rule(fes1.GetFE(0), fes2.GetFE(0), eltrans1, orderinc, verbose)
@@ -344,8 +344,8 @@ def convolve1d(fes1, fes2, kernel=delta, support=None,
                         #if myid == 1:
                         #    print("check here", vdofs2, vdofs22, vdofs222)
                         #print(mmm[:, [k]])
-                        tmp = mat[vdofs222, vv] + mmm[:, [k]]
-                        mat[vdofs222, vv] = tmp.flatten()
+                        mat.add(vdofs222, np.zeros(len(vdofs222), dtype=int) + vv,
+                                mmm[:, k])
                     except:
                         import traceback
                         print("error", myid)
@@ -360,8 +360,10 @@ def convolve1d(fes1, fes2, kernel=delta, support=None,
                 if v2g >= myoffset and v2g < myoffset + mat.shape[0]:
                     i = v2g - myoffset
                     #print("procesising this", myid, i, v2g, elmat, vdofs1)                
-                    mat[i, vdofs1] = mat[i, vdofs1] + elmat
+                    mat.add(np.zeros(len(vdofs1), dtype=int) + i, vdofs1,
+                            elmat)
 
+    mat = mat.tocsr()
     from scipy.sparse import coo_matrix, csr_matrix
 
     if USE_PARALLEL:
@@ -401,7 +403,8 @@ def convolve2d(fes1, fes2, kernel=delta, support=None,
         ScalarFE, VectorFE   : func is vector (horizontal)
         VectorFE, VectorFE   : func matrix
     '''
-    mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex)
+    mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex,
+                                mode='sum')
 
     if fes1.GetNE() == 0:
         assert False, "FESpace does not have element"
@@ -706,8 +709,8 @@ def convolve2d(fes1, fes2, kernel=delta, support=None,
                         #if myid == 1:
                         #    print("check here", vdofs2, vdofs22, vdofs222)
                         #print(mmm[:, [k]])
-                        tmp = mat[vdofs222, vv] + mmm[:, [k]]
-                        mat[vdofs222, vv] = tmp.flatten()
+                        mat.add(vdofs222, np.zeros(len(vdofs222), dtype=int) + vv,
+                                mmm[:, k])
 
                     except:
                         import traceback
@@ -723,8 +726,10 @@ def convolve2d(fes1, fes2, kernel=delta, support=None,
                 if v2g >= myoffset and v2g < myoffset + mat.shape[0]:
                     i = v2g - myoffset
                     #print("procesising this", myid, i, v2g, elmat, vdofs1)                
-                    mat[i, vdofs1] = mat[i, vdofs1] + elmat
+                    mat.add(np.zeros(len(vdofs1), dtype=int) + i, vdofs1,
+                            elmat)
 
+    mat = mat.tocsr()
     from scipy.sparse import coo_matrix, csr_matrix
 
     if USE_PARALLEL:
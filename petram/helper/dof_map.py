@@ -33,7 +33,6 @@ import scipy
 import bisect
 import warnings
 import traceback
-from scipy.sparse import lil_matrix
 import petram.debug as debug
 debug.debug_default_level = 1
 dprint1, dprint2, dprint3 = debug.init_dprints('dof_map')
@@ -150,6 +149,27 @@ def find_el_center(fes, ibdr1, trans1, mode='Bdr'):
     return pts
 
 
+def get_tdof_numbers(fes, vdofs, use_global=False):
+    '''
+    vdof -> global tdof (use_global) or offset+local tdof (-1 if not owned)
+    MFEM is called once for each unique vdof.
+    '''
+    vdofs = np.asarray(vdofs, dtype=int)
+    if not use_parallel:
+        return vdofs
+
+    uvdofs, inv = np.unique(vdofs, return_inverse=True)
+    if use_global:
+        tdofs = np.array([fes.GetGlobalTDofNumber(i) for i in uvdofs],
+                         dtype=int)
+    else:
+        tdofs = np.array([fes.GetLocalTDofNumber(i) for i in uvdofs],
+                         dtype=int)
+        myoffset = fes.GetMyTDofOffset()
+        tdofs[tdofs >= 0] = tdofs[tdofs >= 0] + myoffset
+    return tdofs[inv]
+
+
 def get_element_data(fes, idx, trans, mode='Bdr', use_global=False):
     mesh = fes.GetMesh()
 
@@ -157,47 +177,62 @@ def get_element_data(fes, idx, trans, mode='Bdr', use_global=False):
     GetElement = getattr(fes, methods[mode]['Element'])
     GetVDofs = getattr(fes, methods[mode]['VDofs'])
 
+    vdofs = [np.array(GetVDofs(k1), dtype=int) for k1 in idx]
+    if len(vdofs) > 0:
+        allvdofs = np.hstack(vdofs)
+        subvdofs = np.where(allvdofs >= 0, allvdofs, -1 - allvdofs)
+        # note subdof2 = -1 if it is not owned by the node
+        alltdofs = get_tdof_numbers(fes, subvdofs, use_global=use_global)
+        alltdofs = np.split(alltdofs, np.cumsum([len(x) for x in vdofs])[:-1])
+    else:
+        alltdofs = []
+
+    ptx = mfem.DenseMatrix()
     ret = [None]*len(idx)
     for iii, k1 in enumerate(idx):
         tr1 = GetTrans(k1)
         nodes1 = GetElement(k1).GetNodes()
-        vdof1 = GetVDofs(k1)
-        # pt1 = np.vstack([trans(tr1.Transform(nodes1.IntPoint(kk)))
-        #                 for kk in range(len(vdof1))])
-        pt1o = np.vstack([tr1.Transform(nodes1.IntPoint(kk))
-                          for kk in range(len(vdof1))])
-        pt1 = np.vstack([trans(pt) for pt in pt1o])
-
-        subvdof1 = [x if x >= 0 else -1-x for x in vdof1]
-        if use_parallel:
-            if use_global:
-                subvdof2 = [fes.GetGlobalTDofNumber(i) for i in subvdof1]
-            else:
-                subvdof2 = [fes.GetLocalTDofNumber(i) for i in subvdof1]
-                flag = False
-                myoffset = fes.GetMyTDofOffset()
-                for k, x in enumerate(subvdof2):
-                    if x >= 0:
-                        subvdof2[k] = myoffset + x
-                    else:
-                        flag = True
-                if element_data_debug and flag:
-                    dprint2(subvdof1, vdof1, subvdof2)
-            # note subdof2 = -1 if it is not owned by the node
+        vdof1 = vdofs[iii]
+        subvdof2 = alltdofs[iii]
+
+        # transform all nodes at once
+        tr1.Transform(nodes1, ptx)
+        pt1o = ptx.GetDataArray().transpose()[:len(vdof1)].copy()
+        if trans is notrans:
+            pt1 = pt1o.copy()
         else:
-            subvdof2 = subvdof1
+            pt1 = np.vstack([trans(pt) for pt in pt1o])
 
-        newk1 = np.vstack([(k, xx[0], xx[1])
-                           for k, xx in enumerate(zip(vdof1, subvdof2))])
+        if element_data_debug and np.any(subvdof2 < 0):
+            dprint2(vdof1, subvdof2)
 
-        # this doesn't do anything since kk is [0, 1,2,3,...]??
-        #pt1 =  np.vstack([pt1[kk] for kk, v, s in newk1])
-        #pt1o = np.vstack([pt1o[kk] for kk, v, s in newk1])
+        newk1 = np.vstack((np.arange(len(vdof1)), vdof1, subvdof2)).transpose()
 
         ret[iii] = (newk1, pt1, pt1o)
     return ret
 
 
+_shape_diag = {}
+
+
+def get_shape_diag(el):
+    '''
+    shape function i evaluated at node i (reference element).
+    this does not depend on element transformation and is computed
+    once for each finite element type.
+    '''
+    key = (el.GetGeomType(), el.GetOrder(), el.GetDof(), type(el).__name__)
+    if not key in _shape_diag:
+        nodes1 = el.GetNodes()
+        v = mfem.Vector(nodes1.GetNPoints())
+        shape = np.zeros(nodes1.GetNPoints())
+        for idx in range(len(shape)):
+            el.CalcShape(nodes1.IntPoint(idx), v)
+            shape[idx] = v.GetDataArray()[idx]
+        _shape_diag[key] = shape
+    return _shape_diag[key]
+
+
 def get_shape(fes, ibdr, mode='Bdr'):
     mesh = fes.GetMesh()
 
@@ -230,18 +265,12 @@ def get_shape(fes, ibdr, mode='Bdr'):
     tr1.SetIntPoint(nodes1.IntPoint(0))
 
     for iii, k1 in enumerate(ibdr):
-        tr1 = GetTrans(k1)
         el = GetElement(k1)
-        nodes1 = el.GetNodes()
-
-        weight = tr1.Weight() if use_weight else 1
-
-        v = mfem.Vector(nodes1.GetNPoints())
-        shape = [None]*nodes1.GetNPoints()
-        for idx in range(len(shape)):
-            el.CalcShape(nodes1.IntPoint(idx), v)
-            shape[idx] = v.GetDataArray()[idx]*weight
-        ret[iii] = np.array(shape)
+        if use_weight:
+            tr1 = GetTrans(k1)
+            ret[iii] = get_shape_diag(el)*tr1.Weight()
+        else:
+            ret[iii] = get_shape_diag(el).copy()
 
     return ret
 
@@ -912,9 +941,9 @@ def gather_dataset(idx1, idx2, fes1, fes2, trans1,
     return data, map_1_2
 
 
-def get_empty_map(fes1, fes2, is_complex=False):
+def get_map_shape(fes1, fes2):
     '''
-    empty matrix (fes1: test, fes2: 
+    shape of map (fes1: test, fes2: trial) and the first row
     '''
     if use_parallel:
         fesize1 = fes1.GetTrueVSize()
@@ -924,9 +953,23 @@ def get_empty_map(fes1, fes2, is_complex=False):
         fesize1 = fes1.GetNDofs()
         fesize2 = fes2.GetNDofs()
         rstart = 0
+    return (fesize1, fesize2), rstart
+
+
+def get_empty_map(fes1, fes2, is_complex=False, mode='set'):
+    '''
+    empty matrix (fes1: test, fes2: trial)
+
+    returns ElementBatchAssembler. entries are set by map[i, j] = value
+    (mode='set') or accumulated by map.add (mode='sum').
+    call tocsr/tocoo to get the matrix.
+    '''
+    from petram.helper.element_batch import ElementBatchAssembler
+
+    shape, rstart = get_map_shape(fes1, fes2)
 
     dtype = complex if is_complex else float
-    map = lil_matrix((fesize1, fesize2), dtype=dtype)
+    map = ElementBatchAssembler(shape, dtype=dtype, mode=mode)
     return map, rstart
 
 
@@ -1209,31 +1252,24 @@ def projection_matrix(idx1,  idx2,  fes, tdof1, fes2=None, tdof2=None,
     map = mapper(idx2, idx1, fes, fes2=fes2, trans1=trans1, trans2=trans2, tdof1=tdof1,
                  tdof2=tdof2, tol=tol, old_mapping=old_mapping)
 
+    map = map.tocsr()
     if weight is None:
         iscomplex = False
         if (dphase == 0.):
             pass
         elif (dphase == 180.):
-            map = map.tocsr()
             map *= -1
-            map = map.tolil()
-
         else:
             iscomplex = True
             map = map.astype(complex)
-            # need to this to make efficient....
-            map = map.tocsr()
             map *= np.exp(-1j*np.pi/180*dphase)
-            map = map.tolil()
 
     else:
         iscomplex = np.iscomplexobj(weight)
         if iscomplex:
             map = map.astype(complex)
         if map.nnz > 0:
-            map = map.tocsr()
             map *= -weight
-            map = map.tolil()
 
     m_coo = map.tocoo()
     row = m_coo.row
@@ -1249,13 +1285,14 @@ def projection_matrix(idx1,  idx2,  fes, tdof1, fes2=None, tdof2=None,
         start_row = 0
         end_row = map.shape[0]
 
-    if filldiag:
-        for i in range(min(map.shape[0], map.shape[1])):
-            r = start_row+i
-            if not r in col:
-                map[i, r] = 1.0
-
     from scipy.sparse import coo_matrix, csr_matrix
+
+    if filldiag:
+        # 1 on diagonal of columns which are not mapped
+        rr = start_row + np.arange(min(map.shape[0], map.shape[1]))
+        ii = np.where(np.logical_not(np.isin(rr, col)))[0]
+        diag = coo_matrix((np.ones(len(ii)), (ii, rr[ii])), shape=map.shape)
+        map = (map + diag).tocsr()
     if use_parallel:
         if iscomplex:
             m1 = csr_matrix(map.real, dtype=float)
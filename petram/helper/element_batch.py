@@ -0,0 +1,173 @@
+'''
+   element_batch
+
+   utility to assemble sparse matrices from element batches.
+
+   a kernel takes a batch (a slice of element index array) and returns
+   COO triplets (rows, cols, data) or a list of them. triplets are
+   concatenated once at the end instead of filling lil_matrix entry
+   by entry. negative row/col index means "skip this entry".
+
+   kernels are run in a thread pool when thread_safe=True and the
+   number of threads is larger than one. kernels which calls MFEM
+   objects shared among elements (ElementTransformation returned by
+   GetElementTransformation, work DenseMatrix/Vector...) must be run
+   with thread_safe=False.
+
+   number of threads:
+       set_num_threads(n) or PETRAM_NUM_THREADS environment variable
+       (default 1)
+
+   duplicated entries are summed (mode='sum'), or the last one is
+   kept (mode='set'), which is the same as item assignment of
+   lil_matrix (asm[i, j] = value). DoF maps use mode='set'.
+
+   usage:
+       asm = ElementBatchAssembler((nrows, ncols), dtype=float)
+       asm.run(kernel, np.arange(NE))
+       asm.add_elements(rows, cols, elmats)
+       m = asm.tocsr()
+'''
+import os
+import numpy as np
+
+import petram.debug as debug
+dprint1, dprint2, dprint3 = debug.init_dprints('ElementBatch')
+
+_num_threads = int(os.environ.get('PETRAM_NUM_THREADS', 1))
+
+
+def set_num_threads(n):
+    global _num_threads
+    _num_threads = max(int(n), 1)
+
+
+def get_num_threads():
+    return _num_threads
+
+
+def batches(idx, batch_size):
+    '''
+    split index array to batches
+    '''
+    idx = np.asarray(idx)
+    for i in range(0, len(idx), batch_size):
+        yield idx[i:i + batch_size]
+
+
+def element_triplets(rows, cols, mats):
+    '''
+    expand element matrices to COO triplets
+
+    rows : (ne, nr) row index of element matrices
+    cols : (ne, nc) col index
+    mats : (ne, nr, nc) element matrices
+    '''
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    mats = np.asarray(mats)
+    ne, nr, nc = mats.shape
+
+    r = np.broadcast_to(rows[:, :, None], (ne, nr, nc)).ravel()
+    c = np.broadcast_to(cols[:, None, :], (ne, nr, nc)).ravel()
+    d = mats.ravel()
+    return r, c, d
+
+
+class ElementBatchAssembler(object):
+    def __init__(self, shape, dtype=float, batch_size=1024,
+                 num_threads=None, mode='sum'):
+        assert mode in ('sum', 'set'), "unknown mode: " + mode
+        self.shape = shape
+        self.dtype = dtype
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.mode = mode
+        self._rows = []
+        self._cols = []
+        self._data = []
+
+    @property
+    def nnz(self):
+        '''
+        number of stored entries after duplicates are resolved
+        '''
+        return self.tocoo().nnz
+
+    def __setitem__(self, key, value):
+        r, c = key
+        r, c, value = np.broadcast_arrays(r, c, value)
+        self.add(r, c, value)
+
+    def add(self, rows, cols, data):
+        rows = np.asarray(rows, dtype=int).ravel()
+        cols = np.asarray(cols, dtype=int).ravel()
+        data = np.asarray(data).ravel()
+
+        flag = np.logical_and(rows >= 0, cols >= 0)
+        if not np.all(flag):
+            rows = rows[flag]
+            cols = cols[flag]
+            data = data[flag]
+        self._rows.append(rows)
+        self._cols.append(cols)
+        self._data.append(data)
+
+    def add_elements(self, rows, cols, mats):
+        self.add(*element_triplets(rows, cols, mats))
+
+    def _add_result(self, ret):
+        if ret is None:
+            return
+        if isinstance(ret, tuple):
+            ret = [ret]
+        for r, c, d in ret:
+            self.add(r, c, d)
+
+    def run(self, kernel, idx, thread_safe=True):
+        '''
+        run kernel on each batch of idx.
+        results are added in the order of batches.
+        '''
+        nthreads = get_num_threads() if self.num_threads is None else self.num_threads
+        items = list(batches(idx, self.batch_size))
+
+        if thread_safe and nthreads > 1 and len(items) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            dprint2("running element kernel using " + str(nthreads) +
+                    " threads")
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                results = list(executor.map(kernel, items))
+        else:
+            results = [kernel(b) for b in items]
+
+        for ret in results:
+            self._add_result(ret)
+
+    def triplets(self):
+        if len(self._data) == 0:
+            return (np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                    np.zeros(0, dtype=self.dtype))
+        return (np.hstack(self._rows), np.hstack(self._cols),
+                np.hstack(self._data).astype(self.dtype, copy=False))
+
+    def tocoo(self):
+        '''
+        duplicated entries are summed (mode='sum') or the last one
+        is used (mode='set', zeros are removed)
+        '''
+        from scipy.sparse import coo_matrix
+        r, c, d = self.triplets()
+        if self.mode == 'set' and len(d) > 0:
+            key = r * self.shape[1] + c
+            _, idx = np.unique(key[::-1], return_index=True)
+            idx = len(key) - 1 - idx
+            r, c, d = r[idx], c[idx], d[idx]
+        m = coo_matrix((d, (r, c)), shape=self.shape, dtype=self.dtype)
+        m.sum_duplicates()
+        if self.mode == 'set':
+            m.eliminate_zeros()
+        return m
+
+    def tocsr(self):
+        return self.tocoo().tocsr()
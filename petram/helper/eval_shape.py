@@ -74,33 +74,37 @@ def eval_shape(order = 1, refine = 5, elem_type = 0,
     fe = fespace.GetFE(idx)
     fe_nd = fe.GetDof()
 
+    # points are transformed at once
+    m = mfem.DenseMatrix()
     ir = fe.GetNodes()
-    npt = ir.GetNPoints()
-    dof = np.vstack([T.Transform(ir.IntPoint(i)) for i in range(npt)])
+    T.Transform(ir, m)
+    dof = m.GetDataArray().transpose().copy()
     
     RefG = mfem.GlobGeometryRefiner.Refine(geom, refine, 1);
     ir = RefG.RefPts
 
     npt = ir.GetNPoints()
-    ptx = np.vstack([T.Transform(ir.IntPoint(i)) for i in range(npt)])
+    T.Transform(ir, m)
+    ptx = m.GetDataArray().transpose().copy()
 
-    shape = []
+    # shape is filled in preallocated array
     if fec == 'ND' or fec == 'RT':
+        shape = np.empty((npt, fe_nd, spaceDim))
         mat = mfem.DenseMatrix(fe_nd, spaceDim)
-        shape_func = fe.CalcVShape
         for i in range(npt):
             ip = ir.IntPoint(i)
             T.SetIntPoint(ip)
             fe.CalcVShape(T, mat)
-            shape.append(mat.GetDataArray().copy())
+            shape[i] = mat.GetDataArray()
     else:
+        shape = np.empty((npt, fe_nd))
         vec = mfem.Vector(fe_nd)
         for i in range(npt):
             ip = ir.IntPoint(i)            
             fe.CalcShape(ip, vec)
-            shape.append(vec.GetDataArray().copy())
+            shape[i] = vec.GetDataArray()
 
-    return dof, ptx, np.stack(shape)
+    return dof, ptx, shape
 
 def plot_shape(dof, ptx,  shape, viewer = None):
     try:
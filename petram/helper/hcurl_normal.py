@@ -1,13 +1,12 @@
 from petram.mfem_config import use_parallel
 import numpy as np
 import itertools
-from scipy.sparse import lil_matrix
-import itertools
 from collections import defaultdict, OrderedDict
 from mfem.common.mpi_debug import nicePrint
 from mfem.common.parcsr_extra import ToScipyCoo
 
-from petram.helper.dof_map import get_empty_map
+from petram.helper.dof_map import get_map_shape
+from petram.helper.element_batch import ElementBatchAssembler
 
 import petram.debug
 dprint1, dprint2, dprint3 = petram.debug.init_dprints('hcurln')
@@ -153,6 +152,36 @@ def check_inv_doftrans(doftrans):
     print(Mdoftrans)
 
 
+_perms = {}
+
+
+def get_perms(n, k):
+    if not (n, k) in _perms:
+        _perms[(n, k)] = np.array(list(itertools.permutations(range(n), k)),
+                                  dtype=int)
+    return _perms[(n, k)]
+
+
+def get_options(g1, pp):
+    '''
+    candidate reference points (#options, dim1) which can be mapped to
+    a point pp on the boundary element
+    '''
+    if g1 == 2 or g1 == 3:
+        s = np.array(ref_shapes['tri'] if g1 == 2 else ref_shapes['quad'])
+        pm = get_perms(len(s), 2)
+        options = pp[0]*s[pm[:, 0]] + (1-pp[0])*s[pm[:, 1]]
+    elif g1 == 4 or g1 == 5:
+        s = np.array(ref_shapes['tet'] if g1 == 4 else ref_shapes['hex'])
+        pm = get_perms(len(s), 3)
+        options = (pp[0]*s[pm[:, 0]] + pp[1]*s[pm[:, 1]] +
+                   (1-pp[0]-pp[1])*s[pm[:, 2]])
+    else:
+        print(pp)
+        assert False, "geometry type: " + str(g1) + " is not supported."
+    return options
+
+
 def map_ir(fe1, eltrans, coeff1,
            shape1, dim2, sdim2, locnors2,
            sign1, Mdoftrans, MV, th=1e-7):
@@ -162,67 +191,48 @@ def map_ir(fe1, eltrans, coeff1,
 
     res = []
 
-    def get_options(g1, *pp):
+    # all candidates of all points are transformed at once
+    options = [get_options(g1, data[:dim2]) for data in locnors2]
+    noptions = [len(o) for o in options]
+    options = np.vstack(options)
+
+    ir = mfem.IntegrationRule(len(options))
+    for i, o in enumerate(options):
         if g1 == 2 or g1 == 3:
-            s = ref_shapes['tri'] if g1 == 2 else ref_shapes['quad']
-            options = [pp[0]*s[i] + (1-pp[0])*s[j] for i, j
-                       in itertools.permutations(range(len(s)), 2)]
-        elif g1 == 4 or g1 == 5:
-            s = ref_shapes['tet'] if g1 == 4 else ref_shapes['hex']
-            options = [pp[0]*s[i] + pp[1]*s[j] + (1-pp[0]-pp[1])*s[k] for i, j, k
-                       in itertools.permutations(range(len(s)), 3)]
+            ir.IntPoint(i).Set2(*o)
         else:
-            print(pp)
-            assert False, "geometry type: " + str(g1) + " is not supported."
-        return options
+            ir.IntPoint(i).Set3(*o)
+    ptx = mfem.DenseMatrix()
+    eltrans.Transform(ir, ptx)
+    pxs = ptx.GetDataArray().transpose()
 
     d_misalginment = []
 
-    for data in locnors2:
-        pp = data[:dim2]
+    k0 = 0
+    for data, n in zip(locnors2, noptions):
         p = data[dim2:dim2 + sdim2]
         nor = data[dim2 + sdim2:]
 
-        options = get_options(g1, *pp)
-
-        dd = []
-
-        pxs = []
-        for o in options:
-            if g1 == 2 or g1 == 3:
-                ip.Set2(*o)
-            elif g1 == 4 or g1 == 5:
-                ip.Set3(*o)
-            else:
-                assert False, "geometry type: " + \
-                    str(g1) + " is not supported."
-            px = eltrans.Transform(ip)
-            pxs.append(px)
-            dd.append(np.sum((p - px)**2))
+        dd = np.sum((pxs[k0:k0+n] - p)**2, 1)
 
         assert np.min(dd) < np.max(dd) * \
             th, "point not found: " + str(np.min(dd))
 
         kk = np.argmin(dd)
         if g1 == 2 or g1 == 3:
-            ip.Set2(*options[kk])
-        elif g1 == 4 or g1 == 5:
-            ip.Set3(*options[kk])
+            ip.Set2(*options[k0 + kk])
         else:
-            assert False, "geometry type: " + str(g1) + " is not supported."
-        #if myid == 1: print("location", pxs[kk])
+            ip.Set3(*options[k0 + kk])
+        k0 = k0 + n
+
         eltrans.SetIntPoint(ip)
         fe1.CalcVShape(eltrans, shape1)
 
-        # if doftrans is not None:
         s1 = shape1.GetDataArray().transpose().dot(Mdoftrans)
-        # else:
-        #    s1 = shape1.GetDataArray().transpose().dot(Msign)
 
         cc = eval_coeff(coeff1, eltrans, ip, MV)
 
-        val = nor.dot(cc.dot(s1))  # *sign1
-        # shape1.GetDataArray().transpose())) * sign1   #/ww
+        val = nor.dot(cc.dot(s1))
 
         res.append(val)
         d_misalginment.append(np.min(dd))
@@ -233,8 +243,9 @@ def map_ir(fe1, eltrans, coeff1,
 def hcurln(fes1, fes2, coeff,
            is_complex=False, bdr='all', orderinc=1, verbose=False):
 
-    mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex)
-    mat2, rstart = get_empty_map(fes2, fes1, is_complex=is_complex)
+    shape, rstart = get_map_shape(fes2, fes1)
+    asm = ElementBatchAssembler(shape,
+                                dtype=complex if is_complex else float)
 
     from petram.helper.element_map import map_element
 
@@ -248,8 +259,6 @@ def hcurln(fes1, fes2, coeff,
     mesh1 = fes1.GetMesh()
     mesh2 = fes2.GetMesh()
 
-    mesh2.Print("/home/shiraiwa/part.mesh")
-
     if verbose:
         if myid == 0:
             dprint1("NE", mesh1.GetNE(), mesh2.GetNE())
@@ -398,11 +407,10 @@ def hcurln(fes1, fes2, coeff,
 
             locnors2 = locnorss[k]
             shape1.SetSize(nd1, sdim1)
-            vdofs1 = fes1.GetElementVDofs(i_fe1)
+            vdofs1 = np.array(fes1.GetElementVDofs(i_fe1), dtype=int)
 
-            dof_sign1 = np.array([[1 if vv >= 0 else -1
-                                   for vv in vdofs1], ])
-            vdofs1 = [-1 - x if x < 0 else x for x in vdofs1]
+            dof_sign1 = np.where(vdofs1 >= 0, 1, -1).reshape(1, -1)
+            vdofs1 = np.where(vdofs1 >= 0, vdofs1, -1 - vdofs1)
 
             mat_doftrans = get_inv_doftrans(doftrans, dof_sign1)
 
@@ -412,21 +420,16 @@ def hcurln(fes1, fes2, coeff,
                 #  We construct submatrix of Prolongation to construct element matrix
                 #  in TrueDof space
 
-                vv1 = [P1mat.indices[P1mat.indptr[ii]:P1mat.indptr[ii+1]]
-                       for ii in vdofs1]
-                vv3 = [P1mat.data[P1mat.indptr[ii]:P1mat.indptr[ii+1]]
-                       for ii in vdofs1]
-                ngtof = np.sum([len(x) for x in vv3])
-                sub_p = np.zeros((nd1, ngtof))
-                k1 = 0
-                k2 = 0
-                for gtofs, weights in zip(vv1, vv3):
-                    for g, w in zip(gtofs, weights):
-                        sub_p[k1, k2] = w
-                        k2 = k2 + 1
-                    k1 = k1 + 1
-
-                vdofs1 = np.hstack(vv1).flatten()
+                counts = (P1mat.indptr[vdofs1 + 1] -
+                          P1mat.indptr[vdofs1])
+                ptr = np.hstack([np.arange(P1mat.indptr[ii],
+                                           P1mat.indptr[ii + 1])
+                                 for ii in vdofs1]).astype(int)
+                sub_p = np.zeros((nd1, len(ptr)))
+                sub_p[np.repeat(np.arange(nd1), counts),
+                      np.arange(len(ptr))] = P1mat.data[ptr]
+
+                vdofs1 = P1mat.indices[ptr]
                 mat_doftrans = mat_doftrans.dot(sub_p)
 
             res, misalignment = map_ir(fe1, eltrans, coeff,
@@ -451,55 +454,59 @@ def hcurln(fes1, fes2, coeff,
             MPI.COMM_WORLD.gather(max_misalignment, root=0))
     dprint1("Max misalignment: ", max_misalignment)
 
+    # collect DoFs of fes2 (MFEM calls, done sequentially)
+    elem_data = []
     shared_data = []
-
     for rank, i_el2s in enumerate(el2_arr):
         for k, i_el2 in enumerate(i_el2s):
             vdofs1 = vdofs1_arr[rank][k]
-
-            fe2 = fes2.GetFE(i_el2)
-            eltrans2 = fes2.GetElementTransformation(i_el2)
-            vdofs2 = fes2.GetElementVDofs(i_el2)
-            vdofs2 = [-1 - x if x < 0 else x for x in vdofs2]
-
             d1 = data1_arr[rank][k]
             d2 = data2_arr[rank][k]
 
-            mm = d2.transpose().dot(d1)
+            vdofs2 = np.array(fes2.GetElementVDofs(i_el2), dtype=int)
+            vdofs2 = np.where(vdofs2 >= 0, vdofs2, -1 - vdofs2)
 
             if USE_PARALLEL:
                 # prepare data for not-owned DoFs, which will be shared later
-                vdofs22 = [fes2.GetLocalTDofNumber(ii) for ii in vdofs2]
-                vdofs22g = [fes2.GetGlobalTDofNumber(ii) for ii in vdofs2]
-
-                kkk = 0
-                for v2, v2g in zip(vdofs22, vdofs22g):
-                    if v2 < 0:
+                vdofs22 = np.array([fes2.GetLocalTDofNumber(ii)
+                                    for ii in vdofs2], dtype=int)
+                notowned = np.where(vdofs22 < 0)[0]
+                if len(notowned) > 0:
+                    mm = d2[:, notowned].transpose().dot(d1)
+                    for kkk, ii in enumerate(notowned):
+                        v2g = fes2.GetGlobalTDofNumber(vdofs2[ii])
                         shared_data.append([v2g, mm[kkk, :], vdofs1])
-                    kkk = kkk + 1
             else:
                 vdofs22 = vdofs2
+            elem_data.append((vdofs22, vdofs1, d1, d2))
+
+    # element matrices (rows of not-owned DoFs are dropped by asm)
+    def kernel(batch):
+        ret = []
+        for ii in batch:
+            vdofs22, vdofs1, d1, d2 = elem_data[ii]
+            mm = d2.transpose().dot(d1)
+            ret.append((np.repeat(vdofs22, len(vdofs1)),
+                        np.tile(vdofs1, len(vdofs22)),
+                        mm.flatten()))
+        return ret
 
-            for i, ltdof2 in enumerate(vdofs22):
-                if ltdof2 < 0:
-                    continue
-                for j, gtdof1 in enumerate(vdofs1):
-                    mat[ltdof2, gtdof1] = mat[ltdof2, gtdof1] + mm[i, j]
+    asm.run(kernel, np.arange(len(elem_data)), thread_safe=True)
 
     if USE_PARALLEL:
         #nicePrint("shared data", shared_data)
+        myoffset = fes2.GetMyTDofOffset()
         for source_id in range(nprc):
             data = comm.bcast(shared_data, root=source_id)
-            myoffset = fes2.GetMyTDofOffset()
             for v2g, elmat, vdofs1 in data:
-                if v2g >= myoffset and v2g < myoffset + mat.shape[0]:
+                if v2g >= myoffset and v2g < myoffset + shape[0]:
                     i = v2g - myoffset
-                    for j, gtdof1 in enumerate(vdofs1):
-                        mat[i, gtdof1] = mat[i, gtdof1] + elmat[j]
-                    #mat[i, vdofs1] = mat[i, vdofs1] + elmat
+                    asm.add(np.zeros(len(vdofs1), dtype=int) + i,
+                            vdofs1, elmat)
 
-    from scipy.sparse import coo_matrix, csr_matrix
+    from scipy.sparse import csr_matrix
 
+    mat = asm.tocsr()
     if USE_PARALLEL:
         if is_complex:
             m1 = csr_matrix(mat.real, dtype=float)
@@ -515,6 +522,6 @@ def hcurln(fes1, fes2, coeff,
         M = CHypreMat(m1, m2, col_starts=col_starts)
     else:
         from petram.helper.block_matrix import convert_to_ScipyCoo
-        M = convert_to_ScipyCoo(coo_matrix(mat, dtype=mat.dtype))
+        M = convert_to_ScipyCoo(mat.tocoo())
 
     return M
@@ -481,60 +481,72 @@ class DeltaM(Operator):
         pts = np.array(args[0], copy=False).reshape(-1, sdim)
 
         from mfem.common.chypre import LF2PyVec, PyVec2PyMat, MfemVec2PyVec, HStackPyVec
-        vecs = []
 
-        for k, pt in enumerate(pts):
+        # locate all points at once. in parallel, a point found in
+        # multiple processes is kept only in the lowest rank (see
+        # element_locator)
+        from petram.mesh.element_locator import get_locator
+        locator = get_locator(self.fes1.GetMesh())
+        count, elem_ids, int_points = locator.FindPoints(pts)
+        elem_ids = np.asarray(elem_ids, dtype=int)
+        nfound = int(np.sum(elem_ids != -1))
+        if use_parallel:
+            nfound = comm.allreduce(nfound)
+        if nfound != len(pts):
+            dprint1("DeltaM: " + str(len(pts) - nfound) +
+                    " points are not found in mesh")
+
+        fes = self.fes1
+        elvect = mfem.Vector()
+
+        def add_delta(k, pt, arr):
+            if elem_ids[k] == -1:
+                return
             w = float(weight[0] if len(weight) == 1 else weight[k])
+            pt = [float(x) for x in np.atleast_1d(pt)]
             if vdim == 1:
-                if sdim == 3:
-                    x, y, z = pt
-                    d = mfem.DeltaCoefficient(x, y, z, w)
-                elif sdim == 2:
-                    x, y = pt
-                    d = mfem.DeltaCoefficient(x, y, w)
-                elif sdim == 1:
-                    x = pt
-                    d = mfem.DeltaCoefficient(x, w)
-                else:
-                    assert False, "unsupported dimension"
+                d = mfem.DeltaCoefficient(*(pt + [w]))
                 intg = mfem.DomainLFIntegrator(d)
             else:
                 dir = direction[0] if len(direction) == 1 else direction[k]
                 dd = mfem.Vector(dir)
-                if sdim == 3:
-                    x, y, z = pt
-                    d = mfem.VectorDeltaCoefficient(dd, x, y, z, w)
-                elif sdim == 2:
-                    x, y = pt
-                    d = mfem.VectorDeltaCoefficient(dd, x, y, w)
-                elif sdim == 1:
-                    x = pt
-                    d = mfem.VectorDeltaCoefficient(dd, x, w)
-                else:
-                    assert False, "unsupported dimension"
+                d = mfem.VectorDeltaCoefficient(*([dd] + pt + [w]))
 
-                if self.fes1.FEColl().Name().startswith('ND'):
+                if fes.FEColl().Name().startswith('ND'):
                     intg = mfem.VectorFEDomainLFIntegrator(d)
-                elif self.fes1.FEColl().Name().startswith('RT'):
+                elif fes.FEColl().Name().startswith('RT'):
                     intg = mfem.VectorFEDomainLFIntegrator(d)
                 else:
                     intg = mfem.VectorDomainLFIntegrator(d)
 
-            if do_sum:
-                if k == 0:
-                    lf1 = engine.new_lf(self.fes1)
-                lf1.AddDomainIntegrator(intg)
-            else:
-                lf1 = engine.new_lf(self.fes1)
-                lf1.AddDomainIntegrator(intg)
-                lf1.Assemble()
-                vecs.append(LF2PyVec(lf1))
+            iel = int(elem_ids[k])
+            eltrans = fes.GetElementTransformation(iel)
+            eltrans.SetIntPoint(int_points[k])
+            intg.AssembleDeltaElementVect(fes.GetFE(iel), eltrans, elvect)
+            doftrans = fes.GetElementVDofTransformation(iel)
+            if doftrans is not None:
+                doftrans.TransformDual(elvect)
+
+            vdofs = np.array(fes.GetElementVDofs(iel), dtype=int)
+            sign = np.where(vdofs >= 0, 1.0, -1.0)
+            vdofs = np.where(vdofs >= 0, vdofs, -1 - vdofs)
+            np.add.at(arr, vdofs, sign*elvect.GetDataArray())
 
         if do_sum:
-            lf1.Assemble()
+            lf1 = engine.new_lf(fes)
+            lf1.Assign(0.0)
+            arr = lf1.GetDataArray()
+            for k, pt in enumerate(pts):
+                add_delta(k, pt, arr)
             v1 = MfemVec2PyVec(engine.b2B(lf1), None)
             v1 = PyVec2PyMat(v1)
         else:
+            vecs = []
+            for k, pt in enumerate(pts):
+                lf1 = engine.new_lf(fes)
+                lf1.Assign(0.0)
+                add_delta(k, pt, lf1.GetDataArray())
+                vecs.append(LF2PyVec(lf1))
             v1 = HStackPyVec(vecs)
 
         if not self._transpose:
@@ -709,7 +721,7 @@ class Projection(Operator):
                           '    import numpy as np',
                           '    x = xyz[0]',
                           '    return np.array(['+trans2+'])']
-
+            exec('\n'.join(trans2), self._global_ns, lns)
             trans2 = lns['trans2']
         else:
             trans2 = notrans
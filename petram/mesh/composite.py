@@ -1,173 +1,183 @@
-from collections import defaultdict
-from itertools import combinations
-from sets import Set
+'''
+   composite
+
+   merge_domain_3d : merge domains (volumes) of 3D mesh into one domain.
+                     interface surfaces are removed and surfaces which
+                     become one face of the merged domain are merged.
+
+   the decision is made on sparse incidence matrices (volume x surface,
+   surface x line) built from extended_connectivity.
+'''
 import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('Composite')
+
+
+def _incidence(d, nrows, ncols):
+    '''
+    dict (row -> list of columns) to boolean csr matrix
+    '''
+    keys = list(d)
+    cols = [np.asarray(d[k], dtype=int).flatten() for k in keys]
+    rows = np.repeat(np.array(keys, dtype=int), [len(c) for c in cols])
+    cols = np.hstack(cols + [np.zeros(0, dtype=int)])
+    mat = csr_matrix((np.ones(len(cols), dtype=np.int32), (rows, cols)),
+                     shape=(nrows, ncols))
+    mat.sum_duplicates()
+    mat.data[:] = 1
+    return mat
+
+
+def _rows_with(mat, mask):
+    '''
+    mat restricted to rows where mask is True (other rows are zero)
+    '''
+    return csr_matrix(mat.multiply(mask[:, None]))
+
+
+def _column_count(mat):
+    return np.asarray((mat > 0).sum(0)).flatten()
+
+
+def find_merge_entities(v2s, s2l, domain_list):
+    '''
+    returns remove_surf, remove_edge, merge_face
+       remove_surf : interface surfaces between domains in domain_list
+       remove_edge : lines which disappear after merging
+       merge_face  : surface -> index of merged face group
+    '''
+    def nmax(d):
+        return int(np.max(np.hstack([np.hstack(d[k]) for k in d] + [0]))) + 1
+
+    nvol = max(v2s) + 1
+    nsurf = max(max(s2l) + 1, nmax(v2s))
+    nline = nmax(s2l)
+
+    vs = _incidence(v2s, nvol, nsurf)
+    sl = _incidence(s2l, nsurf, nline)
+
+    in_list = np.zeros(nvol, dtype=bool)
+    in_list[domain_list] = True
+    is_vol = np.zeros(nvol, dtype=bool)
+    is_vol[list(v2s)] = True
+    outside = np.logical_and(is_vol, ~in_list)
+
+    # surfaces shared by two domains in domain_list
+    vs_in = _rows_with(vs, in_list)
+    removed = _column_count(vs_in) >= 2
+    remove_surf = np.where(removed)[0]
 
+    # check merging to one domain
+    touch = (vs_in @ vs_in.transpose()).tocsr()
+    sub = touch[domain_list][:, domain_list]
+    ncomp, labels = connected_components(sub, directed=False)
+    dprint1("touched_domain", [int(x) for x in
+                               np.array(domain_list)[labels == labels[0]]])
+    assert len(remove_surf) > 0 and ncomp == 1, "domains are not connected"
+
+    # lines of interface surfaces
+    candidate = _column_count(_rows_with(sl, removed)) > 0
+
+    # (a) lines not used by volumes outside domain_list
+    vl_out = _rows_with(vs, outside) @ sl
+    not_outside = _column_count(vl_out) == 0
+
+    # (b) lines where two remaining surfaces meet and both belong to
+    #     the same single outside volume
+    sl_keep = _rows_with(sl, ~removed)
+    nkeep = _column_count(sl_keep)
+    nvol_out = _column_count(_rows_with(vs, outside) @ sl_keep)
+    single = np.logical_and(nkeep == 2, nvol_out == 1)
+
+    remove = np.logical_and(candidate, np.logical_or(not_outside, single))
+    remove_edge = np.where(remove)[0]
+
+    # surfaces connected by removed lines form a merged face
+    sl_r = sl_keep[:, remove_edge]
+    nodes = np.where(_column_count(sl_r.transpose()) > 0)[0]
+    merge_face = {}
+    if len(nodes) > 0:
+        ss = (sl_r @ sl_r.transpose()).tocsr()[nodes][:, nodes]
+        ngroup, labels = connected_components(ss, directed=False)
+
+        # order groups by the first removed line touching them
+        coo = sl_r.tocoo()
+        first = np.full(nsurf, nline)
+        np.minimum.at(first, coo.row, remove_edge[coo.col])
+        gfirst = np.full(ngroup, nline)
+        np.minimum.at(gfirst, labels, first[nodes])
+        rank = np.argsort(np.argsort(gfirst, kind='stable'), kind='stable')
+        merge_face = {int(s): int(rank[g]) for s, g in zip(nodes, labels)}
+
+    return [int(x) for x in remove_surf], [int(x) for x in remove_edge], merge_face
 
-def merge_domain_3d(mesh, domain_list, reorder_dom=True):
 
-    if not hasattr(mesh, 'extended_connectivity'): 
-        from petram.mesh.mesh_utils import  get_extended_connectivity       
-        get_extended_connectivity(mesh)               
+def merge_domain_3d(mesh, domain_list, reorder_dom=True):
+    '''
+    returns new mesh where domains in domain_list are merged
+    '''
+    from petram.mesh.mesh_arrays import (element_vertices,
+                                         element_vertices_of,
+                                         vertex_coordinates)
+    from petram.mesh.mesh_cache import arrays_to_mesh
+
+    if not hasattr(mesh, 'extended_connectivity'):
+        from petram.mesh.mesh_utils import get_extended_connectivity
+        get_extended_connectivity(mesh)
     ec = mesh.extended_connectivity
 
     v2s = ec['vol2surf']
     s2l = ec['surf2line']
 
-    from petram.mesh.mesh_utils import vol2line, line2surf,line2vol
-    
-    v2l = vol2line(v2s, s2l)
-    l2v = line2vol(v2l)
-    l2s = line2surf(s2l)
-    
-    # find surfaces to remove
-    # find edge to remove
-    remove_surf=[]
-    remove_edge = Set()
-    merge_vol = {}
-    for d in domain_list:
-       merge_vol[d] = 0
-    touched_dom = []    
-    for i, j in combinations(domain_list, 2):
-        iscts = np.intersect1d(v2s[i], v2s[j])
-        if len(iscts) != 0: touched_dom.append((i,j))
-        remove_surf.append(iscts)
-    remove_surf = list(np.hstack(remove_surf).astype(int))
-    
-    for s in remove_surf:
-        for l in s2l[s]:
-            for v in v2l:
-                if l in v2l[v] and not v in domain_list:
-                    break
-            else:
-                remove_edge.add(l)
-        for l in s2l[s]:
-            connected_surf = [s for s in l2s[l] if not s in remove_surf]
-            if len(connected_surf) != 2: continue
-            v1 = [v for v in v2s if not v in domain_list and connected_surf[0] in v2s[v]]
-            v2 = [v for v in v2s if not v in domain_list and connected_surf[1] in v2s[v]]
-            if len(Set(v1+v2)) == 1:
-               remove_edge.add(l)                        
-               
-    remove_edge = list(remove_edge)                
-
+    domain_list = [int(x) for x in domain_list]
+    remove_surf, remove_edge, merge_face = find_merge_entities(v2s, s2l,
+                                                               domain_list)
 
-    # check merging to one domain
-    if len(touched_dom)==0:
-        assert False, "domains are not connected"
-    c = list(touched_dom[0])
-    for i in range(len(touched_dom)):
-         for j in range(i, len(touched_dom)):
-             if touched_dom[j][0] in c and not touched_dom[j][1] in c:
-                 c.append(touched_dom[j][1])
-             if touched_dom[j][1] in c and not touched_dom[j][0] in c:
-                 c.append(touched_dom[j][0])
-    print("touched_domain", c)
-    if len(c) != len(domain_list): 
-        assert False, "domains are not connected"       
-    
-    # collect faces to merge
-    merge_face0 = []
-    for k, l in enumerate(remove_edge):
-        for f in merge_face0:
-            if np.intersect1d(list(f), l2s[l]).size != 0:
-                 for s in l2s[l]:
-                     if not s in remove_surf: f.add(s)
-                 break
-        else:
-            sss = [s for s in l2s[l] if not s in remove_surf]
-            merge_face0.append(Set(sss))
-    print(merge_face0)
-    merge_face = {}
-    for k, ss in enumerate(merge_face0):
-        for s in ss:
-            merge_face[s] = k
-                 
-    # mapping of bdr (face) attributes
-    idx = 1
-    bdrattr_map = {}
-    for s in s2l:
-        if s in remove_surf: continue
-        if not s in merge_face:
-            bdrattr_map[s] = idx
-            idx = idx + 1
+    # mapping of bdr (face) attributes (0: removed)
+    bdrattr_map = np.zeros(max(s2l) + 1, dtype=int)
+    keep = [s for s in s2l if s not in remove_surf and s not in merge_face]
+    bdrattr_map[keep] = np.arange(len(keep)) + 1
+    idx = len(keep) + 1
     for s, k in merge_face.items():
-        if s in remove_surf: continue        
-        bdrattr_map[s] = k + idx        
+        bdrattr_map[s] = k + idx
 
-    # mapping of domaon attributes
+    # mapping of domain attributes
+    domattr_map = np.zeros(max(v2s) + 1, dtype=int)
+    keep = [v for v in v2s if v not in domain_list]
     if reorder_dom:
-        idx = 1
-        domattr_map = {}
-        for v in v2s:
-            if not v in merge_vol:
-                domattr_map[v] = idx
-                idx = idx + 1
-        for v, k in merge_vol.items():
-            domattr_map[v] = k + idx
+        domattr_map[keep] = np.arange(len(keep)) + 1
+        domattr_map[domain_list] = len(keep) + 1
     else:
-        domattr_map = {}
-        for v in v2s:
-            if not v in merge_vol:
-                domattr_map[v] = v
-        idx = max(v2s.keys())+1
-        for v, k in merge_vol.tems():
-            domattr_map[v] = k + idx
-        
-    print("merge_vol", merge_vol)
-    print("merge_surf", merge_face)    
-    print("remove_edge", remove_edge)
-    print("remove_surf", remove_surf)
-
-    print("domattr_map", domattr_map)
-    print("bdrattr_map", bdrattr_map)    
-
-    # check if edge can be removed...
-        
-    
-    NV = mesh.GetNV()
-    NE = mesh.GetNE()
-    NBE = mesh.GetNBE()    
-
-    bdrattr = mesh.GetBdrAttributeArray()
-    domattr = mesh.GetAttributeArray()
-    
-    Nbelem = np.sum([x in bdrattr_map for x in bdrattr])
-
-    print("NV, NE, NBE", NV, NE, Nbelem)
-
-    import sys
-    if 'mfem.par' in sys.modules:
-       import mfem.par as mfem
-    else:
-       import mfem.par as mfem        
-    omesh = mfem.Mesh(3, NV, NE, Nbelem, 3)
-
-    for k in range(NV):
-        v = mesh.GetVertexArray(k)
-        omesh.AddVertex(list(v))
-
-    for k in range(NE):
-        iv = mesh.GetElementVertices(k)
-        a = domattr_map[domattr[k]]
-        if len(iv) == 4:
-            omesh.AddTet(list(iv), a)
-        if len(iv) == 8:
-            omesh.AddHex(list(iv), a)
-            
-    for k in range(NBE):
-        iv = mesh.GetBdrElementVertices(k)
-        if not bdrattr[k] in bdrattr_map: continue
-        a = bdrattr_map[bdrattr[k]]
-        
-        if len(iv) == 3:
-            omesh.AddBdrTriangle(list(iv), a)
-        if len(iv) == 4:
-            omesh.AddBdrQuad(list(iv), a)
-
-    omesh.FinalizeTopology()
-    omesh.Finalize(refine=True, fix_orientation=True)
-            
-    return omesh    
-
-
+        domattr_map[keep] = keep
+        domattr_map[domain_list] = max(v2s) + 1
+
+    dprint1("merge_vol", domain_list)
+    dprint1("merge_surf", merge_face)
+    dprint1("remove_edge", remove_edge)
+    dprint1("remove_surf", remove_surf)
+
+    # new mesh (same vertices and elements, new attributes)
+    sdim = mesh.SpaceDimension()
+    vertices = np.zeros((mesh.GetNV(), 3))
+    vertices[:, :sdim] = vertex_coordinates(mesh)
+    arrays = {'vertices': vertices}
+
+    attrs = domattr_map[mesh.GetAttributeArray()]
+    battrs = bdrattr_map[mesh.GetBdrAttributeArray()]
+    for name, bdr, a in (('elem', False, attrs), ('bdr', True, battrs)):
+        geoms, offsets, ivert = element_vertices(mesh, bdr=bdr)
+        sel = np.where(a > 0)[0]
+        sub_offsets, sub_vertices = element_vertices_of(offsets, ivert, sel)
+        arrays[name + '_geoms'] = geoms[sel].astype(np.int32)
+        arrays[name + '_offsets'] = sub_offsets.astype(np.int64)
+        arrays[name + '_vertices'] = sub_vertices.astype(np.int32)
+        arrays[name + '_attrs'] = a[sel].astype(np.int32)
+
+    dprint1("NV, NE, NBE", mesh.GetNV(), len(arrays['elem_attrs']),
+            len(arrays['bdr_attrs']))
+
+    header = {'dim': 3, 'sdim': 3, 'nodes': None}
+    return arrays_to_mesh(header, arrays, refine=True, fix_orientation=True)
@@ -0,0 +1,372 @@
+'''
+   element_locator
+
+   find elements and reference coordinates of points.
+
+   ElementLocator bins element bounding boxes to a uniform grid once per
+   mesh. A query collects candidate elements from the grid cell of each
+   point and keeps those whose own bounding box contains the point.
+   Candidates are inverted in a vectorized way:
+      linear simplex        : direct solve
+      linear quad/hex       : Newton iteration of (bi/tri)linear map
+   Other candidates (curved elements, prism/pyramid, surface mesh
+   embedded in higher dimension) are inverted one by one by
+   InverseElementTransformation. The whole mesh is never searched.
+
+   In parallel (ParMesh), a point found in multiple processes is
+   assigned to the lowest rank (same as ParMesh::FindPoints). FindPoints
+   is collective in this case.
+
+   usage:
+      locator = get_locator(mesh)
+      counts, elem_ids, int_points = locator.FindPoints(points)
+'''
+import numpy as np
+from weakref import WeakKeyDictionary as WKD
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+    from mpi4py import MPI
+else:
+    import mfem.ser as mfem
+
+from petram.mesh.mesh_arrays import (element_vertices,
+                                     vertex_coordinates)
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('ElementLocator')
+
+Geom = mfem.Geometry
+simplex_geoms = (Geom.SEGMENT, Geom.TRIANGLE, Geom.TETRAHEDRON)
+tensor_geoms = (Geom.SQUARE, Geom.CUBE)
+
+# reference coordinates of vertices of SQUARE/CUBE (MFEM ordering)
+tensor_vertices = {Geom.SQUARE: np.array([[0, 0], [1, 0], [1, 1], [0, 1]],
+                                         dtype=float),
+                   Geom.CUBE: np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0],
+                                        [0, 1, 0], [0, 0, 1], [1, 0, 1],
+                                        [1, 1, 1], [0, 1, 1]], dtype=float)}
+
+_locators = WKD()
+
+
+def get_locator(mesh):
+    '''
+    ElementLocator is built once per mesh object
+    '''
+    if not mesh in _locators:
+        _locators[mesh] = ElementLocator(mesh)
+    return _locators[mesh]
+
+
+def _expand_ranges(starts, counts):
+    '''
+    concatenation of arange(s, s + c) for each (s, c)
+    '''
+    total = int(np.sum(counts))
+    if total == 0:
+        return np.zeros(0, dtype=int)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(total) - offsets
+
+
+class ElementLocator(object):
+    cache_size = 8
+    newton_iter = 20
+
+    def __init__(self, mesh, tol=1e-12):
+        self.mesh = mesh
+        self.tol = tol
+        self.dim = mesh.Dimension()
+        self.sdim = mesh.SpaceDimension()
+        self.is_parallel = use_parallel and hasattr(mesh, 'ParPrint')
+
+        self.coords = vertex_coordinates(mesh)
+        geoms, offsets, vertices = element_vertices(mesh)
+        self.geoms = geoms
+        self.offsets = offsets
+        self.vertices = vertices
+
+        # linear elements can be inverted using vertices
+        self.is_linear = (mesh.GetNodes() is None and
+                          self.dim == self.sdim)
+        if mesh.GetNodes() is None:
+            ptx = self.coords[vertices]
+            self.bbmin = np.minimum.reduceat(ptx, offsets[:-1], axis=0)
+            self.bbmax = np.maximum.reduceat(ptx, offsets[:-1], axis=0)
+        else:
+            self.bbmin, self.bbmax = self._curved_bounding_box()
+
+        self._build_grid()
+        self._results = {}
+
+    def _curved_bounding_box(self):
+        '''
+        bounding box of element nodes, padded by 5% on each side
+        since curved edges may bulge out of the nodes.
+        '''
+        nodes = self.mesh.GetNodes()
+        fes = nodes.FESpace()
+        data = nodes.GetDataArray()
+        ndofs = fes.GetNDofs()
+        by_vdim = fes.GetOrdering() == mfem.Ordering.byVDIM
+
+        ne = self.mesh.GetNE()
+        bbmin = np.zeros((ne, self.sdim))
+        bbmax = np.zeros((ne, self.sdim))
+        for i in range(ne):
+            dofs = np.array(fes.GetElementDofs(i), dtype=int)
+            dofs = np.where(dofs >= 0, dofs, -1 - dofs)
+            if by_vdim:
+                idx = dofs[:, None] * self.sdim + np.arange(self.sdim)
+            else:
+                idx = dofs[:, None] + np.arange(self.sdim) * ndofs
+            ptx = data[idx]
+            bbmin[i] = np.min(ptx, 0)
+            bbmax[i] = np.max(ptx, 0)
+        pad = (bbmax - bbmin) * 0.05
+        return bbmin - pad, bbmax + pad
+
+    def _build_grid(self):
+        '''
+        uniform grid (about one cell per element). each element is
+        registered to all cells its bounding box overlaps.
+        '''
+        ne = len(self.bbmin)
+        if ne == 0:
+            self.origin = np.zeros(self.sdim)
+            self.h = np.ones(self.sdim)
+            self.ncells = np.ones(self.sdim, dtype=int)
+            self.cell_ptr = np.zeros(2, dtype=int)
+            self.cell_elems = np.zeros(0, dtype=int)
+            self.scaled_tol = self.tol
+            return
+
+        lo = np.min(self.bbmin, 0)
+        hi = np.max(self.bbmax, 0)
+        scale = np.max(hi - lo)
+        scale = scale if scale > 0 else 1.0
+        self.scaled_tol = self.tol * scale
+
+        ext = np.maximum(hi - lo, scale * 1e-3)
+        n = max(int(np.ceil(ne ** (1.0 / self.sdim))), 1)
+        self.ncells = np.maximum(np.ceil(ext / scale * n), 1).astype(int)
+        self.h = ext / self.ncells
+        self.origin = lo
+
+        clo = self._cell_index(self.bbmin - self.scaled_tol)
+        chi = self._cell_index(self.bbmax + self.scaled_tol)
+        span = chi - clo + 1
+        counts = np.prod(span, 1)
+
+        elems = np.repeat(np.arange(ne), counts)
+        k = _expand_ranges(np.zeros(ne, dtype=int), counts)
+        idx = []
+        for d in range(self.sdim):
+            s = span[elems, d]
+            idx.append(clo[elems, d] + k % s)
+            k = k // s
+        cells = np.ravel_multi_index(tuple(idx), self.ncells)
+
+        order = np.argsort(cells, kind='stable')
+        self.cell_elems = elems[order]
+        ncell = int(np.prod(self.ncells))
+        self.cell_ptr = np.hstack((0, np.cumsum(np.bincount(cells,
+                                                            minlength=ncell))))
+        dprint2("element grid", self.ncells, "entries", len(self.cell_elems))
+
+    def _cell_index(self, x):
+        idx = np.floor((x - self.origin) / self.h).astype(int)
+        return np.clip(idx, 0, self.ncells - 1)
+
+    def candidates(self, points):
+        '''
+        returns (point index, element index) pairs whose element bounding
+        box contains the point
+        '''
+        tol = self.scaled_tol
+        inside_grid = np.all((points >= self.origin - tol) &
+                             (points <= self.origin + self.h * self.ncells
+                              + tol), -1)
+        ipts = np.where(inside_grid)[0]
+        cells = np.ravel_multi_index(tuple(self._cell_index(points[ipts]).T),
+                                     self.ncells)
+        starts = self.cell_ptr[cells]
+        counts = self.cell_ptr[cells + 1] - starts
+        iels = self.cell_elems[_expand_ranges(starts, counts)]
+        ipts = np.repeat(ipts, counts)
+
+        inside = np.all((points[ipts] >= self.bbmin[iels] - tol) &
+                        (points[ipts] <= self.bbmax[iels] + tol), -1)
+        return ipts[inside], iels[inside]
+
+    def invert_simplex(self, points, ipts, iels):
+        '''
+        reference coordinate of points in linear simplex.
+        returns (mask of pairs where point is inside, reference coords),
+        or None if an element is degenerated
+        '''
+        nv = self.dim + 1
+        verts = self.vertices[self.offsets[iels][:, None] + np.arange(nv)]
+        v = self.coords[verts]                         # (n, nv, sdim)
+        jac = (v[:, 1:, :] - v[:, :1, :]).transpose(0, 2, 1)    # (n, sdim, dim)
+        rhs = points[ipts] - v[:, 0, :]
+        try:
+            ref = np.linalg.solve(jac, rhs[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            return None
+
+        tol = 1e-10
+        inside = (np.all(ref >= -tol, -1) & (np.sum(ref, -1) <= 1 + tol))
+        return inside, ref
+
+    def invert_tensor(self, points, ipts, iels, geom):
+        '''
+        reference coordinate of points in linear quad/hex (Newton
+        iteration of the multilinear map).
+        returns (mask of pairs where point is inside, reference coords),
+        or None if the iteration breaks down (degenerated element)
+        '''
+        rv = tensor_vertices[geom]                     # (nv, dim)
+        nv = len(rv)
+        verts = self.vertices[self.offsets[iels][:, None] + np.arange(nv)]
+        v = self.coords[verts]                         # (n, nv, sdim)
+        x = points[ipts]
+        ref = np.zeros((len(ipts), self.dim)) + 0.5
+
+        sign = 2 * rv - 1                              # (nv, dim)
+        for it in range(self.newton_iter):
+            # shape functions and derivatives of multilinear map
+            f = np.where(rv[None, :, :] == 1, ref[:, None, :],
+                         1 - ref[:, None, :])          # (n, nv, dim)
+            shape = np.prod(f, -1)                     # (n, nv)
+            dshape = np.empty(f.shape)
+            for d in range(self.dim):
+                others = np.delete(f, d, axis=-1)
+                dshape[..., d] = sign[:, d] * np.prod(others, -1)
+            res = np.einsum('nv,nvs->ns', shape, v) - x
+            jac = np.einsum('nvd,nvs->nsd', dshape, v)
+            try:
+                dref = np.linalg.solve(jac, res[..., None])[..., 0]
+            except np.linalg.LinAlgError:
+                return None
+            ref = np.clip(ref - dref, -0.5, 1.5)
+            if np.max(np.abs(dref), initial=0) < 1e-13:
+                break
+
+        tol = 1e-10
+        inside = np.all((ref >= -tol) & (ref <= 1 + tol), -1)
+        return inside, ref
+
+    def invert_generic(self, points, ipts, iels):
+        '''
+        InverseElementTransformation for each candidate
+        '''
+        inside = np.zeros(len(ipts), dtype=bool)
+        ips = [None] * len(ipts)
+        for k, (i, e) in enumerate(zip(ipts, iels)):
+            T = self.mesh.GetElementTransformation(int(e))
+            inv = mfem.InverseElementTransformation(T)
+            pt = mfem.Vector(list(points[i]))
+            ip = mfem.IntegrationPoint()
+            ret = inv.Transform(pt, ip)
+            if ret == mfem.InverseElementTransformation.Inside:
+                inside[k] = True
+                ips[k] = ip
+        return inside, ips
+
+    def _locate(self, points):
+        npts = len(points)
+        elem_ids = np.zeros(npts, dtype=int) - 1
+        int_points = [None] * npts
+
+        ipts, iels = self.candidates(points)
+        handled = np.zeros(len(ipts), dtype=bool)
+
+        found_i = []
+        found_e = []
+        found_ref = []
+        if self.is_linear:
+            geoms = self.geoms[iels]
+            for geom in np.unique(geoms):
+                if geom in simplex_geoms:
+                    sel = np.where(geoms == geom)[0]
+                    ret = self.invert_simplex(points, ipts[sel], iels[sel])
+                elif geom in tensor_geoms:
+                    sel = np.where(geoms == geom)[0]
+                    ret = self.invert_tensor(points, ipts[sel], iels[sel],
+                                             geom)
+                else:
+                    continue
+                if ret is None:
+                    # left for invert_generic
+                    continue
+                inside, ref = ret
+                handled[sel] = True
+                found_i.append(ipts[sel][inside])
+                found_e.append(iels[sel][inside])
+                found_ref.append(ref[inside])
+
+        if len(found_i) > 0:
+            i1 = np.hstack(found_i)
+            e1 = np.hstack(found_e)
+            ref = np.vstack(found_ref)
+            # first hit is used
+            void, first = np.unique(i1, return_index=True)
+            for i, e, r in zip(i1[first], e1[first], ref[first]):
+                ip = mfem.IntegrationPoint()
+                ip.x = r[0]
+                if self.dim > 1:
+                    ip.y = r[1]
+                if self.dim > 2:
+                    ip.z = r[2]
+                elem_ids[i] = e
+                int_points[i] = ip
+
+        # candidates of points not found yet
+        rest = np.where(~handled)[0]
+        rest = rest[elem_ids[ipts[rest]] == -1]
+        if len(rest) > 0:
+            dprint2("inverting " + str(len(rest)) + " candidates one by one")
+            inside, ips = self.invert_generic(points, ipts[rest], iels[rest])
+            for k in np.where(inside)[0]:
+                i = ipts[rest[k]]
+                if elem_ids[i] == -1:
+                    elem_ids[i] = iels[rest[k]]
+                    int_points[i] = ips[k]
+
+        if self.is_parallel:
+            self._resolve_owner(elem_ids, int_points)
+
+        counts = int(np.sum(elem_ids != -1))
+        return counts, elem_ids, int_points
+
+    def _resolve_owner(self, elem_ids, int_points):
+        '''
+        keep points only in the lowest rank which found them
+        '''
+        comm = self.mesh.GetComm()
+        myid = comm.rank
+        owner = np.where(elem_ids != -1, myid, comm.size).astype(np.int32)
+        owner_min = np.empty_like(owner)
+        comm.Allreduce(owner, owner_min, op=MPI.MIN)
+        for i in np.where((owner_min != myid) & (elem_ids != -1))[0]:
+            elem_ids[i] = -1
+            int_points[i] = None
+
+    def FindPoints(self, points):
+        '''
+        same return values as mesh.FindPoints.
+        result is cached using the point coordinates as a key.
+        '''
+        points = np.ascontiguousarray(points, dtype=float).reshape(-1, self.sdim)
+        key = (points.shape, points.tobytes())
+        if key in self._results:
+            return self._results[key]
+
+        result = self._locate(points)
+        if len(self._results) >= self.cache_size:
+            self._results.pop(next(iter(self._results)))
+        self._results[key] = result
+        return result
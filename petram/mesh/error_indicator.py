@@ -0,0 +1,87 @@
+'''
+   error_indicator
+
+   element-wise error indicator used by ErrorIndicatorRefinement.
+
+   an indicator computed from a solution (for example by kelly_indicator)
+   is saved with the element centers of the mesh it was computed on:
+
+      eta = kelly_indicator(gf)
+      save_indicator('eta.npz', mesh, eta)
+
+   and is sampled at the element centers of the mesh being refined
+   (nearest saved center). since the lookup is done by location, the
+   file can be used for a refined mesh or a ParMesh (each process
+   samples its own elements).
+'''
+import numpy as np
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+    from mpi4py import MPI
+    from petram.helper.mpi_recipes import allgather_vector
+else:
+    import mfem.ser as mfem
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('ErrorIndicator')
+
+
+def kelly_indicator(gf):
+    '''
+    Kelly error estimate (jump of the flux across element faces) of
+    a scalar H1 GridFunction. returns array of local elements.
+    '''
+    fes = gf.FESpace()
+    mesh = fes.GetMesh()
+    order = fes.GetOrder(0)
+    fec = mfem.L2_FECollection(order, mesh.Dimension())
+    if hasattr(mesh, 'ParPrint'):
+        flux_fes = mfem.ParFiniteElementSpace(mesh, fec, mesh.SpaceDimension())
+    else:
+        flux_fes = mfem.FiniteElementSpace(mesh, fec, mesh.SpaceDimension())
+
+    one = mfem.ConstantCoefficient(1.0)
+    integ = mfem.DiffusionIntegrator(one)
+    estimator = mfem.KellyErrorEstimator(integ, gf, flux_fes)
+    estimator._objs = (fec, flux_fes, one, integ)  # in order to keep it from freed
+    return estimator.GetLocalErrors().GetDataArray().copy()
+
+
+def save_indicator(filename, mesh, values):
+    '''
+    save indicator of each element with element centers.
+    in parallel, data of all processes are written by root.
+    '''
+    from petram.mesh.mesh_arrays import element_centers
+
+    centers = element_centers(mesh)
+    values = np.asarray(values, dtype=float).flatten()
+    assert len(values) == len(centers), "one value per element is required"
+
+    if use_parallel:
+        centers = allgather_vector(centers, MPI.DOUBLE)
+        values = allgather_vector(values, MPI.DOUBLE)
+        if MPI.COMM_WORLD.rank != 0:
+            return
+    np.savez(filename, centers=centers, values=values)
+
+
+def load_indicator(filename):
+    data = np.load(filename)
+    return data['centers'], data['values']
+
+
+def sample_indicator(mesh, centers, values):
+    '''
+    indicator at element centers of mesh (value of nearest saved center)
+    '''
+    from scipy.spatial import cKDTree
+    from petram.mesh.mesh_arrays import element_centers
+
+    ctr = element_centers(mesh)
+    if len(ctr) == 0:
+        return np.zeros(0)
+    void, idx = cKDTree(centers).query(ctr)
+    return values[idx]
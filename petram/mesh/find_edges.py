@@ -1,6 +1,4 @@
 import numpy as np
-from collections import defaultdict
-from scipy.sparse import lil_matrix, coo_matrix
 
 def fill_table(table1, table2, i, j, value):
     if i > j:
@@ -24,58 +22,58 @@ def fill_table(table1, table2, i, j, value):
             else:
                 table2[j, i] = value            
             
+def edge_multiplicity(attrs, offsets, edges):
+    '''
+    count how many times each edge appears in (bdr) elements of each
+    attribute.
+
+    returns unique (attr, edge) pairs as (n, 2) array and counts
+    '''
+    eattrs = np.repeat(np.asarray(attrs, dtype=int), np.diff(offsets))
+    pairs = np.vstack((eattrs, edges)).transpose()
+    if len(pairs) == 0:
+        return pairs.reshape(-1, 2), np.array([], dtype=int)
+    return np.unique(pairs, axis=0, return_counts=True)
+
+
 def find_edges(mesh):
+    from petram.mesh.mesh_arrays import element_edges
 
     iv = mesh.GetBdrElementVertices(0)
     l = len(iv)
-    ne = mesh.GetNEdges()        
 
     if l == 2:
         # 2D mesh
-        get_edges = mesh.GetElementEdges
-        get_attr  = mesh.GetAttribute
-        iattr= mesh.GetAttributeArray()     # min of this array is 1
-        nattr = np.max(iattr)
-        nb = mesh.GetNE()        
+        iattr = mesh.GetAttributeArray()     # min of this array is 1
+        offsets, iedges, _void = element_edges(mesh)
     else:
         # 3D mesh
-        get_edges = mesh.GetBdrElementEdges
-        get_attr  = mesh.GetBdrAttribute
-        iattr= mesh.GetBdrAttributeArray()  # min of this array is 1
-        nattr = np.max(iattr)        
-        nb = mesh.GetNBE()
-
-    edges = defaultdict(list)
-    for i in range(nb):
-        ie, io = get_edges(i)
-        iattr = get_attr(i)
-        edges[iattr].extend(list(ie))
-        
+        iattr = mesh.GetBdrAttributeArray()  # min of this array is 1
+        offsets, iedges, _void = element_edges(mesh, bdr=True)
+
+    pairs, counts = edge_multiplicity(iattr, offsets, iedges)
+
     # for each iattr real edge appears only once
-    for key in edges.keys():
-        seen = defaultdict(int)
-        for x in edges[key]: seen[x] +=1
-        edges[key] = [k for k in seen if seen[k] == 1]
-        
-    N = np.hstack([np.zeros(len(edges[k]))+k-1 for k in edges.keys()])
-    M = np.hstack([np.array(edges[k]) for k in edges.keys()])
-    data = M*0+1
-                  
-    table1 = coo_matrix((data, (M, N)), shape = (ne, nattr), dtype = int)
-    csr = table1.tocsr()
+    pairs = pairs[counts == 1]
+    edges = {}
+    for k in np.unique(pairs[:, 0]):
+        edges[int(k)] = list(pairs[pairs[:, 0] == k, 1])
 
-    #embeded surface only touches to one iattr
-    idx = np.where(np.diff(csr.indptr) >= 1)[0]
-    csr = csr[idx, :]    
+    # set of attributes each edge touches (embeded surface only
+    # touches to one iattr)
+    order = np.lexsort((pairs[:, 0], pairs[:, 1]))
+    pairs = pairs[order]
+    uedges, first, nattrs = np.unique(pairs[:, 1], return_index=True,
+                                      return_counts=True)
 
     # this is true bdr edges.
-    bb_edges = defaultdict(list)
-    indptr = csr.indptr; indices = csr.indices
-    
-    for i in range(csr.shape[0]):
-        idxs = tuple(indices[indptr[i]:indptr[i+1]]+1)
-        bb_edges[idxs].append(idx[i])
-    bb_edges.default_factory = None
+    bb_edges = {}
+    for ie, i, n in zip(uedges, first, nattrs):
+        key = tuple(pairs[i:i + n, 0])
+        if key in bb_edges:
+            bb_edges[key].append(ie)
+        else:
+            bb_edges[key] = [ie]
 
     '''
     edges : face index -> edge elements
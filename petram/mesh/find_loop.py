@@ -5,157 +5,193 @@
 
 '''
 import numpy as np
-from collections import defaultdict
+
+import petram.debug as debug
+dprint1, dprint2, dprint3 = debug.init_dprints('FindLoop')
+
+
+def _bdr_edges_of(mesh, faces):
+    '''
+    edges (and orientations) of boundary elements whose attribute is
+    in faces. an edge appears as many times as it is used.
+    '''
+    from petram.mesh.mesh_arrays import element_edges
+
+    if mesh.GetNBE() == 0:
+        empty = np.array([], dtype=int)
+        return empty, empty
+    offsets, iedges, dirs = element_edges(mesh, bdr=True)
+    battrs = mesh.GetBdrAttributeArray()
+    flag = np.repeat(np.isin(battrs, faces), np.diff(offsets))
+    return iedges[flag], dirs[flag]
+
+
+def _edges_used_once(iedges):
+    '''
+    edges which appears only once. returned in the order of first
+    appearance
+    '''
+    u, first, counts = np.unique(iedges, return_index=True,
+                                 return_counts=True)
+    first = first[counts == 1]
+    return iedges[np.sort(first)]
+
+
+def order_edge_loops(ev):
+    '''
+    connect edges to loops (or open chains) by walking the
+    vertex -> edge adjacency. O(n).
+
+    ev : (n, 2) vertices of edges
+    returns list of (edge index, sign). sign is +1 when edge is
+    traversed from ev[:, 0] to ev[:, 1]. each loop starts from the
+    first edge (or an open end) and the first edge is traversed in
+    its direction.
+    '''
+    ev = np.asarray(ev, dtype=int).reshape(-1, 2)
+    n = len(ev)
+    flat = ev.flatten()
+    uv, inv, counts = np.unique(flat, return_inverse=True,
+                                return_counts=True)
+    order = np.argsort(inv, kind='stable')
+    offsets = np.hstack([0, np.cumsum(counts)])
+
+    # partner[p] : the other edge end (flat position) at the same
+    # vertex as p. -1 at open end or branch.
+    partner = np.full(2 * n, -1, dtype=int)
+    k2 = np.where(counts == 2)[0]
+    a = order[offsets[k2]]
+    b = order[offsets[k2] + 1]
+    partner[a] = b
+    partner[b] = a
+
+    starts = np.hstack([np.where(partner == -1)[0],
+                        np.arange(n, dtype=int) * 2])
+
+    visited = np.zeros(n, dtype=bool)
+    loops = []
+    for p in starts:
+        e = p // 2
+        if visited[e]:
+            continue
+        idx = []
+        signs = []
+        while True:
+            visited[e] = True
+            idx.append(e)
+            signs.append(1 if p % 2 == 0 else -1)
+            q = partner[p ^ 1]
+            if q < 0:
+                break
+            e = q // 2
+            if visited[e]:
+                break
+            p = q
+        loops.append((np.array(idx, dtype=int), np.array(signs, dtype=int)))
+    return loops
+
 
 def find_loop_ser(mesh, *face):
     '''
     find_loop_ser(mesh, 1)                 # loop around boundary index = 1
     find_loop_ser(mesh, [1, 2, 3])           # loop around boundary made by union of index = 1,2,3
-    find_loop_ser(mesh, [1,2,3], [4, 5]) # loop made by two set of boundaries 
+    find_loop_ser(mesh, [1,2,3], [4, 5]) # loop made by two set of boundaries
                                               # (1,2,3) and (4, 5)
 
     '''
     if len(face) == 1:
-        face = face[0]
-        faces = np.atleast_1d(face)
-        battrs = mesh.GetBdrAttributeArray()
-        bidx = np.where(np.in1d(battrs, faces))[0]
-        edges = [mesh.GetBdrElementEdges(i) for i in bidx]
-        iedges = sum([e1[0] for e1 in edges], [])
-        dirs =  sum([e1[1] for e1 in edges], [])
+        faces = np.atleast_1d(face[0])
+        iedges, _dirs = _bdr_edges_of(mesh, faces)
+        idx = _edges_used_once(iedges)
     else:
-        battrs = mesh.GetBdrAttributeArray()
-        
-        bidx1 = np.where(np.in1d(battrs, face[0]))[0]
-        edges1 = np.unique(np.hstack([mesh.GetBdrElementEdges(i)[0] for i in bidx1]))
-        bidx2 = np.where(np.in1d(battrs, face[1]))[0]
-        edges2 = np.unique(np.hstack([mesh.GetBdrElementEdges(i)[0] for i in bidx2]))
-
-        iedges = np.intersect1d(edges1, edges2)
-
-        #dirs = {}
-        #for i in bidx2:
-        #     print(mesh.GetBdrElementEdges(i))
-        #     for ei, dir in zip(*mesh.GetBdrElementEdges(i)):
-        #         if ei in dirs and  dirs[ei] != dir:
-        #             print("orientation is not obtained by this way")
-        #         dirs[ei] = dir
-        #dirs = [dirs[i] for i in iedges]
-
-    seens = defaultdict(int)
-    seendirs  = defaultdict(int)
-    
-    for k, ie in enumerate(iedges):
-        seens[ie] = seens[ie] + 1
-        seendirs[ie] = dirs[k]
-    seens.default_factory = None
-     
-    idx = []
-    signs = []
-    for k in seens.keys():
-        if seens[k] == 1:
-            idx.append(k)
-            signs.append(seendirs[k])
-
-    ll = {tuple(mesh.GetEdgeVertices(i)):i for i in idx}
-
-    from petram.helper.geom import connect_pairs
-
-    loop = connect_pairs(list(ll))
-
-    dirs = {}
-    for i in range(len(loop)-1):
-        if (loop[i], loop[i+1]) in ll: dirs[(loop[i], loop[i+1])] = 1
-        if (loop[i+1], loop[i]) in ll: dirs[(loop[i+1], loop[i])] = -1
-
-    signs = [dirs[key] for key in ll.keys()]
-    idx = [ll[key] for key in ll.keys()]    
-        
-    print("here",idx, signs)
+        edges1, _dirs = _bdr_edges_of(mesh, np.atleast_1d(face[0]))
+        edges2, _dirs = _bdr_edges_of(mesh, np.atleast_1d(face[1]))
+        idx = np.intersect1d(edges1, edges2)
+
+    if len(idx) == 0:
+        return [], []
+
+    ev = np.array([mesh.GetEdgeVertices(int(i)) for i in idx], dtype=int)
+    loops = order_edge_loops(ev)
+    dprint1("number of loops found", len(loops))
+
+    idx = list(np.hstack([idx[k] for k, s in loops]))
+    signs = list(np.hstack([s for k, s in loops]))
     return idx, signs
-    
+
+
 def find_loop_par(pmesh, *face):
     '''
     find_loop_ser(mesh, 1)          # loop around boundary index = 1
     find_loop_ser(mesh, [1, 2, 3])    # loop around boundary made by union of index = 1,2,3
+
+    edge multiplicity is counted locally. only edges on partition
+    interfaces are sent to the process owning them.
+    returns local edge index and sign of edges owned by this process.
     '''
-    
-    import mfem.par as mfem
     from mpi4py import MPI
 
     myid = MPI.COMM_WORLD.rank
-    nprc = MPI.COMM_WORLD.size   
-    comm  = MPI.COMM_WORLD
+    nprc = MPI.COMM_WORLD.size
 
     if nprc == 1:
-        return find_loop_ser(pmesh, face)
-
-    from mfem.common.mpi_debug import nicePrint
-    from petram.helper.mpi_recipes import allgather, allgather_vector, gather_vector    
+        return find_loop_ser(pmesh, *face)
 
-    battrs = pmesh.GetBdrAttributeArray()
+    from petram.helper.mpi_recipes import allgather, alltoall_vector
+    from petram.mesh.mesh_utils import distribute_shared_entity
 
-    face = face[0]
-    faces = np.atleast_1d(face)
-    bidx = np.where(np.in1d(battrs,faces))[0]
-    
+    faces = np.atleast_1d(face[0])
     offset_e = np.hstack([0, np.cumsum(allgather(pmesh.GetNEdges()))])
-    
-    edges = [pmesh.GetBdrElementEdges(i) for i in bidx]
-    iedges = np.array(sum([e1[0] for e1 in edges], []), dtype=int) + offset_e[myid]
-    dirs =  np.array(sum([e1[1] for e1 in edges], []), dtype=int)
 
-    from petram.mesh.mesh_utils import distribute_shared_entity
-
-    shared_info = distribute_shared_entity(pmesh)
-
-    keys = shared_info[0].keys()
-    local_edges = np.hstack([shared_info[0][key][1] for key in keys])
-    global_edges = np.hstack([shared_info[1][key][1] for key in keys])
-
-    own_edges = []
-    for k, ie in enumerate(iedges):
-        iii = np.where(local_edges == ie)[0]
-        if len(iii) != 0:
-            if ie == global_edges[iii[0]]:
-               own_edges.append(ie)          
-            iedges[k] = global_edges[iii[0]]
-        else:
-            own_edges.append(ie)
-
-    #nicePrint("iedges", iedges)
-    iedges_all = allgather_vector(iedges)
-    dirs = allgather_vector(dirs)
-
-    seens = defaultdict(int)
-    seendirs  = defaultdict(int)        
-    for k, ie in enumerate(iedges_all):
-        seens[ie] = seens[ie] + 1
-        seendirs[ie] = dirs[k]
-    seens.default_factory = None
-
-    idx = []
-    signs = []
-    for k in seens.keys():
-        if seens[k] == 1:
-            idx.append(k)
-            signs.append(seendirs[k])
-    iedges_g = np.array(idx)
-    # here idx is global numbering
-    
-    #nicePrint("global_index", idx, signs)
-    #nicePrint("own_edges", own_edges)
-    
-    iedges_l = []
-    signs_l = []
-    for k, ie in enumerate(iedges_g):
-        iii = np.where(own_edges == ie)[0]
-        if len(iii) != 0:
-            iedges_l.append(ie)
-            signs_l.append(signs[k])
-    iedges_l = np.array(iedges_l) - offset_e[myid]
-    signs_l = np.array(signs_l)
-
-    #nicePrint("local_index", iedges_l, signs_l)
+    iedges, dirs = _bdr_edges_of(pmesh, faces)
+    iedges = iedges + offset_e[myid]
+
+    # local count (sign is taken from the last appearance)
+    u, inv, counts = np.unique(iedges, return_inverse=True,
+                               return_counts=True)
+    udirs = np.zeros(len(u), dtype=int)
+    udirs[inv] = dirs
+
+    # shared edges owned by other processes
+    if not hasattr(pmesh, "shared_info"):
+        pmesh.shared_info = distribute_shared_entity(pmesh)
+    ld, md = pmesh.shared_info
+    lids = [np.atleast_1d(ld[key][1]) for key in ld if key[0] != myid]
+    mids = [np.atleast_1d(md[key][1]) for key in ld if key[0] != myid]
+    ranks = [np.zeros(len(np.atleast_1d(ld[key][1])), dtype=int) + key[0]
+             for key in ld if key[0] != myid]
+    if len(lids) > 0:
+        lids = np.hstack(lids).astype(int)
+        mids = np.hstack(mids).astype(int)
+        ranks = np.hstack(ranks).astype(int)
+    else:
+        lids = mids = ranks = np.array([], dtype=int)
+
+    # send (global id, count, sign) of edges owned by others
+    flag = np.isin(u, lids)
+    sorter = np.argsort(lids)
+    pos = sorter[np.searchsorted(lids, u[flag], sorter=sorter)]
+    send_ids = mids[pos]
+    send_ranks = ranks[pos]
+    senddata = [np.hstack((send_ids[send_ranks == i],
+                           counts[flag][send_ranks == i],
+                           udirs[flag][send_ranks == i]))
+                for i in range(nprc)]
+    recvdata = alltoall_vector(senddata, int)
+    recvdata = [x.reshape(3, -1) for x in recvdata]
+
+    # own edges + edges received from others
+    ids = np.hstack([u[~flag]] + [x[0] for x in recvdata])
+    cnts = np.hstack([counts[~flag]] + [x[1] for x in recvdata])
+    sgns = np.hstack([udirs[~flag]] + [x[2] for x in recvdata])
+
+    uids, inv = np.unique(ids, return_inverse=True)
+    total = np.bincount(inv, weights=cnts).astype(int)
+    signs = np.zeros(len(uids), dtype=int)
+    signs[inv] = sgns
+
+    once = total == 1
+    iedges_l = uids[once] - offset_e[myid]
+    signs_l = signs[once]
 
     return iedges_l, signs_l
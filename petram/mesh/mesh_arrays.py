@@ -0,0 +1,212 @@
+'''
+   mesh_arrays
+
+   bulk (numpy) access to mesh connectivity, to avoid calling
+   GetElement(i)... for every element from python.
+
+   element_geometries  : base geometry of each (bdr) element
+   element_vertices    : (bdr) element -> vertex as CSR (offsets, vertices)
+   element_edges       : (bdr) element -> edge as CSR (offsets, edges,
+                         orientations)
+   edge_vertices       : (NEdges, 2) array of edge vertices
+   vertex_coordinates  : (NV, sdim) array of vertex coordinates
+   element_centers     : (NE, sdim) array of element (vertex average) centers
+   element_sizes       : longest vertex-vertex distance of each element
+'''
+import numpy as np
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+else:
+    import mfem.ser as mfem
+
+Geom = mfem.Geometry
+
+geom_nvert = {Geom.POINT: 1,
+              Geom.SEGMENT: 2,
+              Geom.TRIANGLE: 3,
+              Geom.SQUARE: 4,
+              Geom.TETRAHEDRON: 4,
+              Geom.CUBE: 8, }
+geom_of_dim = {0: [Geom.POINT],
+               1: [Geom.SEGMENT],
+               2: [Geom.TRIANGLE, Geom.SQUARE],
+               3: [Geom.TETRAHEDRON, Geom.CUBE], }
+if hasattr(Geom, 'PRISM'):
+    geom_nvert[Geom.PRISM] = 6
+    geom_of_dim[3].append(Geom.PRISM)
+if hasattr(Geom, 'PYRAMID'):
+    geom_nvert[Geom.PYRAMID] = 5
+    geom_of_dim[3].append(Geom.PYRAMID)
+
+
+def _element_data(mesh, geom, bdr):
+    vtx = mfem.intArray()
+    attr = mfem.intArray()
+    if bdr:
+        mesh.GetBdrElementData(geom, vtx, attr)
+    else:
+        mesh.GetElementData(geom, vtx, attr)
+    vtx = np.array(vtx.ToList(), dtype=int).reshape(-1, geom_nvert[geom])
+    return vtx
+
+
+def _nelements(mesh, bdr):
+    return mesh.GetNBE() if bdr else mesh.GetNE()
+
+
+def _element_dim(mesh, bdr):
+    return mesh.Dimension() - 1 if bdr else mesh.Dimension()
+
+
+def element_geometries(mesh, bdr=False):
+    '''
+    base geometry type of all (bdr) elements
+    '''
+    ne = _nelements(mesh, bdr)
+    for g in geom_of_dim[_element_dim(mesh, bdr)]:
+        if len(_element_data(mesh, g, bdr)) == ne:
+            return np.full(ne, g, dtype=int)
+
+    # mixed mesh
+    getbasegeom = (mesh.GetBdrElementBaseGeometry if bdr else
+                   mesh.GetElementBaseGeometry)
+    return np.array([getbasegeom(i) for i in range(ne)], dtype=int)
+
+
+def element_vertices(mesh, bdr=False):
+    '''
+    (bdr) element -> vertex in CSR form
+
+    returns geoms, offsets, vertices
+       vertices of element i are vertices[offsets[i]:offsets[i+1]]
+       in the local vertex ordering of element.
+    '''
+    ne = _nelements(mesh, bdr)
+    geoms = None
+    data = {}
+    for g in geom_of_dim[_element_dim(mesh, bdr)]:
+        data[g] = _element_data(mesh, g, bdr)
+        if len(data[g]) == ne:
+            geoms = np.full(ne, g, dtype=int)
+            break
+    if geoms is None:
+        geoms = element_geometries(mesh, bdr=bdr)
+
+    nverts = np.zeros(ne, dtype=int)
+    for g in data:
+        nverts[geoms == g] = geom_nvert[g]
+    offsets = np.hstack([0, np.cumsum(nverts)]).astype(int)
+
+    vertices = np.empty(offsets[-1], dtype=int)
+    for g in data:
+        idx = np.where(geoms == g)[0]
+        if len(idx) == 0:
+            continue
+        pos = offsets[idx][:, None] + np.arange(geom_nvert[g])
+        vertices[pos] = data[g]
+    return geoms, offsets, vertices
+
+
+def element_vertices_of(offsets, vertices, ielements):
+    '''
+    subset of CSR returned by element_vertices
+    '''
+    ielements = np.asarray(ielements, dtype=int)
+    nverts = offsets[ielements + 1] - offsets[ielements]
+    sub_offsets = np.hstack([0, np.cumsum(nverts)]).astype(int)
+    pos = (np.repeat(offsets[ielements] - sub_offsets[:-1], nverts) +
+           np.arange(sub_offsets[-1]))
+    return sub_offsets, vertices[pos]
+
+
+def element_edges(mesh, bdr=False):
+    '''
+    (bdr) element -> edge in CSR form
+
+    returns offsets, edges, orientations
+       edges of element i are edges[offsets[i]:offsets[i+1]].
+       orientations is the edge orientation seen from the element (+1/-1)
+
+    MFEM does not expose this incidence as an array. it is collected
+    in one pass over elements and all later processing should use
+    the arrays.
+    '''
+    ne = _nelements(mesh, bdr)
+    get_edges = mesh.GetBdrElementEdges if bdr else mesh.GetElementEdges
+    if ne == 0:
+        empty = np.array([], dtype=int)
+        return np.zeros(1, dtype=int), empty, empty
+
+    data = [get_edges(i) for i in range(ne)]
+    nedges = np.array([len(x[0]) for x in data], dtype=int)
+    offsets = np.hstack([0, np.cumsum(nedges)]).astype(int)
+    edges = np.fromiter((e for x in data for e in x[0]), dtype=int,
+                        count=offsets[-1])
+    orientations = np.fromiter((o for x in data for o in x[1]), dtype=int,
+                               count=offsets[-1])
+    return offsets, edges, orientations
+
+
+def edge_vertices(mesh):
+    '''
+    (NEdges, 2) array of edge vertices
+    '''
+    nedges = mesh.GetNEdges()
+    try:
+        jarr = mesh.GetEdgeVertexTable().GetJArray()
+        return np.array(jarr, dtype=int).reshape(-1, 2)[:nedges]
+    except (AttributeError, TypeError):
+        pass
+    ev = [mesh.GetEdgeVertices(i) for i in range(nedges)]
+    return np.array(ev, dtype=int).reshape(-1, 2)
+
+
+def vertex_coordinates(mesh):
+    '''
+    (NV, sdim) array of vertex coordinates
+    '''
+    v = mfem.Vector()
+    mesh.GetVertices(v)
+    sdim = mesh.SpaceDimension()
+    return v.GetDataArray().reshape(sdim, -1).transpose().copy()
+
+
+def _grouped_element_coords(mesh, bdr=False):
+    '''
+    yield (element index, (n, nvert, sdim) vertex coordinates) for each
+    group of elements which has the same number of vertices
+    '''
+    geoms, offsets, vertices = element_vertices(mesh, bdr=bdr)
+    coords = vertex_coordinates(mesh)
+    nverts = np.diff(offsets)
+    for nv in np.unique(nverts):
+        idx = np.where(nverts == nv)[0]
+        pos = offsets[idx][:, None] + np.arange(nv)
+        yield idx, coords[vertices[pos]]
+
+
+def element_centers(mesh, bdr=False):
+    '''
+    (NE, sdim) array of element centers (average of vertices).
+    for curved (high order nodal) elements, this is not the same as
+    GetElementCenter.
+    '''
+    ne = _nelements(mesh, bdr)
+    centers = np.zeros((ne, mesh.SpaceDimension()))
+    for idx, c in _grouped_element_coords(mesh, bdr=bdr):
+        centers[idx] = np.mean(c, 1)
+    return centers
+
+
+def element_sizes(mesh, bdr=False):
+    '''
+    longest distance between vertices of each element
+    '''
+    ne = _nelements(mesh, bdr)
+    sizes = np.zeros(ne)
+    for idx, c in _grouped_element_coords(mesh, bdr=bdr):
+        d = c[:, :, None, :] - c[:, None, :, :]
+        sizes[idx] = np.sqrt(np.max(np.sum(d**2, -1), (1, 2)))
+    return sizes
@@ -0,0 +1,367 @@
+'''
+   mesh_cache
+
+   binary cache of mfem.Mesh, to skip parsing large mesh files and
+   re-running python mesh generators.
+
+   file layout:
+      b'PMESHBIN'                  magic (8 bytes)
+      header length                uint64 (little endian)
+      header                       json (dim, sdim, nodes, arrays)
+      arrays                       raw data, each aligned to 8 bytes
+
+   arrays:
+      vertices                     (NV, 3) float64
+      elem_geoms, elem_offsets, elem_vertices, elem_attrs
+      bdr_geoms, bdr_offsets, bdr_vertices, bdr_attrs
+      nodes                        (optional) nodes of curved mesh
+
+   arrays are read via np.memmap and mfem.Mesh is built from them.
+   when all elements (and all bdr elements) have the same geometry, the
+   bulk Mesh constructor is used.
+
+   load_mesh_file : mfem.Mesh(path, ...) using a cache file next to path
+                    (.<name>.<hash>.pmesh, hash of file content and
+                    load options)
+   cached_mesh    : cache of generated mesh. cache files are stored
+                    in PETRAM_MESH_CACHE_DIR (default ~/.cache/petram/mesh)
+
+   setting PETRAM_MESH_CACHE=0 disables the cache.
+'''
+import os
+import glob
+import json
+import struct
+import hashlib
+import tempfile
+import numpy as np
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+    from mpi4py import MPI
+    myid = MPI.COMM_WORLD.rank
+else:
+    import mfem.ser as mfem
+    myid = 0
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('MeshCache')
+
+magic = b'PMESHBIN'
+format_version = 1
+
+# mesh files smaller than this are read directly
+min_file_size = 1024 * 1024
+# generated meshes smaller than this (number of elements) are not cached
+min_generated_ne = 50000
+
+
+def cache_enabled():
+    return os.getenv('PETRAM_MESH_CACHE', '1') != '0'
+
+
+def cache_dir():
+    d = os.getenv('PETRAM_MESH_CACHE_DIR')
+    if d is None:
+        d = os.path.join(os.path.expanduser('~'), '.cache', 'petram', 'mesh')
+    return d
+
+
+def _aligned(n):
+    return (n + 7) // 8 * 8
+
+
+def can_cache(mesh):
+    '''
+    NURBS and non-conforming meshes are not cached
+    '''
+    if getattr(mesh, 'NURBSext', None) is not None:
+        return False
+    if getattr(mesh, 'ncmesh', None) is not None:
+        return False
+    return True
+
+
+def mesh_to_arrays(mesh):
+    '''
+    returns header (dict), arrays (dict of numpy array)
+    '''
+    from petram.mesh.mesh_arrays import element_vertices, vertex_coordinates
+
+    sdim = mesh.SpaceDimension()
+    vertices = np.zeros((mesh.GetNV(), 3))
+    vertices[:, :sdim] = vertex_coordinates(mesh)
+
+    arrays = {'vertices': vertices}
+    for name, bdr, get_attrs in (('elem', False, mesh.GetAttributeArray),
+                                 ('bdr', True, mesh.GetBdrAttributeArray)):
+        geoms, offsets, ivert = element_vertices(mesh, bdr=bdr)
+        arrays[name + '_geoms'] = geoms.astype(np.int32)
+        arrays[name + '_offsets'] = offsets.astype(np.int64)
+        arrays[name + '_vertices'] = ivert.astype(np.int32)
+        arrays[name + '_attrs'] = np.array(get_attrs(), dtype=np.int32)
+
+    header = {'version': format_version,
+              'dim': mesh.Dimension(),
+              'sdim': sdim,
+              'nodes': None}
+
+    nodes = mesh.GetNodes()
+    if nodes is not None:
+        fes = nodes.FESpace()
+        fec = fes.FEColl()
+        header['nodes'] = {'order': fec.GetOrder(),
+                           'discont': fec.Name().startswith('L2'),
+                           'vdim': fes.GetVDim(),
+                           'ordering': fes.GetOrdering()}
+        arrays['nodes'] = nodes.GetDataArray().copy()
+
+    return header, arrays
+
+
+def write_mesh_cache(filename, mesh):
+    '''
+    write mesh to filename. file is written to a temporary file
+    first and moved, so that other processes never see a partial file.
+    '''
+    header, arrays = mesh_to_arrays(mesh)
+
+    header['arrays'] = {}
+    pos = 0
+    for name, a in arrays.items():
+        header['arrays'][name] = (a.dtype.str, a.shape, pos)
+        pos = _aligned(pos + a.nbytes)
+
+    hdata = json.dumps(header).encode()
+    start = _aligned(len(magic) + 8 + len(hdata))
+
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                   suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            fid.write(magic)
+            fid.write(struct.pack('<Q', len(hdata)))
+            fid.write(hdata)
+            for name, a in arrays.items():
+                fid.seek(start + header['arrays'][name][2])
+                fid.write(np.ascontiguousarray(a).tobytes())
+            fid.truncate(start + pos)
+        os.replace(tmpfile, filename)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
+def read_mesh_arrays(filename):
+    '''
+    returns header, arrays (arrays are views of np.memmap)
+    '''
+    with open(filename, 'rb') as fid:
+        assert fid.read(len(magic)) == magic, "not a mesh cache file: " + filename
+        size = struct.unpack('<Q', fid.read(8))[0]
+        header = json.loads(fid.read(size).decode())
+    assert header['version'] == format_version, "unsupported mesh cache version"
+
+    start = _aligned(len(magic) + 8 + size)
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    arrays = {}
+    for name, (dtype, shape, pos) in header['arrays'].items():
+        arrays[name] = np.ndarray(tuple(shape), dtype=np.dtype(dtype),
+                                  buffer=data, offset=start + pos)
+    return header, arrays
+
+
+def _bulk_mesh(header, arrays):
+    '''
+    use Mesh(vertices, nv, element_indices, geom, attrs, ne, ...).
+    returns None if it can not be used.
+    '''
+    egeoms = np.unique(arrays['elem_geoms'])
+    bgeoms = np.unique(arrays['bdr_geoms'])
+    if len(egeoms) != 1 or len(bgeoms) > 1:
+        return None
+    bgeom = bgeoms[0] if len(bgeoms) == 1 else mfem.Geometry.POINT
+
+    vertices = np.array(arrays['vertices'], dtype=float)
+    elems = np.ascontiguousarray(arrays['elem_vertices'], dtype=np.int32)
+    attrs = np.ascontiguousarray(arrays['elem_attrs'], dtype=np.int32)
+    belems = np.ascontiguousarray(arrays['bdr_vertices'], dtype=np.int32)
+    battrs = np.ascontiguousarray(arrays['bdr_attrs'], dtype=np.int32)
+    try:
+        mesh = mfem.Mesh(vertices, len(vertices),
+                         elems, int(egeoms[0]), attrs, len(attrs),
+                         belems, int(bgeom), battrs, len(battrs),
+                         header['dim'], header['sdim'])
+    except (TypeError, NotImplementedError):
+        dprint2("bulk Mesh constructor is not available")
+        return None
+
+    # mesh uses vertices as external data
+    mesh._vertices = vertices  # in order to keep it from freed
+    return mesh
+
+
+def _add_element(mesh, geom, iv, attr, bdr):
+    Geom = mfem.Geometry
+    iv = [int(x) for x in iv]
+    attr = int(attr)
+    if geom == Geom.POINT:
+        el = mfem.Point(iv[0])
+        el.SetAttribute(attr)
+        el.thisown = False
+        mesh.AddBdrElement(el)
+    elif geom == Geom.SEGMENT:
+        if bdr:
+            mesh.AddBdrSegment(iv, attr)
+        else:
+            el = mfem.Segment(tuple(iv), attr)
+            el.thisown = False
+            mesh.AddElement(el)
+    elif geom == Geom.TRIANGLE:
+        if bdr:
+            mesh.AddBdrTriangle(iv, attr)
+        else:
+            mesh.AddTri(iv, attr)
+    elif geom == Geom.SQUARE:
+        if bdr:
+            mesh.AddBdrQuad(iv, attr)
+        else:
+            mesh.AddQuad(iv, attr)
+    elif geom == Geom.TETRAHEDRON:
+        mesh.AddTet(iv, attr)
+    elif geom == Geom.CUBE:
+        mesh.AddHex(iv, attr)
+    elif geom == getattr(Geom, 'PRISM', -1):
+        mesh.AddWedge(iv, attr)
+    elif geom == getattr(Geom, 'PYRAMID', -1):
+        mesh.AddPyramid(iv, attr)
+    else:
+        assert False, "unsupported base geometry: " + str(geom)
+
+
+def _elementwise_mesh(header, arrays):
+    dim, sdim = header['dim'], header['sdim']
+    vertices = arrays['vertices']
+    mesh = mfem.Mesh(dim, len(vertices), len(arrays['elem_attrs']),
+                     len(arrays['bdr_attrs']), sdim)
+
+    for name, bdr in (('elem', False), ('bdr', True)):
+        geoms = arrays[name + '_geoms']
+        offsets = arrays[name + '_offsets']
+        ivert = arrays[name + '_vertices']
+        attrs = arrays[name + '_attrs']
+        for i in range(len(attrs)):
+            _add_element(mesh, geoms[i], ivert[offsets[i]:offsets[i + 1]],
+                         attrs[i], bdr)
+
+    for v in vertices[:, :sdim]:
+        mesh.AddVertex(list(v))
+    mesh.FinalizeTopology()
+    return mesh
+
+
+def arrays_to_mesh(header, arrays, refine=1, fix_orientation=True):
+    mesh = _bulk_mesh(header, arrays)
+    if mesh is None:
+        mesh = _elementwise_mesh(header, arrays)
+    mesh.Finalize(refine, fix_orientation)
+
+    nodes = header['nodes']
+    if nodes is not None:
+        mesh.SetCurvature(nodes['order'], nodes['discont'], nodes['vdim'],
+                          nodes['ordering'])
+        mesh.GetNodes().Assign(np.ascontiguousarray(arrays['nodes']))
+    return mesh
+
+
+def read_mesh_cache(filename, refine=1, fix_orientation=True):
+    header, arrays = read_mesh_arrays(filename)
+    return arrays_to_mesh(header, arrays, refine=refine,
+                          fix_orientation=fix_orientation)
+
+
+def _try_read(filename, refine, fix_orientation):
+    if not os.path.exists(filename):
+        return None
+    try:
+        mesh = read_mesh_cache(filename, refine=refine,
+                               fix_orientation=fix_orientation)
+    except BaseException as err:
+        dprint1("failed to read mesh cache (ignored): " + filename, err)
+        return None
+    dprint1("mesh is read from cache: " + filename)
+    return mesh
+
+
+def _try_write(filename, mesh, stale=()):
+    if myid != 0 or not can_cache(mesh):
+        return
+    try:
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        write_mesh_cache(filename, mesh)
+        for f in stale:
+            if f != filename:
+                os.remove(f)
+    except OSError as err:
+        dprint1("mesh cache is not written: " + filename, err)
+        return
+    dprint1("mesh cache is written: " + filename)
+
+
+def file_hash(path, *options):
+    h = hashlib.sha1()
+    h.update(repr((format_version, options)).encode())
+    with open(path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def cache_filename(path, key):
+    dirname, basename = os.path.split(os.path.abspath(path))
+    return os.path.join(dirname, '.' + basename + '.' + key + '.pmesh')
+
+
+def load_mesh_file(path, generate_edges=1, refine=1, fix_orientation=True):
+    '''
+    mfem.Mesh(path, generate_edges, refine, fix_orientation) using
+    binary cache next to path.
+    '''
+    args = (path, generate_edges, refine, fix_orientation)
+    if not cache_enabled() or os.path.getsize(path) < min_file_size:
+        return mfem.Mesh(*args)
+
+    key = file_hash(path, generate_edges, refine, fix_orientation)
+    filename = cache_filename(path, key)
+    mesh = _try_read(filename, refine, fix_orientation)
+    if mesh is not None:
+        return mesh
+
+    mesh = mfem.Mesh(*args)
+    stale = glob.glob(cache_filename(path, '*'))
+    _try_write(filename, mesh, stale=stale)
+    return mesh
+
+
+def cached_mesh(key, builder, refine=1, fix_orientation=True):
+    '''
+    key     : tuple of parameters which determine mesh (repr is hashed)
+    builder : function to generate mesh. called when cache is not found
+    '''
+    if not cache_enabled():
+        return builder()
+
+    h = hashlib.sha1(repr((format_version, key)).encode()).hexdigest()[:16]
+    filename = os.path.join(cache_dir(), 'mesh_' + h + '.pmesh')
+    mesh = _try_read(filename, refine, fix_orientation)
+    if mesh is not None:
+        return mesh
+
+    mesh = builder()
+    if mesh.GetNE() >= min_generated_ne:
+        _try_write(filename, mesh)
+    return mesh
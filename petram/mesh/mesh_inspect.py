@@ -8,12 +8,6 @@ import textwrap
 from collections import defaultdict
 from ifigure.interactive import figure
 
-from petram.mfem_config import use_parallel
-if use_parallel:
-    import mfem.par as mfem
-else:
-    import mfem.ser as mfem
-
 '''
 Data collectors
 '''   
@@ -124,7 +118,12 @@ def find_invalid_topology(mesh):
 
     We also returns the attributes of the elements containing invalid
     faces
+
+    face orientation is checked from bulk element arrays
+    (see mesh_quality.invalid_faces)
     '''
+    from petram.mesh.mesh_quality import invalid_faces
+
     dim = mesh.Dimension()
     sdim = mesh.SpaceDimension()
     attrs = mesh.GetAttributeArray()
@@ -133,20 +132,11 @@ def find_invalid_topology(mesh):
         # this case does not need this check
         return [], [], []
 
-    NFaces = mesh.GetNumFaces()
+    pairs, lfaces = invalid_faces(mesh)
 
-    invalid = []
-    invalid_attrs = []
-    
-    for i in range(NFaces):
-        info = mesh.GetFaceElementTransformations(i)
-        _elem1inf, elem2inf = mesh.GetFaceInfos(i)
-
-        check = info.Elem2No < 0 or (elem2inf % 2) != 0
-        if not check:
-            invalid.append(i)
-            tmp = (attrs[info.Elem1No], attrs[info.Elem2No])
-            invalid_attrs.append(tmp)
+    invalid = [mesh.GetElementFaces(int(e1))[0][lf]
+               for (e1, e2), lf in zip(pairs, lfaces)]
+    invalid_attrs = [(attrs[e1], attrs[e2]) for e1, e2 in pairs]
             
     sj = get_scaled_jacobian(mesh)
     inverted_elements = np.where(sj < 0)[0]
@@ -177,27 +167,11 @@ def format_error(invalids, invalid_attrs, inverted, width=60):
                      out1 + ["Found in domain:"] + out2)
     
 def get_scaled_jacobian(mesh, sd=-1):
-    if sd == -1:
-        nd = mesh.GetNodes()
-        if nd is None:
-            sd = 1
-        else:
-            order = nd.FESpace().GetOrder(0)
-            sd = int(order)
-            
-    scaled_jac = np.array([mesh.GetScaledJacobian(i, sd) for i in range(mesh.GetNE())])
-
-    return scaled_jac
+    from petram.mesh.mesh_quality import scaled_jacobian
+    return scaled_jacobian(mesh, sd=sd)
 
 def save_scaled_jacobian(filename, mesh, sd=-1):
+    from petram.mesh.mesh_quality import save_element_data
 
     sj = get_scaled_jacobian(mesh, sd=sd)
-
-    fec = mfem.L2_FECollection(0, mesh.Dimension())
-    fes = mfem.FiniteElementSpace(mesh, fec)
-
-    vec = mfem.Vector(sj)
-    gf = mfem.GridFunction(fes, vec.GetData())
-
-    gf.Save(filename)
-
+    save_element_data(filename, mesh, sj)
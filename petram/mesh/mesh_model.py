@@ -4,7 +4,6 @@ from petram.namespace_mixin import NS_mixin
 from petram.model import Model
 import os
 import numpy as np
-import parser
 import mfem
 from abc import abstractmethod
 
@@ -82,6 +81,19 @@ class MeshGenerator(Mesh):
         m = self.run(mesh=mesh)
         return m
 
+    def run_parallel(self, comm, get_partitioning, serial_ops=(),
+                     partitioning='auto'):
+        '''
+        generate ParMesh directly. returns None if not supported.
+        in this case, engine calls run and distribute the serial mesh.
+
+        serial_ops: functions (mesh -> mesh) to be applied to the
+                    serial mesh before partitioning
+        partitioning: name of partitioning method (get_partitioning
+                      uses this method)
+        '''
+        return None
+
     @abstractmethod
     def run(self, mesh=None):
         pass
@@ -96,21 +108,27 @@ class MFEMMesh(Model):
         try:
             from petram.mesh.pumimesh_model import PumiMesh
             return [MeshFile, PumiMesh, Mesh1D, Mesh2D, Mesh3D,
-                    UniformRefinement, DomainRefinement]
+                    UniformRefinement, DomainRefinement,
+                    SizeFieldRefinement, ErrorIndicatorRefinement,
+                    ElementReordering]
         except BaseException:
             return [MeshFile, Mesh1D, Mesh2D, Mesh3D, UniformRefinement,
-                    DomainRefinement]
+                    DomainRefinement, SizeFieldRefinement,
+                    ErrorIndicatorRefinement, ElementReordering]
 
     def get_possible_child_menu(self):
         try:
             from petram.mesh.pumimesh_model import PumiMesh
             return [("", MeshFile), ("Other Meshes", Mesh1D),
                     ("", Mesh2D), ("", Mesh3D), ("!", PumiMesh),
-                    ("Refinement...", UniformRefinement), ("!", DomainRefinement)]
+                    ("Refinement...", UniformRefinement), ("", DomainRefinement),
+                    ("", SizeFieldRefinement), ("!", ErrorIndicatorRefinement),
+                    ("", ElementReordering)]
         except BaseException:
             return [("", MeshFile), ("Other Meshes", Mesh1D),
                     ("", Mesh2D), ("!", Mesh3D), ("Refinement...", UniformRefinement),
-                    ("!", DomainRefinement)]
+                    ("", DomainRefinement), ("", SizeFieldRefinement),
+                    ("!", ErrorIndicatorRefinement), ("", ElementReordering)]
 
     def panel1_param(self):
         if not hasattr(self, "_topo_check_char"):
@@ -205,7 +223,8 @@ class MFEMMesh(Model):
             evt.Skip()
 
     def compute_scaled_jac(self, evt):
-        from petram.mesh.mesh_inspect import get_scaled_jacobian
+        from petram.mesh.mesh_quality import (mesh_quality, quality_summary,
+                                              element_gridfunction)
 
         editor = evt.GetEventObject().GetTopLevelParent()
         dlg = editor.show_progress_bar(
@@ -214,11 +233,10 @@ class MFEMMesh(Model):
         try:
             viewer = editor.GetParent()
             mesh = viewer.model.variables.getvar('mesh')
-            sj = get_scaled_jacobian(mesh, sd=-1)
-            fec = mfem.L2_FECollection(0, mesh.Dimension())
-            fes = mfem.FiniteElementSpace(mesh, fec)
-            vec = mfem.Vector(sj)
-            gf = mfem.GridFunction(fes, vec.GetData())
+            quality = mesh_quality(mesh, sd=-1)
+            for key, value in quality_summary(quality).items():
+                dprint1(key + " (min, max, mean): " + str(value))
+            gf = element_gridfunction(mesh, quality['scaled_jacobian'])
 
         except BaseException:
             import traceback
@@ -456,9 +474,9 @@ class MeshFile(MeshGenerator):
         if not os.path.exists(path):
             print("mesh file does not exists : " + path + " in " + os.getcwd())
             return None
-        args = (path, self.generate_edges, self.refine, self.fix_orientation)
-
-        mesh = mfem.Mesh(*args)
+        from petram.mesh.mesh_cache import load_mesh_file
+        mesh = load_mesh_file(path, self.generate_edges, self.refine,
+                              self.fix_orientation)
 
         if self.enforce_ncmesh:
             mesh.EnsureNCMesh()
@@ -471,6 +489,32 @@ class MeshFile(MeshGenerator):
         except BaseException:
             return None
 
+    def run_parallel(self, comm, get_partitioning, serial_ops=(),
+                     partitioning='auto'):
+        '''
+        read mesh on root (or from pre-split files) and send each
+        process only its part. see parallel_mesh_io.
+        '''
+        if self.enforce_ncmesh:
+            return None
+        path = self.get_real_path()
+        if not os.path.exists(path):
+            return None
+
+        from petram.mesh.parallel_mesh_io import load_parallel_mesh
+        pmesh = load_parallel_mesh(comm, path,
+                                   get_partitioning=get_partitioning,
+                                   generate_edges=self.generate_edges,
+                                   refine=self.refine,
+                                   fix_orientation=self.fix_orientation,
+                                   serial_ops=serial_ops,
+                                   partitioning=partitioning)
+        if pmesh is not None:
+            self.parent.sdim = pmesh.SpaceDimension()
+            # statistics of the part of this process
+            self._mesh_char = format_mesh_characteristic(pmesh)
+        return pmesh
+
 
 class Mesh1D(MeshGenerator):
     has_2nd_panel = False
@@ -551,15 +595,21 @@ class Mesh1D(MeshGenerator):
     def run(self, mesh=None):
 
         from petram.mesh.make_simplemesh import straight_line_mesh
+        from petram.mesh.mesh_cache import cached_mesh
 
         success = self.eval_strings()
         assert success, "Conversion error of input parameter"
 
-        mesh = straight_line_mesh(self.length, self.nsegs,
-                                  filename='',
-                                  refine=self.refine == 1,
-                                  fix_orientation=self.fix_orientation,
-                                  sdim=1, x0=self.mesh_x0)
+        def build():
+            return straight_line_mesh(self.length, self.nsegs,
+                                      filename='',
+                                      refine=self.refine == 1,
+                                      fix_orientation=self.fix_orientation,
+                                      sdim=1, x0=self.mesh_x0)
+        key = ('Mesh1D', self.length, self.nsegs, self.refine == 1,
+               self.fix_orientation, self.mesh_x0)
+        mesh = cached_mesh(key, build, refine=self.refine == 1,
+                           fix_orientation=self.fix_orientation)
         self.parent.sdim = mesh.SpaceDimension()
         self._mesh_char = format_mesh_characteristic(mesh)
         try:
@@ -668,14 +718,20 @@ class Mesh2D(MeshGenerator):
     def run(self, mesh=None):
 
         from petram.mesh.make_simplemesh import quad_rectangle_mesh
+        from petram.mesh.mesh_cache import cached_mesh
 
         success = self.eval_strings()
         assert success, "Conversion error of input parameter"
 
-        mesh = quad_rectangle_mesh(self.xlength, self.xnsegs, self.ylength, self.ynsegs,
-                                   filename='', refine=self.refine == 1,
-                                   fix_orientation=self.fix_orientation,
-                                   sdim=2, x0=self.mesh_x0)
+        def build():
+            return quad_rectangle_mesh(self.xlength, self.xnsegs, self.ylength, self.ynsegs,
+                                       filename='', refine=self.refine == 1,
+                                       fix_orientation=self.fix_orientation,
+                                       sdim=2, x0=self.mesh_x0)
+        key = ('Mesh2D', self.xlength, self.xnsegs, self.ylength, self.ynsegs,
+               self.refine == 1, self.fix_orientation, self.mesh_x0)
+        mesh = cached_mesh(key, build, refine=self.refine == 1,
+                           fix_orientation=self.fix_orientation)
 
         if self.enforce_ncmesh:
             mesh.EnsureNCMesh()
@@ -799,13 +855,20 @@ class Mesh3D(MeshGenerator):
 
     def run(self, mesh=None):
         from petram.mesh.make_simplemesh import hex_box_mesh
+        from petram.mesh.mesh_cache import cached_mesh
 
         success = self.eval_strings()
         assert success, "Conversion error of input parameter"
 
-        mesh = hex_box_mesh(self.xlength, self.xnsegs, self.ylength, self.ynsegs, self.zlength, self.znsegs,
-                            filename='', refine=self.refine == 1, fix_orientation=self.fix_orientation,
-                            sdim=3, x0=self.mesh_x0)
+        def build():
+            return hex_box_mesh(self.xlength, self.xnsegs, self.ylength, self.ynsegs, self.zlength, self.znsegs,
+                                filename='', refine=self.refine == 1, fix_orientation=self.fix_orientation,
+                                sdim=3, x0=self.mesh_x0)
+        key = ('Mesh3D', self.xlength, self.xnsegs, self.ylength, self.ynsegs,
+               self.zlength, self.znsegs, self.refine == 1,
+               self.fix_orientation, self.mesh_x0)
+        mesh = cached_mesh(key, build, refine=self.refine == 1,
+                           fix_orientation=self.fix_orientation)
 
         if self.enforce_ncmesh:
             mesh.EnsureNCMesh()
@@ -820,6 +883,72 @@ class Mesh3D(MeshGenerator):
             return None
 
 
+def is_mixed_geometry(mesh):
+    '''
+    check if element geometry type is mixed (in all processes)
+    '''
+    from petram.mesh.mesh_arrays import element_geometries
+
+    gtype = np.unique(element_geometries(mesh))
+    if use_parallel:
+        gtype = gtype.astype(np.int32)
+        gtype = np.unique(allgather_vector(gtype, MPI.INT))
+    return len(gtype) > 1
+
+
+def eval_element_expr(mesh, expr, ns_g):
+    '''
+    evaluate expression at element centers.
+
+    x, y, z are arrays of element centers and h is array of element
+    size (longest vertex-vertex distance). an expression which can
+    not be evaluated on arrays (such as "x > 0 and y > 0") is evaluated
+    element by element.
+    '''
+    from petram.mesh.mesh_arrays import element_centers, element_sizes
+
+    code = compile(expr.strip(), '<string>', 'eval')
+    ne = mesh.GetNE()
+    centers = element_centers(mesh)
+    ll = {}
+    for k, c in zip(('x', 'y', 'z'), centers.transpose()):
+        ll[k] = c
+    if 'h' in code.co_names:
+        ll['h'] = element_sizes(mesh)
+
+    try:
+        value = np.asarray(eval(code, ns_g, ll))
+    except ValueError:
+        value = np.array([eval(code, ns_g, {k: ll[k][i] for k in ll})
+                          for i in range(ne)])
+    return np.broadcast_to(value, (ne,))
+
+
+def get_domains(domain_txt):
+    if domain_txt.strip() == '':
+        return None
+    return [int(x) for x in domain_txt.split(',')]
+
+
+def global_count(flag):
+    n = int(np.sum(flag))
+    if use_parallel:
+        n = MPI.COMM_WORLD.allreduce(n)
+    return n
+
+
+def global_max(value):
+    v = np.max(value) if len(value) > 0 else -np.inf
+    if use_parallel:
+        v = MPI.COMM_WORLD.allreduce(v, op=MPI.MAX)
+    return v
+
+
+def refine_elements(mesh, flag):
+    idx = mfem.intArray(list(np.where(flag)[0]))
+    mesh.GeneralRefinement(idx)  # this is parallel refinement
+
+
 class UniformRefinement(Mesh):
     isRefinement = True
     has_2nd_panel = False
@@ -849,14 +978,7 @@ class UniformRefinement(Mesh):
         return (str(self.num_refine),)
 
     def run(self, mesh):
-        gtype = np.unique([mesh.GetElementBaseGeometry(i)
-                           for i in range(mesh.GetNE())])
-        if use_parallel:
-            from mpi4py import MPI
-            gtype = gtype.astype(np.int32)
-            gtype = np.unique(allgather_vector(gtype, MPI.INT))
-
-        if len(gtype) > 1:
+        if is_mixed_geometry(mesh):
             dprint1(
                 "(Warning) Element Geometry Type is mixed. Cannot perform UniformRefinement")
             return mesh
@@ -908,14 +1030,7 @@ class DomainRefinement(Mesh):
                 str(self.expression_ns), )
 
     def run(self, mesh):
-        gtype = np.unique([mesh.GetElementBaseGeometry(i)
-                           for i in range(mesh.GetNE())])
-        if use_parallel:
-            from mpi4py import MPI
-            gtype = gtype.astype(np.int32)
-            gtype = np.unique(allgather_vector(gtype, MPI.INT))
-
-        if len(gtype) > 1:
+        if is_mixed_geometry(mesh):
             dprint1(
                 "(Warning) Element Geometry Type is mixed. Cannot perform UniformRefinement")
             return mesh
@@ -924,31 +1039,239 @@ class DomainRefinement(Mesh):
             return mesh
 
         if self.expression != '':
-            st = parser.expr(self.expression)
-            code = st.compile('<string>')
-            names = list(code.co_names)
             ns_obj, ns_g = self.find_ns_by_name(self.expression_ns)
 
-        v = mfem.Vector()
-        coords = ['x', 'y', 'z']
-        #nicePrint("refining elements domain choice", domains)
         for i in range(int(self.num_refine)):
             attr = mesh.GetAttributeArray()
-            idx = list(np.where(np.in1d(attr, domains))[0])
+            flag = np.isin(attr, domains)
 
             if self.expression != '':
-                idx2 = []
-
-                for ii in idx:
-                    ll = {}
-                    vv = mesh.GetElementCenterArray(ii)
-                    for i in range(len(vv)):
-                        ll[coords[i]] = vv[i]
-                    if eval(code, ns_g, ll):
-                        idx2.append(ii)
-
-                idx = idx2
-            #nicePrint("number of refined element: ", len(idx))
-            idx0 = mfem.intArray(idx)
-            mesh.GeneralRefinement(idx0)  # this is parallel refinement
+                flag = np.logical_and(flag,
+                                      eval_element_expr(mesh, self.expression,
+                                                        ns_g).astype(bool))
+            #nicePrint("number of refined element: ", np.sum(flag))
+            refine_elements(mesh, flag)
         return mesh
+
+
+class SizeFieldRefinement(Mesh):
+    '''
+    refine elements until element size (h) becomes smaller than
+    target size h(x, y, z) given by expression.
+    "Max passes" is the maximum number of refinement passes.
+    '''
+    isRefinement = True
+    has_2nd_panel = False
+
+    def __init__(self, parent=None, **kwargs):
+        self.num_refine = kwargs.pop("num_refine", "0")
+        self.domain_txt = kwargs.pop("domain_txt", "")
+        self.expression = kwargs.pop("expression", "")
+        super(SizeFieldRefinement, self).__init__(parent=parent, **kwargs)
+
+    def __repr__(self):
+        try:
+            return 'MeshSizeFieldRefinement(' + self.num_refine + ')'
+        except BaseException:
+            return 'MeshSizeFieldRefinement(!!!Error!!!)'
+
+    def attribute_set(self, v):
+        v = super(SizeFieldRefinement, self).attribute_set(v)
+        v['num_refine'] = '5'
+        v['domain_txt'] = ''
+        v['expression'] = ''
+        v['expression_ns'] = 'global'
+        return v
+
+    def panel1_param(self):
+        return [["Max passes", str(self.num_refine), 0, {}],
+                ["Domains", self.domain_txt, 0, {}],
+                ["Target h(x,y,z)", self.expression, 0, {}],
+                ["NS for expr.", self.expression_ns, 0, {}], ]
+
+    def import_panel1_value(self, v):
+        self.num_refine = str(v[0])
+        self.domain_txt = str(v[1])
+        self.expression = str(v[2])
+        self.expression_ns = str(v[3])
+
+    def get_panel1_value(self):
+        return (str(self.num_refine),
+                str(self.domain_txt),
+                str(self.expression),
+                str(self.expression_ns), )
+
+    def run(self, mesh):
+        from petram.mesh.mesh_arrays import element_sizes
+
+        if self.expression.strip() == '':
+            return mesh
+        domains = get_domains(self.domain_txt)
+        ns_obj, ns_g = self.find_ns_by_name(self.expression_ns)
+
+        for i in range(int(self.num_refine)):
+            target = eval_element_expr(mesh, self.expression, ns_g)
+            flag = element_sizes(mesh) > target
+            if domains is not None:
+                flag = np.logical_and(flag,
+                                      np.isin(mesh.GetAttributeArray(), domains))
+            n = global_count(flag)
+            dprint1("size field refinement (pass " + str(i) + "): " +
+                    str(n) + " elements")
+            if n == 0:
+                break
+            refine_elements(mesh, flag)
+        return mesh
+
+
+class ErrorIndicatorRefinement(Mesh):
+    '''
+    refine elements marked by error indicator.
+
+    source:
+       file       : indicator saved by error_indicator.save_indicator
+                    (e.g. Kelly estimate of a previous solution). it is
+                    sampled at element centers.
+       expression : expression evaluated at element centers (x, y, z,
+                    and h can be used)
+
+    marking:
+       threshold    : indicator > value
+       max fraction : indicator >= value * (max of indicator)
+    '''
+    isRefinement = True
+    has_2nd_panel = False
+
+    def __init__(self, parent=None, **kwargs):
+        self.num_refine = kwargs.pop("num_refine", "0")
+        self.domain_txt = kwargs.pop("domain_txt", "")
+        self.expression = kwargs.pop("expression", "")
+        super(ErrorIndicatorRefinement, self).__init__(parent=parent, **kwargs)
+
+    def __repr__(self):
+        try:
+            return 'MeshErrorIndicatorRefinement(' + self.num_refine + ')'
+        except BaseException:
+            return 'MeshErrorIndicatorRefinement(!!!Error!!!)'
+
+    def attribute_set(self, v):
+        v = super(ErrorIndicatorRefinement, self).attribute_set(v)
+        v['num_refine'] = '1'
+        v['domain_txt'] = ''
+        v['expression'] = ''
+        v['expression_ns'] = 'global'
+        v['indicator_source'] = 'expression'
+        v['indicator_file'] = ''
+        v['marking'] = 'max fraction'
+        v['marking_value'] = '0.5'
+        return v
+
+    def panel1_param(self):
+        return [["Number", str(self.num_refine), 0, {}],
+                ["Domains", self.domain_txt, 0, {}],
+                ["Source", self.indicator_source, 4,
+                 {"readonly": True, "choices": ["expression", "file"]}],
+                ["Indicator file", self.indicator_file, 0, {}],
+                ["Indicator", self.expression, 0, {}],
+                ["NS for expr.", self.expression_ns, 0, {}],
+                ["Marking", self.marking, 4,
+                 {"readonly": True, "choices": ["threshold", "max fraction"]}],
+                ["Value", self.marking_value, 0, {}], ]
+
+    def import_panel1_value(self, v):
+        self.num_refine = str(v[0])
+        self.domain_txt = str(v[1])
+        self.indicator_source = str(v[2])
+        self.indicator_file = str(v[3])
+        self.expression = str(v[4])
+        self.expression_ns = str(v[5])
+        self.marking = str(v[6])
+        self.marking_value = str(v[7])
+
+    def get_panel1_value(self):
+        return (str(self.num_refine),
+                str(self.domain_txt),
+                str(self.indicator_source),
+                str(self.indicator_file),
+                str(self.expression),
+                str(self.expression_ns),
+                str(self.marking),
+                str(self.marking_value), )
+
+    def eval_indicator(self, mesh, ns_g):
+        if self.indicator_source == 'file':
+            from petram.mesh.error_indicator import sample_indicator
+
+            return sample_indicator(mesh, *self._indicator)
+        return eval_element_expr(mesh, self.expression, ns_g).astype(float)
+
+    def run(self, mesh):
+        if self.indicator_source == 'file':
+            from petram.mesh.error_indicator import load_indicator
+
+            if self.indicator_file.strip() == '':
+                return mesh
+            self._indicator = load_indicator(self.indicator_file.strip())
+        elif self.expression.strip() == '':
+            return mesh
+        domains = get_domains(self.domain_txt)
+        ns_obj, ns_g = self.find_ns_by_name(self.expression_ns)
+        value = float(eval(self.marking_value, ns_g, {}))
+
+        for i in range(int(self.num_refine)):
+            eta = self.eval_indicator(mesh, ns_g)
+            if domains is not None:
+                eta = np.where(np.isin(mesh.GetAttributeArray(), domains),
+                               eta, -np.inf)
+            if self.marking == 'threshold':
+                flag = eta > value
+            else:
+                flag = eta >= value * global_max(eta)
+                flag = np.logical_and(flag, np.isfinite(eta))
+            n = global_count(flag)
+            dprint1("error indicator refinement (pass " + str(i) + "): " +
+                    str(n) + " elements")
+            if n == 0:
+                break
+            refine_elements(mesh, flag)
+        return mesh
+
+
+class ElementReordering(Mesh):
+    '''
+    reorder elements (and vertices/DoFs) for memory locality.
+    see mesh_reorder. in parallel, engine applies this to the serial
+    mesh before it is partitioned.
+    '''
+    has_2nd_panel = False
+    isRefinement = True
+
+    def __repr__(self):
+        try:
+            return 'MeshElementReordering(' + self.method + ')'
+        except BaseException:
+            return 'MeshElementReordering(!!!Error!!!)'
+
+    def attribute_set(self, v):
+        v = super(ElementReordering, self).attribute_set(v)
+        v['method'] = 'hilbert'
+        return v
+
+    def panel1_param(self):
+        from petram.mesh.mesh_reorder import methods
+        return [["Method", self.method, 4,
+                 {"readonly": True, "choices": methods}], ]
+
+    def import_panel1_value(self, v):
+        self.method = str(v[0])
+
+    def get_panel1_value(self):
+        return (str(self.method),)
+
+    def run(self, mesh):
+        from petram.mesh.mesh_reorder import reorder_elements
+
+        if hasattr(mesh, 'ParPrint'):
+            dprint1("(Warning) ParMesh is not reordered")
+            return mesh
+        return reorder_elements(mesh, self.method)
@@ -0,0 +1,289 @@
+'''
+   mesh_quality
+
+   element quality and face orientation check computed from bulk
+   mesh arrays (see mesh_arrays). all quantities are computed for
+   each geometry type in vectorized batches.
+
+   scaled_jacobian   : min over element vertices of
+                        det(J) / (|J_1| |J_2| |J_3|)
+                       (J_k: columns of Jacobian. J of a linear element
+                        at a vertex is given by its edges). same as
+                       mesh.GetScaledJacobian(i, 1) for straight
+                       elements. curved meshes and prism/pyramid use
+                       GetScaledJacobian.
+   aspect_ratio      : max edge length / min edge length
+   min_edge/max_edge : min/max edge length
+   invalid_faces     : interior faces whose orientation seen from
+                       two elements is not opposite (same check as
+                       Mesh::CheckTopology/elem2inf % 2)
+
+   usage:
+      q = mesh_quality(mesh)
+      summary = quality_summary(q)    # reduced in parallel
+      save_element_data(filename, mesh, q['scaled_jacobian'])
+'''
+import numpy as np
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+    from mpi4py import MPI
+    myid = MPI.COMM_WORLD.rank
+else:
+    import mfem.ser as mfem
+    myid = 0
+
+from petram.mesh.mesh_arrays import (element_vertices,
+                                     vertex_coordinates)
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('MeshQuality')
+
+Geom = mfem.Geometry
+
+# edges of reference elements (MFEM ordering)
+edge_vert = {Geom.SEGMENT: [[0, 1]],
+             Geom.TRIANGLE: [[0, 1], [1, 2], [2, 0]],
+             Geom.SQUARE: [[0, 1], [1, 2], [2, 3], [3, 0]],
+             Geom.TETRAHEDRON: [[0, 1], [0, 2], [0, 3],
+                                [1, 2], [1, 3], [2, 3]],
+             Geom.CUBE: [[0, 1], [1, 2], [3, 2], [0, 3],
+                         [4, 5], [5, 6], [7, 6], [4, 7],
+                         [0, 4], [1, 5], [2, 6], [3, 7]], }
+
+# faces of reference elements (MFEM ordering, outward normal)
+face_vert = {Geom.TETRAHEDRON: [[1, 2, 3], [0, 3, 2], [0, 1, 3], [0, 2, 1]],
+             Geom.CUBE: [[3, 2, 1, 0], [0, 1, 5, 4], [1, 2, 6, 5],
+                         [2, 3, 7, 6], [3, 0, 4, 7], [4, 5, 6, 7]], }
+
+if hasattr(Geom, 'PRISM'):
+    edge_vert[Geom.PRISM] = [[0, 1], [1, 2], [2, 0], [3, 4], [4, 5],
+                             [5, 3], [0, 3], [1, 4], [2, 5]]
+    face_vert[Geom.PRISM] = [[0, 2, 1], [3, 4, 5], [0, 1, 4, 3],
+                             [1, 2, 5, 4], [2, 0, 3, 5]]
+if hasattr(Geom, 'PYRAMID'):
+    edge_vert[Geom.PYRAMID] = [[0, 1], [1, 2], [3, 2], [0, 3],
+                               [0, 4], [1, 4], [2, 4], [3, 4]]
+    face_vert[Geom.PYRAMID] = [[3, 2, 1, 0], [0, 1, 4], [1, 2, 4],
+                               [2, 3, 4], [3, 0, 4]]
+
+# (vertex, [vertices along reference axes]) at each corner.
+# Jacobian columns at the corner are the edges to these vertices.
+# for simplex, J is constant and vertex 0 is used.
+corner_jac = {Geom.TRIANGLE: [[0, 1, 2]],
+              Geom.SQUARE: [[0, 1, 3], [1, 0, 2], [2, 3, 1], [3, 2, 0]],
+              Geom.TETRAHEDRON: [[0, 1, 2, 3]],
+              Geom.CUBE: [[0, 1, 3, 4], [1, 0, 2, 5], [2, 3, 1, 6],
+                          [3, 2, 0, 7], [4, 5, 7, 0], [5, 4, 6, 1],
+                          [6, 7, 5, 2], [7, 6, 4, 3]], }
+# columns which point to negative reference direction at each corner
+corner_sign = {Geom.TRIANGLE: [[1, 1]],
+               Geom.SQUARE: [[1, 1], [-1, 1], [-1, -1], [1, -1]],
+               Geom.TETRAHEDRON: [[1, 1, 1]],
+               Geom.CUBE: [[1, 1, 1], [-1, 1, 1], [-1, -1, 1],
+                           [1, -1, 1], [1, 1, -1], [-1, 1, -1],
+                           [-1, -1, -1], [1, -1, -1]], }
+
+
+def _geometry_groups(mesh):
+    '''
+    yield (geom, element index, (n, nvert) vertex index)
+    '''
+    geoms, offsets, vertices = element_vertices(mesh)
+    for g in np.unique(geoms):
+        idx = np.where(geoms == g)[0]
+        nv = offsets[idx[0] + 1] - offsets[idx[0]]
+        pos = offsets[idx][:, None] + np.arange(nv)
+        yield g, idx, vertices[pos]
+
+
+def _is_curved(mesh):
+    nodes = mesh.GetNodes()
+    if nodes is None:
+        return False
+    return nodes.FESpace().GetOrder(0) > 1
+
+
+def _det(J):
+    '''
+    J: (..., sdim, dim). for sdim > dim, sqrt(det(J^t J)) is used
+    '''
+    if J.shape[-1] == J.shape[-2]:
+        return np.linalg.det(J)
+    JtJ = np.einsum('...ki,...kj->...ij', J, J)
+    return np.sqrt(np.abs(np.linalg.det(JtJ)))
+
+
+def edge_lengths(mesh):
+    '''
+    min and max edge length of each element
+    '''
+    ne = mesh.GetNE()
+    coords = vertex_coordinates(mesh)
+    emin = np.zeros(ne)
+    emax = np.zeros(ne)
+    for g, idx, iv in _geometry_groups(mesh):
+        ev = np.array(edge_vert[g])
+        d = coords[iv[:, ev[:, 1]]] - coords[iv[:, ev[:, 0]]]
+        l = np.sqrt(np.sum(d**2, -1))
+        emin[idx] = np.min(l, 1)
+        emax[idx] = np.max(l, 1)
+    return emin, emax
+
+
+def scaled_jacobian(mesh, sd=-1):
+    '''
+    minimum scaled Jacobian of each element
+    '''
+    ne = mesh.GetNE()
+    if sd == -1:
+        nd = mesh.GetNodes()
+        sd = 1 if nd is None else int(nd.FESpace().GetOrder(0))
+
+    sj = np.zeros(ne)
+    if _is_curved(mesh):
+        for i in range(ne):
+            sj[i] = mesh.GetScaledJacobian(i, sd)
+        return sj
+
+    coords = vertex_coordinates(mesh)
+    for g, idx, iv in _geometry_groups(mesh):
+        if not g in corner_jac:
+            # prism, pyramid, segment
+            for i in idx:
+                sj[i] = mesh.GetScaledJacobian(int(i), sd)
+            continue
+
+        cj = np.array(corner_jac[g])
+        cs = np.array(corner_sign[g], dtype=float)
+        # (n, corners, columns, sdim)
+        J = (coords[iv[:, cj[:, 1:]]] - coords[iv[:, cj[:, :1]]])
+        J = J * cs[None, :, :, None]
+        norms = np.prod(np.sqrt(np.sum(J**2, -1)), -1)
+        det = _det(np.swapaxes(J, -1, -2))
+        sj[idx] = np.min(det / norms, 1)
+    return sj
+
+
+def _face_orientation(fv):
+    '''
+    fv: (n, k) face vertices. returns key (sorted vertices) and the
+    direction of traversal (True if next vertex of the smallest one
+    is smaller than the previous one)
+    '''
+    n, k = fv.shape
+    amin = np.argmin(fv, 1)
+    rows = np.arange(n)
+    nxt = fv[rows, (amin + 1) % k]
+    prv = fv[rows, (amin - 1) % k]
+    return np.sort(fv, 1), nxt < prv
+
+
+def invalid_faces(mesh):
+    '''
+    interior faces which are not oriented consistently.
+
+    returns (n, 2) array of element pairs and (n,) array of local face
+    number in the first element
+    '''
+    empty = (np.zeros((0, 2), dtype=int), np.zeros(0, dtype=int))
+    if mesh.Dimension() != 3:
+        return empty
+
+    # collect all element faces (triangle and quad separately)
+    faces = {3: [], 4: []}
+    for g, idx, iv in _geometry_groups(mesh):
+        for lf, fvert in enumerate(face_vert[g]):
+            fv = iv[:, fvert]
+            faces[len(fvert)].append((fv, idx, np.zeros(len(idx), dtype=int) + lf))
+
+    pairs = []
+    lfaces = []
+    for k in faces:
+        if len(faces[k]) == 0:
+            continue
+        fv = np.vstack([x[0] for x in faces[k]])
+        el = np.hstack([x[1] for x in faces[k]])
+        lf = np.hstack([x[2] for x in faces[k]])
+
+        key, direction = _face_orientation(fv)
+        ukey, inv, counts = np.unique(key, axis=0, return_inverse=True,
+                                      return_counts=True)
+        inv = inv.flatten()
+        order = np.argsort(inv, kind='stable')
+        # interior faces (shared by two elements)
+        interior = counts[inv[order]] == 2
+        order = order[interior]
+        first = order[0::2]
+        second = order[1::2]
+        bad = direction[first] == direction[second]
+        pairs.append(np.vstack((el[first][bad], el[second][bad])).transpose())
+        lfaces.append(lf[first][bad])
+
+    if len(pairs) == 0:
+        return empty
+    return np.vstack(pairs), np.hstack(lfaces)
+
+
+def mesh_quality(mesh, sd=-1):
+    '''
+    dictionary of element quality arrays
+    '''
+    emin, emax = edge_lengths(mesh)
+    with np.errstate(divide='ignore'):
+        ar = emax / emin
+    return {'scaled_jacobian': scaled_jacobian(mesh, sd=sd),
+            'aspect_ratio': ar,
+            'min_edge': emin,
+            'max_edge': emax, }
+
+
+def quality_summary(quality):
+    '''
+    (min, max, mean) of each quality array. reduced over all
+    processes in parallel.
+    '''
+    summary = {}
+    for key in quality:
+        v = quality[key]
+        n = len(v)
+        vmin = np.min(v) if n > 0 else np.inf
+        vmax = np.max(v) if n > 0 else -np.inf
+        vsum = np.sum(v)
+        if use_parallel:
+            comm = MPI.COMM_WORLD
+            n = comm.allreduce(n)
+            vmin = comm.allreduce(vmin, op=MPI.MIN)
+            vmax = comm.allreduce(vmax, op=MPI.MAX)
+            vsum = comm.allreduce(vsum)
+        summary[key] = (vmin, vmax, vsum / max(n, 1))
+    return summary
+
+
+def element_gridfunction(mesh, values):
+    '''
+    L2 (order 0) grid function of element-wise values
+    '''
+    fec = mfem.L2_FECollection(0, mesh.Dimension())
+    if hasattr(mesh, 'GetNGroups'):
+        fes = mfem.ParFiniteElementSpace(mesh, fec)
+        gf = mfem.ParGridFunction(fes)
+    else:
+        fes = mfem.FiniteElementSpace(mesh, fec)
+        gf = mfem.GridFunction(fes)
+    gf.Assign(np.ascontiguousarray(values, dtype=float))
+    gf._fec = fec  # in order to keep it from freed
+    gf._fes = fes
+    return gf
+
+
+def save_element_data(filename, mesh, values):
+    '''
+    save element-wise values as L2 grid function.
+    in parallel, filename has process id suffix.
+    '''
+    gf = element_gridfunction(mesh, values)
+    if hasattr(mesh, 'GetNGroups'):
+        filename = filename + '.' + '{:0>6d}'.format(myid)
+    gf.Save(filename)
@@ -0,0 +1,184 @@
+'''
+   mesh_reorder
+
+   element reordering to improve memory locality of assembly and
+   of the linear system.
+
+   methods:
+      hilbert : MFEM GetHilbertElementOrdering
+      morton  : Morton (Z-order) curve of element centers
+      rcm     : reverse Cuthill-McKee of vertex-vertex graph (DoF
+                renumbering). the mesh is rebuilt with vertices in
+                RCM order and elements sorted by their first vertex
+                in RCM order.
+
+   hilbert/morton reorder elements by mesh.ReorderElements, which also
+   renumbers vertices in the new element order. since edge/face and DoF
+   numbers follow the element/vertex numbering, this also renumbers
+   DoFs of FiniteElementSpaces allocated after the reordering.
+
+   rcm sets the vertex numbering (i.e. vertex DoFs) to the RCM order
+   directly. edges/faces are numbered in the new element order. curved
+   and non-conforming meshes can not be rebuilt and fall back to
+   ReorderElements with the same element ordering.
+
+   reordering is done on serial mesh. in parallel, it is applied before
+   the mesh is partitioned (ParMesh numbers local vertices in the global
+   order, so the locality is kept in each process).
+
+   usage:
+      mesh = reorder_elements(mesh, 'hilbert')
+'''
+import numpy as np
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+else:
+    import mfem.ser as mfem
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('MeshReorder')
+
+methods = ['hilbert', 'morton', 'rcm']
+
+
+def _inverse(perm):
+    '''
+    perm[new] = old  ->  ordering[old] = new
+    '''
+    ordering = np.empty(len(perm), dtype=int)
+    ordering[perm] = np.arange(len(perm))
+    return ordering
+
+
+def morton_codes(points, nbits=None):
+    '''
+    Morton (Z-order) code of points ((n, ndim) array)
+    '''
+    ndim = points.shape[1]
+    if nbits is None:
+        nbits = min(63 // ndim, 32)
+    lo = np.min(points, 0)
+    w = np.max(points, 0) - lo
+    w[w == 0] = 1.0
+    q = ((points - lo) / w * (2**nbits - 1)).astype(np.uint64)
+
+    codes = np.zeros(len(points), dtype=np.uint64)
+    one = np.uint64(1)
+    for b in range(nbits):
+        for d in range(ndim):
+            bit = (q[:, d] >> np.uint64(b)) & one
+            codes |= bit << np.uint64(b * ndim + d)
+    return codes
+
+
+def morton_ordering(mesh):
+    from petram.mesh.mesh_arrays import element_centers
+
+    codes = morton_codes(element_centers(mesh))
+    return _inverse(np.argsort(codes, kind='stable'))
+
+
+def hilbert_ordering(mesh):
+    ordering = mfem.intArray()
+    mesh.GetHilbertElementOrdering(ordering)
+    return np.array(ordering.ToList(), dtype=int)
+
+
+def rcm_vertex_rank(offsets, vertices, nv):
+    '''
+    RCM order of vertex-vertex graph (new index of each vertex)
+    '''
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+    ne = len(offsets) - 1
+    rows = np.repeat(np.arange(ne), np.diff(offsets))
+    ev = csr_matrix((np.ones(len(vertices), dtype=np.int32), (rows, vertices)),
+                    shape=(ne, nv))
+    vv = (ev.transpose() @ ev).tocsr()
+    return _inverse(reverse_cuthill_mckee(vv, symmetric_mode=True))
+
+
+def _first_vertex_sort(offsets, vertices, rank):
+    '''
+    element permutation (perm[new] = old) sorting elements by their
+    first vertex in rank order
+    '''
+    if len(offsets) < 2:
+        return np.zeros(0, dtype=int)
+    key = np.minimum.reduceat(rank[vertices], offsets[:-1])
+    return np.argsort(key, kind='stable')
+
+
+def rcm_ordering(mesh):
+    from petram.mesh.mesh_arrays import element_vertices
+
+    geoms, offsets, vertices = element_vertices(mesh)
+    rank = rcm_vertex_rank(offsets, vertices, mesh.GetNV())
+    return _inverse(_first_vertex_sort(offsets, vertices, rank))
+
+
+def rcm_renumber(mesh):
+    '''
+    new mesh with vertices in RCM order and elements (and bdr elements)
+    sorted by their first vertex. returns None if mesh can not be
+    rebuilt from arrays (curved, NURBS or non-conforming mesh).
+    '''
+    from petram.mesh.mesh_arrays import element_vertices_of
+    from petram.mesh.mesh_cache import (can_cache,
+                                        mesh_to_arrays,
+                                        arrays_to_mesh)
+
+    if not can_cache(mesh) or mesh.GetNodes() is not None:
+        return None
+
+    header, arrays = mesh_to_arrays(mesh)
+    rank = rcm_vertex_rank(arrays['elem_offsets'], arrays['elem_vertices'],
+                           mesh.GetNV())
+    arrays['vertices'] = arrays['vertices'][np.argsort(rank)]
+
+    for name in ('elem', 'bdr'):
+        offsets = arrays[name + '_offsets']
+        vertices = rank[arrays[name + '_vertices']]
+        perm = _first_vertex_sort(offsets, vertices, np.arange(len(rank)))
+        offsets, vertices = element_vertices_of(offsets, vertices, perm)
+        arrays[name + '_offsets'] = offsets.astype(np.int64)
+        arrays[name + '_vertices'] = vertices.astype(np.int32)
+        arrays[name + '_geoms'] = arrays[name + '_geoms'][perm]
+        arrays[name + '_attrs'] = arrays[name + '_attrs'][perm]
+
+    return arrays_to_mesh(header, arrays, refine=1, fix_orientation=True)
+
+
+def element_ordering(mesh, method):
+    '''
+    returns ordering (new index of each element)
+    '''
+    if method == 'hilbert':
+        return hilbert_ordering(mesh)
+    elif method == 'morton':
+        return morton_ordering(mesh)
+    elif method == 'rcm':
+        return rcm_ordering(mesh)
+    assert False, "unknown reordering method: " + method
+
+
+def reorder_elements(mesh, method):
+    '''
+    reorder elements of serial mesh. returns reordered mesh
+    (mesh itself is reordered in place, except for rcm which
+    returns a new mesh when possible)
+    '''
+    if mesh.GetNE() == 0:
+        return mesh
+    if method == 'rcm':
+        new_mesh = rcm_renumber(mesh)
+        if new_mesh is not None:
+            dprint1("vertices/elements are renumbered (rcm)")
+            return new_mesh
+    ordering = element_ordering(mesh, method)
+    mesh.ReorderElements(mfem.intArray(list(ordering)))
+    dprint1("elements are reordered (" + method + ")")
+    return mesh
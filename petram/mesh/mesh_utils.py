@@ -1,7 +1,6 @@
 import os
 import numpy as np
-from scipy.sparse import coo_matrix
-from collections import OrderedDict, defaultdict
+from collections import defaultdict
 from petram.helper.global_named_list import GlobalNamedList
 
 debug = False
@@ -132,375 +131,368 @@ def bdr_loop(mesh):
 
     return loop
     
-def find_edge_corner(mesh):
+def _shared_table(mesh, imode, myid):
     '''
-    For 3D geometry
-      find line (boundary between two bdr_attribute) and
-      corner of lines
+    shared entities (imode 0: vertex, 1: edge, 2: face) in global
+    (offset) numbering.
+
+    returns (local id, master id) of all shared entities and
+    (local id, master id) sorted by master id of those owned by
+    other processes
     '''
-    use_parallel = hasattr(mesh, "GroupNVertices")
-    
-    if use_parallel:
-        from mpi4py import MPI
-        myid = MPI.COMM_WORLD.rank
-        nprc = MPI.COMM_WORLD.size   
-        comm  = MPI.COMM_WORLD
-        
-        from mfem.common.mpi_debug import nicePrint, niceCall        
-        from petram.helper.mpi_recipes import allgather, allgather_vector, gather_vector
-        from petram.mesh.mesh_utils import distribute_shared_entity        
-        if not hasattr(mesh, "shared_info"):
-            mesh.shared_info = distribute_shared_entity(mesh)
-    else:
-        myid = 0
-        nprc = 1
-    ndim =  mesh.Dimension()
-    sdim =  mesh.SpaceDimension()    
-    ne = mesh.GetNEdges()
-    assert ndim == 3, "find_edge_corner is for 3D mesh"
-
-    # 3D mesh
-    get_edges = mesh.GetBdrElementEdges
-    get_attr  = mesh.GetBdrAttribute
-    iattr= mesh.GetBdrAttributeArray()  # min of this array is 1
-    nattr = 0 if iattr.size == 0 else np.max(iattr)        
-    nb = mesh.GetNBE()
-    if mesh.GetNBE() == 0 and nprc == 1:    
-        return {}, {}, {}, {}
-    
+    empty = np.array([], dtype=int)
+    if not hasattr(mesh, "shared_info"):
+        return empty, empty, empty, empty
+    ld, md = mesh.shared_info
+    if len(ld) == 0:
+        return empty, empty, empty, empty
+
+    lids = np.hstack([np.atleast_1d(ld[key][imode]) for key in ld]).astype(int)
+    mids = np.hstack([np.atleast_1d(md[key][imode]) for key in ld]).astype(int)
+    lids, ii = np.unique(lids, return_index=True)
+    mids = mids[ii]
+
+    other = lids != mids
+    o_lids = lids[other]
+    o_mids = mids[other]
+    order = np.argsort(o_mids)
+    return lids, mids, o_lids[order], o_mids[order]
+
+
+def _lookup(keys, values, query, default=-1):
+    '''
+    values[keys == query] (keys is sorted). default if not found
+    '''
+    query = np.asarray(query, dtype=int)
+    if len(keys) == 0:
+        return np.full(query.shape, default, dtype=int)
+    pos = np.searchsorted(keys, query)
+    pos[pos == len(keys)] = 0
+    found = keys[pos] == query
+    return np.where(found, values[pos], default)
 
-    if use_parallel:
-        offset = np.hstack([0, np.cumsum(allgather(mesh.GetNEdges()))])
-        offsetf = np.hstack([0, np.cumsum(allgather(mesh.GetNFaces()))])
-        offsetv = np.hstack([0, np.cumsum(allgather(mesh.GetNV()))])
-        myoffset = offset[myid]
-        myoffsetf = offsetf[myid]
-        myoffsetv = offsetv[myid]                
-        nattr = max(allgather(nattr))
-        ne = sum(allgather(mesh.GetNEdges()))
-    else:
-        myoffset  = np.array(0, dtype=int)
-        myoffsetf = np.array(0, dtype=int)
-        myoffsetv = np.array(0, dtype=int)
 
-    edges = defaultdict(list)
-    iedges = np.arange(nb, dtype=int)
-    
-    if use_parallel:
-        # eliminate slave faces from consideration
-        iface = np.array([mesh.GetBdrElementEdgeIndex(i) for i in iedges],
-                          dtype=int)+myoffsetf
-        mask = np.array([True]*len(iface), dtype=bool)
-        ld, md = mesh.shared_info
-        for key in ld.keys():
-            mid, g_in_master = key
-            if mid == myid: continue
-            iii = np.in1d(iedges, ld[key][2], invert = True)
-            mask = np.logical_and(mask, iii)
-        iedges = iedges[mask]
-        
-    # nicePrint(len(iedges)) np 1,2,4 gives 900... ok
+def _to_master(gids, lids, mids):
+    '''
+    global (offset) id -> master id
+    '''
+    m = _lookup(lids, mids, gids)
+    return np.where(m >= 0, m, gids)
 
-    for i in iedges:
-        ie, io = get_edges(i)
-        ie += myoffset
-        iattr = get_attr(i)
-        edges[iattr].extend(list(ie))
 
-    if use_parallel:
-        # collect edges using master edge number
-        # and gather it to a node.
-        edgesc = {}
-        ld, md = mesh.shared_info        
-        for j in range(1, nattr+1):
-            if j in edges:
-               data = np.array(edges[j], dtype=int)
-               for key in ld.keys():
-                   mid, g_in_master = key
-                   if mid == myid: continue
-                   for le, me in zip(ld[key][1], md[key][1]):
-                       iii =  np.where(data == le)[0]
-                       data[iii] = me
-            else:
-                data = np.atleast_1d([]).astype(int)
-            data = gather_vector(data, root = j % nprc)
-            if data is not None: edgesc[j] = data
-        edges = edgesc
-
-    # for each iattr real edge appears only once
-    for key in edges.keys():
-        seen = defaultdict(int)
-        for x in edges[key]: seen[x] +=1
-        edges[key] = [k for k in seen if seen[k] == 1]
-    
-    #nicePrint('Num edges',
-    nedge = sum([len(edges[k]) for k in edges])
-    if nedge != 0:
-        N = np.hstack([np.zeros(len(edges[k]), dtype=int)+k-1 for k in edges.keys()])
-        M = np.hstack([np.array(edges[k]) for k in edges.keys()])
-    else:
-        N = np.atleast_1d([]).astype(int)
-        M = np.atleast_1d([]).astype(int)        
-    M = M.astype(int, copy = False)
-    N = N.astype(int, copy = False)    
+def _to_local(mids, o_mids, o_lids, offset, n):
+    '''
+    master id -> local id (-1 if the entity is not on this process)
+    '''
+    mids = np.asarray(mids, dtype=int)
+    own = np.logical_and(mids >= offset, mids < offset + n)
+    other = _lookup(o_mids, o_lids, mids)
+    return np.where(own, mids - offset,
+                    np.where(other >= 0, other - offset, -1))
 
-    if use_parallel:
-        # send attribute to owner of edges
-        for j in range(nprc):
-            idx = np.logical_and(M >= offset[j], M < offset[j+1])
-            Mpart = M[idx]
-            Npart = N[idx]
-            Mpart = gather_vector(Mpart, root = j)
-            Npart = gather_vector(Npart, root = j)
-            if j==myid: M2, N2 = Mpart, Npart
-        M, N = M2, N2
-        
-    #nicePrint('unique edge', len(np.unique(M)))
-    #nicePrint('N', len(N))    
-    data = M*0+1
-    table1 = coo_matrix((data, (M, N)), shape = (ne, nattr), dtype = int)
 
-    csr = table1.tocsr()
+def _attr_sets(edges, attrs):
+    '''
+    group (edge, attribute) pairs by edge.
 
-    #embeded surface only touches to one iattr
-    idx = np.where(np.diff(csr.indptr) >= 1)[0]
-    csr = csr[idx, :]    
+    returns unique edges, list of attribute sets (sorted tuple) and
+    index of attribute set for each edge
+    '''
+    if len(edges) == 0:
+        empty = np.array([], dtype=int)
+        return empty, [], empty
 
-    # this is true bdr edges.
-    bb_edges = defaultdict(list)
-    indptr = csr.indptr; indices = csr.indices
-    
-    for i in range(csr.shape[0]):
-        idxs = tuple(sorted(indices[indptr[i]:indptr[i+1]]+1))
-        bb_edges[idxs].append(idx[i])
-    bb_edges.default_factory = None
+    order = np.lexsort((attrs, edges))
+    e = edges[order]
+    a = attrs[order]
+    uedges, first, counts = np.unique(e, return_index=True,
+                                      return_counts=True)
+    # attribute >= 1. 0 is used as padding.
+    table = np.zeros((len(uedges), np.max(counts)), dtype=int)
+    col = np.arange(len(e)) - np.repeat(first, counts)
+    table[np.repeat(np.arange(len(uedges)), counts), col] = a
+
+    ukeys, inv = np.unique(table, axis=0, return_inverse=True)
+    keys = [tuple(int(x) for x in k if x != 0) for k in ukeys]
+    return uedges, keys, inv.flatten()
+
+
+def _edge_vertices(mesh, ledges):
+    if len(ledges) == 0:
+        return np.zeros((0, 2), dtype=int)
+    return np.array([mesh.GetEdgeVertices(int(i)) for i in ledges],
+                    dtype=int).reshape(-1, 2)
 
-    # sort keys (= attribute set) 
-    keys = list(bb_edges)
-    if use_parallel:
-        keys = comm.gather(keys)
-        if myid == 0: keys = sum(keys, [])        
-    sorted_key = None
-    if myid == 0:
-        sorted_key = list(set(keys))
-        sorted_key.sort(key = lambda x:(len(x), x))
-
-    if use_parallel: sorted_key = comm.bcast(sorted_key, root=0)
-    bb_edgess = OrderedDict()
-    for k in sorted_key:
-        if k in bb_edges:
-            bb_edgess[k] = bb_edges[k]
-        else:
-            bb_edgess[k] = []  # in parallel, put empty so that key order is kept
-    bb_edges = bb_edgess
 
+def _vertex_count(ikey, verts):
     '''
-    res = []
-    for key in sorted_key:
-        tmp = allgather(len(bb_edges[key]))
-        if myid == 0:
-            res.append((key, sum(tmp)))
-    if myid == 0: print res
+    count (line, vertex) pairs.
+    returns unique (n, 2) array of (line, vertex) and counts
     '''
-    # at this point each node has its own edges populated in bb_edges (no shadow)
-    ivert = {}
+    pairs = np.vstack((np.repeat(ikey, 2), verts.flatten())).transpose()
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=int), np.array([], dtype=int)
+    return np.unique(pairs, axis=0, return_counts=True)
 
-    for k in sorted_key:
-        if len(bb_edges[k])>0:
-            ivert[k] = np.hstack([mesh.GetEdgeVertices(i-myoffset)+ myoffsetv
-                              for i in np.unique(bb_edges[k])]).astype(int)
-        else:
-            ivert[k] = np.atleast_1d([]).astype(int)
 
-    if use_parallel:
-        # convert shadow vertex to real
-        for k in sorted_key:
-            data = ivert[k]
-            for key in ld:
-                if key[0] == myid: continue
-                for le, me in zip(ld[key][0], md[key][0]):
-                   iii =  np.where(data == le)[0]
-                   data[iii] = me
-            ivert[k] = data
-        ivertc = {}
-        for j, k in enumerate(sorted_key):
-            data = gather_vector(ivert[k], root = j % nprc)
-            if data is not None:
-                ivertc[k] = data
-        ivert = ivertc
-
-    corners = {}
-    for key in ivert:
-        seen = defaultdict(int)
-        for iiv in ivert[key]:
-            seen[iiv] += 1
-        corners[key] = [kk for kk in seen if seen[kk]==1]
-
-    if len(corners) == 0:
-       u = np.atleast_1d([]).astype(int)
-    else:
-       u = np.unique(np.hstack([corners[key]
-                  for key in corners])).astype(int, copy=False)
+def _line_corner_tables(mesh, ledges, lkeys, ikeys, shared_pairs,
+                        offset_e=0, offset_v=0):
+    '''
+    build line -> edge, line -> corner and corner -> vertex from
+    line edges.
 
-    # collect vertex on each node and gather to node 0
-    u_own = u
+    ledges : local id of line edges whose line is determined locally
+    lkeys  : list of lines (attribute set tuple)
+    ikeys  : index of lkeys for each ledges
+    shared_pairs : (n, 3) array of (master edge id, attribute, count)
+                   of edges on partition interface (its line is
+                   determined after merging data of all processes)
+
+    offset_e, offset_v : offset of global edge and vertex numbering
+
+    in parallel, all merging is done by one allgather.
+    '''
+    use_parallel = hasattr(mesh, "GroupNVertices")
     if use_parallel:
-         u = np.unique(allgather_vector(u))
-         u_own = u.copy()
-         for key in ld:
-             if key[0] == myid: continue
-             for lv, mv in zip(ld[key][0], md[key][0]):
-                 iii =  np.where(u == mv)[0]
-                 u[iii] = lv
-         idx = np.logical_and(u >= offsetv[myid], u < offsetv[myid+1])         
-         u= u[idx]  # u include shared vertex
-         idx = np.logical_and(u_own >= offsetv[myid], u_own < offsetv[myid+1])
-         u_own = u_own[idx] # u_own is only owned vertex
-         
-    #nicePrint('u_own',mesh.GetNV(),",",  u_own)
-    if len(u_own) > 0:
-        vtx = np.vstack([mesh.GetVertexArray(i - myoffsetv) for i in u_own])
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        myid = comm.rank
     else:
-        vtx = np.atleast_1d([]).reshape(-1, sdim)
-    if use_parallel:
-        u_own = gather_vector(u_own)
-        vtx   = gather_vector(vtx.flatten())
-
-    # sort vertex  
-    if myid == 0:
-        vtx = vtx.reshape(-1, sdim)
-        #print('vtx shape', vtx.shape)
-        tmp = sorted([(k, tuple(x)) for k, x in enumerate(vtx)], key=lambda x:x[1])
-        if len(tmp) > 0:
-            vtx = np.vstack([x[1] for x in tmp])
-            u_own = np.hstack([[u_own[x[0]] for x in tmp]]).astype(int)
-            ivert=np.arange(len(vtx), dtype=int)+1
-        else:
-            vtx = np.atleast_1d([]).astype(float)
-            u_own = np.atleast_1d([]).astype(int)
-            u_own = np.atleast_1d([]).astype(int)
+        myid = 0
+    ne = mesh.GetNEdges()
+    nv = mesh.GetNV()
+    sdim = mesh.SpaceDimension()
+
+    from petram.mesh.mesh_arrays import vertex_coordinates
+    coords = vertex_coordinates(mesh)
+
+    e_lids, e_mids, eo_lids, eo_mids = _shared_table(mesh, 1, myid)
+    v_lids, v_mids, vo_lids, vo_mids = _shared_table(mesh, 0, myid)
+
+    def vertex_to_master(lv):
+        return _to_master(lv + offset_v, v_lids, v_mids)
+
+    def is_shared_vertex(lv):
+        return np.isin(lv + offset_v, v_lids)
+
+    # vertex counts of locally determined lines
+    ev = _edge_vertices(mesh, ledges)
+    vpairs, vcounts = _vertex_count(ikeys, ev)
+    shared_v = is_shared_vertex(vpairs[:, 1])
+    own = np.logical_and(~shared_v, vcounts == 1)
+    corners = vpairs[own]          # (line, local vertex) final
+
+    # vertices of edges on partition interface
+    s_edges = np.unique(shared_pairs[:, 0])
+    s_ledges = _to_local(s_edges, eo_mids, eo_lids, offset_e, ne)
+    s_ev = _edge_vertices(mesh, s_ledges)
+
+    senddata = {'keys': lkeys,
+                'pairs': shared_pairs,
+                'edgev': np.hstack((s_edges.reshape(-1, 1),
+                                    vertex_to_master(s_ev))),
+                'edgec': coords[s_ev.flatten()],
+                'vcount': np.hstack((vpairs[shared_v, :1],
+                                     vertex_to_master(vpairs[shared_v, 1:]),
+                                     vcounts[shared_v].reshape(-1, 1))),
+                'vcoords': coords[vpairs[shared_v, 1]],
+                'corners': np.hstack((corners[:, :1],
+                                      vertex_to_master(corners[:, 1:]))),
+                'ccoords': coords[corners[:, 1]], }
     if use_parallel:
-        #if myid != 0:
-        #    u_own = None; vtx = None
-        u_own = comm.bcast(u_own)
-        ivert=np.arange(len(u_own), dtype=int)+1
-        for key in ld:
-            if key[0] == myid: continue
-            for lv, mv in zip(ld[key][0], md[key][0]):
-                iii =  np.where(u_own == mv)[0]
-                u_own[iii] = lv
-        idx = np.logical_and(u_own >= offsetv[myid], u_own < offsetv[myid+1])
-        u_own = u_own[idx]
-        ivert = ivert[idx]
-        #vtx = comm.bcast(vtx)
-        #vtx = comm.bcast(vtx)[idx.flatten()]
-
-
-    vert2vert = {iv: iu-myoffsetv for iv, iu in zip(ivert, u_own)}
-    #nicePrint('vert2vert', vert2vert)
-
-    vv_values = np.array([x[1] for x in vert2vert.items()])
-    vv_keys = np.array([x[0] for x in vert2vert.items()])
-    
-    # mapping line index to vertex index (not MFFEM vertex id)
+        alldata = comm.allgather(senddata)
+    else:
+        alldata = [senddata]
+
+    # lines of edges on partition interface
+    pairs = np.vstack([x['pairs'] for x in alldata]).reshape(-1, 3)
+    upairs, inv = np.unique(pairs[:, :2], axis=0, return_inverse=True)
+    total = np.bincount(inv.flatten(), weights=pairs[:, 2]).astype(int)
+    upairs = upairs[total == 1]
+    s_edges, s_keys, s_ikeys = _attr_sets(upairs[:, 0], upairs[:, 1])
+
+    # global line list
+    all_keys = set(s_keys)
+    for x in alldata:
+        all_keys.update(x['keys'])
+    sorted_key = sorted(all_keys, key=lambda x: (len(x), x))
+    key_index = {k: i for i, k in enumerate(sorted_key)}
+
+    def to_global_key(keys, ikey):
+        table = np.array([key_index[k] for k in keys] + [-1], dtype=int)
+        return table[np.asarray(ikey, dtype=int)]
+
+    # vertex of interface edges
+    edgev = np.vstack([x['edgev'] for x in alldata]).reshape(-1, 3)
+    edgec = np.vstack([x['edgec'] for x in alldata]).reshape(-1, 2, sdim)
+    edgev, ii = np.unique(edgev, axis=0, return_index=True)
+    edgec = edgec[ii]
+    pos = np.searchsorted(edgev[:, 0], s_edges)
+    s_ev = edgev[pos, 1:]
+    s_evc = edgec[pos]
+
+    # count of vertices on partition interface
+    vc = [np.vstack((np.repeat(to_global_key(s_keys, s_ikeys), 2),
+                     s_ev.flatten(),
+                     np.ones(2 * len(s_edges), dtype=int))).transpose()]
+    vcc = [s_evc.reshape(-1, sdim)]
+    for x in alldata:
+        tmp = x['vcount'].reshape(-1, 3).copy()
+        tmp[:, 0] = to_global_key(x['keys'], tmp[:, 0])
+        vc.append(tmp)
+        vcc.append(x['vcoords'].reshape(-1, sdim))
+    vc = np.vstack(vc)
+    vcc = np.vstack(vcc)
+    uvc, ii, inv = np.unique(vc[:, :2], axis=0, return_index=True,
+                             return_inverse=True)
+    total = np.bincount(inv.flatten(), weights=vc[:, 2]).astype(int)
+    corners = [uvc[total == 1]]
+    ccoords = [vcc[ii][total == 1]]
+
+    for x in alldata:
+        tmp = x['corners'].reshape(-1, 2).copy()
+        tmp[:, 0] = to_global_key(x['keys'], tmp[:, 0])
+        corners.append(tmp)
+        ccoords.append(x['ccoords'].reshape(-1, sdim))
+    corners = np.vstack(corners)
+    ccoords = np.vstack(ccoords)
+
+    # number corner vertices in the order of coordinates
+    uv, ii, inv = np.unique(corners[:, 1], return_index=True,
+                            return_inverse=True)
+    vtx = ccoords[ii]
+    order = np.lexsort((uv,) + tuple(vtx[:, k] for k in reversed(range(sdim))))
+    ivert = np.empty(len(uv), dtype=int)
+    ivert[order] = np.arange(len(uv), dtype=int) + 1
+
+    lvert = _to_local(uv, vo_mids, vo_lids, offset_v, nv)
+    present = lvert >= 0
+    vert2vert = {int(iv): int(lv) for iv, lv in
+                 sorted(zip(ivert[present], lvert[present]))}
+
+    cline = corners[:, 0]
+    civert = ivert[inv.flatten()]
+    cpresent = present[inv.flatten()]
     line2vert = {}
+    for j in range(len(sorted_key)):
+        flag = np.logical_and(cline == j, cpresent)
+        line2vert[j + 1] = list(np.unique(civert[flag]))
+
+    # line -> local edges (including copy of interface edges)
+    s_local = _to_local(s_edges, eo_mids, eo_lids, offset_e, ne)
+    eline = np.hstack((to_global_key(lkeys, ikeys),
+                       to_global_key(s_keys, s_ikeys)[s_local >= 0]))
+    eids = np.hstack((np.asarray(ledges, dtype=int), s_local[s_local >= 0]))
+    order = np.lexsort((eids, eline))
+    eline = eline[order]
+    eids = eids[order]
+    bounds = np.searchsorted(eline, np.arange(len(sorted_key) + 1))
+    line2edge = {j + 1: list(eids[bounds[j]:bounds[j + 1]])
+                 for j in range(len(sorted_key))}
+
+    return sorted_key, line2edge, line2vert, vert2vert
+
+
+def _parallel_offsets(mesh, nattr=0):
+    '''
+    offsets of global edge, face and vertex numbering of this process
+    and global max of nattr
+    '''
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    myid = comm.rank
+    counts = np.array(comm.allgather((mesh.GetNEdges(), mesh.GetNFaces(),
+                                      mesh.GetNV(), nattr)), dtype=int)
+    offsets = np.vstack([np.zeros((1, 4), dtype=int),
+                         np.cumsum(counts, 0)])[myid]
+    return myid, offsets[0], offsets[1], offsets[2], np.max(counts[:, 3])
 
-    #nicePrint(corners)
-    for j, key in enumerate(sorted_key):
-        data = corners[key] if key in corners else None
-        if use_parallel:
-            data = comm.bcast(data, root = j % nprc)
-            data = np.array(data, dtype=int)            
-            for key2 in ld:
-                if key2[0] == myid: continue
-                for lv, mv in zip(ld[key2][0], md[key2][0]):
-                    iii =  np.where(data == mv)[0]
-                    data[iii] = lv
-            idx = np.logical_and(data >= offsetv[myid],
-                                 data < offsetv[myid+1])
-            data = data[idx]
-        else:
-            data = np.array(data, dtype=int)                        
-        data = list(data - myoffsetv)
-
-        line2vert[j+1] = list(vv_keys[np.in1d(vv_values, data)])
 
-        '''
-        (this was origial very slow)
-        line2vert[j+1] = [k for k in vert2vert
-                          if vert2vert[k] in data]
-        '''
+def _masked_csr(offsets, indices, mask):
+    nnz = np.diff(offsets)
+    keep = np.repeat(mask, nnz)
+    offsets = np.hstack([0, np.cumsum(nnz[mask])]).astype(int)
+    return offsets, indices[keep]
 
-    # finish-up edge data
-    if use_parallel:
-        # distribute edges, convert (add) from master to local
-        # number
-        for attr_set in bb_edges:
-            data = sum(allgather(bb_edges[attr_set]), [])
-            data = np.array(data, dtype=int)
-            for key in ld:
-                if key[0] == myid: continue
-                for le, me in zip(ld[key][1], md[key][1]):
-                   iii =  np.where(data == me)[0]
-                   data[iii] = le
-            
-            idx = np.logical_and(data >= offset[myid], data < offset[myid+1])
-            data = data[idx]
-            bb_edges[attr_set] = list(data - myoffset)
-
-        attrs = list(edges)
-        attrsa = np.unique(sum(allgather(attrs), []))
-
-        for a in attrsa:
-            if a in attrs:
-                data = np.array(edges[a], dtype=int)
-            else:
-                data = np.atleast_1d([]).astype(int)
-            data = allgather_vector(data)
-            
-            for key in ld:
-                if key[0] == myid: continue                
-                for le, me in zip(ld[key][1], md[key][1]):
-                   iii =  np.where(data == me)[0]
-                   data[iii] = le
-            idx = np.logical_and(data >= offset[myid], data < offset[myid+1])
-            data = data[idx]
-            edges[a] = list(data - myoffset)
-
-    line2edge = {}
-    for k, attr_set in enumerate(sorted_key):
-        if attr_set in bb_edges:
-            line2edge[k+1] = bb_edges[attr_set]
-        else:
-            line2edge[k+1] = []
 
+def find_edge_corner(mesh):
     '''
-    # debug find true (non-shadow) edges
-    line2edge_true = {}
-    for k, attr_set in enumerate(sorted_key):
-        if attr_set in bb_edges:
-            data = np.array(bb_edges[attr_set], dtype=int)
-            for key in ld:
-                if key[0] == myid: continue                                
-                iii = np.in1d(data+myoffset, ld[key][1], invert = True)
-                data = data[iii]
-            line2edge_true[k+1] = data
-        else:
-            line2edge_true[k+1] = []
-    nicePrint([sum(allgather(len(line2edge_true[key]))) for key in line2edge])
+    For 3D geometry
+      find line (boundary between two bdr_attribute) and
+      corner of lines
+
+    line : set of boundary edges which is used only once by each
+           bdr_attribute. lines are identified by the set of
+           bdr_attributes and numbered in the order of (len, set).
+    corner : vertices used once by edges of a line. numbered in the
+             order of coordinates.
     '''
-    surf2line = {k+1:[] for k in range(nattr)}
+    from petram.mesh.mesh_arrays import element_edges
+    from petram.mesh.find_edges import edge_multiplicity
+
+    use_parallel = hasattr(mesh, "GroupNVertices")
+    if use_parallel:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        nprc = comm.size
+    else:
+        myid = 0
+        nprc = 1
+
+    assert mesh.Dimension() == 3, "find_edge_corner is for 3D mesh"
+
+    iattr = mesh.GetBdrAttributeArray()  # min of this array is 1
+    nattr = 0 if iattr.size == 0 else np.max(iattr)
+    if mesh.GetNBE() == 0 and nprc == 1:
+        return {}, {}, {}, {}
+
+    if use_parallel:
+        if not hasattr(mesh, "shared_info"):
+            mesh.shared_info = distribute_shared_entity(mesh)
+        myid, offset_e, offset_f, offset_v, nattr = _parallel_offsets(mesh,
+                                                                      nattr)
+    else:
+        offset_e = offset_f = offset_v = 0
+
+    offsets, iedges, _void = element_edges(mesh, bdr=True)
+
+    e_lids, e_mids, _void, _void = _shared_table(mesh, 1, myid)
+    if use_parallel and mesh.GetNBE() > 0:
+        # eliminate slave faces from consideration
+        f_lids, f_mids, _void, _void = _shared_table(mesh, 2, myid)
+        iface = np.array([mesh.GetBdrElementEdgeIndex(i)
+                          for i in range(mesh.GetNBE())], dtype=int)
+        iface = iface + offset_f
+        slave = _lookup(f_lids, f_mids, iface, default=-1)
+        mask = np.logical_or(slave == -1, slave == iface)
+        iattr = iattr[mask]
+        offsets, iedges = _masked_csr(offsets, iedges, mask)
+
+    # (attribute, edge) multiplicity
+    pairs, counts = edge_multiplicity(iattr, offsets, iedges)
+    gedges = pairs[:, 1] + offset_e
+    shared = np.isin(gedges, e_lids)
+
+    # edges not on partition interface: line is determined locally
+    flag = np.logical_and(~shared, counts == 1)
+    ledges, lkeys, ikeys = _attr_sets(pairs[flag, 1], pairs[flag, 0])
+
+    shared_pairs = np.vstack((_to_master(gedges[shared], e_lids, e_mids),
+                              pairs[shared, 0],
+                              counts[shared])).transpose()
+
+    sorted_key, line2edge, line2vert, vert2vert = _line_corner_tables(
+        mesh, ledges, lkeys, ikeys, shared_pairs,
+        offset_e=offset_e, offset_v=offset_v)
+
+    surf2line = {k+1: [] for k in range(nattr)}
     for k, attr_set in enumerate(sorted_key):
-        for a in attr_set: surf2line[a].append(k+1)
+        for a in attr_set:
+            surf2line[a].append(k+1)
 
-    if debug:
-        g = GlobalNamedList(line2vert)
-        g.sharekeys()
-        gg = g.gather(nprc, overwrite = False).unique()
-        if myid==0: print("debug (gathered line2vert)", gg)
-    
     return surf2line, line2vert, line2edge, vert2vert
 
+
 def find_corner(mesh):
     '''
     For 2D geometry
@@ -508,176 +500,49 @@ def find_corner(mesh):
       corner of lines
     '''
     use_parallel = hasattr(mesh, "GroupNVertices")
-    
+
     if use_parallel:
         from mpi4py import MPI
-        myid = MPI.COMM_WORLD.rank
-        nprc = MPI.COMM_WORLD.size   
-        comm  = MPI.COMM_WORLD
-        
-        from mfem.common.mpi_debug import nicePrint, niceCall        
-        from petram.helper.mpi_recipes import allgather, allgather_vector, gather_vector
-        from petram.mesh.mesh_utils import distribute_shared_entity        
+        comm = MPI.COMM_WORLD
         if not hasattr(mesh, "shared_info"):
             mesh.shared_info = distribute_shared_entity(mesh)
+        myid, offset_e, _void, offset_v, _void = _parallel_offsets(mesh)
     else:
         myid = 0
-        nprc = 1
-        
-    ndim =  mesh.Dimension()
-    sdim =  mesh.SpaceDimension()    
-    ne = mesh.GetNEdges()
-    assert ndim == 2, "find_edge_corner is for 3D mesh"
+        offset_e = offset_v = 0
+
+    assert mesh.Dimension() == 2, "find_corner is for 2D mesh"
 
-    get_edges = mesh.GetElementEdges
-    get_attr  = mesh.GetAttribute
-    iattr= mesh.GetAttributeArray()     # min of this array is 1
-    nattr = 0 if iattr.size == 0 else np.max(iattr)            
-    nb = mesh.GetNE()
     nbe = mesh.GetNBE()
     if use_parallel:
-        nbe = sum(allgather(nbe))
-    if nbe == 0:    
+        nbe = comm.allreduce(nbe)
+    if nbe == 0:
         return {}, {}, {}
 
-    if use_parallel:
-        offset = np.hstack([0, np.cumsum(allgather(mesh.GetNEdges()))])
-        offsetf = np.hstack([0, np.cumsum(allgather(mesh.GetNFaces()))])
-        offsetv = np.hstack([0, np.cumsum(allgather(mesh.GetNV()))])
-        myoffset = offset[myid]
-        myoffsetf = offsetf[myid]
-        myoffsetv = offsetv[myid]                
-        nattr = max(allgather(nattr))
-        ne = sum(allgather(mesh.GetNEdges()))
-    else:
-        myoffset  = np.array(0, dtype=int)
-        myoffsetf = np.array(0, dtype=int)
-        myoffsetv = np.array(0, dtype=int)
-        
-    if mesh.GetNBE() == 0: # some parallel node may have zero boundary
-        battrs =  []
+    if mesh.GetNBE() == 0:  # some parallel node may have zero boundary
+        battrs = np.array([], dtype=int)
         iedges = np.array([], dtype=int)
     else:
-        battrs =  mesh.GetBdrAttributeArray()
-        iedges = np.hstack([mesh.GetBdrElementEdgeIndex(ibdr) for ibdr in
-                        range(mesh.GetNBE())]).astype(int, copy=False)
-    
+        battrs = mesh.GetBdrAttributeArray()
+        iedges = np.array([mesh.GetBdrElementEdgeIndex(ibdr) for ibdr in
+                           range(mesh.GetNBE())], dtype=int)
+
     line2edge = GlobalNamedList()
     line2edge.setlists(battrs, iedges)
 
-    if use_parallel:
-        ld, md = mesh.shared_info                
-        iedges = iedges+myoffset
+    # eliminate slave edges
+    e_lids, e_mids, _void, _void = _shared_table(mesh, 1, myid)
+    gedges = iedges + offset_e
+    master = _to_master(gedges, e_lids, e_mids)
+    real = master == gedges
 
-    if use_parallel:
-        for key2 in ld:
-            if key2[0] == myid: continue
-            iii = np.in1d(iedges, ld[key2][1], invert = True)
-            if len(iii) == 0: continue
-            iedges = iedges[iii]
-            battrs = battrs[iii]
-
-    line2realedge = GlobalNamedList()            
-    line2realedge.setlists(battrs, iedges)
-    
-    line2realvert = GlobalNamedList()
-    for key in line2realedge:
-        data = np.hstack([mesh.GetEdgeVertices(i-myoffset)+ myoffsetv
-                           for i in line2realedge[key]])
-        if use_parallel:        
-            for key2 in ld:
-                if key2[0] == myid: continue                
-                for lv, mv in zip(ld[key2][0], md[key2][0]):
-                   iii =  np.where(data == lv)[0]
-                   data[iii] = mv
-        line2realvert[key] = data
-
-    line2realvert.sharekeys().gather(nprc, distribute=True)
-
-    corners = GlobalNamedList()
-    for key in line2realvert:
-        seen = defaultdict(int)
-        for iiv in line2realvert[key]:
-            seen[iiv] += 1
-        corners[key] = [kk for kk in seen if seen[kk]==1]
-
-    sorted_key = corners.sharekeys().globalkeys
-    
-    corners.allgather()
-    u_own = np.unique(np.hstack([corners[key] for key in corners]).astype(int, copy=False))
-
-    if use_parallel:
-        idx = np.logical_and(u_own >= offsetv[myid], u_own < offsetv[myid+1])
-        u_own = u_own[idx]
-
-    if len(u_own) > 0:
-        vtx = np.hstack([mesh.GetVertexArray(i - myoffsetv) for i in u_own])
-    else:
-        vtx = np.atleast_1d([])
-    if use_parallel:
-        vtx = gather_vector(vtx)
-        u_own = gather_vector(u_own)
+    lkeys, ikeys = np.unique(battrs[real], return_inverse=True)
+    lkeys = [(int(k),) for k in lkeys]
+    empty = np.zeros((0, 3), dtype=int)
+    sorted_key, _void, line2vert, vert2vert = _line_corner_tables(
+        mesh, iedges[real], lkeys, ikeys.flatten(), empty,
+        offset_e=offset_e, offset_v=offset_v)
 
-    # sort vertex  
-    if myid == 0:
-        vtx = vtx.reshape(-1, sdim)
-        tmp = sorted([(k, tuple(x)) for k, x in enumerate(vtx)], key=lambda x:x[1])
-        if len(tmp) > 0:
-            vtx = np.vstack([x[1] for x in tmp])
-            u_own = np.hstack([[u_own[x[0]] for x in tmp]]).astype(int)
-            ivert=np.arange(len(vtx), dtype=int)+1
-        else:
-            u_own = np.atleast_1d([]).astype(int)
-            ivert = np.atleast_1d([]).astype(int)
-
-    if use_parallel:
-        #if myid != 0:
-        #    u_own = None; vtx = None
-        u_own = comm.bcast(u_own)
-        ivert=np.arange(len(u_own), dtype=int)+1
-        for key in ld:
-            if key[0] == myid: continue
-            for lv, mv in zip(ld[key][0], md[key][0]):
-                iii =  np.where(u_own == mv)[0]
-                u_own[iii] = lv
-        idx = np.logical_and(u_own >= offsetv[myid], u_own < offsetv[myid+1])
-        u_own = u_own[idx]
-        vtx = comm.bcast(vtx)
-        vtx = comm.bcast(vtx)[idx.flatten()]
-        ivert = ivert[idx]                          
-
-    vert2vert = {iv: iu-myoffsetv for iv, iu in zip(ivert, u_own)}
-    
-    # mapping line index to vertex index (not MFFEM vertex id)
-    line2vert = {}
-    #nicePrint(corners)
-    corners.bcast(nprc, distributed = True)
-    for j, key in enumerate(sorted_key):
-        data = corners[key]
-        if use_parallel:                     
-            for key2 in ld:
-                if key2[0] == myid: continue
-                for lv, mv in zip(ld[key2][0], md[key2][0]):
-                    iii =  np.where(data == mv)[0]
-                    data[iii] = lv
-            idx = np.logical_and(data >= offsetv[myid],
-                                 data < offsetv[myid+1])
-            data = data[idx]
-        data = list(data - myoffsetv)
-        line2vert[j+1] = [k for k in vert2vert
-                          if vert2vert[k] in data]
-   
-    if debug:
-        g = GlobalNamedList(line2vert)
-        g.sharekeys()
-        gg = g.gather(nprc, overwrite = False).unique()
-        if myid==0: print(gg)
-        for i in range(nprc):
-            if use_parallel:comm.barrier()
-            if myid == i:
-                for k in vert2vert:
-                    print(myid, k, mesh.GetVertexArray(vert2vert[k]))
-            if use_parallel:comm.barrier()                  
     return line2vert, line2edge, vert2vert
 
 def get_extended_connectivity(mesh):
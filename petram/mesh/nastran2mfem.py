@@ -18,9 +18,11 @@
     index in nas starts from 1.
     index in mfem starts from 0.
 
+    write_nas2mfem : write text mesh file (and _order2.mesh for 2nd
+                     order tet), or binary mesh (binary=True)
+    nas2mfem_mesh  : make mfem.Mesh in memory
+
 '''
-import numba
-from numba import jit, types, prange
 import numpy as np
 import re
 from scipy.sparse import coo_matrix
@@ -157,6 +159,7 @@ class NASReader(object):
             if not all(idx):
                 print("some TETRA has no volume")
                 TETRA = TETRA[idx, :]
+                TETRAF = TETRAF[idx, :]
                 TETRA_ATTR = TETRA_ATTR[idx]
 
             new_elems['TETRA'] = TETRA-1
@@ -185,7 +188,7 @@ class NASReader(object):
             HEXA = np.vstack([np.array((int(g[3]), int(g[4]), int(g[5]), int(g[6]),
                                         int(g[7]), int(g[8]), int(g[9]), int(g[10]),))
                               for g in elems['HEXA']])
-            TEXAF = np.vstack([np.array([int(x) for x in g[3:]])
+            HEXAF = np.vstack([np.array([int(x) for x in g[3:]])
                                for g in elems['HEXA']])
             HEXA_ATTR = np.array([int(g[2])
                                   for g in elems['HEXA']])  # PSOLID ID
@@ -446,212 +449,233 @@ def prepare_ho_node(mesh):
     mesh._linked_obj = (nfes, nfec)
 
 
-def write_ho_tet_mesh(filename, reader, ho_thre=1e-20):
-    import mfem.ser as mfem
+# NASTRAN CTETRA10 midside nodes (G5...G10) are on these edges
+tet10_edges = ((0, 1), (1, 2), (0, 2), (0, 3), (1, 3), (2, 3))
 
-    @jit(numba.int64(numba.float64[:], numba.float64[:, :]), cache=False)
-    def find_closest0(ptx, grids):
-        x1 = ptx[0]
-        y1 = ptx[1]
-        z1 = ptx[2]
-        for jj in range(10):
-            d2 = ((x1 - grids[jj, 0])**2 +
-                  (y1 - grids[jj, 1])**2 +
-                  (z1 - grids[jj, 2])**2)
-            if d2 < ho_thre:
-                return jj
-        assert(False)
-        return -1
-
-    @jit(parallel=True, cache=False)
-    def find_closest_tet_ptx(ptx, grids):
-        idx = np.empty(10, dtype=numba.int64)
-        for jj in prange(10):
-            idx[jj] = find_closest0(ptx[jj], grids)
-        return idx
+geom_type = {'TETRA': 4,
+             'TRIA6': 2,
+             'TRIA3': 2,
+             'HEXA':  5,
+             'QUAD8': 3,
+             'QUAD4': 3, }
+'''
+    SEGMENT = 1
+    TRIANGLE = 2
+    SQUARE = 3
+    TETRAHEDRON = 4
+    CUBE = 5
+'''
 
-    mesh = mfem.Mesh(filename)
 
-    prepare_ho_node(mesh)
-    n = mesh.GetNE()
+def _mfem_arrays(reader, exclude_bdr, offset):
+    '''
+    vertices/elements of MFEM mesh as arrays
 
-    node_gf = mesh.GetNodes()
-    nfes = node_gf.FESpace()
-    nodes = node_gf.GetDataArray().copy()
+    returns unique_grids, vertices, elements, bdr_elements
+        unique_grids : grid index (nas) of each vertex (mfem)
+        elements, bdr_elements : list of (geom, attr, vertex (n, nv))
+    '''
+    if reader.dataset is None:
+        reader.load()
 
-    node_gf2 = mfem.GridFunction(mesh._linked_obj[0])
-    nodes2 = node_gf2.GetDataArray()
+    grid = reader.dataset['GRIDS']
+    elems = reader.dataset['ELEMS']
 
-    grid_all = reader.dataset['GRIDS']
-    i_tetra = reader.dataset["ELEMS_HO"]["TETRA"]
+    el_3d = ['TETRA', 'HEXA']
+    if 'TETRA' in elems:
+        el_2d = ['TRIA6', 'TRIA3']
+    else:
+        el_2d = ['QUAD8', 'QUAD4']
+    el_3d = [x for x in el_3d if x in elems]
+    el_2d = [x for x in el_2d if x in elems]
 
-    for i in range(n):
-        # for i in [0]:
-        vdofs = nfes.GetElementVDofs(i)
-        ptx = nodes[vdofs].reshape(3, -1).transpose()
-        grids = grid_all[i_tetra[i]]
+    n3d = np.sum([len(elems[x]) for x in el_3d])
+    el_vtx = el_3d if n3d > 0 else el_2d
+    unique_grids = np.unique(np.hstack([elems[name].flatten()
+                                        for name in el_vtx]))
+    print('unique_grid (done)....' + str(len(unique_grids)))
 
-        new_grids = linearized_grids(grids)
+    rev_map = np.full(len(grid), -1, dtype=int)
+    rev_map[unique_grids] = np.arange(len(unique_grids))
+    reader.grid_mapping = (unique_grids, rev_map)
 
-        idx = find_closest_tet_ptx(ptx, new_grids)
+    vertices = grid[unique_grids] + np.array(offset, dtype=float)
 
-        tmp = grids[idx]
-        data = np.hstack((tmp[:, 0], tmp[:, 1], tmp[:, 2]))
-        nodes2[vdofs] = data
+    elements = [(geom_type[name], elems[name+'_ATTR'], rev_map[elems[name]])
+                for name in el_3d]
 
-        if (i % 50000) == 0:
-            print("processing elements "+str(i) + "/" + str(n))
+    # sometimes .nas contains a boundary element which are not used
+    # in 3D mesh. By default we skip this
+    nbdry = 0
+    bdr_elements = []
+    for name in el_2d:
+        vidx = elems[name]
+        attr = elems[name+'_ATTR']
+        used = np.all(rev_map[vidx] >= 0, axis=1)
+        flag = np.logical_and(used, ~np.isin(attr, exclude_bdr))
+        nbdry = nbdry + np.sum(~np.isin(attr, exclude_bdr))
+        bdr_elements.append((geom_type[name], attr[flag],
+                             rev_map[vidx[flag]]))
 
-    node_gf.Assign(nodes2)
+    print("number of bdry in file:", nbdry)
+    print("number of used bdry in file:",
+          np.sum([len(x[1]) for x in bdr_elements]))
 
-    filename2 = filename[:-5]+"_order2.mesh"
-    mesh.Save(filename2)
+    return unique_grids, vertices, elements, bdr_elements
 
 
-def write_nas2mfem(filename,  reader, exclude_bdr=None, offset=None,
-                   skip_unused_bdry=True, ho_thre=1e-20, skip_ho=False):
-
-    geom_type = {'TETRA': 4,
-                 'TRIA6': 2,
-                 'TRIA3': 2,
-                 'HEXA':  5,
-                 'QUAD8': 3,
-                 'QUAD4': 3, }
-    '''                     
-        SEGMENT = 1
-        TRIANGLE = 2
-        SQUARE = 3
-        TETRAHEDRON = 4
-        CUBE = 5
-        '''
+def _write_elements(fid, elements):
+    for gtyp, attr, ivert in elements:
+        data = np.column_stack((attr, np.full(len(attr), gtyp), ivert))
+        np.savetxt(fid, data, fmt='%d')
 
-    if exclude_bdr is None:
-        exclude_bdr = []
-    if offset is None:
-        offset = [0.0, 0.0, 0.0]
-    if reader.dataset is None:
-        reader.load()
 
-    data = reader.dataset
-    fid = open(filename, 'w')
+def _to_mesh(vertices, elements, bdr_elements):
+    '''
+    build mfem.Mesh from arrays returned by _mfem_arrays
+    '''
+    from petram.mesh.mesh_cache import arrays_to_mesh
 
-    grid = data['GRIDS']
-    elems = data['ELEMS']
+    def cat(x, dtype):
+        return np.hstack([np.zeros(0, dtype=dtype)] + x).astype(dtype)
 
-    el_3d = ['TETRA', 'HEXA']
-    if 'TETRA' in elems:
-        el_2d = ['TRIA6', 'TRIA3']
-    else:
-        el_2d = ['QUAD8', 'QUAD4']
+    arrays = {'vertices': vertices}
+    for name, data in (('elem', elements), ('bdr', bdr_elements)):
+        nverts = cat([np.full(len(x[1]), x[2].shape[-1]) for x in data], int)
+        arrays[name + '_geoms'] = cat([np.full(len(x[1]), x[0]) for x in data],
+                                      np.int32)
+        arrays[name + '_offsets'] = np.hstack(([0], np.cumsum(nverts))).astype(np.int64)
+        arrays[name + '_vertices'] = cat([x[2].flatten() for x in data], np.int32)
+        arrays[name + '_attrs'] = cat([x[1] for x in data], np.int32)
 
-    n3d = np.sum([len(elems[x]) for x in el_3d if x in elems])
+    header = {'dim': vertices.shape[-1],
+              'sdim': vertices.shape[-1],
+              'nodes': None}
+    return arrays_to_mesh(header, arrays)
 
-    if n3d > 0:
-        unique_grids = list(np.unique(np.hstack([elems[name].flatten()
-                                                 for name in el_3d if name in elems])))
-    else:
-        unique_grids = list(np.unique(np.hstack([elems[name].flatten()
-                                                 for name in el_2d if name in elems])))
-    nvtc = len(unique_grids)
-    print('unique_grid (done)....' + str(nvtc))
 
-    ndim = grid.shape[-1]
-    nelem = 0
-    nbdry = 0
+def ho_tet_nodes(mesh, reader, offset=None):
+    '''
+    set 2nd order nodes of pure tet mesh from CTETRA10 midside nodes.
 
-    for k in elems:
-        if k in el_3d:
-            nelem = nelem + len(elems[k+'_ATTR'])
-        if k in el_2d:
-            tmp = [x for x in elems[k+'_ATTR'] if not x in exclude_bdr]
-            nbdry = nbdry + len(tmp)
+    mesh vertex i should be grid reader.grid_mapping[0][i].
+    the midside node of each (sorted) vertex pair is scattered to the
+    edge dof of H1 order-2 nodal space (dof = NV + edge index).
+    '''
+    from petram.mesh.mesh_arrays import edge_vertices
 
-    fid.write('MFEM mesh v1.0\n')
-    fid.write('\n')
-    fid.write('dimension\n')
-    fid.write(str(ndim) + '\n')
-    fid.write('\n')
-    fid.write('elements\n')
-    fid.write(str(nelem) + '\n')
+    if offset is None:
+        offset = [0.0, 0.0, 0.0]
+    unique_grids, rev_map = reader.grid_mapping
 
-    rev_map = {unique_grids[x]: x for x in range(len(unique_grids))}
-    reader.grid_mapping = (unique_grids, rev_map)
+    grid_all = reader.dataset['GRIDS'] + np.array(offset, dtype=float)
+    i_tetra = reader.dataset["ELEMS_HO"]["TETRA"]
 
-    for name in el_3d:
-        if not name in elems:
-            continue
-        vidx = elems[name]
-        attr = elems[name+'_ATTR']
-        gtyp = geom_type[name]
-        txts = [None]*len(attr)
-        for i in range(len(attr)):
-            txt = [str(attr[i]), str(gtyp)]
-#                txt.extend([str(unique_grids.index(x)) for x in vidx[i]])
-            txt.extend([str(rev_map[x]) for x in vidx[i]])
-            txts[i] = ' '.join(txt)
-        fid.write('\n'.join(txts))
-    fid.write('\n')
+    prepare_ho_node(mesh)
+    nv = mesh.GetNV()
+    node_gf = mesh.GetNodes()
+    assert node_gf.FESpace().GetNDofs() == nv + mesh.GetNEdges(), "unexpected dof layout"
+
+    # (vertex pair) -> midside grid
+    nas_edges = np.array(tet10_edges)
+    v1 = rev_map[i_tetra[:, nas_edges[:, 0]]].flatten()
+    v2 = rev_map[i_tetra[:, nas_edges[:, 1]]].flatten()
+    mid = i_tetra[:, 4:10].flatten()
+    keys = np.minimum(v1, v2) * nv + np.maximum(v1, v2)
+    keys, idx = np.unique(keys, return_index=True)
+    mid = mid[idx]
+
+    ev = np.sort(edge_vertices(mesh), axis=1)
+    ekeys = ev[:, 0] * nv + ev[:, 1]
+    pos = np.searchsorted(keys, ekeys)
+    pos[pos == len(keys)] = 0
+    assert np.all(keys[pos] == ekeys), "midside node is not found for some edges"
+
+    nodes = np.vstack((grid_all[unique_grids], grid_all[mid[pos]]))
+    node_gf.Assign(np.ascontiguousarray(nodes.flatten()))
+
+
+def write_ho_tet_mesh(filename, reader, ho_thre=1e-20, offset=None):
+    '''
+    read linear mesh (filename) and write 2nd order mesh
+    (filename_order2.mesh).
+
+    ho_thre is not used (kept for compatibility). midside nodes are
+    assigned to edges by vertex pairs.
+    '''
+    import mfem.ser as mfem
 
-    # count valid 2d elements
-    # sometimes .nas contains a boundary element which are not used
-    # in 3D mesh. By default we skip this
+    mesh = mfem.Mesh(filename)
+    ho_tet_nodes(mesh, reader, offset=offset)
 
-    bdry_checks = {}
-    bdry_flags = {}
-    for name in el_2d:
-        if not name in elems:
-            continue
-        vidx = elems[name]
-        ss = vidx.shape
-        bdry_check = (np.in1d(vidx, unique_grids)).reshape(ss)
-        bdry_flag = [len(x) == np.sum(x) for x in bdry_check]
-        bdry_checks[name] = bdry_check
-        bdry_flags[name] = bdry_flag
+    filename2 = filename[:-5]+"_order2.mesh"
+    mesh.Save(filename2)
 
-    n_validbdry = np.sum([np.sum(bdry_flags[x]) for x in bdry_flags])
 
-    fid.write('boundary\n')
-    fid.write(str(n_validbdry) + '\n')
+def nas2mfem_mesh(reader, exclude_bdr=None, offset=None, skip_ho=False):
+    '''
+    make mfem.Mesh in memory (no text mesh file)
+    '''
+    if exclude_bdr is None:
+        exclude_bdr = []
+    if offset is None:
+        offset = [0.0, 0.0, 0.0]
 
-    print("number of bdry in file:", nbdry)
-    print("number of used bdry in file:", n_validbdry)
-    for name in el_2d:
-        if not name in elems:
-            continue
+    ret = _mfem_arrays(reader, exclude_bdr, offset)
+    mesh = _to_mesh(*ret[1:])
+    if reader.has_ho and not skip_ho:
+        ho_tet_nodes(mesh, reader, offset=offset)
+    return mesh
 
-        vidx = elems[name]
 
-        attr = elems[name+'_ATTR']
-        gtyp = geom_type[name]
-        txts = [None]*n_validbdry
+def write_nas2mfem(filename,  reader, exclude_bdr=None, offset=None,
+                   skip_unused_bdry=True, ho_thre=1e-20, skip_ho=False,
+                   binary=False):
+    '''
+    write MFEM mesh file.
+
+    binary : write binary mesh (petram.mesh.mesh_cache format)
+             including 2nd order nodes, instead of text mesh files.
+    '''
+    if exclude_bdr is None:
+        exclude_bdr = []
+    if offset is None:
+        offset = [0.0, 0.0, 0.0]
 
-        bdry_flag = bdry_flags[name]
-        k = 0
-        for i in range(len(attr)):
-            if attr[i] in exclude_bdr:
-                continue
-            if not bdry_flag[i]:
-                continue
-            txt = [str(attr[i]), str(gtyp)]
-#                txt.extend([str(unique_grids.index(x)) for x in vidx[i]])
-            txt.extend([str(rev_map[x]) for x in vidx[i]])
-            txts[k] = ' '.join(txt)
-            k = k + 1
+    if binary:
+        from petram.mesh.mesh_cache import write_mesh_cache
+        mesh = nas2mfem_mesh(reader, exclude_bdr=exclude_bdr, offset=offset,
+                             skip_ho=skip_ho)
+        write_mesh_cache(filename, mesh)
+        return
+
+    unique_grids, vertices, elements, bdr_elements = _mfem_arrays(reader,
+                                                                  exclude_bdr,
+                                                                  offset)
+    ndim = vertices.shape[-1]
 
-        fid.write('\n'.join(txts))
+    fid = open(filename, 'w')
+    fid.write('MFEM mesh v1.0\n')
+    fid.write('\n')
+    fid.write('dimension\n')
+    fid.write(str(ndim) + '\n')
     fid.write('\n')
-    print("Writing vertices", nvtc)
+    fid.write('elements\n')
+    fid.write(str(np.sum([len(x[1]) for x in elements])) + '\n')
+    _write_elements(fid, elements)
+
+    fid.write('boundary\n')
+    fid.write(str(np.sum([len(x[1]) for x in bdr_elements])) + '\n')
+    _write_elements(fid, bdr_elements)
+
+    print("Writing vertices", len(vertices))
     fid.write('vertices\n')
-    fid.write(str(nvtc) + '\n')
+    fid.write(str(len(vertices)) + '\n')
     fid.write(str(ndim) + '\n')
-    txts = [None]*nvtc
-    for i in range(nvtc):
-        txt = [str(x+offset[kk]) for kk, x in enumerate(grid[unique_grids[i]])]
-        txts[i] = ' '.join(txt)
-    fid.write('\n'.join(txts))
+    np.savetxt(fid, vertices, fmt='%.17g')
+    fid.close()
     print("Done")
 
     if reader.has_ho and not skip_ho:
-        print("generating 2nd order mesh. this may take a while")
-        write_ho_tet_mesh(filename, reader, ho_thre=ho_thre)
-    fid.close()
+        print("generating 2nd order mesh.")
+        write_ho_tet_mesh(filename, reader, ho_thre=ho_thre, offset=offset)
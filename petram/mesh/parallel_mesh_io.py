@@ -0,0 +1,272 @@
+'''
+   parallel_mesh_io
+
+   load ParMesh without having the whole serial mesh on every
+   process.
+
+   (1) pre-split files: when <path>.000000, <path>.000001, ... (one
+       file per process, written by split_mesh) exist, each process
+       reads only its own file. split_mesh also writes <path>.split
+       (json) recording the size/mtime of the source file, the number
+       of parts, the load options (generate_edges, refine,
+       fix_orientation) and the partitioning method. the files are
+       used only when all of them match the current run.
+   (2) otherwise, root process reads the serial mesh, partitions it and
+       extracts each part (mfem.MeshPartitioner). parts are sent to
+       processes by point-to-point messages (in chunks, since a part
+       can exceed the int range of MPI counts) and loaded as ParMesh.
+   (3) when neither is possible (MeshPartitioner is not available,
+       high order (curved) mesh), load_parallel_mesh returns None and
+       caller uses ParMesh(comm, serial_mesh, parts) as before.
+
+   files of parts are written in MFEM parallel mesh format, which can
+   be read by ParMesh(comm, filename).
+
+   usage:
+      # off-line (serial)
+      split_mesh('beam-tet.mesh', 4)
+      # parallel
+      pmesh = load_parallel_mesh(MPI.COMM_WORLD, 'beam-tet.mesh')
+'''
+import os
+import json
+import tempfile
+import numpy as np
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+else:
+    import mfem.ser as mfem
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('ParallelMeshIO')
+
+
+def part_filename(path, rank):
+    return path + '.' + '{:0>6d}'.format(rank)
+
+
+def can_split(mesh):
+    '''
+    MeshPartitioner does not handle high order nodes
+    '''
+    if not hasattr(mfem, 'MeshPartitioner'):
+        return False
+    nodes = mesh.GetNodes()
+    return nodes is None or nodes.FESpace().GetOrder(0) == 1
+
+
+def write_parts(mesh, nparts, prefix, parts=None):
+    '''
+    partition serial mesh and write each part to prefix.%06d
+
+    parts : partitioning array (None: MFEM default partitioning)
+    '''
+    if parts is None:
+        partitioner = mfem.MeshPartitioner(mesh, nparts)
+    else:
+        partitioner = mfem.MeshPartitioner(mesh, nparts, parts)
+
+    filenames = []
+    for i in range(nparts):
+        mesh_part = mfem.MeshPart()
+        partitioner.ExtractPart(i, mesh_part)
+        filename = part_filename(prefix, i)
+        mesh_part.Print(filename, 16)
+        filenames.append(filename)
+    return filenames
+
+
+def split_info_filename(path):
+    return path + '.split'
+
+
+def split_info(path, nparts, args, partitioning):
+    '''
+    description of pre-split files (written next to the parts)
+    '''
+    st = os.stat(path)
+    return {'size': st.st_size,
+            'mtime': st.st_mtime,
+            'nparts': nparts,
+            'options': [int(x) for x in args],
+            'partitioning': str(partitioning)}
+
+
+def split_mesh(path, nparts, get_partitioning=None, generate_edges=1,
+               refine=1, fix_orientation=True, partitioning='auto'):
+    '''
+    write pre-split files of path for nparts processes. run in serial.
+
+    get_partitioning : function(mesh, nparts) -> partitioning
+    partitioning : name of partitioning method (General.partitioning)
+                   the parts are made with. pre-split files are used
+                   only by a run using the same method.
+    '''
+    args = (generate_edges, refine, fix_orientation)
+    mesh = mfem.Mesh(path, *args)
+    assert can_split(mesh), "this mesh can not be split"
+    parts = None if get_partitioning is None else get_partitioning(mesh, nparts)
+    filenames = write_parts(mesh, nparts, path, parts=parts)
+    with open(split_info_filename(path), 'w') as fid:
+        json.dump(split_info(path, nparts, args, partitioning), fid)
+    return filenames
+
+
+def _check_split_info(path, nparts, args, partitioning):
+    '''
+    True if pre-split files are made from the current path with
+    the same options
+    '''
+    filename = split_info_filename(path)
+    if not os.path.exists(filename):
+        dprint1("pre-split files without " + filename + " are not used")
+        return False
+    try:
+        with open(filename, 'r') as fid:
+            info = json.load(fid)
+    except (OSError, ValueError) as err:
+        dprint1("failed to read " + filename, err)
+        return False
+    expected = split_info(path, nparts, args, partitioning)
+    if info != expected:
+        dprint1("pre-split files are stale or made with different options",
+                info, expected)
+        return False
+    return True
+
+
+def has_split_files(comm, path, args=(1, 1, True), partitioning='auto'):
+    '''
+    True if every process has its own part file, there is no extra
+    part, and the parts are made from the current path with the
+    same options.
+    '''
+    found = os.path.exists(part_filename(path, comm.rank))
+    if comm.rank == 0:
+        found = (found and
+                 not os.path.exists(part_filename(path, comm.size)) and
+                 _check_split_info(path, comm.size, args, partitioning))
+    from mpi4py import MPI
+    return bool(comm.allreduce(int(found), op=MPI.MIN))
+
+
+chunk_size = 2**30
+
+
+def _scatter_bytes(comm, data, root=0):
+    '''
+    data (list of bytes at root) -> bytes on each process
+    each part is sent by Send/Recv in chunks smaller than chunk_size
+    (counts of Scatterv are C int and overflow for large meshes)
+    '''
+    from mpi4py import MPI
+
+    sizes = [len(x) for x in data] if comm.rank == root else None
+    size = comm.scatter(sizes, root=root)
+
+    if comm.rank == root:
+        for rank, x in enumerate(data):
+            if rank == root:
+                continue
+            buf = np.frombuffer(x, dtype=np.uint8)
+            for i in range(0, len(buf), chunk_size):
+                comm.Send([buf[i:i + chunk_size], MPI.BYTE], dest=rank)
+        return data[root]
+
+    recvdata = np.empty(size, dtype=np.uint8)
+    for i in range(0, size, chunk_size):
+        comm.Recv([recvdata[i:i + chunk_size], MPI.BYTE], source=root)
+    return recvdata.tobytes()
+
+
+def _read_serial_and_split(comm, path, get_partitioning, args,
+                           serial_ops=(), root=0):
+    '''
+    read/split on root and return the part of this process as bytes.
+    returns None on all processes if the mesh can not be split.
+    an error on root is raised on all processes.
+    '''
+    data = None
+    error = None
+    if comm.rank == root:
+        try:
+            data = _split_on_root(comm, path, get_partitioning, args,
+                                  serial_ops)
+        except BaseException as err:
+            import traceback
+            traceback.print_exc()
+            error = repr(err)
+
+    status = comm.bcast((data is not None, error), root=root)
+    if status[1] is not None:
+        raise RuntimeError("failed to read/split mesh on root: " + status[1])
+    if not status[0]:
+        return None
+    return _scatter_bytes(comm, data, root=root)
+
+
+def _split_on_root(comm, path, get_partitioning, args, serial_ops):
+    from petram.mesh.mesh_cache import load_mesh_file
+
+    mesh = load_mesh_file(path, *args)
+    for op in serial_ops:
+        mesh = op(mesh)
+    if not can_split(mesh):
+        return None
+
+    parts = None
+    if get_partitioning is not None:
+        parts = get_partitioning(mesh, comm.size)
+    tmpdir = tempfile.mkdtemp()
+    filenames = write_parts(mesh, comm.size, os.path.join(tmpdir, 'mesh'),
+                            parts=parts)
+    data = []
+    for filename in filenames:
+        with open(filename, 'rb') as fid:
+            data.append(fid.read())
+        os.remove(filename)
+    os.rmdir(tmpdir)
+    return data
+
+
+def load_parallel_mesh(comm, path, get_partitioning=None, generate_edges=1,
+                       refine=1, fix_orientation=True, serial_ops=(),
+                       partitioning='auto'):
+    '''
+    load ParMesh. each process keeps only its own part.
+    returns None if the mesh can not be distributed in this way.
+
+    get_partitioning : function(mesh, nparts) -> partitioning
+                       called only on the root process
+    serial_ops : functions (mesh -> mesh) applied to the serial mesh
+                 on the root process before partitioning
+    partitioning : name of partitioning method. pre-split files
+                   made by another method are not used.
+    '''
+    args = (generate_edges, refine, fix_orientation)
+    if has_split_files(comm, path, args=args, partitioning=partitioning):
+        if len(serial_ops) == 0:
+            dprint1("reading pre-split mesh files: " + path + ".******")
+            return mfem.ParMesh(comm, part_filename(path, comm.rank))
+        dprint1("pre-split mesh files are not used (serial mesh operation)")
+
+    if not hasattr(mfem, 'MeshPartitioner'):
+        return None
+
+    data = _read_serial_and_split(comm, path, get_partitioning, args,
+                                  serial_ops=serial_ops)
+    if data is None:
+        return None
+    dprint1("mesh is read on root and distributed: " + path)
+
+    fd, filename = tempfile.mkstemp(suffix='.mesh')
+    with os.fdopen(fd, 'wb') as fid:
+        fid.write(data)
+    del data
+    try:
+        pmesh = mfem.ParMesh(comm, filename)
+    finally:
+        os.remove(filename)
+    return pmesh
@@ -17,6 +17,7 @@ import os
 import numpy as np
 
 from petram.mfem_config import use_parallel
+from petram.mesh.mesh_arrays import vertex_coordinates
 import petram.debug
 dprint1, dprint2, dprint3 = petram.debug.init_dprints('partial_mesh')
 
@@ -30,7 +31,8 @@ if use_parallel:
    
    smyid = '{:0>6d}'.format(myid)
    from mfem.common.mpi_debug import nicePrint, niceCall
-   from petram.helper.mpi_recipes import allgather, allgather_vector, gather_vector
+   from petram.helper.mpi_recipes import (allgather, allgather_vector,
+                                          alltoall_vector)
    from petram.mesh.mesh_utils import distribute_shared_entity
 else:
    import mfem.ser as mfem
@@ -56,7 +58,7 @@ def _collect_data(index, mesh, mode, skip_vtx= False):
         GetXElementVertices = mesh.GetBdrElementVertices
         GetXBaseGeometry    = mesh.GetBdrElementBaseGeometry
         attrs = mesh.GetBdrAttributeArray()
-        idx = np.arange(len(attrs))[np.in1d(attrs, index)]
+        idx = np.arange(len(attrs))[np.isin(attrs, index)]
         attrs = attrs[idx]
         
     elif mode == 'dom':
@@ -64,7 +66,7 @@ def _collect_data(index, mesh, mode, skip_vtx= False):
         GetXBaseGeometry    = mesh.GetElementBaseGeometry
         attrs = mesh.GetAttributeArray()
         
-        idx = np.arange(len(attrs))[np.in1d(attrs, index)]
+        idx = np.arange(len(attrs))[np.isin(attrs, index)]
         attrs = attrs[idx]
         
     elif mode == 'edge':        
@@ -118,6 +120,73 @@ def _add_face_data(m, idx, nverts, base):
     return nverts, base
 
  
+def _shared_table(shared_info, imode):
+    '''
+    flatten shared entity information of entities owned by other
+    processes
+
+    returns (local id, master id, master rank). local ids are unique
+    and sorted (when an entity appears more than once, the first one
+    is used)
+    '''
+    ld, md = shared_info
+    lids = []
+    mids = []
+    ranks = []
+    for key in ld.keys():
+        mid, g_in_master = key
+        if mid == myid:
+            continue
+        l = np.atleast_1d(ld[key][imode]).astype(int)
+        lids.append(l)
+        mids.append(np.atleast_1d(md[key][imode]).astype(int))
+        ranks.append(np.zeros(len(l), dtype=int) + mid)
+    if len(lids) == 0:
+        empty = np.array([], dtype=int)
+        return empty, empty, empty
+    lids = np.hstack(lids)
+    mids = np.hstack(mids)
+    ranks = np.hstack(ranks)
+    lids, ii = np.unique(lids, return_index=True)
+    return lids, mids[ii], ranks[ii]
+
+
+def _lookup(keys, values):
+    '''
+    position of values in sorted unique keys (-1 if not found)
+    '''
+    values = np.asarray(values, dtype=int)
+    if len(keys) == 0:
+        return np.zeros(len(values), dtype=int) - 1
+    pos = np.searchsorted(keys, values)
+    pos[pos == len(keys)] = 0
+    pos[keys[pos] != values] = -1
+    return pos
+
+
+def _split_by_rank(ranks, *arrays):
+    '''
+    interleave arrays and split to the list for alltoall_vector
+    '''
+    data = np.vstack(arrays).transpose().astype(int) if len(ranks) > 0 else None
+    ret = []
+    for i in range(nprc):
+        if data is None:
+            ret.append(np.array([], dtype=int))
+        else:
+            ret.append(data[ranks == i].flatten())
+    return ret
+
+
+def _allgather_columns(*arrays):
+    '''
+    allgather arrays of the same length in one call
+    '''
+    data = np.vstack([np.asarray(x).astype(int) for x in arrays]).transpose()
+    data = allgather_vector(data.flatten()).reshape(-1, len(arrays))
+    return [data[:, k] for k in range(len(arrays))]
+
+
 def _gather_shared_vertex(mesh, u, shared_info,  *iverts):
     # u_own, iv1, iv2... = gather_shared_vertex(mesh, u, ld, md, iv1, iv2...)
 
@@ -136,28 +205,24 @@ def _gather_shared_vertex(mesh, u, shared_info,  *iverts):
     offset = np.hstack([0, np.cumsum(allgather(mesh.GetNV()))])
     iverts = [iv + offset[myid] for iv in iverts]                        
     u = u +  offset[myid] # -> global numbering
-    
-    ld, md = shared_info
-    mv_list = [[] for i in range(nprc)]
-    for key in ld.keys():
-        mid, g_in_master = key
-        if mid != myid:
-            for lv, mv in zip(ld[key][0], md[key][0]):
-                ic = 0
-                for iv in iverts:
-                    iii =  np.where(iv == lv)[0]
-                    ic = ic + len(iii)
-                    if len(iii)>0:
-                        iv[iii] = mv
-                if ic > 0: mv_list[mid].append(mv)                        
-            u = u[np.in1d(u, ld[key][0], invert=True)]
-    for i in range(nprc):
-        mvv = gather_vector(np.atleast_1d(mv_list[i]).astype(int), root=i)
-        if i == myid:
-            missing = np.unique(mvv[np.in1d(mvv, u, invert=True)])
-            if len(missing) != 0:
-                print("adding (vertex)", missing)
-                u = np.hstack((u, missing))               
+
+    lv, mv, mrank = _shared_table(shared_info, 0)
+
+    used = np.zeros(len(lv), dtype=bool)
+    for iv in iverts:
+        pos = _lookup(lv, iv)
+        hit = pos >= 0
+        iv[hit] = mv[pos[hit]]
+        used[pos[hit]] = True
+    u = u[np.isin(u, lv, invert=True)]
+
+    # send the real vertices used here to their owner
+    mv_list = _split_by_rank(mrank[used], mv[used])
+    mvv = np.hstack(alltoall_vector(mv_list, int))
+    missing = np.unique(mvv[np.isin(mvv, u, invert=True)])
+    if len(missing) != 0:
+        dprint2("adding (vertex)", missing)
+        u = np.hstack((u, missing))
 
     u_own = np.sort(u - offset[myid])
     return [u_own]+list(iverts) ## u_own, iv1, iv2 =
@@ -165,50 +230,42 @@ def _gather_shared_vertex(mesh, u, shared_info,  *iverts):
 def _gather_shared_element(mesh, mode, shared_info, ielem, kelem, attrs,
                            nverts, base, ivert, skip_adding=False):
    
-    ld, md = shared_info
-    
     if mode == 'face': imode=2
     elif mode == 'edge': imode=1
     else: imode = 0
-    #
-    me_list = [[] for i in range(nprc)]
-    mea_list = [[] for i in range(nprc)]
-    for key in ld.keys():
-        mid, g_in_master = key
-        if mid != myid:
-           for le, me in zip(ld[key][imode], md[key][imode]): 
-               iii =  np.where(ielem == le)[0]
-               if len(iii) != 0:
-                   if not skip_adding:
-                      kelem[iii] = False
-                   me_list[mid].append(me)
-                   mea_list[mid].extend(list(attrs[iii]))
-               assert len(iii)<2, "same iface (pls report this error to developer) ???"
-
-    new_ivert = np.array([], dtype=ivert.dtype)
-    for i in range(nprc):        
-        mev = gather_vector(np.atleast_1d(me_list[i]).astype(int), root=i)
-        mea = gather_vector(np.atleast_1d(mea_list[i]).astype(int), root=i)
-        if i == myid:            
-           check = np.in1d(mev, ielem, invert=True)
-           missing, mii = np.unique(mev[check], return_index=True)
-           missinga = mea[check][mii]
-           if len(missing) != 0:                       
-               print("adding (face)", myid, missing)
-               print(len(missing), len(missinga), missinga)
-               if not skip_adding:
-                   nverts, base  = _add_face_data(mesh, missing, nverts, base)
-                   attrs = np.hstack((attrs, missinga)).astype(attrs.dtype)
-                   kelem = np.hstack((kelem, [True]*len(missing)))
-               
+
+    le, me, mrank = _shared_table(shared_info, imode)
+
+    ielem = np.asarray(ielem, dtype=int)
+    order = np.argsort(ielem, kind='stable')
+    sorted_ielem = ielem[order]
+    assert len(np.unique(sorted_ielem)) == len(sorted_ielem), "same iface (pls report this error to developer) ???"
+
+    # shared elements found here
+    pos = _lookup(sorted_ielem, le)
+    hit = pos >= 0
+    iii = order[pos[hit]]
     if not skip_adding:
-       new_ivert = new_ivert.astype(ivert.dtype)       
-       new_ivert = allgather_vector(new_ivert)
-       #ivert  = np.hstack((ivert,  new_ivert))
-    attrs = allgather_vector(attrs)
-    base  = allgather_vector(base)
-    nverts = allgather_vector(nverts)
-    kelem  = allgather_vector(kelem)
+        kelem[iii] = False
+
+    me_list = _split_by_rank(mrank[hit], me[hit], attrs[iii])
+    data = np.hstack(alltoall_vector(me_list, int)).reshape(-1, 2)
+    mev = data[:, 0]
+    mea = data[:, 1]
+
+    check = np.isin(mev, ielem, invert=True)
+    missing, mii = np.unique(mev[check], return_index=True)
+    missinga = mea[check][mii]
+    if len(missing) != 0:
+        dprint2("adding (face)", myid, missing, missinga)
+        if not skip_adding:
+            nverts, base  = _add_face_data(mesh, missing, nverts, base)
+            attrs = np.hstack((attrs, missinga)).astype(attrs.dtype)
+            kelem = np.hstack((kelem, [True]*len(missing)))
+
+    attrs, base, nverts, kelem = _allgather_columns(attrs, base, nverts,
+                                                    kelem)
+    kelem = kelem.astype(bool)
     return kelem, attrs, nverts, base, ivert
    
         
@@ -305,18 +362,13 @@ def edge(mesh, in_attr, filename = '', precision=8):
         u_own, ivert, eivert = _gather_shared_vertex(mesh, u, shared_info,
                                                    ivert, eivert)
     Nvert = len(u)
-    if len(u_own) > 0:
-        vtx = np.vstack([mesh.GetVertexArray(i) for i in u_own])    
-    else:
-        vtx = np.array([]).reshape((-1, sdim))
+    vtx = vertex_coordinates(mesh)[u_own]
 
     if isParMesh(mesh):       
         #
         # distribute vertex/element data
         #
-        base = allgather_vector(base)
-        nverts = allgather_vector(nverts)
-        attrs = allgather_vector(attrs)
+        base, nverts, attrs = _allgather_columns(base, nverts, attrs)
         
         ivert = allgather_vector(ivert)
         eivert = allgather_vector(eivert)
@@ -334,8 +386,9 @@ def edge(mesh, in_attr, filename = '', precision=8):
                                    keelem, eattrs,
                                    neverts, ebase, eivert))
         
-    indices  = np.array([np.where(u == biv)[0][0] for biv in ivert])
-    eindices = np.array([np.where(u == biv)[0][0] for biv in eivert])
+    # u is sorted unique
+    indices = np.searchsorted(u, ivert)
+    eindices = np.searchsorted(u, eivert)
 
     Nvert = len(vtx)
     Nelem = len(attrs)    
@@ -468,18 +521,13 @@ def surface(mesh, in_attr, filename = '', precision=8):
         u_own, ivert, eivert = _gather_shared_vertex(mesh, u, shared_info,
                                                    ivert, eivert)
     Nvert = len(u)
-    if len(u_own) > 0:
-        vtx = np.vstack([mesh.GetVertexArray(i) for i in u_own])    
-    else:
-        vtx = np.array([]).reshape((-1, sdim))
+    vtx = vertex_coordinates(mesh)[u_own]
 
     if isParMesh(mesh):
         #
         # distribute vertex/element data
         #
-        base = allgather_vector(base)
-        nverts = allgather_vector(nverts)
-        attrs = allgather_vector(attrs)
+        base, nverts, attrs = _allgather_columns(base, nverts, attrs)
         
         ivert = allgather_vector(ivert)
         eivert = allgather_vector(eivert)
@@ -498,15 +546,9 @@ def surface(mesh, in_attr, filename = '', precision=8):
                                    neverts, ebase, eivert,
                                    skip_adding=True))
         
-    #indices  = np.array([np.where(u == biv)[0][0] for biv in ivert])
-    #eindices = np.array([np.where(u == biv)[0][0] for biv in eivert])
-    
-    iv, ivi = np.unique(ivert, return_inverse=True)
-    tmp  = np.where(np.in1d(u,  ivert,  assume_unique=True))[0]
-    indices = tmp[ivi]
-    iv, ivi = np.unique(eivert, return_inverse=True)
-    tmp  = np.where(np.in1d(u,  eivert, assume_unique=True))[0]
-    eindices = tmp[ivi]
+    # u is sorted unique
+    indices = np.searchsorted(u, ivert)
+    eindices = np.searchsorted(u, eivert)
 
     Nvert = len(vtx)
     Nelem = len(attrs)    
@@ -644,18 +686,13 @@ def volume(mesh, in_attr, filename = '', precision=8):
         u_own, ivert, bivert = _gather_shared_vertex(mesh, u, shared_info,
                                                    ivert, bivert)
        
-    if len(u_own) > 0:
-        vtx = np.vstack([mesh.GetVertexArray(i) for i in u_own])    
-    else:
-        vtx = np.array([]).reshape((-1, sdim))
+    vtx = vertex_coordinates(mesh)[u_own]
 
     if isParMesh(mesh):              
         #
         # distribute vertex/element data
         #
-        base = allgather_vector(base)
-        nverts = allgather_vector(nverts)
-        attrs = allgather_vector(attrs)
+        base, nverts, attrs = _allgather_columns(base, nverts, attrs)
         
         ivert = allgather_vector(ivert)
         bivert = allgather_vector(bivert)
@@ -678,17 +715,9 @@ def volume(mesh, in_attr, filename = '', precision=8):
                                    skip_adding=True))
         
         
-    #indices0  = np.array([np.where(u == biv)[0][0] for biv in ivert])
-    #bindices0 = np.array([np.where(u == biv)[0][0] for biv in bivert])
-
-    iv, ivi = np.unique(ivert, return_inverse=True)
-    tmp  = np.where(np.in1d(u,  ivert,  assume_unique=True))[0]
-    indices = tmp[ivi]
-    iv, ivi = np.unique(bivert, return_inverse=True)
-    tmp  = np.where(np.in1d(u,  bivert, assume_unique=True))[0]
-    bindices = tmp[ivi]
-    
-    #print('check', np.sum(np.abs(indices - indices0)))    
+    # u is sorted unique
+    indices = np.searchsorted(u, ivert)
+    bindices = np.searchsorted(u, bivert)
     
     Nvert = len(vtx)
     Nelem = len(attrs)    
@@ -865,6 +865,7 @@ class DlgPlotSol(SimpleFramePlus):
 
     def load_sol_if_needed(self):
         from petram.sol.solsets import read_sol, find_solfiles
+        from petram.sol.checkpoint import solpath_exists
         model = self.GetParent().model
         solfiles = model.variables.getvar('solfiles')
 
@@ -882,7 +883,7 @@ class DlgPlotSol(SimpleFramePlus):
                 self.local_solsubdir = ""
             else:
                 npath = os.path.join(self.local_soldir, self.local_solsubdir)
-                if not os.path.exists(npath):  # fall back
+                if not solpath_exists(npath):  # fall back
                     npath = sol.owndir()
                     self.local_soldir = npath
                     self.local_solsubdir = ""
@@ -896,7 +897,7 @@ class DlgPlotSol(SimpleFramePlus):
             doit = True
             if self.local_soldir is not None:
                 npath = os.path.join(self.local_soldir, self.local_solsubdir)
-                if not os.path.exists(npath):  # fall back
+                if not solpath_exists(npath):  # fall back
                     npath = sol.owndir()
                     self.local_soldir = npath
                     self.local_solsubdir = ""
@@ -3,7 +3,6 @@
       a thing to evaluate solution on a boundary
 '''
 import numpy as np
-import parser
 import weakref
 import six
 
@@ -22,6 +21,37 @@ else:
 from petram.sol.evaluator_agent import EvaluatorAgent
 Geom = mfem.Geometry()
 
+_compiled_expr = {}
+def compile_expr(expr):
+    if not expr in _compiled_expr:
+        _compiled_expr[expr] = compile(expr.strip(), '<string>', 'eval')
+    return _compiled_expr[expr]
+
+# geometry data cache
+#    _element_csr[mesh] = (geoms, offsets, vertices) of elements
+#    _vertex_coords[mesh] = vertex coordinates
+#    _geom_cache[mesh][(battrs, decimate)] = preprocessed boundary data
+_element_csr = WKD()
+_vertex_coords = WKD()
+_geom_cache = WKD()
+
+def get_element_csr(mesh):
+    if not mesh in _element_csr:
+        from petram.mesh.mesh_arrays import element_vertices
+        _element_csr[mesh] = element_vertices(mesh)
+    return _element_csr[mesh]
+
+def get_vertex_coordinates(mesh):
+    if not mesh in _vertex_coords:
+        from petram.mesh.mesh_arrays import vertex_coordinates
+        _vertex_coords[mesh] = vertex_coordinates(mesh)
+    return _vertex_coords[mesh]
+
+def get_geom_cache(mesh):
+    if not mesh in _geom_cache:
+        _geom_cache[mesh] = {}
+    return _geom_cache[mesh]
+
 def process_iverts2nodals(mesh, iverts):
     ''' 
     collect data to evalutate nodal values of mesh
@@ -34,34 +64,34 @@ def process_iverts2nodals(mesh, iverts):
     iverts_inv = iverts_inv.reshape(iverts.shape)
 
     # then get unique set of elements relating to the verts.
-    vert2el = mesh.GetVertexToElementTable()
-    ieles = np.hstack([vert2el.GetRowList(i) for i in iverts_f])
-    ieles = np.unique(ieles)
-
+    # (element vertices which is in iverts_f)
+    geoms, offsets, vertices = get_element_csr(mesh)
+    nverts = np.diff(offsets)
+    elnum = np.repeat(np.arange(len(nverts)), nverts)
+    localnum = np.arange(len(vertices)) - np.repeat(offsets[:-1], nverts)
+
+    pos = np.searchsorted(iverts_f, vertices)
+    pos[pos == len(iverts_f)] = 0
+    hit = np.where(iverts_f[pos] == vertices)[0]
+
+    ieles, counts = np.unique(elnum[hit], return_counts=True)
+    split = np.cumsum(counts)[:-1]
+    
     # map from element -> (element's vert index, ivert_f index)
-    elvert2facevert = [None]*len(ieles)
-    elvertloc = [None]*len(ieles)
-    elattr = [None]*len(ieles)
-
-    wverts = np.zeros(len(iverts_f))
-    for kk, iel in enumerate(ieles):
-        elvert2facevert[kk] = []
-        elvertloc[kk] = []
-        elattr[kk] = mesh.GetAttribute(iel)
-        elverts = mesh.GetElement(iel).GetVerticesArray()
-        for k, elvert in enumerate(elverts):
-            idx = np.searchsorted(iverts_f, elvert)
-            if idx == len(iverts_f): continue ## not found   
-            if iverts_f[idx] != elvert: continue ## not found
-            elvert2facevert[kk].append((k, idx))
-            elvertloc[kk].append(mesh.GetVertexArray(elvert))
-            wverts[idx] = wverts[idx]+1
+    pairs = np.vstack((localnum[hit], pos[hit])).transpose()
+    elvert2facevert = np.split(pairs, split)
+
+    vcoords = get_vertex_coordinates(mesh)[iverts_f]
+    elvertloc = np.split(vcoords[pos[hit]], split)
+
+    wverts = np.bincount(pos[hit], minlength=len(iverts_f)).astype(float)
+    elattr = mesh.GetAttributeArray()[ieles]
 
     # idx of element needs to be evaluated
     
-    return {'ieles': np.array(ieles),
+    return {'ieles': ieles,
             'elvert2facevert': elvert2facevert,
-            'locs': np.stack([mesh.GetVertexArray(k) for k in iverts_f]),
+            'locs': vcoords,
             'elvertloc': elvertloc,
             'elattr': np.array(elattr),
             'iverts_inv': iverts_inv,
@@ -69,28 +99,21 @@ def process_iverts2nodals(mesh, iverts):
             'wverts' : wverts}
 
 def edge_detect(index):
-    #print("edge_detect", index.shape)
-    store = []
-    def check_pair(store, a, b):
-        a1 = min(a,b)
-        b1 = max(a,b)
-        p = (a1, b1)
-        if p in store: store.remove(p)
-        else: store.append(p)
-        return store
-        
-    for iv in index:
-        store = check_pair(store, iv[0], iv[1])
-        store = check_pair(store, iv[0], iv[2])
-        store = check_pair(store, iv[1], iv[2])        
-    ret = np.vstack(store)
-    return  ret
+    '''
+    edges of triangles (index) which appears odd number of times
+    '''
+    index = np.atleast_2d(index)
+    edges = np.vstack((index[:, [0, 1]],
+                       index[:, [0, 2]],
+                       index[:, [1, 2]]))
+    edges = np.sort(edges, axis=1)
+    edges, counts = np.unique(edges, axis=0, return_counts=True)
+    return edges[counts % 2 == 1]
 
 def get_emesh_idx(obj, expr, solvars, phys):
     from petram.helper.variables import Variable, var_g, NativeCoefficientGenBase
     
-    st = parser.expr(expr)
-    code= st.compile('<string>')
+    code = compile_expr(expr)
     names = code.co_names
     
     g = {}
@@ -130,8 +153,7 @@ def eval_at_nodals(obj, expr, solvars, phys):
     if len(obj.iverts) == 0: return None
     variables = []
 
-    st = parser.expr(expr)
-    code= st.compile('<string>')
+    code = compile_expr(expr)
     names = code.co_names
 
     g = {}
@@ -207,12 +229,27 @@ class BdrNodalEvaluator(EvaluatorAgent):
         self.knowns = WKD()
         self.iverts = []
 
+        cache = get_geom_cache(mesh)
+        key = (tuple(battrs), decimate)
+        if not key in cache:
+            cache[key] = self.process_bdr_geometry(mesh, battrs, decimate)
+        data = cache[key]
+        if data is None: return
+
+        for k in list(data):
+            setattr(self, k, data[k])
+        self.emesh_idx = emesh_idx
+
+    @staticmethod
+    def process_bdr_geometry(mesh, battrs, decimate):
+        from petram.mesh.mesh_arrays import element_vertices, element_vertices_of
+
         if mesh.Dimension() == 3:
             getarray = mesh.GetBdrArray
-            getelement = mesh.GetBdrElement
+            bdr = True
         elif mesh.Dimension() == 2:
             getarray = mesh.GetDomainArray
-            getelement = mesh.GetElement            
+            bdr = False
         else:
             assert False, "BdrNodal Evaluator is not supported for this dimension"
             
@@ -221,31 +258,33 @@ class BdrNodalEvaluator(EvaluatorAgent):
         
         ibdrs = np.hstack(x).astype(int).flatten()
 
-        if self.decimate != 1:
-            ibdrs = ibdrs[::self.decimate]
+        if decimate != 1:
+            ibdrs = ibdrs[::decimate]
 
-        self.ibeles = np.array(ibdrs)
+        if bdr:
+            void, offsets, vertices = element_vertices(mesh, bdr=True)
+        else:
+            void, offsets, vertices = get_element_csr(mesh)
+        offsets, vertices = element_vertices_of(offsets, vertices, ibdrs)
+        nverts = np.diff(offsets)
 
-        def get_vertices_array(i):
-            arr = getelement(i).GetVerticesArray()
-            if len(arr) == 3:
-                return arr
-            elif len(arr) == 4:
-                x = arr[:-1]
-                y = np.array([arr[0], arr[2], arr[3]])
-                return np.vstack([x, y])
-            
         # we handle quad as two triangles
-        iverts = np.vstack([get_vertices_array(i) for i in ibdrs])
-        
-        self.iverts = iverts
-        if len(self.iverts) == 0: return
+        tri = offsets[:-1][nverts == 3]
+        quad = offsets[:-1][nverts == 4]
+        iv = np.empty((len(nverts) + len(quad), 3), dtype=int)
+        ntri = np.where(nverts == 3, 1, 2)
+        start = np.hstack([0, np.cumsum(ntri)[:-1]])
+        iv[start[nverts == 3]] = vertices[tri[:, None] + np.arange(3)]
+        iv[start[nverts == 4]] = vertices[quad[:, None] + np.arange(3)]
+        iv[start[nverts == 4] + 1] = vertices[quad[:, None] + np.array([0, 2, 3])]
+        if len(iv) == 0: return
+
+        data = process_iverts2nodals(mesh, iv)
+        data['iverts'] = iv
+        data['ibeles'] = ibdrs
+        data['refined'] = {}
+        return data
 
-        data = process_iverts2nodals(mesh, iverts)
-        for k in list(data):
-            setattr(self, k, data[k])
-        self.emesh_idx = emesh_idx
-        
     def eval(self, expr, solvars, phys, **kwargs):
         emesh_idx = get_emesh_idx(self, expr, solvars, phys)
         if len(emesh_idx) > 1:
@@ -277,17 +316,17 @@ class BdrNodalEvaluator(EvaluatorAgent):
             if not edge_only:
                 return self.locs, val, self.iverts_inv
             else:
-                idx = edge_detect(self.iverts_inv)
-                return self.locs, val, idx
+                if not 'edge' in self.refined:
+                    self.refined['edge'] = edge_detect(self.iverts_inv)
+                return self.locs, val, self.refined['edge']
         else:
-            from petram.sol.nodal_refinement import refine_surface_data
-
-            ptx, data, ridx = refine_surface_data(self.mesh()[self.emesh_idx],
-                                                  self.ibeles,
-                                                  val, self.iverts_inv,
-                                                  refine)
+            from petram.sol.nodal_refinement import (refine_surface_geometry,
+                                                     refine_surface_values)
+            if not refine in self.refined:
+                self.refined[refine] = refine_surface_geometry(
+                                          self.mesh()[self.emesh_idx],
+                                          self.ibeles, self.iverts_f,
+                                          refine)
+            ptx, ridx, groups = self.refined[refine]
+            data = refine_surface_values(groups, val)
             return ptx, data, ridx
-
-
-
-
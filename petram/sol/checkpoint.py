@@ -0,0 +1,236 @@
+'''
+  incremental checkpoint storage for time domain runs
+
+  checkpoint_<solver>/
+     solmesh_*             : mesh (written once)
+     checkpoint.index      : binary index
+     checkpoint.data       : variable arrays of all checkpoints
+     sol_extended_<idx>.data : extra data of each checkpoint (same
+                             text format as sol_extended.data)
+     (in parallel, these files have rank suffix .000000 etc)
+
+  index file
+     magic (CHECKPOINT_MAGIC)
+     uint32 header length (little endian)
+     json header {"names": [...], "meta": {name: {...}}}
+     fixed size records (INDEX_DTYPE)
+
+  a data record stores all arrays one after another, each prefixed
+  by its byte length (uint64). encoding of record:
+     ENC_RAW   : raw bytes
+     ENC_ZLIB  : zlib compressed bytes
+     ENC_DELTA : zlib compressed bit-wise xor with the previous
+                 checkpoint (lossless). a full record is written
+                 every keyframe checkpoints to bound the chain
+'''
+import os
+import json
+import zlib
+import numpy as np
+
+CHECKPOINT_MAGIC = b'\x93PETRAM_CHECKPOINT'
+INDEX_DTYPE = np.dtype([('icheckpoint', '<i8'),
+                        ('time', '<f8'),
+                        ('encoding', '<i8'),
+                        ('offset', '<i8'),
+                        ('nbytes', '<i8')])
+ENC_RAW = 0
+ENC_ZLIB = 1
+ENC_DELTA = 2
+
+index_name = 'checkpoint.index'
+data_name = 'checkpoint.data'
+
+
+def extrafile_name(icheckpoint):
+    return 'sol_extended_' + str(icheckpoint) + '.data'
+
+
+def split_checkpoint_path(path):
+    '''
+    "checkpoint_<solver>#3" -> ("checkpoint_<solver>", 3)
+    returns (path, None) for a normal directory
+    '''
+    base = os.path.basename(path)
+    if base.find('#') == -1:
+        return path, None
+    base, idx = base.split('#')
+    return os.path.join(os.path.dirname(path), base), int(idx)
+
+
+def split_checkpoint_ref(ref):
+    '''
+    solution file in incremental checkpoint is refered as
+    "<dir>/solr_E_0.000000#3"
+    returns ("<dir>", "solr_E_0", ".000000", 3)
+    '''
+    path, idx = split_checkpoint_path(ref)
+    base = os.path.basename(path)
+    name = base.split('.')[0]
+    return os.path.dirname(path), name, base[len(name):], idx
+
+
+def read_checkpoint_ref(ref, suffix=''):
+    '''
+    arrays of incremental checkpoint "<dir>/checkpoint_<solver>#<idx>"
+    returns dict of name (solr_E_0 etc) -> ndarray
+    '''
+    path, idx = split_checkpoint_path(ref)
+    return CheckpointReader(path, suffix).read(idx)
+
+
+def solpath_exists(path):
+    path, idx = split_checkpoint_path(path)
+    return os.path.exists(path)
+
+
+def _uint_dtype(dtype):
+    itemsize = np.dtype(dtype).itemsize
+    return '<u' + str(itemsize if itemsize in (1, 2, 4) else 8)
+
+
+def _uint_view(array):
+    array = np.ascontiguousarray(array).reshape(-1)
+    return array.view(_uint_dtype(array.dtype))
+
+
+class CheckpointWriter(object):
+    def __init__(self, path, suffix='', compress=True, delta=False,
+                 keyframe=10):
+        self.index_file = os.path.join(path, index_name + suffix)
+        self.data_file = os.path.join(path, data_name + suffix)
+        self.compress = compress or delta
+        self.delta = delta
+        self.keyframe = keyframe
+
+        self.header = None
+        self.offset = 0
+        self.count = 0
+        self._previous = None
+
+    def _write_header(self, arrays, meta):
+        names = list(arrays)
+        meta = {n: dict(meta.get(n, {}),
+                        dtype=arrays[n].dtype.str,
+                        shape=list(arrays[n].shape)) for n in names}
+        self.header = {'names': names, 'meta': meta}
+        txt = json.dumps(self.header).encode()
+        with open(self.index_file, 'wb') as fid:
+            fid.write(CHECKPOINT_MAGIC)
+            fid.write(np.array(len(txt), dtype='<u4').tobytes())
+            fid.write(txt)
+        open(self.data_file, 'wb').close()
+
+    def write(self, icheckpoint, time, arrays, meta=None):
+        '''
+        arrays : dict of name -> ndarray. names/shape/dtype must be
+                 the same in all checkpoints.
+        meta   : dict of name -> json-serializable dict (written once)
+        '''
+        if self.header is None:
+            self._write_header(arrays, {} if meta is None else meta)
+
+        names = self.header['names']
+        use_delta = (self.delta and self._previous is not None and
+                     self.count % self.keyframe != 0)
+        if use_delta:
+            encoding = ENC_DELTA
+        elif self.compress:
+            encoding = ENC_ZLIB
+        else:
+            encoding = ENC_RAW
+
+        chunks = []
+        for n in names:
+            data = _uint_view(arrays[n])
+            if use_delta:
+                data = np.bitwise_xor(data, self._previous[n])
+            data = data.tobytes()
+            if encoding != ENC_RAW:
+                data = zlib.compress(data, 1)
+            chunks.append(np.array(len(data), dtype='<u8').tobytes())
+            chunks.append(data)
+        payload = b''.join(chunks)
+
+        with open(self.data_file, 'ab') as fid:
+            fid.write(payload)
+
+        rec = np.array([(icheckpoint, time, encoding,
+                         self.offset, len(payload))], dtype=INDEX_DTYPE)
+        with open(self.index_file, 'ab') as fid:
+            rec.tofile(fid)
+
+        self.offset += len(payload)
+        self.count += 1
+        if self.delta:
+            self._previous = {n: _uint_view(arrays[n]).copy() for n in names}
+
+
+class CheckpointReader(object):
+    def __init__(self, path, suffix=''):
+        self.index_file = os.path.join(path, index_name + suffix)
+        self.data_file = os.path.join(path, data_name + suffix)
+        self.reload()
+
+    def reload(self):
+        with open(self.index_file, 'rb') as fid:
+            if fid.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+                raise ValueError("not a checkpoint index: " + self.index_file)
+            l = int(np.frombuffer(fid.read(4), dtype='<u4')[0])
+            self.header = json.loads(fid.read(l).decode())
+            raw = np.fromfile(fid, dtype=np.uint8)
+        nrec = len(raw) // INDEX_DTYPE.itemsize
+        self.index = raw[:nrec * INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+
+    @property
+    def names(self):
+        return self.header['names']
+
+    @property
+    def meta(self):
+        return self.header['meta']
+
+    @property
+    def checkpoints(self):
+        return [(int(i), float(t)) for i, t in
+                zip(self.index['icheckpoint'], self.index['time'])]
+
+    def _read_record(self, fid, k):
+        rec = self.index[k]
+        fid.seek(int(rec['offset']))
+        payload = fid.read(int(rec['nbytes']))
+
+        ret = {}
+        pos = 0
+        for n in self.names:
+            l = int(np.frombuffer(payload[pos:pos + 8], dtype='<u8')[0])
+            data = payload[pos + 8:pos + 8 + l]
+            pos = pos + 8 + l
+            if rec['encoding'] != ENC_RAW:
+                data = zlib.decompress(data)
+            ret[n] = np.frombuffer(data, dtype=_uint_dtype(self.meta[n]['dtype']))
+        return ret, rec['encoding']
+
+    def read(self, icheckpoint):
+        '''
+        returns dict of name -> ndarray of the checkpoint
+        '''
+        k = np.where(self.index['icheckpoint'] == icheckpoint)[0]
+        if len(k) == 0:
+            raise KeyError("checkpoint " + str(icheckpoint) + " not found")
+        k = k[-1]
+
+        # go back to the last full record
+        k0 = k
+        while self.index[k0]['encoding'] == ENC_DELTA:
+            k0 = k0 - 1
+
+        with open(self.data_file, 'rb') as fid:
+            data, _enc = self._read_record(fid, k0)
+            for kk in range(k0 + 1, k + 1):
+                delta, _enc = self._read_record(fid, kk)
+                data = {n: np.bitwise_xor(data[n], delta[n])
+                        for n in self.names}
+
+        return {n: data[n].view(self.meta[n]['dtype']).reshape(self.meta[n]['shape'])
+                for n in self.names}
@@ -196,7 +196,9 @@ class EvaluatorServer(EvaluatorMP):
     
     def set_model(self, soldir):
         import os
+        from petram.sol.checkpoint import split_checkpoint_path
         soldir = os.path.expanduser(soldir)        
+        soldir, _idx = split_checkpoint_path(soldir)
         model_path = os.path.join(soldir, 'model_proc.pmfm')
         if not os.path.exists(model_path):
            if 'case' in os.path.split(soldir)[-1]:
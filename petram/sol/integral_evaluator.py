@@ -1,9 +1,16 @@
 '''
    IntegralEvaluator:
       a thing to evaluate integral on a boundary/domain
+
+   integration is done by quadrature. quadrature points (element,
+   integration point, physical location, weight x detJ and attribute)
+   are computed once per (mesh, kind, order) and reused for all
+   expressions, attributes and solution sets. the expression is
+   evaluated at the quadrature points using point_values of
+   Variables, and integral over each attribute is a weighted
+   bincount of the values.
 '''
 import numpy as np
-import parser
 import weakref
 import six
 
@@ -20,83 +27,225 @@ else:
     from mfem.ser import GlobGeometryRefiner as GR
     
 from petram.sol.evaluator_agent import EvaluatorAgent
+from petram.sol.bdr_nodal_evaluator import compile_expr
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('IntegralEvaluator')
+
 Geom = mfem.Geometry()
 
-def do_integration(expr, solvars, phys, mesh, kind, attrs,
-                   order, num):
+# _qpoints[mesh][(kind, order)] = QuadraturePoints
+_qpoints = WKD()
+
+def get_quadrature_points(mesh, kind, order):
+    if not mesh in _qpoints:
+        _qpoints[mesh] = {}
+    key = (kind, order)
+    if not key in _qpoints[mesh]:
+        _qpoints[mesh][key] = QuadraturePoints(mesh, kind, order)
+    return _qpoints[mesh][key]
+
+class QuadraturePoints(object):
+    '''
+    quadrature points of all (boundary) elements.
+
+    elem_ids/int_points are the element and the integration point
+    in the element (for boundary, the volume element adjacent to the
+    boundary element), which are used by point_values of Variables.
+    '''
+    def __init__(self, mesh, kind, order):
+        self.kind = kind
+        self.order = order
+
+        if kind == 'Domain':
+            self.attrs = np.unique(mesh.GetAttributeArray()).astype(int)
+            self.collect_domain(mesh)
+        else:
+            self.attrs = np.unique(mesh.GetBdrAttributeArray()).astype(int)
+            self.collect_boundary(mesh)
+        self.iattr = np.searchsorted(self.attrs, self.point_attrs)
+        self.counts = len(self.weights)
+        dprint2("quadrature points", kind, order, self.counts)
+
+    def _rule(self, geom, T):
+        return mfem.IntRules.Get(geom, 2 * self.order + T.OrderW())
+
+    def collect_domain(self, mesh):
+        eattr = mesh.GetAttributeArray()
+        ptx = mfem.Vector()
+
+        elem_ids, int_points, locs, weights, attrs = [], [], [], [], []
+        for i in range(mesh.GetNE()):
+            T = mesh.GetElementTransformation(i)
+            ir = self._rule(mesh.GetElementBaseGeometry(i), T)
+            for j in range(ir.GetNPoints()):
+                ip = ir.IntPoint(j)
+                T.SetIntPoint(ip)
+                T.Transform(ip, ptx)
+                elem_ids.append(i)
+                int_points.append(ip)
+                locs.append(ptx.GetDataArray().copy())
+                weights.append(ip.weight * T.Weight())
+                attrs.append(eattr[i])
+        self._store(elem_ids, int_points, locs, weights, attrs, mesh)
+
+    def collect_boundary(self, mesh):
+        battr = mesh.GetBdrAttributeArray()
+        ptx = mfem.Vector()
+
+        elem_ids, int_points, locs, weights, attrs = [], [], [], [], []
+        for i in range(mesh.GetNBE()):
+            # ip is in the reference frame of the face (which may be
+            # oriented differently from the boundary element). location,
+            # weight and element point are all taken from ftr
+            ftr = mesh.GetBdrFaceTransformations(i)
+            if ftr is None:
+                continue
+            ir = self._rule(mesh.GetBdrElementBaseGeometry(i), ftr)
+            for j in range(ir.GetNPoints()):
+                ip = ir.IntPoint(j)
+                ftr.SetAllIntPoints(ip)
+                ftr.Transform(ip, ptx)
+                eip1 = ftr.GetElement1IntPoint()
+                eip = mfem.IntegrationPoint()
+                eip.Set(eip1.x, eip1.y, eip1.z, eip1.weight)
+                elem_ids.append(ftr.Elem1No)
+                int_points.append(eip)
+                locs.append(ptx.GetDataArray().copy())
+                weights.append(ip.weight * ftr.Weight())
+                attrs.append(battr[i])
+        self._store(elem_ids, int_points, locs, weights, attrs, mesh)
+
+    def _store(self, elem_ids, int_points, locs, weights, attrs, mesh):
+        sdim = mesh.SpaceDimension()
+        self.elem_ids = np.array(elem_ids, dtype=int)
+        self.int_points = int_points
+        self.locs = np.array(locs, dtype=float).reshape(-1, sdim)
+        self.weights = np.array(weights, dtype=float)
+        self.point_attrs = np.array(attrs, dtype=int)
+
+    def attr_index(self, attrs):
+        attrs = np.atleast_1d(np.asarray(attrs, dtype=int))
+        idx = np.searchsorted(self.attrs, attrs)
+        idx[idx == len(self.attrs)] = 0
+        valid = self.attrs[idx] == attrs if len(self.attrs) > 0 else attrs < 0
+        return idx, valid
+
+    def integrate(self, values, attrs):
+        '''
+        values : (nsets, npoints) values at quadrature points
+        returns (nsets, len(attrs)) integrals over each attribute
+        (0 for an attribute which does not exist in this mesh)
+        '''
+        idx, valid = self.attr_index(attrs)
+        ret = np.zeros((len(values), len(idx)))
+        for k, v in enumerate(values):
+            sums = np.bincount(self.iattr, weights=self.weights * v,
+                               minlength=len(self.attrs))
+            ret[k] = np.where(valid, sums[idx], 0.0)
+        return ret
+
+def _eval_at_qpoints(code, g, qp, mesh, ind_vars):
+    '''
+    evaluate code at quadrature points. scalar values are evaluated
+    as arrays at once. it falls back to pointwise evaluation when
+    a vector value is involved or the expression does not work on
+    arrays.
+    '''
     from petram.helper.variables import (Variable,
                                          var_g,
                                          NativeCoefficientGenBase,
                                          CoefficientVariable)
-    from petram.phys.coefficient import SCoeff
-
-    st = parser.expr(expr)
-    code= st.compile('<string>')
-    names = code.co_names
-
-    g = {}
-    #print solvars.keys()
-    for key in phys._global_ns.keys():
-       g[key] = phys._global_ns[key]
-    for key in solvars.keys():
-       g[key] = solvars[key]
-
-    l = var_g.copy()
-
-    ind_vars = ','.join(phys.get_independent_variables())
-
-    if kind == 'Domain':
-        size = max(max(mesh.attributes.ToList()), max(attrs))
-    else:
-        size = max(max(mesh.bdr_attributes.ToList()), max(attrs))
-        
-    arr = [0]*(size)
-    for k in attrs:
-        arr[k-1] = 1
-    flag = mfem.intArray(arr)
-
-    s = SCoeff(expr, ind_vars, l, g, return_complex=False)
-
-    ## note L2 does not work for boundary....:D
-    if kind == 'Domain':
-        fec = mfem.L2_FECollection(order, mesh.Dimension())
-    else:
-        fec = mfem.H1_FECollection(order, mesh.Dimension())
-
-    fes = mfem.FiniteElementSpace(mesh, fec)
-    one = mfem.ConstantCoefficient(1)
-
-    gf = mfem.GridFunction(fes)
-    gf.Assign(0.0)
-
-    if kind == 'Domain':
-        gf.ProjectCoefficient(mfem.RestrictedCoefficient(s, flag))
-    else:
-        gf.ProjectBdrCoefficient(mfem.RestrictedCoefficient(s, flag), flag)
-
-    b = mfem.LinearForm(fes)
-    one = mfem.ConstantCoefficient(1)
-    if kind == 'Domain':
-        itg = mfem.DomainLFIntegrator(one)
-        b.AddDomainIntegrator(itg)
-    else:
-        itg = mfem.BoundaryLFIntegrator(one)
-        b.AddBoundaryIntegrator(itg)
-
-    b.Assemble()
-
-    from petram.engine import SerialEngine
-    en = SerialEngine()
-    ans = mfem.InnerProduct(en.x2X(gf), en.b2B(b))
-    
-    if not np.isfinite(ans):
-        print("not finite", ans, arr)
-        print(size, mesh.bdr_attributes.ToList())
-        from mfem.common.chypre import LF2PyVec, PyVec2PyMat, Array2PyVec, IdentityPyMat
-        #print(list(gf.GetDataArray()))
-        print(len(gf.GetDataArray()), np.sum(gf.GetDataArray()))
-        print(np.sum(list(b.GetDataArray())))
-    return ans
+
+    knowns = WKD()
+    names = []
+    for n in code.co_names:
+        if n in g and isinstance(g[n], NativeCoefficientGenBase):
+            g[n + "_coeff"] = CoefficientVariable(g[n], g)
+            names.append((n + "_coeff", n))
+        elif n in g and isinstance(g[n], Variable):
+            for d in g[n].dependency:
+                names.append((d, d))
+            names.append((n, n))
+
+    var_g2 = var_g.copy()
+    for n in code.co_names:
+        if n in g and not isinstance(g[n], Variable):
+            var_g2[n] = g[n]
+
+    ll = {}
+    for k, n in enumerate(ind_vars):
+        if n in code.co_names and not n in ll:
+            ll[n] = qp.locs[:, k]
+    for n, name in names:
+        if not n in g or not isinstance(g[n], Variable):
+            continue
+        if not g[n] in knowns:
+            knowns[g[n]] = g[n].point_values(counts=qp.counts,
+                                             locs=qp.locs,
+                                             attrs=qp.point_attrs,
+                                             elem_ids=qp.elem_ids,
+                                             mesh=mesh,
+                                             int_points=qp.int_points,
+                                             g=g,
+                                             knowns=knowns)
+        ll[name] = knowns[g[n]]
+
+    if all(np.ndim(v) <= 1 for v in ll.values()):
+        try:
+            val = np.asarray(eval(code, var_g2, ll))
+            if val.ndim <= 1:
+                return np.broadcast_to(val, (qp.counts,))
+        except (ValueError, TypeError):
+            pass
+    keys = list(ll)
+    vals = [np.broadcast_to(ll[k], (qp.counts,) + np.shape(ll[k])[1:])
+            for k in keys]
+    return np.array([eval(code, var_g2, dict(zip(keys, v)))
+                     for v in zip(*vals)]).reshape(qp.counts)
+
+def do_integration(expr, solvars, phys, mesh, kind, attrs,
+                   order, num, per_attr=False):
+    '''
+    integrate expr over attrs.
+
+    solvars can be a list of solution sets. in this case, the
+    result is a list (one for each solution set).
+
+    if per_attr is True, an array of integral for each attribute
+    in attrs is returned.
+    '''
+    code = compile_expr(expr)
+
+    is_list = isinstance(solvars, (list, tuple))
+    if not is_list:
+        solvars = [solvars]
+
+    ind_vars = phys.get_independent_variables()
+
+    qp = get_quadrature_points(mesh, kind, order)
+    if isinstance(attrs, str) and attrs == 'all':
+        attrs = qp.attrs
+    attrs = [int(x) for x in np.atleast_1d(attrs)]
+
+    values = []
+    for solvar in solvars:
+        g = {}
+        for key in phys._global_ns.keys():
+            g[key] = phys._global_ns[key]
+        for key in solvar.keys():
+            g[key] = solvar[key]
+        val = _eval_at_qpoints(code, g, qp, mesh, ind_vars)
+        values.append(np.real(val))
+
+    vals = qp.integrate(values, attrs)
+
+    if not np.all(np.isfinite(vals)):
+        print("not finite", vals, attrs)
+
+    if not per_attr:
+        vals = np.sum(vals, 1)
+    return list(vals) if is_list else vals[0]
 
 class IntegralEvaluator(EvaluatorAgent):
     def __init__(self, battrs, decimate=1):
@@ -105,16 +254,20 @@ class IntegralEvaluator(EvaluatorAgent):
         self.decimate = decimate
 
     def eval_integral(self, expr, solvars, phys,
-                      kind='domain', attrs='all', order=2, num=-1):
+                      kind='domain', attrs='all', order=2, num=-1,
+                      per_attr=False):
 
         from .bdr_nodal_evaluator import get_emesh_idx
 
-        emesh_idx = get_emesh_idx(self, expr, solvars, phys)
+        # solvars can be a list of solution sets on the same mesh
+        sv = solvars[0] if isinstance(solvars, (list, tuple)) else solvars
+        emesh_idx = get_emesh_idx(self, expr, sv, phys)
 
         if len(emesh_idx) > 1:
             assert False, "expression involves multiple mesh (emesh length != 1)"
 
         mesh = self.mesh()[emesh_idx[0]]
-        itg = do_integration(expr, solvars, phys, mesh, kind, attrs, order, num)
+        itg = do_integration(expr, solvars, phys, mesh, kind, attrs, order,
+                             num, per_attr=per_attr)
 
         return itg
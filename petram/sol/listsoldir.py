@@ -5,11 +5,14 @@
    solmesh
    probe_
    checkpoint_
+     incremental checkpoint appears as checkpoint_<solver>#<idx>
 '''
 import os
 from os.path import expanduser
 from collections import defaultdict
 
+from petram.sol.checkpoint import CheckpointReader
+
 def gather_soldirinfo(path):
     path = expanduser(path)
     checkpoints = {}    
@@ -25,10 +28,20 @@ def gather_soldirinfo(path):
 
     cp = defaultdict(dict)   ### cp["SolveStep1_TimeStep1"] = (1.0, dirname)
     for nn in os.listdir(path):
-        if (nn.startswith('checkpoint_') and os.path.isdir(os.path.join(path, nn))):
+        if not (nn.startswith('checkpoint_') and os.path.isdir(os.path.join(path, nn))):
+            continue
+        cpdir = os.path.join(path, nn)
+        suffix = [x[len('checkpoint.index'):] for x in os.listdir(cpdir)
+                  if x.startswith('checkpoint.index')]
+        if len(suffix) > 0:
+            solvername = '_'.join(nn.split('_')[1:])
+            reader = CheckpointReader(cpdir, sorted(suffix)[0])
+            for idx, t in reader.checkpoints:
+                cp[solvername][(idx, t)] = nn + '#' + str(idx)
+        else:
             solvername = '_'.join(nn.split('_')[1:-1])
             idx = int(nn.split('_')[-1])
-            if len(checkpoints[solvername]) > idx:            
+            if len(checkpoints[solvername]) > idx:
                 cp[solvername][(idx, checkpoints[solvername][idx])] = nn
     cp.default_factory=None
 
@@ -7,7 +7,6 @@
 
 '''
 import numpy as np
-import parser
 import weakref
 import six
 from petram.mfem_config import use_parallel
@@ -80,56 +79,68 @@ def surface_weight(refine, gtype):
     return w
     
 
-def refine_surface_data(mesh, ibele, val, idx, refine):
+def refine_surface_geometry(mesh, ibele, iverts_f, refine):
+    '''
+    geometrical part of surface refinement. (does not depend on values)
+
+    returns ptx, ridx, groups
+       groups : list of (w, vidx) for each geometry type
+                w : weight (refined point, vertex)
+                vidx : element vertex index in iverts_f
+    '''
+    from petram.mesh.mesh_arrays import element_vertices, element_vertices_of
 
     if mesh.Dimension() == 3:
-        getarray = mesh.GetBdrArray
         gettrans = mesh.GetBdrElementTransformation
-        getelement = mesh.GetBdrElement
-        getbasegeom = mesh.GetBdrElementBaseGeometry
-        getvertices = mesh.GetBdrElementVertices
+        bdr = True
     elif mesh.Dimension() == 2:
-        getarray = mesh.GetDomainArray
         gettrans = mesh.GetElementTransformation        
-        getelement = mesh.GetElement
-        getbasegeom = mesh.GetElementBaseGeometry
-        getvertices = mesh.GetElementVertices
+        bdr = False
     else:
         assert False, "BdrNodal Evaluator is not supported for this dimension"
 
+    ibele = np.asarray(ibele, dtype=int)
+    geoms, offsets, vertices = element_vertices(mesh, bdr=bdr)
+    geoms = geoms[ibele]
+    offsets, vertices = element_vertices_of(offsets, vertices, ibele)
 
     ptx = []
-    data = []
     ridx = []
+    groups = []
 
     nele = 0
-    gtype_st = -1    
-    sdim = mesh.SpaceDimension()
-
-    for k, i in enumerate(ibele):
-        gtype = getbasegeom(i)
-        verts = getvertices(i)
+    pt = mfem.DenseMatrix()
+    for gtype in np.unique(geoms):
+        idx = np.where(geoms == gtype)[0]
+        nv = offsets[idx[0]+1] - offsets[idx[0]]
+        verts = vertices[offsets[idx][:, None] + np.arange(nv)]
+
+        RefG = GR.Refine(gtype, refine)
+        ir = RefG.RefPts
+        npt = ir.GetNPoints()
+        ele = np.array(RefG.RefGeoms.ToList()).reshape(-1, nv)
+        w = surface_weight(refine, gtype)
+
+        for i in ibele[idx]:
+            gettrans(i).Transform(ir, pt)
+            ptx.append(pt.GetDataArray().transpose().copy())
+
+        shift = nele + np.arange(len(idx))*npt
+        ridx.append((ele[None, :, :] + shift[:, None, None]).reshape(-1, nv))
+        groups.append((w, np.searchsorted(iverts_f, verts)))
+        nele = nele + len(idx)*npt
 
-        if gtype != gtype_st:
-            RefG = GR.Refine(gtype, 3)
-            ir = RefG.RefPts
-            npt = ir.GetNPoints()
-            ele = np.array(RefG.RefGeoms.ToList()).reshape(-1, len(verts))
-            w = surface_weight(refine, gtype)
-            gtype_st = gtype
-
-        T = gettrans(i)
-        pt = np.vstack([T.Transform(ir.IntPoint(j)) for j in range(npt)])
-        ptx.append(pt)
-        d = val[idx[k]]
-        data.append(np.dot(w, d))
-        ridx.append(ele + nele)
-        nele = nele + ir.GetNPoints()
-        
     ptx = np.vstack(ptx)
-    data = np.hstack(data)
     ridx = np.vstack(ridx)
-    return ptx, data, ridx
+    return ptx, ridx, groups
+
+def refine_surface_values(groups, val):
+    '''
+    interpolate nodal values (val) to refined points
+    '''
+    data = [np.tensordot(val[vidx], w, axes=([1], [1])).reshape(-1)
+            for w, vidx in groups]
+    return np.hstack(data)
 
 def refine_edge_data(mesh, ibele, val, idx, refine):
 
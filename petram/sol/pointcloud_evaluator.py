@@ -1,5 +1,4 @@
 import numpy as np
-import parser
 import scipy
 import six
 import weakref
@@ -16,6 +15,8 @@ else:
 from petram.sol.evaluator_agent import EvaluatorAgent
 from petram.sol.bdr_nodal_evaluator import process_iverts2nodals
 from petram.sol.bdr_nodal_evaluator import eval_at_nodals, get_emesh_idx
+from petram.sol.bdr_nodal_evaluator import compile_expr
+from petram.mesh.element_locator import get_locator
 
 class PointcloudEvaluator(EvaluatorAgent):
     def __init__(self, attrs, pc_type=None, pc_param=None):
@@ -139,10 +140,13 @@ class PointcloudEvaluator(EvaluatorAgent):
             print("skipping mesh")
         else:
             print("Chekcing " + str(len(self.points)) + " points")
-            counts, elem_ids, int_points = mesh.FindPoints(self.points, warn=False)
+            counts, elem_ids, int_points = get_locator(mesh).FindPoints(self.points)
             print("FindPoints found " + str(counts) + " points")
-        attrs = [ mesh.GetAttribute(id) if id != -1 else -1 for id in elem_ids]
-        attrs = np.array([ i if i in self.attrs else -1 for i in attrs])
+        elem_ids = np.asarray(elem_ids, dtype=int)
+        attrs = np.zeros(len(elem_ids), dtype=int) - 1
+        found = elem_ids != -1
+        attrs[found] = mesh.GetAttributeArray()[elem_ids[found]]
+        attrs[~np.isin(attrs, list(self.attrs))] = -1
 
         self.elem_ids = elem_ids
         self.masked_attrs = attrs
@@ -161,8 +165,7 @@ class PointcloudEvaluator(EvaluatorAgent):
         from petram.helper.variables import Variable, var_g, NativeCoefficientGenBase, CoefficientVariable
     
         variables = []
-        st = parser.expr(expr)
-        code= st.compile('<string>')
+        code = compile_expr(expr)
         names = code.co_names
 
         g = {}
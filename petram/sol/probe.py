@@ -1,15 +1,36 @@
+'''
+  probe signal file I/O
+
+  format 0, 1 : text file (legacy, read only)
+  format 2    : append-only binary stream
+
+     magic (PROBE_MAGIC)
+     uint32 header length (little endian)
+     json header {"format", "name", "xnames", "xdtype", "dtype", "shape"}
+        (padded with spaces to 16 byte boundary)
+     fixed size records ( x (xdtype, len(xnames)) + y (dtype, shape) )
+
+  Probe buffers samples in chunks and appends them to the file every
+  chunk_size steps once the file has been created by write_file.
+'''
 import numpy as np
 import os
+import json
+import shutil
 
 from petram.mfem_config import use_parallel
 if use_parallel:
-    from mpi4py import MPI                               
+    from mpi4py import MPI
     num_proc = MPI.COMM_WORLD.size
     myid     = MPI.COMM_WORLD.rank
     smyid = '.'+'{:0>6d}'.format(myid)
 else:
     smyid = ''
 
+PROBE_MAGIC = b'\x93PETRAM_PROBE'
+PROBE_FORMAT = 2
+default_chunk_size = 256
+
 def list_probes(dir):
     od = os.getcwd()
     os.chdir(dir)
@@ -19,17 +40,27 @@ def list_probes(dir):
         filenames = [f for f in filenames if '.'+f.split('.')[-1] == smyid]
 
     probenames = [n[6:] for n in filenames]
-    os.chdir(od)    
+    os.chdir(od)
 
     return filenames, probenames
-    
+
+def is_binary_probe(name):
+    with open(name, 'rb') as fid:
+        return fid.read(len(PROBE_MAGIC)) == PROBE_MAGIC
+
 def load_probe(name):
+    if is_binary_probe(name):
+        header, xdata, ydata = read_probe_file(name)
+        xdata = {n:xdata[:, k] for k, n in enumerate(header['xnames'])}
+        ydata = ydata.reshape(len(ydata), -1).transpose()
+        return xdata, ydata
+
     fid = open(name, 'r')
     format = int(fid.readline().split(':')[-1])
 
     if format == 0:
         value = load_format_0(fid)
-        ydata = np.squeeze(value[:,1:].transpose()) 
+        ydata = np.squeeze(value[:,1:].transpose())
         xdata = value[:,0]
         xdata = {'time':xdata}
     if format == 1:
@@ -49,9 +80,9 @@ def load_probes(dir, names):
     #print("ydata shape", [x[1].shape for x in data])
     ydata = np.vstack(ydata)
     ydata = np.squeeze(ydata)
-    
+
     return xdata, ydata
-    
+
 def load_format_0(fid):
     lines = fid.readlines()
     data = [[float(x) for x in l.split(',') if x.strip() != ''] for l in lines]
@@ -61,74 +92,199 @@ def load_format_0(fid):
 def load_format_1(fid):
     xsize = int(fid.readline())
     xnames = [x.strip() for x in fid.readline().split(',')]
-    
+
     lines = fid.readlines()
-    data = [eval(l) for l in lines]
+    try:
+        data = np.loadtxt(lines, delimiter=',', ndmin=2)
+        xdata = data[:, :xsize]
+    except ValueError:
+        # complex values are written as (a+bj). x (time etc) is real
+        data = np.array([eval(l) for l in lines])
+        xdata = data[:, :xsize].real
+
+    xdata = xdata.transpose()
+    ydata = data[:, xsize:].transpose()
 
-    xdata = np.array([x[:xsize] for x in data]).transpose()
-    ydata = np.array([x[xsize:] for x in data]).transpose()
-    
     return xdata, ydata, xnames
-    
+
+def _record_dtype(header):
+    xsize = len(header['xnames'])
+    return np.dtype([('x', np.dtype(header['xdtype']), (xsize,)),
+                     ('y', np.dtype(header['dtype']), tuple(header['shape']))])
+
+def write_probe_header(fid, name, xnames, xdtype, dtype, shape):
+    header = {'format': PROBE_FORMAT,
+              'name': name,
+              'xnames': list(xnames),
+              'xdtype': np.dtype(xdtype).str,
+              'dtype': np.dtype(dtype).str,
+              'shape': [int(x) for x in shape]}
+    txt = json.dumps(header).encode()
+    l = len(PROBE_MAGIC) + 4 + len(txt)
+    txt = txt + b' '*(-l % 16)
+    fid.write(PROBE_MAGIC)
+    fid.write(np.array(len(txt), dtype='<u4').tobytes())
+    fid.write(txt)
+    return header
+
+def read_probe_header(fid):
+    if fid.read(len(PROBE_MAGIC)) != PROBE_MAGIC:
+        raise ValueError("not a binary probe file")
+    l = int(np.frombuffer(fid.read(4), dtype='<u4')[0])
+    return json.loads(fid.read(l).decode())
+
+def read_probe_file(name):
+    '''
+    read binary probe file.
+    returns header, xdata (nstep, nx), ydata (nstep,) + shape
+    a partially written record at the end of file is ignored.
+    '''
+    with open(name, 'rb') as fid:
+        header = read_probe_header(fid)
+        raw = np.fromfile(fid, dtype=np.uint8)
+    rdtype = _record_dtype(header)
+    nrec = len(raw) // rdtype.itemsize
+    data = raw[:nrec*rdtype.itemsize].view(rdtype)
+    return header, data['x'], data['y']
+
+def convert_probe_file(name, outname=None):
+    '''
+    convert text probe file (format 0/1) to binary format.
+    text data is parsed by float/eval, which recovers the repr written
+    by the text writer exactly.
+    '''
+    if outname is None:
+        outname = name
+    if is_binary_probe(name):
+        if outname != name:
+            shutil.copyfile(name, outname)
+        return outname
+
+    with open(name, 'r') as fid:
+        format = int(fid.readline().split(':')[-1])
+        if format == 0:
+            value = load_format_0(fid)
+            xdata = value[:, :1]
+            ydata = value[:, 1:]
+            xnames = ['time']
+        else:
+            xdata, ydata, xnames = load_format_1(fid)
+            xdata = xdata.transpose()
+            ydata = ydata.transpose()
+
+    pname = os.path.basename(name)[6:].split('.')[0]
+    with open(outname, 'wb') as fid:
+        header = write_probe_header(fid, pname, xnames, xdata.dtype,
+                                    ydata.dtype, ydata.shape[1:])
+        rec = np.empty(len(xdata), dtype=_record_dtype(header))
+        rec['x'] = xdata
+        rec['y'] = ydata
+        rec.tofile(fid)
+    return outname
+
 class Probe(object):
-    def __init__(self, name, idx=-1, xnames = None):
+    def __init__(self, name, idx=-1, xnames = None, chunk_size = None):
         '''
         idx is idx in blockvector. could be -1 in such case, Probe can not load data from
         sol. This is used in Parametric to gather all probe later
+
+        samples are kept in chunks of chunk_size. After the first write_file,
+        a full chunk is appended to the file immediately.
         '''
         self.name = name
         self.xnames = ['time'] if xnames is None else xnames
-        self.sig = []
-        self.t = []        
         self.idx = idx
-        self.finalized = False
+        self.chunk_size = default_chunk_size if chunk_size is None else chunk_size
+
+        self.header = None
+        self.filename = None
+        self.nwritten = 0
+        self._chunks = []
+        self._buf = None
+        self._nbuf = 0
+
+    def _allocate_chunk(self):
+        self._buf = np.empty(self.chunk_size, dtype=_record_dtype(self.header))
+        self._nbuf = 0
+
+    def _check_dtype(self, t, value):
+        if self.header is None:
+            self.header = {'format': PROBE_FORMAT,
+                           'name': self.name,
+                           'xnames': list(self.xnames),
+                           'xdtype': np.result_type(t, np.float64).str,
+                           'dtype': value.dtype.str,
+                           'shape': list(value.shape)}
+            self._allocate_chunk()
+            return
+
+        dtype = np.dtype(self.header['dtype'])
+        xdtype = np.dtype(self.header['xdtype'])
+        if list(value.shape) != self.header['shape']:
+            raise ValueError("probe " + self.name + " : signal shape changed " +
+                             str(self.header['shape']) + " -> " + str(value.shape))
+        new_dtype = np.result_type(dtype, value.dtype)
+        new_xdtype = np.result_type(xdtype, t.dtype)
+        if new_dtype == dtype and new_xdtype == xdtype:
+            return
+        if self.filename is not None:
+            raise ValueError("probe " + self.name + " : can not change dtype after " +
+                             "the file header is written")
+        self.header['dtype'] = new_dtype.str
+        self.header['xdtype'] = new_xdtype.str
+        rdtype = _record_dtype(self.header)
+        self._chunks = [c.astype(rdtype) for c in self._chunks]
+        buf = self._buf[:self._nbuf].astype(rdtype)
+        self._allocate_chunk()
+        self._buf[:len(buf)] = buf
+        self._nbuf = len(buf)
+
+    def _append(self, value, t):
+        value = np.atleast_1d(value)
+        t = np.atleast_1d(t)
+        self._check_dtype(t, value)
+
+        self._buf['x'][self._nbuf] = t
+        self._buf['y'][self._nbuf] = value
+        self._nbuf += 1
+        if self._nbuf == self.chunk_size:
+            self._chunks.append(self._buf)
+            self._allocate_chunk()
+            if self.filename is not None:
+                self.flush()
+
+    def flush(self):
+        chunks = self._chunks + [self._buf[:self._nbuf]]
+        with open(self.filename, 'ab') as fid:
+            for c in chunks:
+                c.tofile(fid)
+                self.nwritten += len(c)
+        self._chunks = []
+        self._nbuf = 0
+
+    def write_file(self, filename = None):
+        if self.header is None: return
 
-    def write_file(self, filename = None, format=1):
-        valid = self.finalize()
-        if not valid: return
-        
         if filename is None:
             filename = 'probe_'+self.name + smyid
-            
-        fid = open(filename, 'w')
+        filename = os.path.abspath(filename)
 
-        if format == 0:
-           fid.write("format : 0\n")
-        else:
-           fid.write("format : 1\n")
-           fid.write(str(len(self.time[0]))+"\n")
-           fid.write(','.join(self.xnames)+"\n")
-           
-        for x, t in zip(self.sig_f, self.time):
-           txt1 = ', '.join([str(xx) for xx in t])            
-           txt2 = ', '.join([str(xx) for xx in x])
-           fid.write(txt1 + ', '+ txt2 +"\n")
-        fid.close()
+        if self.filename is None:
+            with open(filename, 'wb') as fid:
+                write_probe_header(fid, self.name, self.header['xnames'],
+                                   self.header['xdtype'], self.header['dtype'],
+                                   self.header['shape'])
+        elif self.filename != filename:
+            # moved to a different directory. carry over the data already written.
+            shutil.copyfile(self.filename, filename)
+        self.filename = filename
+        self.flush()
 
     def append_sol(self, sol, t=0.0):
-        self.sig.append(np.atleast_1d(sol[self.idx].toarray().flatten()))
-        self.t.append(np.atleast_1d(t))
+        self._append(sol[self.idx].toarray().flatten(), t)
 
     def append_value(self, value, t=0.0):
-        self.sig.append(np.atleast_1d(value))
-        self.t.append(np.atleast_1d(t))
-        
+        self._append(value, t)
+
     def current_value(self, sol):
         return np.atleast_1d(sol[self.idx].toarray().flatten())
-        
-    def print_signal(self):
-        if not self.finalized:
-            self.finalize()
-        
-    def finalize(self):
-        if len(self.sig) == 0:
-            self.sig_f = -1
-            self.valid = False
-        else:
-            self.sig_f = np.vstack(self.sig)
-            self.time= self.t
-            self.valid = self.sig_f.size != 0
-            #self.valid = True
-        self.finalized = True
-        return self.valid
-        
@@ -35,6 +35,14 @@ class Solfiles(object):
         return os.path.dirname(self.set[0][0][0])
 
     def store_timestamps(self):
+        from petram.sol.checkpoint import split_checkpoint_ref, index_name
+
+        def getmtime(x):
+            path, _name, suffix, idx = split_checkpoint_ref(x)
+            if idx is not None:
+                x = os.path.join(path, index_name + suffix)
+            return os.path.getmtime(x)
+
         self.timestamps = {}
         for meshes, solf, in self.set:
             for x in meshes:
@@ -43,9 +51,9 @@ class Solfiles(object):
             for key in solf:
                 fr, fi = solf[key]
                 if fr is not None:
-                    self.timestamps[fr] = os.path.getmtime(fr)
+                    self.timestamps[fr] = getmtime(fr)
                 if fi is not None:
-                    self.timestamps[fi] = os.path.getmtime(fi)
+                    self.timestamps[fi] = getmtime(fi)
 
     def is_different_timestamps(self, solfiles):
         for x in self.timestamps:
@@ -97,12 +105,16 @@ class Solsets(object):
     '''
 
     def __init__(self, solfiles, refine=0):
+        from petram.sol.checkpoint import split_checkpoint_path
+
         def fname2idx(t):
+            t, _idx = split_checkpoint_path(t)
             i = int(os.path.basename(t).split('.')[0].split('_')[-1])
             return i
         solfiles = solfiles.set
         object.__init__(self)
         self.set = []
+        self._checkpoints = {}
         import mfem.ser as mfem
 
         fix_orientation = False  #false
@@ -129,9 +141,9 @@ class Solsets(object):
                 i = fname2idx(fr)
                 m = meshes[i]
 
-                solr = (mfem.GridFunction(m, str(fr))
+                solr = (self.load_gridfunction(m, str(fr))
                         if fr is not None else None)
-                soli = (mfem.GridFunction(m, str(fi))
+                soli = (self.load_gridfunction(m, str(fi))
                         if fi is not None else None)
                 if solr is not None:
                     solr._emesh_idx = i
@@ -141,6 +153,34 @@ class Solsets(object):
                 s[key] = (solr, soli)
             self.set.append((meshes, s))
 
+    def load_gridfunction(self, mesh, fname):
+        '''
+        load GridFunction from file, or from incremental checkpoint
+        when fname is "<dir>/solr_E_0.000000#3"
+        '''
+        import mfem.ser as mfem
+        from petram.sol.checkpoint import split_checkpoint_ref, CheckpointReader
+
+        path, name, suffix, idx = split_checkpoint_ref(fname)
+        if idx is None:
+            return mfem.GridFunction(mesh, fname)
+
+        if not (path, suffix) in self._checkpoints:
+            self._checkpoints[(path, suffix)] = (CheckpointReader(path, suffix), {})
+        reader, data = self._checkpoints[(path, suffix)]
+        if not idx in data:
+            data[idx] = reader.read(idx)
+
+        meta = reader.meta[name]
+        fec = mfem.FiniteElementCollection.New(str(meta['fec']))
+        fes = mfem.FiniteElementSpace(mesh, fec, meta['vdim'], meta['ordering'])
+        gf = mfem.GridFunction(fes)
+        gf.Assign(data[idx][name])
+        # keep fec/fes alive as long as gf
+        gf._fec = fec
+        gf._fes = fes
+        return gf
+
     def __len__(self):
         return len(self.set)
 
@@ -165,8 +205,48 @@ class Solsets(object):
         return [x[1][name][1] for x in self.set]
 
 
+def find_checkpoint_solfiles(path, idx):
+    '''
+    list solution in incremental checkpoint directory.
+    solution files are refered as "<path>/solr_E_0.000000#<idx>"
+    '''
+    from petram.sol.checkpoint import CheckpointReader, index_name
+
+    files = os.listdir(path)
+    mfiles = [x for x in files if x.startswith('solmesh')]
+    suffix_list = sorted([x[len(index_name):] for x in files
+                          if x.startswith(index_name)])
+
+    solfiles = []
+    for s in suffix_list:
+        meshes = [x for x in mfiles if (len(x.split('.')) == 1 and s == '') or
+                  x.endswith(s)]
+        meshes = [os.path.join(path, x) for x in meshes]
+        names = CheckpointReader(path, s).names
+
+        sol = {}
+        for x in names:
+            if not x.startswith('solr_'):
+                continue
+            n = x[5:]
+            solr = os.path.join(path, x + s) + '#' + str(idx)
+            soli = (os.path.join(path, 'soli_' + n + s) + '#' + str(idx)
+                    if ('soli_' + n) in names else None)
+            sol[n] = (solr, soli)
+        solfiles.append([meshes, sol])
+
+    ret = Solfiles(solfiles)
+    ret.store_timestamps()
+    return ret
+
+
 def find_solfiles(path, idx=None):
     import os
+    from petram.sol.checkpoint import split_checkpoint_path
+
+    path, cp_idx = split_checkpoint_path(path)
+    if cp_idx is not None:
+        return find_checkpoint_solfiles(path, cp_idx)
 
     files = os.listdir(path)
     mfiles = [x for x in files if x.startswith('solmesh')]
@@ -0,0 +1,110 @@
+'''
+   complex_conversion
+
+   conversion between complex arrays and their real valued block
+   layouts.
+
+   layout:
+     'interleave' : blocks are (R_fes1, I_fes1, R_fes2, I_fes2, ...)
+                    (blk_interleave)
+     'merged'     : each block is [R_fes, I_fes]
+                    (blk_merged, blk_merged_s)
+
+   offsets are the row offsets of real valued block operator.
+   slices used in the conversion are computed once for each
+   (offsets, layout).
+'''
+import numpy as np
+
+from petram.mfem_config import use_parallel
+
+_slices = {}
+
+
+def get_offsets(M, central=False):
+    '''
+    row offsets of block operator M.
+
+    central: offsets of the solution gathered in root node
+    '''
+    offsets = M.RowOffsets().ToList()
+    if central and use_parallel:
+        from mpi4py import MPI
+        offsets = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
+                   for o in offsets]
+    return offsets
+
+
+def block_slices(offsets, layout):
+    '''
+    list of (complex start, length, real part start, imag part start)
+    '''
+    key = (tuple(offsets), layout)
+    if key in _slices:
+        return _slices[key]
+
+    of = offsets
+    ret = []
+    pt = 0
+    if layout == 'interleave':
+        for i in range(0, len(of) - 2, 2):
+            l = of[i + 1] - of[i]
+            ret.append((pt, l, of[i], of[i + 1]))
+            pt = pt + l
+    elif layout == 'merged':
+        for i in range(len(of) - 1):
+            w = (of[i + 1] - of[i]) // 2
+            ret.append((pt, w, of[i], of[i] + w))
+            pt = pt + w
+    else:
+        assert False, "unknown layout: " + str(layout)
+
+    _slices[key] = ret
+    return ret
+
+
+def real_to_complex(x, offsets=None, layout='merged', dtype=np.complex128):
+    '''
+    real valued array (1D or 2D (row = DoF)) to complex array
+    '''
+    slices = block_slices(offsets, layout)
+    ret = np.empty((x.shape[0] // 2,) + x.shape[1:], dtype=dtype)
+    rr = ret.real
+    ii = ret.imag
+    for pt, l, r, i in slices:
+        rr[pt:pt + l] = x[r:r + l]
+        ii[pt:pt + l] = x[i:i + l]
+    return ret
+
+
+def complex_to_real(x, offsets=None, layout='merged', dtype=np.float64):
+    '''
+    complex array to real valued array
+    '''
+    slices = block_slices(offsets, layout)
+    ret = np.empty((x.shape[0] * 2,) + x.shape[1:], dtype=dtype)
+    rr = x.real
+    ii = x.imag
+    for pt, l, r, i in slices:
+        ret[r:r + l] = rr[pt:pt + l]
+        ret[i:i + l] = ii[pt:pt + l]
+    return ret
+
+
+def convert_realblocks_to_complex(solall, M, merge_real_imag, central=False):
+    '''
+    solution of real valued block system to complex.
+
+    central: solall is gathered in root node. other nodes return None
+    '''
+    if central and use_parallel:
+        from mpi4py import MPI
+        offsets = get_offsets(M, central=True)
+        if MPI.COMM_WORLD.rank != 0:
+            return None
+    else:
+        offsets = get_offsets(M)
+
+    layout = 'merged' if merge_real_imag else 'interleave'
+    return real_to_complex(solall, offsets, layout)
+
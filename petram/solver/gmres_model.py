@@ -111,33 +111,8 @@ class GMRES(LinearSolverModel):
         #return None
 
     def real_to_complex(self, solall, M):
-        if use_parallel:
-           from mpi4py import MPI
-           myid     = MPI.COMM_WORLD.rank
-
-
-           offset = M.RowOffsets().ToList()
-           of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o))) for o in offset]
-           if myid != 0: return           
-
-        else:
-           offset = M.RowOffsets()
-           of = offset.ToList()
-           
-        rows = M.NumRowBlocks()
-        s = solall.shape
-        nb = rows/2
-        i = 0
-        pt = 0
-        result = np.zeros((s[0]/2, s[1]), dtype='complex')
-        for j in range(nb):
-           l = of[i+1]-of[i]
-           result[pt:pt+l,:] = (solall[of[i]:of[i+1],:]
-                             +  1j*solall[of[i+1]:of[i+2],:])
-           i = i+2
-           pt = pt + l
-
-        return result
+        from petram.solver.complex_conversion import convert_realblocks_to_complex
+        return convert_realblocks_to_complex(solall, M, False, central=True)
 
     def allocate_solver(self, datatype='D', engine=None):
         solver = GMRESSolver(self, engine, int(self.maxiter),
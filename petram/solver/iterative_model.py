@@ -1,10 +1,12 @@
 from petram.solver.mumps_model import MUMPSPreconditioner
 from petram.mfem_config import use_parallel
+import time
 import numpy as np
 
 from petram.debug import flush_stdout
 from petram.namespace_mixin import NS_mixin
 from .solver_model import LinearSolverModel, LinearSolver
+from .krylov_recycler import init_guess_modes
 
 import petram.debug as debug
 dprint1, dprint2, dprint3 = debug.init_dprints('IterativeSolverModel')
@@ -110,7 +112,13 @@ class Iterative(LinearSolverModel, NS_mixin):
                 [None, self.use_ls_reducer, 3, {
                     "text": "Reduce linear system when possible"}],
                 [None, (self.merge_real_imag, (self.use_block_symmetric,)),
-                 27, ({"text": "Use ComplexOperator"}, {"elp": mm},)], ]
+                 27, ({"text": "Use ComplexOperator"}, {"elp": mm},)],
+                ["initial guess", self.init_guess, 4,
+                 {"readonly": True, "choices": init_guess_modes}],
+                ["recycle dim.", self.recycle_dim, 400, {}],
+                [None, self.reuse_prc, 3,
+                    {"text": "reuse preconditioner"}],
+                ["reuse tol. (operator change)", self.reuse_prc_tol, 300, {}], ]
 
     def get_panel1_value(self):
         # this will set _mat_weight
@@ -151,7 +159,9 @@ class Iterative(LinearSolverModel, NS_mixin):
                  (self.adv_mode, [self.adv_prc, ], [self.preconditioners, ]),
                  self.write_mat, self.assert_no_convergence,
                  self.use_ls_reducer,
-                 (self.merge_real_imag, [self.use_block_symmetric, ]),)
+                 (self.merge_real_imag, [self.use_block_symmetric, ]),
+                 self.init_guess, int(self.recycle_dim),
+                 self.reuse_prc, self.reuse_prc_tol)
 
         return value
 
@@ -187,6 +197,10 @@ class Iterative(LinearSolverModel, NS_mixin):
         self.adv_prc = v[1][1][0]
         self.merge_real_imag = bool(v[5][0])
         self.use_block_symmetric = bool(v[5][1][0])
+        self.init_guess = str(v[6])
+        self.recycle_dim = int(v[7])
+        self.reuse_prc = bool(v[8])
+        self.reuse_prc_tol = float(v[9])
 
     def attribute_set(self, v):
         v = super(Iterative, self).attribute_set(v)
@@ -215,6 +229,10 @@ class Iterative(LinearSolverModel, NS_mixin):
         v['adv_prc'] = ''
         v['merge_real_imag'] = False
         v['use_block_symmetric'] = False
+        v['init_guess'] = 'zero'
+        v['recycle_dim'] = 4
+        v['reuse_prc'] = False
+        v['reuse_prc_tol'] = 0.0
         return v
 
     def verify_setting(self):
@@ -249,68 +267,12 @@ class Iterative(LinearSolverModel, NS_mixin):
         # return None
 
     def real_to_complex(self, solall, M):
-        if self.merge_real_imag:
-            return self.real_to_complex_merged(solall, M)
-        else:
-            return self.real_to_complex_interleaved(solall, M)
-
-    def real_to_complex_interleaved(self, solall, M):
-        if use_parallel:
-            from mpi4py import MPI
-            myid = MPI.COMM_WORLD.rank
-
-            offset = M.RowOffsets().ToList()
-            of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
-                  for o in offset]
-            if myid != 0:
-                return
-
-        else:
-            offset = M.RowOffsets()
-            of = offset.ToList()
-
-        rows = M.NumRowBlocks()
-        s = solall.shape
-        nb = rows // 2
-        i = 0
-        pt = 0
-        result = np.zeros((s[0] // 2, s[1]), dtype='complex')
-        for j in range(nb):
-            l = of[i + 1] - of[i]
-            result[pt:pt + l, :] = (solall[of[i]:of[i + 1], :]
-                                    + 1j * solall[of[i + 1]:of[i + 2], :])
-            i = i + 2
-            pt = pt + l
-
-        return result
-
-    def real_to_complex_merged(self, solall, M):
-        if use_parallel:
-            from mpi4py import MPI
-            myid = MPI.COMM_WORLD.rank
-
-            offset = M.RowOffsets().ToList()
-            of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
-                  for o in offset]
-            if myid != 0:
-                return
-
-        else:
-            offset = M.RowOffsets()
-            of = offset.ToList()
-        dprint1(of)
-        rows = M.NumRowBlocks()
-        s = solall.shape
-        i = 0
-        pt = 0
-        result = np.zeros((s[0] // 2, s[1]), dtype='complex')
-        for i in range(rows):
-            l = of[i + 1] - of[i]
-            w = int(l // 2)
-            result[pt:pt + w, :] = (solall[of[i]:of[i] + w, :]
-                                    + 1j * solall[(of[i] + w):of[i + 1], :])
-            pt = pt + w
-        return result
+        '''
+        solall is distributed (see IterativeSolver.solve_parallel). so
+        local offsets are used in parallel too.
+        '''
+        from petram.solver.complex_conversion import convert_realblocks_to_complex
+        return convert_realblocks_to_complex(solall, M, self.merge_real_imag)
 
     def allocate_solver(self, is_complex=False, engine=None):
         solver = IterativeSolver(self, engine, int(self.maxiter),
@@ -333,6 +295,8 @@ class Iterative(LinearSolverModel, NS_mixin):
 
 class IterativeSolver(LinearSolver):
     is_iterative = True
+    # in parallel, solution is kept distributed (see solve_parallel)
+    is_sol_central = not use_parallel
 
     def __init__(self, gui, engine, maxiter, abstol, reltol, kdim):
         self.maxiter = maxiter
@@ -346,32 +310,34 @@ class IterativeSolver(LinearSolver):
         self.A = opr
 
         from petram.solver.linearsystem_reducer import LinearSystemReducer
-        if use_parallel:
-            if self.gui.use_ls_reducer:
-                self.reducer = LinearSystemReducer(opr, name)
+        from petram.solver.krylov_recycler import get_recycler
+        self.recycler = get_recycler(self.gui)
+
+        self.reducer = None
+        if self.gui.use_ls_reducer:
+            self.reducer = LinearSystemReducer(opr, name)
+            if self.reducer.A is not None:
                 self.M_reduced = self.make_preconditioner(self.reducer.A,
                                                           name=self.reducer.Aname,
-                                                          parallel=True)
+                                                          parallel=use_parallel)
                 solver = self.make_solver(self.reducer.A,
                                           self.M_reduced,
-                                          use_mpi=True)
+                                          use_mpi=use_parallel)
                 self.reducer.set_solver(solver)
-            else:
-                self.M = self.make_preconditioner(self.A, parallel=True)
-                self.solver = self.make_solver(self.A, self.M, use_mpi=True)
+        elif use_parallel:
+            self.M = self.get_preconditioner(self.A, name, parallel=True)
+            self.solver = self.make_solver(self.A, self.M, use_mpi=True)
         else:
-            if self.gui.use_ls_reducer:
-                dprint1("Linear system reducer is not implemented in serial")
-            self.M = self.make_preconditioner(self.A)
+            self.M = self.get_preconditioner(self.A, name)
             self.solver = self.make_solver(self.A, self.M)
 
-            self.reducer = None
-
     def Mult(self, b, x=None, case_base=0):
         if use_parallel:
-            return self.solve_parallel(self.A, b, x)
+            sol = self.solve_parallel(self.A, b, x)
         else:
-            return self.solve_serial(self.A, b, x)
+            sol = self.solve_serial(self.A, b, x)
+        self.recycler.report()
+        return sol
 
     def make_solver(self, A, M, use_mpi=False):
         maxiter = int(self.maxiter)
@@ -420,6 +386,8 @@ class IterativeSolver(LinearSolver):
         solver._prc = prc
         solver.SetPreconditioner(prc)
         solver.SetOperator(A)
+        # x is used as initial guess (see krylov_recycler)
+        solver.iterative_mode = True
 
         solver.SetAbsTol(atol)
         solver.SetRelTol(rtol)
@@ -428,6 +396,17 @@ class IterativeSolver(LinearSolver):
 
         return solver
 
+    def get_preconditioner(self, A, name, parallel=False):
+        '''
+        preconditioner is reused if operator did not change much
+        (see krylov_recycler)
+        '''
+        if self.recycler.check_operator(A, name):
+            return self.recycler.M
+        M = self.make_preconditioner(A, parallel=parallel)
+        self.recycler.set_preconditioner(M, A)
+        return M
+
     def make_preconditioner(self, A, name=None, parallel=False):
         name = self.Aname if name is None else name
 
@@ -511,11 +490,17 @@ class IterativeSolver(LinearSolver):
     @flush_stdout
     def call_mult(self, solver, bb, xx):
         #print(np.sum(bb.GetDataArray()), np.sum(xx.GetDataArray()))
+        self.recycler.initial_guess(self.A, bb, xx)
+
+        t1 = time.perf_counter()
         solver.Mult(bb, xx)
+        t2 = time.perf_counter()
         max_iter = solver.GetNumIterations()
         tol = solver.GetFinalNorm()
 
-        dprint1("convergence check (max_iter, tol) ", max_iter, " ", tol)
+        self.recycler.add_solution(xx, max_iter, t2 - t1)
+        dprint1("convergence check (max_iter, tol, time) ", max_iter, " ", tol,
+                " ", t2 - t1)
         if self.gui.assert_no_convergence:
             if not solver.GetConverged():
                 self.gui.set_solve_error(
@@ -528,14 +513,10 @@ class IterativeSolver(LinearSolver):
 
         sol = []
 
-        # solve the problem and gather solution to head node...
-        # may not be the best approach
-
-        from petram.helper.mpi_recipes import gather_vector
+        # solution stays distributed. each node returns its own part
+        # of solution (in the BlockVector partitioning)
         offset = A.RowOffsets()
         for bb in b:
-            rows = MPI.COMM_WORLD.allgather(np.int32(bb.Size()))
-            #rowstarts = np.hstack((0, np.cumsum(rows)))
             dprint1("row offset", offset.ToList())
             if x is None:
                 xx = mfem.BlockVector(offset)
@@ -553,39 +534,36 @@ class IterativeSolver(LinearSolver):
             else:
                 self.call_mult(self.solver, bb, xx)
 
-            s = []
-            for i in range(offset.Size() - 1):
-                v = xx.GetBlock(i).GetDataArray()
-                if self.gui.merge_real_imag:
-                    w = int(len(v) // 2)
-                    vv1 = gather_vector(v[:w])
-                    vv2 = gather_vector(v[w:])
-                    vv = np.hstack((vv1, vv2))
-                else:
-                    vv = gather_vector(v)
-                if myid == 0:
-                    s.append(vv)
-                else:
-                    pass
-            if myid == 0:
-                sol.append(np.hstack(s))
+            sol.append(xx.GetDataArray().copy())
 
-        if myid == 0:
-            sol = np.transpose(np.vstack(sol))
-            return sol
-        else:
-            return None
+        sol = np.transpose(np.vstack(sol))
+        return sol
 
     def solve_serial(self, A, b, x=None):
         if self.gui.write_mat:
             self. write_mat(A, b, x)
 
         #M = self.M
-        solver = self.solver
+        solver = None if self.gui.use_ls_reducer else self.solver
 
         sol = []
 
         for bb in b:
+            if self.gui.use_ls_reducer:
+                xx = mfem.BlockVector(A.RowOffsets())
+                if x is None:
+                    xx.Assign(0.0)
+                else:
+                    xx.Assign(x.GetDataArray())
+                try:
+                    self.reducer.Mult(bb, xx, self.gui.assert_no_convergence)
+                except debug.ConvergenceError:
+                    self.gui.set_solve_error(
+                        (True, "No Convergence: " + self.gui.name()))
+                    assert False, "No convergence"
+                sol.append(xx.GetDataArray().copy())
+                continue
+
             if x is None:
                 xx = mfem.Vector(bb.Size())
                 xx.Assign(0.0)
@@ -8,7 +8,6 @@ Krylov Model.
 '''
 from petram.solver.mumps_model import MUMPSPreconditioner
 from petram.mfem_config import use_parallel
-import numpy as np
 
 from petram.debug import flush_stdout
 from petram.namespace_mixin import NS_mixin
@@ -139,68 +138,9 @@ class KrylovModel(LinearSolverModel, NS_mixin):
         return True, "", ""
 
     def real_to_complex(self, solall, M):
-        if self.merge_real_imag:
-            return self.real_to_complex_merged(solall, M)
-        else:
-            return self.real_to_complex_interleaved(solall, M)
-
-    def real_to_complex_interleaved(self, solall, M):
-        if use_parallel:
-            from mpi4py import MPI
-            myid = MPI.COMM_WORLD.rank
-
-            offset = M.RowOffsets().ToList()
-            of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
-                  for o in offset]
-            if myid != 0:
-                return
-
-        else:
-            offset = M.RowOffsets()
-            of = offset.ToList()
-
-        rows = M.NumRowBlocks()
-        s = solall.shape
-        nb = rows // 2
-        i = 0
-        pt = 0
-        result = np.zeros((s[0] // 2, s[1]), dtype='complex')
-        for j in range(nb):
-            l = of[i + 1] - of[i]
-            result[pt:pt + l, :] = (solall[of[i]:of[i + 1], :]
-                                    + 1j * solall[of[i + 1]:of[i + 2], :])
-            i = i + 2
-            pt = pt + l
-
-        return result
-
-    def real_to_complex_merged(self, solall, M):
-        if use_parallel:
-            from mpi4py import MPI
-            myid = MPI.COMM_WORLD.rank
-
-            offset = M.RowOffsets().ToList()
-            of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
-                  for o in offset]
-            if myid != 0:
-                return
-
-        else:
-            offset = M.RowOffsets()
-            of = offset.ToList()
-
-        rows = M.NumRowBlocks()
-        s = solall.shape
-        i = 0
-        pt = 0
-        result = np.zeros((s[0] // 2, s[1]), dtype='complex')
-        for i in range(rows):
-            l = of[i + 1] - of[i]
-            w = int(l // 2)
-            result[pt:pt + w, :] = (solall[of[i]:of[i] + w, :]
-                                    + 1j * solall[(of[i] + w):of[i + 1], :])
-            pt = pt + w
-        return result
+        from petram.solver.complex_conversion import convert_realblocks_to_complex
+        return convert_realblocks_to_complex(solall, M, self.merge_real_imag,
+                                             central=True)
 
     def prepare_preconditioner(self, opr, engine):
         for x in self.iter_enabled():
@@ -0,0 +1,220 @@
+'''
+   krylov_recycler
+
+   reuse information between consecutive iterative solves
+   (Parametric scan, TimeDomain steps, multiple RHS)
+
+   initial guess (init_guess):
+     'zero'        : x given by caller (or zero)
+     'previous'    : previous solution
+     'extrapolate' : linear extrapolation of last two solutions
+     'recycle'     : previous solution corrected by minimum residual
+                     projection on the space spanned by the last
+                     recycle_dim solutions, x0 += U y with
+                         y = argmin |b - A x0 - A U y|
+                     (this is the projection step of GCRO-DR. the
+                      deflated Arnoldi is not done since the Krylov
+                      iteration itself is done by MFEM solvers)
+
+   preconditioner reuse:
+     operator is fingerprinted by its shape and by its action on a
+     fixed probe vector. a preconditioner is reused when the relative
+     change of A*r is smaller than reuse_prc_tol. a reused
+     preconditioner is rebuilt when the iteration count exceeds
+     stale_factor times the count observed when it was built.
+
+   usage:
+      recycler = get_recycler(gui)   # one per solver model
+      if not recycler.check_operator(A, name):
+          M = build preconditioner
+          recycler.set_preconditioner(M, A)
+      M = recycler.M
+      recycler.initial_guess(A, b, x)
+      ... solve ...
+      recycler.add_solution(x, niter, time)
+'''
+import numpy as np
+from collections import deque
+from weakref import WeakKeyDictionary as WKD
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+    from mpi4py import MPI
+    myid = MPI.COMM_WORLD.rank
+else:
+    import mfem.ser as mfem
+    myid = 0
+
+import petram.debug as debug
+dprint1, dprint2, dprint3 = debug.init_dprints('KrylovRecycler')
+
+init_guess_modes = ['zero', 'previous', 'extrapolate', 'recycle']
+
+_recyclers = WKD()
+
+
+def get_recycler(gui):
+    '''
+    KrylovRecycler is kept for each linear solver model. it survives
+    LinearSolver instances being allocated for each case/step.
+    '''
+    if not gui in _recyclers:
+        _recyclers[gui] = KrylovRecycler()
+    recycler = _recyclers[gui]
+    recycler.set_param(init_guess=gui.init_guess,
+                       recycle_dim=gui.recycle_dim,
+                       reuse_prc=gui.reuse_prc,
+                       reuse_prc_tol=gui.reuse_prc_tol)
+    return recycler
+
+
+def global_dot(a, b):
+    v = np.dot(a, b)
+    if use_parallel:
+        v = MPI.COMM_WORLD.allreduce(v)
+    return v
+
+
+def operator_shape(A):
+    if hasattr(A, 'RowOffsets'):
+        return (tuple(A.RowOffsets().ToList()),
+                tuple(A.ColOffsets().ToList()))
+    return (A.Height(), A.Width())
+
+
+class KrylovRecycler(object):
+    stale_factor = 2.0
+
+    def __init__(self, init_guess='zero', recycle_dim=4,
+                 reuse_prc=False, reuse_prc_tol=0.0):
+        self.set_param(init_guess, recycle_dim, reuse_prc, reuse_prc_tol)
+        self.reset()
+
+        self.nsolve = 0
+        self.niter = 0
+        self.time = 0.0
+        self.nprc = 0
+
+    def set_param(self, init_guess='zero', recycle_dim=4,
+                  reuse_prc=False, reuse_prc_tol=0.0):
+        assert init_guess in init_guess_modes, "unknown init_guess: " + \
+            str(init_guess)
+        self.init_guess = init_guess
+        self.recycle_dim = max(int(recycle_dim), 2)
+        if hasattr(self, 'sols') and self.sols.maxlen != self.recycle_dim:
+            self.sols = deque(self.sols, maxlen=self.recycle_dim)
+        self.reuse_prc = reuse_prc
+        self.reuse_prc_tol = reuse_prc_tol
+
+    def reset(self):
+        self.shape = None
+        self.name = None
+        self.sols = deque(maxlen=self.recycle_dim)
+
+        self.M = None
+        self.prc_opr = None
+        self.probe = None
+        self.probe_ret = None
+        self.base_iter = None
+        self.stale = False
+
+    def _apply(self, A, x):
+        xx = mfem.Vector(A.Width())
+        xx.Assign(x)
+        yy = mfem.Vector(A.Height())
+        A.Mult(xx, yy)
+        return yy.GetDataArray().copy()
+
+    def check_operator(self, A, name=None):
+        '''
+        called when operator is set. returns True if the preconditioner
+        kept in self.M can be used for A.
+        '''
+        shape = operator_shape(A)
+        name = None if name is None else tuple(name)
+        if shape != self.shape or name != self.name:
+            if self.shape is not None:
+                dprint1("operator shape changed. clearing history")
+            self.reset()
+            self.shape = shape
+            self.name = name
+            return False
+
+        if not self.reuse_prc or self.M is None or self.stale:
+            return False
+
+        y = self._apply(A, self.probe)
+        d = y - self.probe_ret
+        diff = np.sqrt(global_dot(d, d) /
+                       max(global_dot(self.probe_ret, self.probe_ret),
+                           np.finfo(float).tiny))
+        reuse = diff <= self.reuse_prc_tol
+        dprint1("operator change (relative) " + str(diff) +
+                (" : reusing preconditioner" if reuse else ""))
+        return reuse
+
+    def set_preconditioner(self, M, A):
+        '''
+        A is kept so that M (which may refer A) stays valid
+        '''
+        self.nprc += 1
+        self.base_iter = None
+        self.stale = False
+        if not self.reuse_prc:
+            self.M = None
+            self.prc_opr = None
+            return
+        self.M = M
+        self.prc_opr = A
+
+        rng = np.random.default_rng(12345 + myid)
+        self.probe = rng.standard_normal(A.Width())
+        self.probe_ret = self._apply(A, self.probe)
+
+    def initial_guess(self, A, b, x):
+        '''
+        fill mfem.Vector x with initial guess.
+        x is left untouched if there is no history.
+        '''
+        sols = [s for s in self.sols if s.size == x.Size()]
+        if self.init_guess == 'zero' or len(sols) == 0:
+            return
+
+        x0 = sols[-1].copy()
+        if self.init_guess == 'extrapolate' and len(sols) > 1:
+            x0 = 2 * sols[-1] - sols[-2]
+
+        elif self.init_guess == 'recycle' and len(sols) > 1:
+            r0 = b.GetDataArray() - self._apply(A, x0)
+            U = np.vstack(sols)
+            W = np.vstack([self._apply(A, u) for u in U])
+            G = np.dot(W, W.transpose())
+            g = np.dot(W, r0)
+            if use_parallel:
+                G = MPI.COMM_WORLD.allreduce(G)
+                g = MPI.COMM_WORLD.allreduce(g)
+            y = np.linalg.lstsq(G, g, rcond=1e-12)[0]
+            x0 += np.dot(y, U)
+        x.Assign(x0)
+
+    def add_solution(self, x, niter=0, time=0.0):
+        self.sols.append(x.GetDataArray().copy())
+
+        self.nsolve += 1
+        self.niter += niter
+        self.time += time
+
+        if self.base_iter is None:
+            self.base_iter = niter
+        elif niter > self.stale_factor * max(self.base_iter, 1):
+            dprint1("preconditioner is stale (iterations " + str(niter) +
+                    " > " + str(self.stale_factor) + " x " +
+                    str(self.base_iter) + ")")
+            self.stale = True
+
+    def report(self):
+        dprint1("Krylov solve summary: solves = " + str(self.nsolve) +
+                ", iterations = " + str(self.niter) +
+                ", preconditioner builds = " + str(self.nprc) +
+                ", time = " + str(self.time))
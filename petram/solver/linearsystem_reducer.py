@@ -1,16 +1,16 @@
 '''
-  reducer is to eliminate trivial depencencies of 
+  reducer is to eliminate trivial depencencies of
   blockmatrix
 
-  
+
   [A  B][x1]  [a1]
-  [    ][  ]= [  ] 
+  [    ][  ]= [  ]
   [   C][x2]  [a2]
 
-  
+
   C x2 = a2 can be solved first.
-  
-  (1)  When x2 is auxiliary variable, C is often trivial 
+
+  (1)  When x2 is auxiliary variable, C is often trivial
            (diagonal, full but small) to invert.
            Then do this first.
 
@@ -28,8 +28,17 @@
   step4:
        solve (2)
 
+  trivial to invert means that the block is diagonal or block
+  diagonal with small dense blocks (up to max_block_size, for example
+  vector components at each node). the inverse is computed directly
+  in CSR.
 
-  Note: presentely MPI only
+  off-diagonal blocks used in step1 and step4 are applied block by
+  block. only the operator of step3 is assembled as BlockOperator
+  (it refers the original blocks) so that preconditioners can be
+  constructed for it.
+
+  works for both serial (SparseMatrix) and parallel (HypreParMatrix)
 '''
 from __future__ import print_function
 
@@ -40,13 +49,12 @@ dprint1, dprint2, dprint3 = debug.init_dprints('LS_Reducer')
 
 from petram.mfem_config import use_parallel
 if use_parallel:
-    from petram.helper.mpi_recipes import allgather_vector
     from mfem.common.mpi_debug import nicePrint
     import mfem.par as mfem
-   
-    from mpi4py import MPI                                   
+
+    from mpi4py import MPI
     num_proc = MPI.COMM_WORLD.size
-    myid = MPI.COMM_WORLD.rank    
+    myid = MPI.COMM_WORLD.rank
 else:
     import mfem.ser as mfem
     num_proc = 1
@@ -54,139 +62,163 @@ else:
     def nicePrint(x):
         print(x)
 
+max_block_size = 8
+
+
 def get_block(Op, i, j):
     try:
         return Op._linked_op[(i,j)]
     except KeyError:
         return None
 
+
+def get_coo(M):
+    '''
+    local rows (starting from 0), global columns, data, first row,
+    first column, local number of rows and col_starts of block M
+    '''
+    if use_parallel:
+        col_starts = M.GetColPartArray()
+        (num_rows, ilower, iupper, jlower, jupper,
+         irn, jcn, data) = M.GetCooDataArray()
+        m = iupper - ilower + 1
+        return irn - ilower, jcn, data, ilower, jlower, m, col_starts
+    else:
+        indptr = M.GetIArray()
+        m = M.Height()
+        irn = np.repeat(np.arange(m), np.diff(indptr))
+        return irn, M.GetJArray(), M.GetDataArray(), 0, 0, m, None
+
+
+def is_block_diagonal(irn, jcn, ilower, jlower, m, bs):
+    '''
+    vectorized test that all entries are in the diagonal blocks of
+    size bs
+    '''
+    if ilower != jlower or ilower % bs != 0 or m % bs != 0:
+        return False
+    gi = irn + ilower
+    return bool(np.all(gi // bs == jcn // bs))
+
+
+def collective_and(flag):
+    if use_parallel:
+        return bool(MPI.COMM_WORLD.allreduce(int(flag), op=MPI.MIN))
+    return bool(flag)
+
+
 def do_easy_invert(M):
     '''
-    set diagonal element to value (normally 1)
+    compute the inverse of diagonal or block diagonal M.
+
+    returns (block size, inverse) or (-1, None) if M is not trivial
+    to invert.
     '''
-    col_starts = M.GetColPartArray()
-    num_rows, ilower, iupper, jlower, jupper, irn, jcn, data = M.GetCooDataArray()
+    irn, jcn, data, ilower, jlower, m, col_starts = get_coo(M)
+    n = M.Width() if not use_parallel else M.N()
+
+    # check the size of diagonal blocks
+    bs = -1
+    for k in range(1, max_block_size+1):
+        if collective_and(is_block_diagonal(irn, jcn, ilower, jlower, m, k)):
+            bs = k
+            break
+    if bs == -1:
+        return -1, None
+
+    nblk = m // bs
+    blocks = np.zeros((nblk, bs, bs), dtype=data.dtype)
+    np.add.at(blocks, (irn // bs, irn % bs, (jcn - jlower) % bs), data)
+
+    if bs == 1:
+        d = blocks.flatten()
+        ok = np.all(d != 0.0)
+    else:
+        ok = np.all(np.linalg.cond(blocks) < 1/np.finfo(float).eps)
+    if not collective_and(ok):
+        dprint1("block is block-diagonal (size " + str(bs) +
+                ") but singular")
+        return -1, None
+
+    if bs == 1:
+        inv = (1./d).reshape(-1, 1, 1)
+    else:
+        inv = np.linalg.inv(blocks)
+
+    cols = (np.arange(m) // bs * bs)[:, None] + np.arange(bs)[None, :]
+    indptr = np.arange(m+1) * bs
+
+    from scipy.sparse import csr_matrix
+    mat = csr_matrix((inv.reshape(-1), cols.reshape(-1) + jlower, indptr),
+                     shape=(m, n))
+
+    if use_parallel:
+        from mfem.common.parcsr_extra import ToHypreParCSR
+        mat = ToHypreParCSR(mat, col_starts = col_starts)
+    else:
+        mat = mfem.SparseMatrix(mat)
+    return bs, mat
 
 
-    from mpi4py import MPI
-    myid     = MPI.COMM_WORLD.rank
-     
-    m = iupper - ilower + 1
-    n = jupper - jlower + 1
-    n = M.N()
-
-    from scipy.sparse import coo_matrix, lil_matrix
-    for i, j in zip(irn, jcn):
-        if i != j:
-            return -1, None
-    try:
-        mat =  coo_matrix((1./data, (irn-ilower, jcn)), shape = (m, n)).tolil()
-    except:
-       print("wrong input")
-       print(num_rows, ilower, iupper, jlower, jupper)
-       print(np.min(irn-ilower), np.max(irn-ilower) , np.min(jcn),  np.max(jcn), (m, n))
-       raise
-    from mfem.common.parcsr_extra import ToHypreParCSR
-    return  1, ToHypreParCSR(mat.tocsr(), col_starts = col_starts)
-    
 class LinearSystemReducer(object):
     def __init__(self, opr, name):
         offset = opr.RowOffsets()
         nb = opr.NumRowBlocks()
         self.nb = nb
-        
-        size = np.diff(offset.ToList())
-        lsize = size
-        self.lsize = lsize
 
-        if use_parallel:
-            size = allgather_vector(size)
-            size = np.sum(size.reshape(-1, nb), axis = 0)
+        lsize = np.diff(offset.ToList())
+        self.lsize = lsize
 
-        #nicePrint(size)
-        filled = np.zeros((nb, nb), dtype=int)
-        nnz    = np.zeros((nb, nb), dtype=int)
+        filled = np.zeros((nb, nb), dtype=bool)
         for i in range(nb):
            for j in range(nb):
-              m = get_block(opr, i, j)
-              if m is not None:
-                  filled[i, j] = 1
-                  nnz[i, j] = m.NNZ()
-
-        flag = [False]*nb
-        for i in range(nb): 
-            if filled[i, i] == 1 and nnz[i,i] == size[i]:
-                flag[i] = True
-        #nicePrint("filling pattern", filled)
-        #nicePrint("nnz(global)", nnz)
-        #nicePrint("easy to invert ", flag)
+              filled[i, j] = get_block(opr, i, j) is not None
+        offdiag = np.logical_and(filled, np.logical_not(np.eye(nb, dtype=bool)))
+
+        # (1) x_i depends only on b_i, (2) x_j is not used by others
+        row_alone = np.logical_and(filled.diagonal(),
+                                   np.logical_not(np.any(offdiag, 1)))
+        col_alone = np.logical_and(filled.diagonal(),
+                                   np.logical_not(np.any(offdiag, 0)))
 
         easy_inv = [None]*nb
         for i in range(nb):
-            if flag[i]:
-                check, mat = do_easy_invert(get_block(opr, i, i))
+            if row_alone[i] or col_alone[i]:
+                bs, mat = do_easy_invert(get_block(opr, i, i))
+                if mat is not None:
+                    dprint1("block " + str(i) + " is easy to invert (block size " +
+                            str(bs) + ")")
                 easy_inv[i] = mat
         self.easy_inv = easy_inv
+        has_inv = np.array([x is not None for x in easy_inv], dtype=bool)
 
-        first_step_flag = [False]*nb
-        for i in range(nb):
-            flag = True
-            for j in range(nb):
-                if  i != j and filled[i, j] == 1:
-                    flag = False
-            if easy_inv[i] is None: flag = False
-            first_step_flag[i] = flag
-
-        last_step_flag = [False]*nb
-        for j in range(nb):
-            flag = True
-            for i in range(nb):
-                if filled[i, j] == 1 and i != j:
-                    flag = False
-            if easy_inv[j] is None: flag = False                
-            last_step_flag[j] = flag
-
-        idx = np.logical_or(first_step_flag, last_step_flag)
-        reduced_idx = [k for k, n in enumerate(lsize)
-                      if not (first_step_flag[k] or last_step_flag[k])]
+        first_step_flag = np.logical_and(row_alone, has_inv)
+        last_step_flag = np.logical_and(np.logical_and(col_alone, has_inv),
+                                        np.logical_not(first_step_flag))
 
         self.idx_step1 = list(np.where(first_step_flag)[0])
-        self.idx_step2 = list(reduced_idx)
         self.idx_step3 = list(np.where(last_step_flag)[0])
+        self.idx_step2 = [k for k in range(nb)
+                          if not (first_step_flag[k] or last_step_flag[k])]
         self.Aname = [n for k, n in enumerate(name) if k in self.idx_step2]
-        
-        #dprint1("first step: ", self.idx_step1)
-        #dprint1("middle step: ", self.idx_step2)        
-        #dprint1("last step: ", self.idx_step3)
-        #dprint1("A name: ", self.Aname)
-        
-        rd_offsets = np.hstack([0, np.cumsum(np.array(lsize)[self.idx_step2])])
-        self.A = self.make_sub_matrix(opr, rd_offsets, rd_offsets,
-                                      self.idx_step2, self.idx_step2)
-
-       
-        not_in_step1 = [k for k in range(nb) if not k in self.idx_step1]
-        #dprint1("step1", not_in_step1)
-        ro = np.hstack([0, np.cumsum(np.array(lsize)[not_in_step1])])
-        co = np.hstack([0, np.cumsum(np.array(lsize)[self.idx_step1])])
-        self.A_step1 = self.make_sub_matrix(opr, ro, co, 
-                                            not_in_step1, self.idx_step1)
-
-        not_in_step3 = [k for k in range(nb) if not k in self.idx_step3]
-        #dprint1("step3", not_in_step3)        
-        ro = np.hstack([0, np.cumsum(np.array(lsize)[self.idx_step3])])
-        co = np.hstack([0, np.cumsum(np.array(lsize)[not_in_step3])])
-        #dprint1("step3", ro, co)                
-        self.A_step3 = self.make_sub_matrix(opr, ro, co, 
-                                            self.idx_step3, not_in_step3)
-
-        self.Ainv_step1 = self.make_inv_mat(self.idx_step1, easy_inv)
-        self.Ainv_step3 = self.make_inv_mat(self.idx_step3, easy_inv)
-        
+
+        dprint1("reducer (first/middle/last step): ", self.idx_step1,
+                self.idx_step2, self.idx_step3)
+
+        self.opr = opr
+        if len(self.idx_step2) > 0:
+            rd_offsets = np.hstack([0, np.cumsum(lsize[self.idx_step2])])
+            self.A = self.make_sub_matrix(opr, rd_offsets, rd_offsets,
+                                          self.idx_step2, self.idx_step2)
+        else:
+            self.A = None
+        self.solver = None
+
     def make_sub_matrix(self, src_mat, roffset, coffset, row_idx, col_idx):
         ro = mfem.intArray(list(roffset))
         co = mfem.intArray(list(coffset))
         mat = mfem.BlockOperator(ro, co)
+        mat._offsets = (ro, co)
         for ii, i in enumerate(row_idx):
            for jj, j in enumerate(col_idx):
                m = get_block(src_mat, i, j)
@@ -194,23 +226,11 @@ class LinearSystemReducer(object):
                mat.SetBlock(ii, jj,  m)
         return mat
 
-    def make_inv_mat(self, idx, inv):
-        ro = np.hstack([0, np.cumsum(np.array(self.lsize)[idx])])
-        row = mfem.intArray(list(ro))
-        col = mfem.intArray(list(ro))
-        mat = mfem.BlockOperator(row, col)
-        
-        for ii, i in enumerate(idx):
-               mat.SetBlock(ii, ii,  inv[i])
-        return mat
-
-    def make_sub_vec(self, src_vec, idx, inv=False, nocopy=False):
-        if inv:
-            idx = [k for k in range(self.nb) if not k in idx]
+    def make_sub_vec(self, src_vec, idx, nocopy=False):
         size = [src_vec.BlockSize(i) for i in idx]
         offset = np.hstack([0, np.cumsum(size, dtype=int)])
         offset = mfem.intArray(list(offset))
-        
+
         sub_vec = mfem.BlockVector(offset)
         sub_vec._offsets = offset # in order to keep it from freed
 
@@ -224,65 +244,54 @@ class LinearSystemReducer(object):
 
     def set_solver(self, solver):
         self.solver = solver
-        
-    def Mult(self, bb, xx, assert_convergence = False):
-        bb_1 = self.make_sub_vec(bb, self.idx_step1)
-        xx_1 = self.make_sub_vec(xx, self.idx_step1)        
-        self.Ainv_step1.Mult(bb_1, xx_1)
-
-
-        for k, i in enumerate(self.idx_step1):
-            xx.GetBlock(i).Assign(xx_1.GetBlock(k).GetDataArray())
-
-        #nicePrint("xx_1", xx_1.GetBlock(0).GetDataArray())
-        
-        bb_1_2 = self.make_sub_vec(bb, self.idx_step1, inv=True, nocopy=True)
 
-        self.A_step1.Mult(xx_1, bb_1_2)
-
-        for k, i in enumerate(self.idx_step2+self.idx_step3):
-            v = bb.GetBlock(i)
-            v -= bb_1_2.GetBlock(k)
-
-        bb_2 = self.make_sub_vec(bb, self.idx_step2)
-        xx_2 = self.make_sub_vec(xx, self.idx_step2)
-
-        self.solver.Mult(bb_2, xx_2)
-        max_iter = self.solver.GetNumIterations();
-        tol = self.solver.GetFinalNorm()
-        
-        dprint1("convergence check (max_iter, tol) ", max_iter, " ", tol)
-        if assert_convergence:
-            if not self.solver.GetConverged():
-                raise debug.ConvergenceError("Convergence error when solving Reduced linear system")
-
-        for k, i in enumerate(self.idx_step2):
-            xx.GetBlock(i).Assign(xx_2.GetBlock(k).GetDataArray())
-
-
-        xx_3_1 = self.make_sub_vec(xx, self.idx_step3, inv=True)
-        xx_3_2 = self.make_sub_vec(xx, self.idx_step3)
-        bb_3 = self.make_sub_vec(bb, self.idx_step3)
-        self.A_step3.Mult(xx_3_1, bb_3)
-
-        for k, i in enumerate(self.idx_step3):
-            v = bb.GetBlock(i)
-            v -= bb_3.GetBlock(k)
-        bb_3 = self.make_sub_vec(bb, self.idx_step3)            
-        self.Ainv_step3.Mult(bb_3, xx_3_2)
-        
-        for k, i in enumerate(self.idx_step3):
-            xx.GetBlock(i).Assign(xx_3_2.GetBlock(k).GetDataArray())
-        
-        
-        
-
-        
-        
-                
-        
-               
-
-
-            
+    def eliminate(self, rhs, xx, rows, cols):
+        '''
+        rhs[i] -= A_ij x_j  (i in rows, j in cols)
+        '''
+        for i in rows:
+            tmp = None
+            for j in cols:
+                m = get_block(self.opr, i, j)
+                if m is None:
+                    continue
+                if tmp is None:
+                    tmp = mfem.Vector(int(self.lsize[i]))
+                m.Mult(xx.GetBlock(j), tmp)
+                rhs[i] -= tmp.GetDataArray()
 
+    def Mult(self, bb, xx, assert_convergence = False):
+        # RHS is copied (caller's bb is not modified)
+        rhs = [bb.GetBlock(i).GetDataArray().copy() for i in range(self.nb)]
+
+        # step1
+        for i in self.idx_step1:
+            b = mfem.Vector(rhs[i])
+            self.easy_inv[i].Mult(b, xx.GetBlock(i))
+        others = self.idx_step2 + self.idx_step3
+        self.eliminate(rhs, xx, others, self.idx_step1)
+
+        # step3
+        if len(self.idx_step2) > 0:
+            bb_2 = self.make_sub_vec(xx, self.idx_step2, nocopy=True)
+            for k, i in enumerate(self.idx_step2):
+                bb_2.GetBlock(k).Assign(rhs[i])
+            xx_2 = self.make_sub_vec(xx, self.idx_step2)
+
+            self.solver.Mult(bb_2, xx_2)
+            max_iter = self.solver.GetNumIterations();
+            tol = self.solver.GetFinalNorm()
+
+            dprint1("convergence check (max_iter, tol) ", max_iter, " ", tol)
+            if assert_convergence:
+                if not self.solver.GetConverged():
+                    raise debug.ConvergenceError("Convergence error when solving Reduced linear system")
+
+            for k, i in enumerate(self.idx_step2):
+                xx.GetBlock(i).Assign(xx_2.GetBlock(k).GetDataArray())
+
+        # step4
+        self.eliminate(rhs, xx, self.idx_step3, self.idx_step2)
+        for i in self.idx_step3:
+            b = mfem.Vector(rhs[i])
+            self.easy_inv[i].Mult(b, xx.GetBlock(i))
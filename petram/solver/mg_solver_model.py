@@ -467,7 +467,8 @@ class MGInstance(SolverInstance):
         engine.level_idx = 1
         A = engine.assembled_blocks[0]
         X = engine.assembled_blocks[1]
-        A.reformat_central_mat(solall, 0, X[0], self.blk_mask)
+        # both ls1 and mg return the local part of solution
+        A.reformat_distributed_mat(solall, 0, X[0], self.blk_mask)
 
         self.sol = X[0]
 
@@ -587,108 +588,5 @@ def fill_prolongation_operator(engine, level, blk_opr):
 
 
 def genearate_smoother(engine, level, blk_opr):
-    from petram.engine import ParallelEngine
-    assert not isinstance(
-        engine, ParallelEngine), "Parallel is not supported"
-
-    engine.access_idx = 0
-    P = None
-    diags = []
-    cols = [0]
-    ess_tdofs = []
-    A, _X, _RHS, _Ae,  _B,  _M, _dep_vars = engine.assembled_blocks
-    widths = A.get_local_col_widths()
-
-    use_complex_opr = A.complex and (A.shape[0] == blk_opr.NumRowBlocks())
-
-    for dep_var in engine.r_dep_vars:
-        offset = engine.r_dep_var_offset(dep_var)
-
-        tmp_cols = []
-        tmp_diags = []
-        if engine.r_isFESvar(dep_var):
-            ess_tdof = mfem.intArray(engine.ess_tdofs[dep_var])
-            ess_tdofs.append(ess_tdofs)
-            opr = A[offset, offset]
-
-            if use_complex_opr:
-                mat = blk_opr._linked_op[(offset, offset)]
-                conv = mat.GetConvention()
-                conv == 1 if mfem.ComplexOperator.HERMITIAN else -1
-                mat1 = mat._real_operator
-                mat2 = mat._imag_operator
-            else:
-                conv = 1
-                if A.complex:
-                    mat1 = blk_opr.GetBlock(offset*2, offset*2)
-                    mat2 = blk_opr.GetBlock(offset*2 + 1, offset*2 + 1)
-                else:
-                    mat1 = blk_opr.GetBlock(offset, offset)
-
-            if A.complex:
-                dd = opr.diagonal()
-                diag = mfem.Vector(list(dd.real))
-                print("real", dd.real)
-                rsmoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                           diag,
-                                                           ess_tdof,
-                                                           2)
-                dd = opr.diagonal()*conv
-                diag = mfem.Vector(list(dd.real))
-                print("imag", dd.imag)
-                ismoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                           diag,
-                                                           ess_tdof,
-                                                           2)
-                tmp_cols.append(opr.shape[0])
-                tmp_cols.append(opr.shape[0])
-                tmp_diags.append(rsmoother)
-                tmp_diags.append(ismoother)
-
-            else:
-                dd = opr.diagonal()
-                diag = mfem.Vector(list(dd))
-                smoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                          diag,
-                                                          ess_tdof,
-                                                          2)
-                tmp_diags.append(smoother)
-                tmp_cols.append(opr.shape[0])
-
-        else:
-            print("Non FESvar", dep_var, offset)
-            tmp_cols.append(widths[offset])
-            tmp_diags.append(mfem.IdentityOperator(widths[offset]))
-            if A.complex:
-                tmp_cols.append(widths[offset])
-                oo = mfem.IdentityOperator(widths[offset])
-                if conv == -1:
-                    oo2 = mfem.ScaleOperator(oo, -1)
-                    oo2._opr = oo
-                    tmp_diags.append(oo2)
-                else:
-                    tmp_diags.append(oo)
-
-        if use_complex_opr:
-            tmp_cols = [0] + tmp_cols
-            blockOffsets = mfem.intArray(tmp_cols)
-            blockOffsets.PartialSum()
-            smoother = mfem.BlockDiagonalPreconditioner(blockOffsets)
-            smoother.SetDiagonalBlock(0, tmp_diags[0])
-            smoother.SetDiagonalBlock(1, tmp_diags[1])
-            smoother._smoother = tmp_diags
-            cols.append(tmp_cols[1]*2)
-            diags.append(smoother)
-        else:
-            cols.extend(tmp_cols)
-            diags.extend(tmp_diags)
-
-    co = mfem.intArray(cols)
-    co.PartialSum()
-
-    P = mfem.BlockDiagonalPreconditioner(co)
-    for i, d in enumerate(diags):
-        P.SetDiagonalBlock(i,  d)
-    P._diags = diags
-    P._ess_tdofs = ess_tdofs
-    return P
+    from petram.solver.ml_solver_model import generate_smoother
+    return generate_smoother(engine, level, blk_opr)
@@ -18,7 +18,6 @@ from petram.solver.std_solver_model import StdSolver
 
 from petram.mfem_config import use_parallel
 if use_parallel:
-    from petram.helper.mpi_recipes import *
     import mfem.par as mfem
 else:
     import mfem.ser as mfem
@@ -899,9 +898,18 @@ def generate_MG(operators, smoothers, prolongations,
 
 
 class PyMG(mfem.PyIterativeSolver):
+    '''
+    multigrid cycle written in Python.
+
+    work vectors of each level are allocated once in __init__. the
+    number of coarse level cycles (cycle_max) gives V-cycle (1) or
+    W-cycle (2). diagnostics (debug1/debug2) are computed only when
+    enabled, since they need extra operator Mult and reductions.
+    '''
+
     def __init__(self, operators, smoothers, prolongations,
                  ess_tdofs=None, presmoother_count=1, postsmoother_count=1,
-                 debug1=True, debug2=True, cycle_max=1):
+                 debug1=False, debug2=False, cycle_max=1):
         self.operators = operators
         self.smoothers = smoothers
         self.prolongations = prolongations
@@ -915,6 +923,8 @@ class PyMG(mfem.PyIterativeSolver):
         self.cycle_rel_tol = 0.01
         self.cycle_max = cycle_max
 
+        self.allocate_workspace()
+
         if use_parallel:
             from mpi4py import MPI
             args = (MPI.COMM_WORLD,)
@@ -922,27 +932,66 @@ class PyMG(mfem.PyIterativeSolver):
             args = tuple()
         mfem.PyIterativeSolver.__init__(self, *args)
 
+    def allocate_workspace(self):
+        '''
+        per level work vectors
+           err, y0, tmp : used in the cycle at this level
+           b, y, x      : rhs, correction, accumulated correction given
+                          to this level by the upper level
+        '''
+        self.work = []
+        for op in self.operators:
+            w = op.Width()
+            ws = {}
+            for name in ('err', 'y0', 'tmp', 'b', 'y', 'x'):
+                ws[name] = mfem.Vector(w)
+                ws[name].Assign(0.0)
+            self.work.append(ws)
+
+    def global_norm2(self, v):
+        '''
+        L2 norm over all MPI processes (one Allreduce)
+        '''
+        d = v.GetDataArray()
+        local = np.array([np.dot(d, d)])
+        if use_parallel:
+            from mpi4py import MPI
+            glob = np.zeros(1)
+            MPI.COMM_WORLD.Allreduce(local, glob, op=MPI.SUM)
+            local = glob
+        return np.sqrt(local[0])
+
+    def ess_sum(self, v, lvl):
+        return np.sum(np.abs(v.GetDataArray()[self.ess_tdofs[lvl]]))
+
+    def residual(self, lvl, y, x, out):
+        '''
+        out = x - A y
+        '''
+        self.operators[lvl].Mult(y, out)
+        out *= -1
+        out += x
+
     def Mult(self, x, y):
         '''
         call cycle_max times of perform_one_cycle
         '''
         y.Assign(0.0)
 
-        lvl = len(self.ess_tdofs)-1
+        lvl = len(self.operators)-1
+        ws = self.work[lvl]
 
-        correction = mfem.Vector(y.Size())
+        correction = ws['y']
         correction.Assign(0.0)
-        err = mfem.Vector(x.Size())
+        err = ws['b']
         err.Assign(x)
-        tmp = mfem.Vector(x.Size())
+        tmp = ws['tmp']
 
         for i in range(self.cycle_max[lvl]):
             self.perform_one_cycle(err, correction)
 
             self.operators[lvl].Mult(correction, tmp)
-            tmp *= -1
-            tmp += err
-            err.Assign(tmp)
+            err -= tmp
 
             y += correction
 
@@ -950,7 +999,7 @@ class PyMG(mfem.PyIterativeSolver):
 
         if lvl is None:
             # start from finest level
-            lvl = len(self.ess_tdofs)-1
+            lvl = len(self.operators)-1
 
         if self.debug1:
             dprint1("========\n")
@@ -958,7 +1007,7 @@ class PyMG(mfem.PyIterativeSolver):
         if lvl == 0:
             if self.debug2:
                 dprint1("    - error on essential at level = 0",
-                        np.sum(np.abs(x.GetDataArray()[self.ess_tdofs[0]])))
+                        self.ess_sum(x, 0))
                 dprint1("    - NormInf before level0 solve", x.Normlinf())
 
             y.Assign(0.0)
@@ -967,28 +1016,30 @@ class PyMG(mfem.PyIterativeSolver):
             if self.debug2:
                 dprint1("    - NormInf after level0 solve", y.Normlinf())
                 dprint1("    - correction on essential at coarse level",
-                        np.sum(np.abs(y.GetDataArray()[self.ess_tdofs[0]])))
+                        self.ess_sum(y, 0))
 
-                tmp = mfem.Vector(y.Size())
+                tmp = self.work[0]['tmp']
                 self.operators[0].Mult(y, tmp)
                 tmp -= x
-                dprint1("    - level0 linear inverse error (L2): ", tmp.Norml2())
+                dprint1("    - level0 linear inverse error (L2): ",
+                        self.global_norm2(tmp))
 
             if self.debug1:
                 dprint1("Exiting Cycle lvl =  ", lvl)
                 dprint1("========\n")
             return
 
+        ws = self.work[lvl]
         if self.debug2:
             dprint1("")
             dprint1("  - residual on essential at the start of level",
-                    np.sum(np.abs(x.GetDataArray()[self.ess_tdofs[1]])))
-            dprint1("  - initial residual L2", x.Norml2())
+                    self.ess_sum(x, lvl))
+            dprint1("  - initial residual L2", self.global_norm2(x))
 
-        err = mfem.Vector(x.Size())
+        err = ws['err']
         err.Assign(x)
 
-        y0 = mfem.Vector(x.Size())
+        y0 = ws['y0']
         y.Assign(0.0)
 
         for jjj in range(self.presmoother_count[lvl]):
@@ -1002,64 +1053,61 @@ class PyMG(mfem.PyIterativeSolver):
 
             if self.debug2:
                 dprint1("    - resdidual on essential before presmooth",
-                        np.sum(np.abs(err.GetDataArray()[self.ess_tdofs[lvl]])))
+                        self.ess_sum(err, lvl))
 
             self.smoothers[lvl].Mult(err, y0)
 
             y += y0
-            self.operators[lvl].Mult(y, err)
-            err *= -1
-            err += x
+            self.residual(lvl, y, x, err)
 
             if self.debug2:
                 dprint1("    - residual on essential after pre-smooth",
-                        np.sum(np.abs(err.GetDataArray()[self.ess_tdofs[lvl]])))
+                        self.ess_sum(err, lvl))
 
         if self.debug2:
-            dprint1(
-                "  correction (L2) before adding prolonged correction: ", y.Norml2())
+            dprint1("  correction (L2) before adding prolonged correction: ",
+                    self.global_norm2(y))
 
         # prepare err passed to lower level
         lvl2 = lvl - 1
-        lvl2_width = self.operators[lvl2].Width()
-        err2 = mfem.Vector(lvl2_width)
+        ws2 = self.work[lvl2]
+        err2 = ws2['b']
+        y2 = ws2['y']
+        x2 = ws2['x']
+        tmp2 = ws2['tmp']
         self.prolongations[lvl2].MultTranspose(err, err2)
-        y2 = mfem.Vector(lvl2_width)
 
         # (zeroing the error sent to the lower level)   <--- this works
         err2.GetDataArray()[self.ess_tdofs[lvl2]] = 0.0
 
         if self.debug2:
             dprint1("    - error on essential given to a coarse level",
-                    np.sum(np.abs(err2.GetDataArray()[self.ess_tdofs[lvl2]])))
+                    self.ess_sum(err2, lvl2))
 
         # calling lower levels
         #   cycle max = 1 (V-cycle)
         #   cycle max = 2 (W-cycle)
 
-        x2 = mfem.Vector(lvl2_width)
         x2.Assign(0.0)
-        err2_L2 = err2.Norml2()
-        if use_parallel:
-            err2_L2 = np.sqrt(
-                np.sum([x**2 for x in MPI.COMM_WORLD.allgather(err2_L2)]))
+        ncycle = self.cycle_max[lvl]
+        if ncycle > 1:
+            err2_L2 = self.global_norm2(err2)
         rel_improve0 = 1.0
-        for i in range(self.cycle_max[lvl]):
+        for i in range(ncycle):
             self.perform_one_cycle(err2, y2, lvl=lvl2)
             x2 += y2
-            tmp = mfem.Vector(x2.Size())
-            self.operators[lvl2].Mult(y2, tmp)
-            err2 -= tmp
-            err2norm = err2.Norml2()
-            if use_parallel:
-                err2norm = np.sqrt(
-                    np.sum([x**2 for x in MPI.COMM_WORLD.allgather(err2norm)]))
+            if i == ncycle - 1:
+                # no need to check improvement after the last cycle
+                break
 
-            rel_improve = err2norm/err2_L2
+            self.operators[lvl2].Mult(y2, tmp2)
+            err2 -= tmp2
+            rel_improve = self.global_norm2(err2)/err2_L2
 
             if self.debug2:
                 dprint1(str(i)+" th cycle checking cycle error lvl = :" + str(lvl))
-                dprint1("correction L2/ rel_improve", y2.Norml2(), rel_improve)
+                dprint1("correction L2/ rel_improve",
+                        self.global_norm2(y2), rel_improve)
                 dprint1("change of improvement", np.abs(
                     np.abs(rel_improve0/rel_improve)-1))
 
@@ -1069,21 +1117,19 @@ class PyMG(mfem.PyIterativeSolver):
                 break
             rel_improve0 = rel_improve
 
-        y2 = x2
-
         # (zeroing the correction given from the lower level)   <--- this works
-        y2.GetDataArray()[self.ess_tdofs[lvl2]] = 0.0
+        x2.GetDataArray()[self.ess_tdofs[lvl2]] = 0.0
 
-        self.prolongations[lvl2].Mult(y2, y0)
+        self.prolongations[lvl2].Mult(x2, y0)
         # (zeroing after MUMPS after prolongation)
         # tmp.GetDataArray()[self.ess_tdofs[1]] = 0.0  # <--- does not works
         y += y0
 
         if self.debug2:
             dprint1("    - correction on essential prolonged from lower level",
-                    np.sum(np.abs(y0.GetDataArray()[self.ess_tdofs[lvl]])))
-            dprint1(
-                "    - correction (L2) after adding prolonged correction: ", y.Norml2())
+                    self.ess_sum(y0, lvl))
+            dprint1("    - correction (L2) after adding prolonged correction: ",
+                    self.global_norm2(y))
 
         for jjj in range(self.postsmoother_count[lvl]):
             if self.debug1:
@@ -1092,14 +1138,13 @@ class PyMG(mfem.PyIterativeSolver):
                         txt + " : level = " + str(lvl))
 
             # compute error
-            self.operators[lvl].Mult(y, err)
-            err *= -1
-            err += x
+            self.residual(lvl, y, x, err)
 
             if self.debug2:
                 dprint1("    - residual on essential before postsmooth",
-                        np.sum(np.abs(err.GetDataArray()[self.ess_tdofs[lvl]])))
-                dprint1("    - residual L2 before before postsmooth", err.Norml2())
+                        self.ess_sum(err, lvl))
+                dprint1("    - residual L2 before before postsmooth",
+                        self.global_norm2(err))
 
             y0.Assign(0.0)
             self.smoothers[lvl].Mult(err, y0)
@@ -1109,18 +1154,18 @@ class PyMG(mfem.PyIterativeSolver):
 
             if self.debug2:
                 dprint1("    - correction on essential",
-                        np.sum(np.abs(y0.GetDataArray()[self.ess_tdofs[lvl]])))
-                dprint1("    - correction norm (L2) after postsmooth", y0.Norml2())
+                        self.ess_sum(y0, lvl))
+                dprint1("    - correction norm (L2) after postsmooth",
+                        self.global_norm2(y0))
 
         if self.debug2:
-            self.operators[lvl].Mult(y, err)
-            err *= -1
-            err += x
+            self.residual(lvl, y, x, err)
 
             dprint1("  - final correction on essential",
-                    np.sum(np.abs(y.GetDataArray()[self.ess_tdofs[lvl]])))
-            dprint1("  - finial norm of correction (L2): ", y.Norml2())
-            dprint1("  - final residual L2", err.Norml2())
+                    self.ess_sum(y, lvl))
+            dprint1("  - finial norm of correction (L2): ",
+                    self.global_norm2(y))
+            dprint1("  - final residual L2", self.global_norm2(err))
         if self.debug1:
             dprint1("Exiting Cycle lvl =  ", lvl)
             dprint1("========\n")
@@ -1220,11 +1265,46 @@ def fill_prolongation_operator(engine, level, XX, AA, ls_type, phys_real):
     return P
 
 
-def generate_smoother(engine, level, blk_opr):
-    from petram.engine import ParallelEngine
-    assert not isinstance(
-        engine, ParallelEngine), "Parallel is not supported"
+smoother_types = ['chebyshev', 'l1jacobi', 'l1gs']
+
+
+def make_block_smoother(mat, ess_tdof, diag=None, fes=None,
+                        smoother_type='chebyshev', singular_nd=False):
+    '''
+    smoother for one diagonal block.
+
+    serial: OperatorChebyshevSmoother using diag
+    parallel: HypreSmoother (Chebyshev, l1-Jacobi, l1-GS), or
+              HypreAMS if fes is H(curl)
+
+    singular_nd: H(curl) block is pure curl-curl (no mass term).
+                 HypreAMS is told that the problem is singular.
+    '''
+    if not use_parallel:
+        return mfem.OperatorChebyshevSmoother(mat, diag, ess_tdof, 2)
+
+    if fes is not None and fes.FEColl().Name().startswith('ND'):
+        smoother = mfem.HypreAMS(mat, fes)
+        if singular_nd:
+            smoother.SetSingularProblem()
+        smoother.iterative_mode = False
+        return smoother
+
+    if smoother_type == 'chebyshev':
+        t = mfem.HypreSmoother.Chebyshev
+    elif smoother_type == 'l1jacobi':
+        t = mfem.HypreSmoother.l1Jacobi
+    elif smoother_type == 'l1gs':
+        t = mfem.HypreSmoother.l1GS
+    else:
+        assert False, "unknown smoother type: " + smoother_type
+    smoother = mfem.HypreSmoother(mat, t)
+    smoother.iterative_mode = False
+    return smoother
 
+
+def generate_smoother(engine, level, blk_opr, smoother_type='chebyshev',
+                      singular_nd=False):
     engine.access_idx = 0
     P = None
     diags = []
@@ -1240,52 +1320,65 @@ def generate_smoother(engine, level, blk_opr):
 
         tmp_cols = []
         tmp_diags = []
+        conv = 1
         if engine.r_isFESvar(dep_var):
             ess_tdof = mfem.intArray(engine.ess_tdofs[dep_var])
-            ess_tdofs.append(ess_tdofs)
+            ess_tdofs.append(ess_tdof)
             opr = A[offset, offset]
+            fes = engine.fespaces[dep_var]
 
             if use_complex_opr:
                 mat = blk_opr._linked_op[(offset, offset)]
                 conv = mat.GetConvention()
-                conv == 1 if mfem.ComplexOperator.HERMITIAN else -1
+                conv = 1 if conv == mfem.ComplexOperator.HERMITIAN else -1
                 mat1 = mat._real_operator
                 mat2 = mat._imag_operator
             else:
-                conv = 1
                 if A.complex:
                     mat1 = blk_opr.GetBlock(offset*2, offset*2)
                     mat2 = blk_opr.GetBlock(offset*2 + 1, offset*2 + 1)
                 else:
                     mat1 = blk_opr.GetBlock(offset, offset)
 
-            if A.complex:
+            if use_parallel:
+                # diagonal is computed by HYPRE
+                diag1 = None
+                diag2 = None
+                width = mat1.Width()
+            else:
                 dd = opr.diagonal()
-                diag = mfem.Vector(list(dd.real))
-                rsmoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                           diag,
-                                                           ess_tdof,
-                                                           2)
-                dd = opr.diagonal()*conv
-                diag = mfem.Vector(list(dd.real))
-                ismoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                           diag,
-                                                           ess_tdof,
-                                                           2)
-                tmp_cols.append(opr.shape[0])
-                tmp_cols.append(opr.shape[0])
+                diag1 = mfem.Vector(list(dd.real))
+                diag2 = mfem.Vector(list((dd*conv).real))
+                width = opr.shape[0]
+
+            rsmoother = make_block_smoother(mat1, ess_tdof, diag=diag1,
+                                            fes=fes,
+                                            smoother_type=smoother_type,
+                                            singular_nd=singular_nd)
+            if A.complex:
+                if use_parallel and use_complex_opr:
+                    # (imag, imag) block of real equivalent form is
+                    # conv * real part
+                    if conv == -1:
+                        ismoother = mfem.ScaleOperator(rsmoother, -1)
+                        ismoother._opr = rsmoother
+                    else:
+                        ismoother = rsmoother
+                elif use_parallel:
+                    ismoother = make_block_smoother(mat2, ess_tdof, fes=fes,
+                                                    smoother_type=smoother_type,
+                                                    singular_nd=singular_nd)
+                else:
+                    ismoother = make_block_smoother(mat1, ess_tdof,
+                                                    diag=diag2)
+                tmp_cols.append(width)
+                tmp_cols.append(width)
                 tmp_diags.append(rsmoother)
                 tmp_diags.append(ismoother)
 
             else:
-                dd = opr.diagonal()
-                diag = mfem.Vector(list(dd))
-                smoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                          diag,
-                                                          ess_tdof,
-                                                          2)
-                tmp_diags.append(smoother)
-                tmp_cols.append(opr.shape[0])
+                tmp_diags.append(rsmoother)
+                tmp_cols.append(width)
 
         else:
             tmp_cols.append(widths[offset])
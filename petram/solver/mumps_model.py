@@ -1112,59 +1112,15 @@ class MUMPSBlockPreconditioner(mfem.Solver):
 
     def real_to_complex(self, x):
         '''
-        if use_parallel:
-           from mpi4py import MPI
-           myid     = MPI.COMM_WORLD.rank
-
-
-           offset = M.RowOffsets().ToList()
-           of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o))) for o in offset]
-           if myid != 0: return
-
-        else:
-            pass
+        x is local (block_offset is local) in the merged layout
         '''
-
-        rows = len(self.block_size)
-        of = self.block_offset
-        pt = 0
-        x2 = np.zeros(of[-1] // 2, dtype=self.dtype)
-
-        for i in range(rows):
-            l = of[i + 1] - of[i]
-            w = int(l // 2)
-            x2[pt:pt + w] = x[of[i]:of[i] + w] + 1j * x[(of[i] + w):of[i + 1]]
-            pt = pt + w
-
-        return x2
+        from petram.solver.complex_conversion import real_to_complex
+        return real_to_complex(x, self.block_offset, 'merged',
+                               dtype=self.dtype)
 
     def complex_to_real(self, y):
-        '''
-        if use_parallel:
-           from mpi4py import MPI
-           myid     = MPI.COMM_WORLD.rank
-
-
-           offset = M.RowOffsets().ToList()
-           of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o))) for o in offset]
-           if myid != 0: return
-
-        else:
-            pass
-        '''
-        rows = len(self.block_size)
-        of = self.block_offset
-        pt = 0
-        y2 = np.zeros(of[-1], dtype=np.float)
-        for i in range(rows):
-            l = of[i + 1] - of[i]
-            w = int(l // 2)
-            y2[of[i]:(of[i] + w)] = y[pt:pt + w].real
-            y2[(of[i] + w):(of[i] + w + w)] = y[pt:pt + w].imag
-            pt = pt + w
-
-        #assert False, "test"
-        return y2
+        from petram.solver.complex_conversion import complex_to_real
+        return complex_to_real(y, self.block_offset, 'merged')
 
     def Mult(self, x, y):
         if use_parallel:
@@ -1,6 +1,7 @@
 import os
 import traceback
 import gc
+import numpy as np
 
 from petram.model import Model
 from petram.solver.solver_model import Solver, SolveStep
@@ -235,7 +236,8 @@ class Parametric(SolveStep, NS_mixin):
                         if ksol == 0:
                             instance.save_solution(mesh_only = True,
                                                    save_parmesh = s.save_parmesh )
-                        A.reformat_central_mat(solall, ksol, X[0], mask)
+                        A.reformat_sol(solall, ksol, X[0], mask,
+                                       central=linearsolver.is_sol_central)
                         instance.sol = X[0]
                         for p in instance.probe:
                              p.append_sol(X[0])
@@ -267,7 +269,7 @@ class Parametric(SolveStep, NS_mixin):
             os.chdir(dirname)
             for f, p in zip(filenames, probes):
                 xdata, ydata =  load_probe(f)
-                p.append_value(ydata, param)
+                p.append_value(np.asarray(ydata).flatten(), param)
 
         os.chdir(od)
         for p in probes:
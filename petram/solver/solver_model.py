@@ -875,6 +875,9 @@ class LinearSolver(ABC):
     LinearSolver is an interface to linear solvers such as MUMPS.
     '''
     is_iterative = True
+    # True if Mult returns the solution gathered in root node.
+    # False if each node returns its own part of solution.
+    is_sol_central = True
 
     def __init__(self, gui, engine):
         self.gui = gui
@@ -896,70 +899,15 @@ class LinearSolver(ABC):
         self._skip_solve = val
 
 def convert_realblocks_to_complex(solall, M, merge_real_imag):
-    if merge_real_imag:
-        return real_to_complex_merged(solall, M)
-    else:
-        return real_to_complex_interleaved(solall, M)
+    from petram.solver.complex_conversion import convert_realblocks_to_complex
+    return convert_realblocks_to_complex(solall, M, merge_real_imag)
 
 
 def real_to_complex_interleaved(solall, M):
-    from petram.mfem_config import use_parallel
-    if use_parallel:
-        from mpi4py import MPI
-        myid = MPI.COMM_WORLD.rank
-
-        of = M.RowOffsets().ToList()
-        # of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
-        #      for o in offset]
-        # if myid != 0:
-        #    return
-
-    else:
-        offset = M.RowOffsets()
-        of = offset.ToList()
-
-    rows = M.NumRowBlocks()
-    s = solall.shape
-    nb = rows // 2
-    i = 0
-    pt = 0
-    result = np.zeros((s[0] // 2, s[1]), dtype='complex')
-    for j in range(nb):
-        l = of[i + 1] - of[i]
-        result[pt:pt + l, :] = (solall[of[i]:of[i + 1], :]
-                                + 1j * solall[of[i + 1]:of[i + 2], :])
-        i = i + 2
-        pt = pt + l
-
-    return result
+    from petram.solver.complex_conversion import real_to_complex, get_offsets
+    return real_to_complex(solall, get_offsets(M), 'interleave')
 
 
 def real_to_complex_merged(solall, M):
-    from petram.mfem_config import use_parallel
-    if use_parallel:
-        from mpi4py import MPI
-        myid = MPI.COMM_WORLD.rank
-
-        of = M.RowOffsets().ToList()
-        # of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
-        #      for o in offset]
-        # if myid != 0:
-        #    return
-
-    else:
-        offset = M.RowOffsets()
-        of = offset.ToList()
-
-    rows = M.NumRowBlocks()
-    s = solall.shape
-    i = 0
-    pt = 0
-
-    result = np.zeros((s[0] // 2, s[1]), dtype='complex')
-    for i in range(rows):
-        l = of[i + 1] - of[i]
-        w = int(l // 2)
-        result[pt:pt + w, :] = (solall[of[i]:of[i] + w, :]
-                                + 1j * solall[(of[i] + w):of[i + 1], :])
-        pt = pt + w
-    return result
+    from petram.solver.complex_conversion import real_to_complex, get_offsets
+    return real_to_complex(solall, get_offsets(M), 'merged')
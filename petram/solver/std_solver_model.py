@@ -250,7 +250,8 @@ class StandardSolver(SolverInstance):
         if not self.phys_real and self.gui.assemble_real:
             solall = self.linearsolver_model.real_to_complex(solall, AA)
 
-        A.reformat_central_mat(solall, 0, X[0], mask)
+        A.reformat_sol(solall, 0, X[0], mask,
+                       central=linearsolver.is_sol_central)
         self.sol = X[0]
 
         # store probe signal (use t=0.0 in std_solver)
@@ -9,7 +9,7 @@ from petram.namespace_mixin import NS_mixin
 import sys
 import numpy as np
 import scipy
-from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse import csr_matrix
 
 import petram.debug as debug
 dprint1, dprint2, dprint3 = debug.init_dprints('StrumpackModel')
@@ -206,32 +206,8 @@ class Strumpack(LinearSolverModel):
             assert False, "should not come here"
 
     def real_to_complex_merged(self, solall, M):
-        if use_parallel:
-            from mpi4py import MPI
-            myid = MPI.COMM_WORLD.rank
-
-            offset = M.RowOffsets().ToList()
-            of = [np.sum(MPI.COMM_WORLD.allgather(np.int32(o)))
-                  for o in offset]
-            if myid != 0:
-                return
-
-        else:
-            offset = M.RowOffsets()
-            of = offset.ToList()
-        dprint1(of)
-        rows = M.NumRowBlocks()
-        s = solall.shape
-        i = 0
-        pt = 0
-        result = np.zeros((s[0] // 2, s[1]), dtype='complex')
-        for i in range(rows):
-            l = of[i + 1] - of[i]
-            w = int(l // 2)
-            result[pt:pt + w, :] = (solall[of[i]:of[i] + w, :]
-                                    + 1j * solall[(of[i] + w):of[i + 1], :])
-            pt = pt + w
-        return result
+        from petram.solver.complex_conversion import convert_realblocks_to_complex
+        return convert_realblocks_to_complex(solall, M, True, central=True)
 
     def allocate_solver(self, is_complex=False, engine=None):
         solver = StrumpackSolver(self, engine)
@@ -246,122 +222,150 @@ def get_block(Op, i, j):
         return None
 
 
+def _block_csr_arrays(m):
+    '''
+    local CSR arrays of SparseMatrix/HypreParMatrix
+
+    returns indptr, indices (global column), data
+    '''
+    if use_parallel:
+        (num_rows, ilower, iupper, jlower, jupper,
+         irn, jcn, data) = m.GetCooDataArray()
+        irn = irn - ilower
+        if len(irn) > 1 and np.any(irn[1:] < irn[:-1]):
+            idx = np.argsort(irn, kind='stable')
+            irn, jcn, data = irn[idx], jcn[idx], data[idx]
+        indptr = np.hstack(([0], np.cumsum(np.bincount(irn,
+                                                       minlength=num_rows))))
+        return indptr, jcn, data
+    else:
+        return m.GetIArray(), m.GetJArray(), m.GetDataArray()
+
+
 def build_csr_local(A, dtype, is_complex):
     '''
     build CSR form of A as a single
     matrix
+
+    rows are local rows of A (in the order of x, rhs elements).
+    columns are global columns ordered by process first and then by
+    block (the same ordering as rows).
+
+    column index of each block is remapped using a permutation
+    computed once for each block column. CSR is filled in two passes
+    (count nnz per row, and fill) so that the matrix is not copied
+    to intermediate coo/bmat forms. a complex block is expanded to
+    [[mr, -mi], [mi, mr]] (if not is_complex) or mr + 1j*mi on the
+    fly.
     '''
     # print("build_csr_local", dtype, is_complex)
     offset = np.array(A.RowOffsets().ToList(), dtype=int)
-    coffset = np.array(A.ColOffsets().ToList(), dtype=int)
     if is_complex:
         offset = offset // 2
-    # nicePrint("offets", offset, coffset)
     rows = A.NumRowBlocks()
     cols = A.NumColBlocks()
 
     local_size = np.diff(offset)
-    # nicePrint("local_size",local_size)
 
     if use_parallel:
         x = allgather_vector(local_size)
-        global_size = np.sum(x.reshape(num_proc, -1), 0)
-        global_offset = np.hstack(([0], np.cumsum(global_size)))
-        # global_roffset = global_offset + offset
-        # nicePrint("global offset/roffset", global_offset)
         new_offset = np.hstack(([0], np.cumsum(x)))[:-1]
         new_size = x.reshape(num_proc, -1)
         new_offset = new_offset.reshape(num_proc, -1)
-        # nicePrint(new_size)
-        # nicePrint(new_offset)
     else:
-        global_size = local_size
         new_size = local_size.reshape(1, -1)
-        new_offset = offset.reshape(1, -1)
-
-    # index_mapping
-    def blk_stm_idx_map(i):
-        stm_idx = [new_offset[kk, i] +
-                   np.arange(new_size[kk, i], dtype=int)
-                   for kk in range(len(new_offset))]
-        return np.hstack(stm_idx)
-
-    def sparsemat2csr(m):
-        w, h = m.Width(), m.Height()
-        I = m.GetIArray()
-        J = m.GetJArray()
-        data = m.GetDataArray()
-        m = csr_matrix((data, J, I), shape=(h, w),
-                       dtype=data.dtype)
-        return m
-
-    def ToScipyCoo(mat):
-        '''
-        convert HypreParCSR to Scipy Coo Matrix
-        '''
-        num_rows, ilower, iupper, jlower, jupper, irn, jcn, data = mat.GetCooDataArray()
-        m = iupper - ilower + 1
-        n = mat.N()
-
-        return coo_matrix((data, (irn - ilower, jcn)),
-                          shape=(num_rows, n)), ilower
-
-    map = [blk_stm_idx_map(i) for i in range(rows)]
-    # nicePrint("map", map)
-    newi = []
-    newj = []
-    newd = []
+        new_offset = offset[:-1].reshape(1, -1)
+    ncols = np.sum(new_size)
     nrows = np.sum(local_size)
-    ncols = np.sum(global_size)
-
-    from scipy.sparse import bmat
 
-    elements = [None] * rows
-    elements = [elements.copy() for x in range(cols)]
+    # real-equivalent expansion of complex block
+    expand = [False] * cols
     for i in range(rows):
         for j in range(cols):
             m = get_block(A, i, j)
-            if m is None:
-                continue
-            if use_parallel:
-                if isinstance(m, mfem.ComplexOperator):
-                    if not is_complex:
-                        mr, ilower = ToScipyCoo(m._real_operator)
-                        mi, ilower = ToScipyCoo(m._imag_operator)
-                        m = bmat([[mr, -mi], [mi, mr]])
-                    else:
-                        mr, ilower = ToScipyCoo(m._real_operator)
-                        mi, ilower = ToScipyCoo(m._imag_operator)
-                        m = (mr + 1j * mi).tocoo()
-                else:
-                    m, ilower = ToScipyCoo(m)
+            if isinstance(m, mfem.ComplexOperator) and not is_complex:
+                expand[j] = True
+
+    # column index mapping:
+    #    global column of block j -> column of CSR
+    #    (for expanded block, imaginary part is at colmap + shift)
+    colmap = []
+    colshift = []
+    for j in range(cols):
+        size = new_size[:, j] // 2 if expand[j] else new_size[:, j]
+        colmap.append(np.repeat(new_offset[:, j] - np.hstack(([0], np.cumsum(size)[:-1])),
+                                size) + np.arange(np.sum(size)))
+        colshift.append(np.repeat(size, size))
+
+    def pieces(i, j):
+        '''
+        pieces of block (i, j):
+           (row offset, indptr, mapped column, data, factor)
+        '''
+        m = get_block(A, i, j)
+        if m is None:
+            return
+        r0 = offset[i]
+        if isinstance(m, mfem.ComplexOperator):
+            ptr_r, col_r, data_r = _block_csr_arrays(m._real_operator)
+            ptr_i, col_i, data_i = _block_csr_arrays(m._imag_operator)
+            if is_complex:
+                yield r0, ptr_r, colmap[j][col_r], data_r, 1
+                yield r0, ptr_i, colmap[j][col_i], data_i, 1j
             else:
-                # this is not efficient but for now let's do this...
-                if isinstance(m, mfem.ComplexOperator):
-                    if not is_complex:
-                        mr = m._real_operator
-                        mi = m._imag_operator
-                        mr = sparsemat2csr(mr)
-                        mi = sparsemat2csr(mi)
-                        m = bmat([[mr, -mi], [mi, mr]]).tocoo()
-                    else:
-                        mr = m._real_operator
-                        mi = m._imag_operator
-                        mr = sparsemat2csr(mr)
-                        mi = sparsemat2csr(mi)
-                        m = (mr + 1j * mi).tocoo()
-                else:
-                    m = sparsemat2csr(m).tocoo()
-
-            elements[i][j] = m
-    csr = bmat(elements, dtype=dtype).tocsr()
+                n = (offset[i + 1] - offset[i]) // 2
+                cr = colmap[j][col_r]
+                ci = colmap[j][col_i]
+                yield r0, ptr_r, cr, data_r, 1
+                yield r0, ptr_i, ci + colshift[j][col_i], data_i, -1
+                yield r0 + n, ptr_i, ci, data_i, 1
+                yield r0 + n, ptr_r, cr + colshift[j][col_r], data_r, 1
+        else:
+            ptr, col, data = _block_csr_arrays(m)
+            yield r0, ptr, colmap[j][col], data, 1
 
-    # when block is squashed in vertical direction
-    # we need to swap columns in order to match the order of x, rhs
-    # elements
+    # pass 1: nnz per row
+    counts = np.zeros(nrows, dtype=int)
+    has_duplicates = False
+    for i in range(rows):
+        for j in range(cols):
+            for r0, ptr, col, data, factor in pieces(i, j):
+                counts[r0:r0 + len(ptr) - 1] += np.diff(ptr)
+                has_duplicates = has_duplicates or factor == 1j
+
+    # STRUMPACK python interface uses 32 bit integer index
+    indptr = np.hstack(([0], np.cumsum(counts)))
+    imax = np.iinfo(np.int32).max
+    if indptr[-1] > imax or ncols > imax:
+        raise ValueError("STRUMPACK: matrix is too large for 32 bit index " +
+                         "(nnz=" + str(indptr[-1]) + ", ncols=" +
+                         str(ncols) + ")")
+    indptr = indptr.astype(np.int32)
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    data_all = np.empty(indptr[-1], dtype=dtype)
+
+    # pass 2: fill
+    fill = indptr[:-1].astype(int)
+    for i in range(rows):
+        for j in range(cols):
+            for r0, ptr, col, data, factor in pieces(i, j):
+                nnz = np.diff(ptr)
+                nr = len(nnz)
+                pos = (np.repeat(fill[r0:r0 + nr] - ptr[:-1], nnz) +
+                       np.arange(ptr[-1]))
+                indices[pos] = col
+                if factor == 1:
+                    data_all[pos] = data
+                else:
+                    data_all[pos] = data * factor
+                fill[r0:r0 + nr] += nnz
 
-    csr2 = csr[:, np.argsort(np.hstack(map))]
-    return csr2
+    csr = csr_matrix((data_all, indices, indptr), shape=(nrows, ncols))
+    if has_duplicates:
+        csr.sum_duplicates()
+    else:
+        csr.sort_indices()
+    return csr
 
 
 class StrumpackSolver(LinearSolver):
@@ -550,18 +554,9 @@ class StrumpackSolver(LinearSolver):
                 xx = x
 
             if self.is_complex:
-                tmp1 = []
-                tmp2 = []
-                for i in range(len(row_offsets) - 1):
-                    bbv = bb.GetBlock(i).GetDataArray()
-                    xxv = xx.GetBlock(i).GetDataArray()
-                    ll = bbv.size
-                    bbv = bbv[:ll // 2] + 1j * bbv[ll // 2:]
-                    xxv = xxv[:ll // 2] + 1j * xxv[ll // 2:]
-                    tmp1.append(bbv)
-                    tmp2.append(xxv)
-                bbv = np.hstack(tmp1)
-                xxv = np.hstack(tmp2)
+                from petram.solver.complex_conversion import real_to_complex
+                bbv = real_to_complex(bb.GetDataArray(), row_offsets, 'merged')
+                xxv = real_to_complex(xx.GetDataArray(), row_offsets, 'merged')
             else:
                 bbv = bb.GetDataArray()
                 xxv = xx.GetDataArray()
@@ -19,6 +19,11 @@ class DerivedValue(StdSolver):
         instance.set_blk_mask()        
         return instance
     
+checkpoint_modes = ["Full",
+                    "Incremental",
+                    "Incremental (compressed)",
+                    "Incremental (delta)"]
+
 class TimeStep():
     def __init__(self, data):
         self.data = list(np.atleast_1d(data))
@@ -41,12 +46,15 @@ class TimeDomain(Solver):
         v['ts_method'] = "Backward Euler"
         v['abe_minstep']= 0.01
         v['abe_maxstep']= 1.0
+        v['abe_rtol']= 1e-3
+        v['abe_atol']= 1e-6
         v['use_dwc_cp']   = False   # check point
         v['dwc_cp_name']   = ''              
         v['dwc_cp_arg']   = ''      
         v['use_dwc_ts']   = False   # every time step
         v['dwc_ts_name']   = ''                      
         v['dwc_ts_arg']   = ''      
+        v['checkpoint_mode'] = 'Full'
         
         super(TimeDomain, self).attribute_set(v)
         return v
@@ -54,7 +62,9 @@ class TimeDomain(Solver):
     def panel1_param(self):
         elp_be =  [["dt", "", 0, {}],]
         elp_abe =  [["min. dt", "", 0, {}],
-                    ["max. dt", "", 0, {}],]
+                    ["max. dt", "", 0, {}],
+                    ["rel. tol", "", 0, {}],
+                    ["abs. tol", "", 0, {}],]
         ret_cp = [["dwc",   self.dwc_cp_name,   0, {}],
                   ["args.",   self.dwc_cp_arg,   0, {}],]
         value_cp = [self.dwc_cp_name, self.dwc_cp_arg]
@@ -87,7 +97,9 @@ class TimeDomain(Solver):
                 [None,
                  self.save_parmesh,  3, {"text":"save parallel mesh"}],
                 [None,
-                 self.use_profiler,  3, {"text":"use profiler"}],]
+                 self.use_profiler,  3, {"text":"use profiler"}],
+                ["checkpoint", self.checkpoint_mode, 4,
+                 {"readonly": True, "choices": checkpoint_modes}],]
 
     def get_panel1_value(self):
         st_et_nt = ", ".join([str(x) for x in self.st_et_nt])
@@ -99,7 +111,8 @@ class TimeDomain(Solver):
                  [str(self.time_step),],
                  [str(self.time_step_cnk),],
                  [str(self.time_step_fe),],                                  
-                 [str(self.abe_minstep), str(self.abe_maxstep),],
+                 [str(self.abe_minstep), str(self.abe_maxstep),
+                  str(self.abe_rtol), str(self.abe_atol),],
                 ],
                 [self.use_dwc_cp, [self.dwc_cp_name, self.dwc_cp_arg,]],
                 [self.use_dwc_ts, [self.dwc_ts_name, self.dwc_ts_arg,]],            
@@ -107,7 +120,8 @@ class TimeDomain(Solver):
                 self.init_only,               
                 self.assemble_real,
                 self.save_parmesh,
-                self.use_profiler,)
+                self.use_profiler,
+                self.checkpoint_mode,)
 
     
     def import_panel1_value(self, v):
@@ -122,6 +136,7 @@ class TimeDomain(Solver):
         self.assemble_real = v[8]
         self.save_parmesh = v[9]
         self.use_profiler = v[10]
+        self.checkpoint_mode = str(v[11])
         
         self.ts_method = str(v[3][0])
         self.time_step = str(v[3][1][0])
@@ -129,6 +144,8 @@ class TimeDomain(Solver):
         self.time_step_fe = str(v[3][3][0])                
         self.abe_minstep  = float(v[3][4][0])
         self.abe_maxstep  = float(v[3][4][1])
+        self.abe_rtol  = float(v[3][4][2])
+        self.abe_atol  = float(v[3][4][3])
         self.use_dwc_cp   = v[4][0]
         self.dwc_cp_name  = v[4][1][0]                           
         self.dwc_cp_arg   = v[4][1][1]         
@@ -174,12 +191,26 @@ class TimeDomain(Solver):
         return [self[key] for key in self
                 if isinstance(self[key],DerivedValue) and self[key].enabled]
     
+    @property
+    def use_incremental_checkpoint(self):
+        return self.checkpoint_mode.startswith('Incremental')
+
+    def allocate_checkpoint_writer(self, engine, path):
+        from petram.sol.checkpoint import CheckpointWriter
+        return CheckpointWriter(path, engine.solfile_suffix(),
+                                compress = self.checkpoint_mode != "Incremental",
+                                delta = self.checkpoint_mode == "Incremental (delta)")
+
     @debug.use_profiler
     def run(self, engine, is_first=True):
         if self.clear_wdir:
             engine.remove_solfiles()
 
-        fid = engine.open_file('checkpoint.'+self.parent.name()+'_'+self.name()+'.txt', 'w')
+        if self.use_incremental_checkpoint:
+            # time is recorded in the binary index
+            fid = None
+        else:
+            fid = engine.open_file('checkpoint.'+self.parent.name()+'_'+self.name()+'.txt', 'w')
         st, et, nt = self.st_et_nt
         
         if self.ts_method == 'Backward Euler' or self.ts_method == 'Backward Eular':
@@ -204,6 +235,7 @@ class TimeDomain(Solver):
             instance = FirstOrderBackwardEulerAT(self, engine)
             instance.set_timestep(self.abe_minstep)
             instance.set_maxtimestep(self.abe_maxstep)
+            instance.set_tolerance(self.abe_rtol, self.abe_atol)
         else:
             assert False, "unknown stepping method: "+ self.ts_method
             
@@ -284,6 +316,8 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
         self.assembled = False
         self.counter = 0
         self._dt_used_in_assemble = 0.0        
+        self.checkpoint_writer = None
+
     @property
     def time_step(self):
         return self._time_step(self.counter)
@@ -405,7 +439,8 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
             assert False, "this has to be debugged (convertion from real to complex)"
             solall = self.linearsolver_model.real_to_complex(solell, A)
 
-        A.reformat_central_mat(solall, 0, X[0], mask)
+        A.reformat_sol(solall, 0, X[0], mask,
+                       central=self.linearsolver.is_sol_central)
 
         # this apply interpolation operator 
         sol, sol_extra = engine.split_sol_array(X[0])
@@ -446,6 +481,9 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
         return self.time >= self.et, checkpoint_written
 
     def write_checkpoint_solution(self):
+        if self.gui.use_incremental_checkpoint:
+            self.write_incremental_checkpoint()
+            return
         dprint1("writing checkpoint t=" + str(self.time) +
                 "("+str(self.icheckpoint)+")")        
         od = os.getcwd()
@@ -457,6 +495,37 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
         self.save_solution()
         self.engine.symlink('../model.pmfm', 'model.pmfm')        
         os.chdir(od)
+
+    def write_incremental_checkpoint(self):
+        '''
+        mesh is saved once. variables are appended to checkpoint.data
+        and extra data is written to sol_extended_<idx>.data
+        '''
+        from petram.sol.checkpoint import extrafile_name
+
+        dprint1("writing checkpoint (incremental) t=" + str(self.time) +
+                "("+str(self.icheckpoint)+")")        
+        engine = self.engine
+        path = os.path.join(os.getcwd(), 'checkpoint_' + self.gui.parent.name()+'_'+
+                            self.gui.name())
+        if self.checkpoint_writer is None:
+            od = os.getcwd()
+            engine.mkdir(path)
+            os.chdir(path)
+            engine.cleancwd()
+            self.save_solution(mesh_only = True,
+                               save_parmesh = self.gui.save_parmesh)
+            engine.symlink('../model.pmfm', 'model.pmfm')
+            os.chdir(od)
+            self.checkpoint_writer = self.gui.allocate_checkpoint_writer(engine, path)
+
+        sol, sol_extra = engine.split_sol_array(self.sol)
+        engine.recover_sol(sol)
+        extra_data = engine.process_extra(sol_extra)
+        engine.save_sol_to_checkpoint(self.get_phys(), self.checkpoint_writer,
+                                      self.icheckpoint, self.time)
+        engine.save_extra_to_file(extra_data,
+                                  extrafile_name=os.path.join(path, extrafile_name(self.icheckpoint)))
         
 class CrankNicolson(FirstOrderBackwardEuler):
     def compute_A(self, M, B, X, mask_M, mask_B):
@@ -496,151 +565,237 @@ class FirstOrderForwardEuler(FirstOrderBackwardEuler):
     
     
 class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
+    '''
+    Backward Euler with adaptive time step
+
+    time step is dt_min * 2**idt. linear solvers (factorizations) are
+    kept for each idt in self.linearsolver[idt].
+
+    local error is estimated by comparing the BE solution with the
+    linear extrapolation of the last two solutions (predictor)
+         err = dt/(2 dt + dt_prev) * (u_be - u_pred)
+    which does not need an extra solve. the weighted RMS norm of err
+    over all DoFs is used by a PI controller.
+    '''
+    safety = 0.9
+    fac_min = 0.2
+    fac_max = 2.0
+    k_i = 0.7 / 2.0    # BE local error is O(dt^2)
+    k_p = 0.4 / 2.0
+
     def __init__(self, gui, engine):
         FirstOrderBackwardEuler.__init__(self, gui, engine)
-        self.linearsolver  = {}
-        self.blocks1 = {}
-        self.sol1 = None
-        self.sol2 = None
-        self._time_step1 = 0
-        self._time_step2 = -1
-        self.maxstep = 0
+        self.linearsolver = {}
+        self.max_timestep = np.inf
+        self.rtol = 1e-3
+        self.atol = 1e-6
+        self._idt = 0
+        self._err_prev = None
+        self._sol_hist = []       # [(solall, dt), ...] of accepted steps
+        self._m_time_dependent = False
+
+        self.nsolve = 0
+        self.nreject = 0
 
     def set_maxtimestep(self, dt):
         self.max_timestep = dt
-    @property
-    def time_step1(self):
-        return (self.time_step_base)* 2**self._time_step1
-    @property
-    def time_step2(self):
-        return (self.time_step_base)* 2**self._time_step2
-    
+
+    def set_tolerance(self, rtol, atol):
+        self.rtol = rtol
+        self.atol = atol
+
     def set_timestep(self, time_step):
-        self.time_step = time_step
         self.time_step_base = time_step
-        
-    def assemble(self,idt=None):
-        flag = False
-        if idt is None:
-            idt = 0
-            flag = True
-        self.blocks1[idt] = self.engine.run_assemble_blocks(self.compute_A,
-                                                            self.compute_rhs,
-                                                            inplace=False)        
-        if flag:
-            self.blocks = self.blocks1[0]
-        else:
-            self.blocks = None
-            
-    def step(self):
-        dprint1("Entering step", self.time_step1)
-        def get_A_BB(mode, sol, recompute_rhs=False):
-            if sol is None: sol = self.sol
-            idt = self._time_step1 if mode == 0 else self._time_step2
-            dt  = self.time_step1 if mode == 0 else self.time_step2
-            self.time_step = dt            
-            if not idt in self.blocks1:
-                self.assemble(idt = idt)
-                A, X, RHS, Ae, B, M, depvars = self.blocks1[idt]
-                BB = engine.finalize_rhs([RHS], not self.phys_real,
-                                         format = self.ls_type, verbose=False)
-            else:
-                A, X, RHS, Ae, B, M, depvars = self.blocks1[idt]
-                if self.counter != 0 or recompute_rhs:
-                    # recompute RHS
-                    RHS = self.compute_rhs(M, B, [sol])
-                    RHS = engine.eliminateBC(Ae, X[1], RHS)
-                    RHS = engine.apply_interp(RHS=RHS)
-                BB = engine.finalize_rhs([RHS], not self.phys_real,
-                                         format = self.ls_type, verbose=False)
-            if not idt in self.linearsolver:
-                AA = engine.finalize_matrix(A, not self.phys_real,
-                                            format = self.ls_type, verbose=False)
-                if self.ls_type.startswith('coo'):
-                    datatype = 'Z' if (AA.dtype == 'complex') else 'D'
-                else:
-                    datatype = 'D'
-                self.linearsolver[idt]  = self.linearsolver_model.allocate_solver(datatype,
-                                                                                  engine)
-                self.linearsolver[idt].SetOperator(AA,
-                                                   dist = engine.is_matrix_distributed,
-                                                   name = depvars)
-                
-            return A, BB
-            
-        engine = self.engine
 
-        if not self.pre_assembled:
-            assert False, "pre_assmeble must have been called"
+    @property
+    def time_step(self):
+        return self.time_step_base * 2**self._idt
 
-        A, BB = get_A_BB(0, self.sol1)
-        solall = self.linearsolver[self._time_step1].Mult(BB)
-        sol1 = A.reformat_central_mat(solall, 0)
-        print("check sample1 (0)", [p.current_value(sol1) for p in self.probe])
-        
-        A, BB = get_A_BB(1, self.sol2)
-        solall2 = self.linearsolver[self._time_step2].Mult(BB)
-        sol2 = A.reformat_central_mat(solall2, 0)
-        print("check sample2 (1)", [p.current_value(sol2) for p in self.probe])
-        
-        A, BB = get_A_BB(1, sol2, recompute_rhs=True)
-        solall2 = self.linearsolver[self._time_step2].Mult(BB)
-        sol2 = A.reformat_central_mat(solall2, 0)
-        print("check sample2 (1)", [p.current_value(sol2) for p in self.probe])
+    def max_level(self):
+        if not np.isfinite(self.max_timestep):
+            return np.inf
+        return max(int(np.floor(np.log2(self.max_timestep /
+                                        self.time_step_base) + 1e-12)), 0)
 
-        sample1 = np.hstack([p.current_value(sol1) for p in self.probe]).flatten()
-        sample2 = np.hstack([p.current_value(sol2) for p in self.probe]).flatten()
-        
+    def error_norm(self, solall, dt):
+        '''
+        weighted RMS norm of the local error estimate (all DoFs)
+        '''
         from petram.mfem_config import use_parallel
+
+        if solall is None:
+            # non-root node of central solver
+            ss = 0.0
+            nn = 0
+        else:
+            (u0, dt0), (u1, dt1) = self._sol_hist[-2:]
+            pred = u1 + (u1 - u0) * (dt / dt1)
+            err = (solall - pred) * (dt / (2 * dt + dt1))
+            scale = self.atol + self.rtol * np.maximum(np.abs(solall),
+                                                       np.abs(u1))
+            ss = np.sum(np.abs(err / scale)**2)
+            nn = err.size
+
         if use_parallel:
-             from petram.helper.mpi_recipes import allgather, allgather_vector
-             sample1 = allgather_vector(np.atleast_1d(sample1))
-             sample2 = allgather_vector(np.atleast_1d(sample2))
-             
-        delta=np.mean(np.abs(sample1-sample2)/np.abs(sample1+sample2)*2)
-    
-        threshold = 0.01
-        if delta > threshold:
-            dprint1("delta is large ", delta, sample1, sample2)
-            if self._time_step1 > 0:
-                self._time_step1 -= 1
-                self._time_step2 -= 1
-                dprint1("next try....", self.time_step1, self.time_step2)
-                return False                
+            from mpi4py import MPI
+            ss = MPI.COMM_WORLD.allreduce(ss)
+            nn = MPI.COMM_WORLD.allreduce(nn)
+        return np.sqrt(ss / max(nn, 1))
+
+    def step_factor(self, err, accepted):
+        if err == 0.0:
+            return self.fac_max
+        if accepted and self._err_prev is not None:
+            fac = (self.safety * err**(-self.k_i) *
+                   self._err_prev**self.k_p)
+        else:
+            fac = self.safety * err**(-0.5)
+        return min(max(fac, self.fac_min), self.fac_max)
+
+    def next_level(self, fac):
+        idt = self._idt + int(np.floor(np.log2(fac)))
+        return int(min(max(idt, 0), self.max_level()))
+
+    def solve_dt(self, is_first):
+        '''
+        assemble and solve with the current dt (self._idt)
+        '''
+        engine = self.engine
+        mask = self.blk_mask
+        idt = self._idt
+
+        if not (self.counter == 0 and is_first):
+            if self._dt_used_in_assemble != self.time_step:
+                engine.set_update_flag('UpdateAll')
+                time_dependent = False
             else:
-                dprint1("delta may be too large, but restricted by min time step")                
+                engine.set_update_flag('TimeDependent')
+                time_dependent = True
+            engine.run_apply_essential(self.get_phys(), self.get_phys_range(),
+                                       update=True)
+            engine.run_fill_X_block(update=True)
+            self.pre_assemble(update=True)
+            M_changed = self.assemble(update=True)
+            if M_changed and time_dependent:
+                # operator depends on time. factorizations can not be kept
+                self._m_time_dependent = True
+            if self._m_time_dependent:
+                self.linearsolver = {}
+
+        A, X, RHS, Ae, B, M, depvars = self.blocks
+        BB = engine.finalize_rhs([RHS], A, X[-1], mask,
+                                 not self.phys_real, format=self.ls_type,
+                                 verbose=False)
+
+        if not idt in self.linearsolver:
+            dprint1("preparing linear solver for dt = " + str(self.time_step))
+            AA = engine.finalize_matrix(A, mask,
+                                        not self.phys_real, format=self.ls_type,
+                                        verbose=False)
+            depvars = [x for i, x in enumerate(depvars) if mask[0][i]]
+            linearsolver = self.linearsolver_model.allocate_solver(
+                self.gui.is_complex(), engine)
+            linearsolver.SetOperator(AA, dist=engine.is_matrix_distributed,
+                                     name=depvars)
+            self.linearsolver[idt] = linearsolver
+        linearsolver = self.linearsolver[idt]
+
+        if linearsolver.is_iterative:
+            XX = engine.finalize_x(X[-1], RHS, mask, not self.phys_real,
+                                   format=self.ls_type)
         else:
-            dprint1("delta good  ", delta, sample1, sample2)
-        
+            XX = None
+        solall = linearsolver.Mult(BB, x=XX, case_base=engine.case_base)
+        self.nsolve += 1
+        return solall, linearsolver
+
+    def step(self, is_first):
+        engine = self.engine
+        mask = self.blk_mask
+        engine.copy_block_mask(mask)
+
+        if self.counter == 0:
+            self.sol = engine.sol
+            self.write_checkpoint_solution()
+            self.icheckpoint += 1
+
+        while True:
+            dt = self.time_step
+            solall, linearsolver = self.solve_dt(is_first)
+            is_first = False
+
+            if len(self._sol_hist) < 2:
+                # not enough history for error estimate
+                err = None
+                break
+
+            err = self.error_norm(solall, dt)
+            if err <= 1.0:
+                break
+            if self._idt == 0:
+                dprint1("error (" + str(err) + ") is large, but restricted " +
+                        "by min time step")
+                break
+
+            self.nreject += 1
+            idt = min(self.next_level(self.step_factor(err, False)),
+                      self._idt - 1)
+            dprint1("step rejected (error = " + str(err) + "), dt: " +
+                    str(dt) + " -> " + str(self.time_step_base * 2**idt))
+            self._idt = idt
+
+        engine.case_base += 1
+
         if not self.phys_real and self.assemble_real:
             assert False, "this has to be debugged (convertion from real to complex)"
-            solall = self.linearsolver_model.real_to_complex(solell, A)
-            
-        self.time = self.time + self.time_step1
-        self.counter += 1
-        
-        self.sol = A.reformat_central_mat(solall, 0)
-        self.sol1 = self.sol
-        self.sol2 = self.sol        
 
+        A, X, RHS, Ae, B, M, depvars = self.blocks
+        A.reformat_sol(solall, 0, X[0], mask,
+                       central=linearsolver.is_sol_central)
+
+        sol, sol_extra = engine.split_sol_array(X[0])
+
+        for name in self.time_deriv_vars:
+            offset1 = engine.dep_var_offset(name)       # vt
+            offset2 = engine.dep_var_offset(name[:-1])  # v
+            X[0][offset1, 0] = (X[0][offset2, 0] -
+                                X[-1][offset2, 0]) * (1. / dt)
+
+        for child in self.child_instance:
+            child.solve(update_operator=(self.counter == 0))
+
+        self.time = self.time + dt
+        self.counter += 1
         for p in self.probe:
-            p.append_sol(self.sol, self.time)
-                
-        if self.checkpoint[self.icheckpoint] < self.time:
-            self.write_checkpoint_solution()
-            self.icheckpoint += 1
+            p.append_sol(X[0], self.time)
 
-        dprint1("TimeStep ("+str(self.counter)+ "), t="+str(self.time)+"...done.")
-        if delta < threshold/4:
-            dt_test = (self.time_step_base)* 2**(self._time_step1 + 1)
-            if self.max_timestep >  dt_test:
-                 self._time_step1 += 1
-                 self._time_step2 += 1
-                 dprint1("next try....", self.time_step1, self.time_step2)
-            else:
-                 dprint1("delta is small, but restricted by max time step")
-        return self.time >= self.et
-                      
+        # swap X[0] and X[-1] for next computing
+        tmp = X[0]
+        X[0] = X[-1]
+        X[-1] = tmp
+        self.sol = X[-1]
+        engine.sol = self.sol
 
+        engine.recover_sol(sol, access_idx=-1)
+        extra_data = engine.process_extra(sol_extra)
+
+        self._sol_hist = self._sol_hist[-1:] + [(solall, dt)]
 
+        # next time step
+        if err is not None:
+            fac = self.step_factor(err, True)
+            self._err_prev = max(err, 1e-4)
+            self._idt = self.next_level(fac)
 
+        checkpoint_written = False
+        if self.checkpoint[self.icheckpoint] < self.time:
+            self.write_checkpoint_solution()
+            self.icheckpoint += 1
+            checkpoint_written = True
+
+        dprint1("TimeStep (" + str(self.counter) + "), t=" + str(self.time) +
+                ", dt=" + str(dt) + ", error=" + str(err) +
+                " (solves=" + str(self.nsolve) +
+                ", rejected=" + str(self.nreject) + ")...done.")
+        dprint1(debug.format_memory_usage())
+        return self.time >= self.et, checkpoint_written
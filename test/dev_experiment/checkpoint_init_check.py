@@ -0,0 +1,73 @@
+'''
+ write incremental checkpoints (delta encoded) of a GridFunction and
+ initialize from "checkpoint_x#1" using Engine.apply_init_from_file.
+ requires PyMFEM.
+
+   python checkpoint_init_check.py
+'''
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(False)
+
+from petram.engine import Engine
+from petram.sol.checkpoint import CheckpointWriter, extrafile_name
+
+mesh = mfem.Mesh(4, 4, "TRIANGLE")
+fec = mfem.H1_FECollection(2, mesh.Dimension())
+fes = mfem.FiniteElementSpace(mesh, fec)
+ndof = fes.GetVSize()
+
+tmpdir = tempfile.mkdtemp()
+cpdir = os.path.join(tmpdir, 'checkpoint_x')
+os.mkdir(cpdir)
+mesh.Print(os.path.join(cpdir, 'solmesh_0'), 16)
+
+# three checkpoints (#1 is a delta record)
+data = [np.sin(np.arange(ndof) * (k + 1.0)) for k in range(3)]
+writer = CheckpointWriter(cpdir, '', delta=True)
+for k, d in enumerate(data):
+    writer.write(k, 0.1 * k, {'solr_u_0': d})
+    with open(os.path.join(cpdir, extrafile_name(k)), 'w') as fid:
+        fid.write('name : Phys1.u_out\nsize : 1\ndim : 0\ndtype: float64\n')
+        fid.write('0 ' + str(float(k)) + '\n')
+
+
+class Phys(object):
+    emesh_idx = 0
+    dep_vars = ['u']
+
+    def is_complex(self):
+        return False
+
+
+class CheckEngine(object):
+    # the part of Engine used by apply_init_from_file
+    apply_init_from_file = Engine.apply_init_from_file
+    load_extra_from_file = Engine.load_extra_from_file
+    solfile_name = Engine.solfile_name
+    extrafile_name = Engine.extrafile_name
+
+    def __init__(self):
+        self._init_done = []
+        self.r_x = [mfem.GridFunction(fes)]
+        self.i_x = [None]
+
+    def r_ifes(self, name):
+        return 0
+
+    def solfile_suffix(self):
+        return ''
+
+
+engine = CheckEngine()
+engine.r_x[0].Assign(1.0)
+engine.apply_init_from_file(Phys(), os.path.join(tmpdir, 'checkpoint_x#1'))
+
+print("solution restored", np.array_equal(engine.r_x[0].GetDataArray(),
+                                          data[1]))
+print("extra restored", engine.sol_extra)
+shutil.rmtree(tmpdir)
@@ -0,0 +1,116 @@
+'''
+ compare find_edge_corner/find_corner with the reference (previous,
+ dict based) implementation on meshes in data/. requires PyMFEM.
+
+   python extended_connectivity_check.py
+'''
+import os
+import numpy as np
+from collections import defaultdict, OrderedDict
+from scipy.sparse import coo_matrix
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(False)
+
+from petram.mesh.mesh_utils import find_edge_corner, find_corner
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+
+
+def corners_and_vertices(mesh, lines):
+    corners = {}
+    for key in lines:
+        seen = defaultdict(int)
+        for iiv in lines[key]:
+            seen[iiv] += 1
+        corners[key] = [kk for kk in seen if seen[kk] == 1]
+
+    u = [x for key in corners for x in corners[key]]
+    u = np.unique(np.array(u, dtype=int))
+    vtx = [tuple(mesh.GetVertexArray(i)) for i in u]
+    tmp = sorted(zip(vtx, u))
+    vert2vert = {k + 1: x[1] for k, x in enumerate(tmp)}
+    return corners, vert2vert
+
+
+def ref_find_edge_corner(mesh):
+    edges = defaultdict(list)
+    for i in range(mesh.GetNBE()):
+        ie, io = mesh.GetBdrElementEdges(i)
+        edges[mesh.GetBdrAttribute(i)].extend(list(ie))
+    for key in edges.keys():
+        seen = defaultdict(int)
+        for x in edges[key]:
+            seen[x] += 1
+        edges[key] = [k for k in seen if seen[k] == 1]
+
+    nattr = np.max(mesh.GetBdrAttributeArray())
+    N = np.hstack([np.zeros(len(edges[k]), dtype=int) + k - 1 for k in edges])
+    M = np.hstack([np.array(edges[k], dtype=int) for k in edges])
+    csr = coo_matrix((M * 0 + 1, (M, N)),
+                     shape=(mesh.GetNEdges(), nattr), dtype=int).tocsr()
+    idx = np.where(np.diff(csr.indptr) >= 1)[0]
+    csr = csr[idx, :]
+
+    bb_edges = defaultdict(list)
+    for i in range(csr.shape[0]):
+        idxs = tuple(sorted(csr.indices[csr.indptr[i]:csr.indptr[i + 1]] + 1))
+        bb_edges[idxs].append(idx[i])
+    sorted_key = sorted(bb_edges, key=lambda x: (len(x), x))
+
+    lines = OrderedDict()
+    for k in sorted_key:
+        lines[k] = np.hstack([mesh.GetEdgeVertices(i)
+                              for i in np.unique(bb_edges[k])])
+    corners, vert2vert = corners_and_vertices(mesh, lines)
+    vv = {v: k for k, v in vert2vert.items()}
+
+    line2vert = {j + 1: sorted(vv[x] for x in corners[key])
+                 for j, key in enumerate(sorted_key)}
+    line2edge = {j + 1: list(bb_edges[key])
+                 for j, key in enumerate(sorted_key)}
+    surf2line = {k + 1: [] for k in range(nattr)}
+    for k, attr_set in enumerate(sorted_key):
+        for a in attr_set:
+            surf2line[a].append(k + 1)
+    return surf2line, line2vert, line2edge, vert2vert
+
+
+def ref_find_corner(mesh):
+    battrs = mesh.GetBdrAttributeArray()
+    iedges = [mesh.GetBdrElementEdgeIndex(i) for i in range(mesh.GetNBE())]
+    line2edge = defaultdict(list)
+    for a, ie in zip(battrs, iedges):
+        line2edge[a].append(ie)
+    sorted_key = sorted(line2edge)
+
+    lines = OrderedDict()
+    for k in sorted_key:
+        lines[k] = np.hstack([mesh.GetEdgeVertices(i) for i in line2edge[k]])
+    corners, vert2vert = corners_and_vertices(mesh, lines)
+    vv = {v: k for k, v in vert2vert.items()}
+
+    line2vert = {j + 1: sorted(vv[x] for x in corners[key])
+                 for j, key in enumerate(sorted_key)}
+    return line2vert, dict(line2edge), vert2vert
+
+
+def normalize(d):
+    return {int(k): [int(x) for x in np.atleast_1d(v)] for k, v in d.items()}
+
+
+for name in ['beam-tet.mesh', 'beam-tri.mesh', 'star.mesh',
+             'waveguide_hex.mesh']:
+    mesh = mfem.Mesh(os.path.join(data_dir, name), 1, 1, True)
+    if mesh.Dimension() == 3:
+        names = ['surf2line', 'line2vert', 'line2edge', 'vert2vert']
+        ret = find_edge_corner(mesh)
+        ref = ref_find_edge_corner(mesh)
+    else:
+        names = ['line2vert', 'line2edge', 'vert2vert']
+        ret = find_corner(mesh)
+        ref = ref_find_corner(mesh)
+
+    for n, x, y in zip(names, ret, ref):
+        ok = normalize(x) == normalize(y)
+        print(name.ljust(20) + n.ljust(10) + ": " + ("OK" if ok else "NG"))
@@ -0,0 +1,109 @@
+'''
+ iteration count/wall time of a frequency sweep with KrylovRecycler
+
+ H1 (order 2) problem (-div grad + k^2) u = 1 on star.mesh, k is
+ swept. each system is solved by GMRES + GS smoother, with different
+ initial guess modes and with/without preconditioner reuse.
+
+   python krylov_recycle_sweep.py
+   python krylov_recycle_sweep.py 40       (number of frequencies)
+'''
+import sys
+import os
+import time
+import numpy as np
+
+nfreq = 20
+if len(sys.argv) > 1:
+    nfreq = int(sys.argv[1])
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(False)
+
+from petram.solver.krylov_recycler import KrylovRecycler
+
+filename = os.path.join(os.path.dirname(__file__), '..', '..',
+                        'data', 'star.mesh')
+mesh = mfem.Mesh(filename)
+for i in range(3):
+    mesh.UniformRefinement()
+
+fec = mfem.H1_FECollection(2, mesh.Dimension())
+fes = mfem.FiniteElementSpace(mesh, fec)
+
+ess_bdr = mfem.intArray([1]*mesh.bdr_attributes.Max())
+ess_tdofs = mfem.intArray()
+fes.GetEssentialTrueDofs(ess_bdr, ess_tdofs)
+
+one = mfem.ConstantCoefficient(1.0)
+b = mfem.LinearForm(fes)
+b.AddDomainIntegrator(mfem.DomainLFIntegrator(one))
+b.Assemble()
+
+keep = []
+
+
+def system(k):
+    kk = mfem.ConstantCoefficient(k**2)
+    a = mfem.BilinearForm(fes)
+    a.AddDomainIntegrator(mfem.DiffusionIntegrator(one))
+    a.AddDomainIntegrator(mfem.MassIntegrator(kk))
+    a.Assemble()
+
+    x = mfem.GridFunction(fes)
+    x.Assign(0.0)
+    A = mfem.SparseMatrix()
+    B = mfem.Vector()
+    X = mfem.Vector()
+    a.FormLinearSystem(ess_tdofs, x, b, A, X, B)
+    keep.extend([a, kk, x])
+    return A, B
+
+
+freqs = np.linspace(1.0, 5.0, nfreq)
+systems = [system(k) for k in freqs]
+
+
+def sweep(init_guess, reuse_prc, reuse_prc_tol=0.2):
+    recycler = KrylovRecycler(init_guess=init_guess, recycle_dim=4,
+                              reuse_prc=reuse_prc,
+                              reuse_prc_tol=reuse_prc_tol)
+    t1 = time.perf_counter()
+    for A, B in systems:
+        if recycler.check_operator(A):
+            M = recycler.M
+        else:
+            M = mfem.GSSmoother(A)
+            recycler.set_preconditioner(M, A)
+
+        solver = mfem.GMRESSolver()
+        solver.SetKDim(50)
+        solver.SetRelTol(1e-10)
+        solver.SetAbsTol(0.0)
+        solver.SetMaxIter(2000)
+        solver.SetOperator(A)
+        solver.SetPreconditioner(M)
+        solver.iterative_mode = True
+
+        x = mfem.Vector(A.Width())
+        x.Assign(0.0)
+        recycler.initial_guess(A, B, x)
+        s1 = time.perf_counter()
+        solver.Mult(B, x)
+        s2 = time.perf_counter()
+        recycler.add_solution(x, solver.GetNumIterations(), s2 - s1)
+    t2 = time.perf_counter()
+
+    print("init guess = " + init_guess.ljust(12) +
+          ", reuse prc = " + str(reuse_prc).ljust(5) +
+          ", iterations = " + str(recycler.niter).rjust(6) +
+          ", prc builds = " + str(recycler.nprc).rjust(3) +
+          ", wall time = " + str(t2 - t1))
+
+
+print("size = " + str(systems[0][0].Height()) +
+      ", number of frequencies = " + str(nfreq))
+for mode in ['zero', 'previous', 'extrapolate', 'recycle']:
+    sweep(mode, False)
+for mode in ['zero', 'recycle']:
+    sweep(mode, True)
@@ -0,0 +1,97 @@
+'''
+ compare merge_domain_3d (find_merge_entities) with the reference
+ (previous, loop based) implementation on 3D meshes in data/.
+
+   python merge_domain_check.py
+
+ merged face groups are compared as partitions. the reference groups
+ surfaces greedily, so it may split a face which is connected through
+ removed lines. in such case the reference partition should be finer.
+'''
+import os
+import time
+import numpy as np
+from collections import defaultdict
+from itertools import combinations
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(False)
+
+from petram.mesh.mesh_utils import get_extended_connectivity
+from petram.mesh.composite import find_merge_entities, merge_domain_3d
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+
+
+def ref_find_merge_entities(v2s, s2l, domain_list):
+    v2l = {v: list(np.unique(np.hstack([s2l[s] for s in v2s[v]])).astype(int))
+           for v in v2s}
+    l2s = defaultdict(list)
+    for s in s2l:
+        for l in s2l[s]:
+            l2s[l].append(s)
+
+    remove_surf = []
+    remove_edge = set()
+    for i, j in combinations(domain_list, 2):
+        remove_surf.append(np.intersect1d(v2s[i], v2s[j]))
+    remove_surf = list(np.hstack(remove_surf).astype(int))
+
+    for s in remove_surf:
+        for l in s2l[s]:
+            for v in v2l:
+                if l in v2l[v] and not v in domain_list:
+                    break
+            else:
+                remove_edge.add(l)
+        for l in s2l[s]:
+            cs = [x for x in l2s[l] if not x in remove_surf]
+            if len(cs) != 2:
+                continue
+            v1 = [v for v in v2s if not v in domain_list and cs[0] in v2s[v]]
+            v2 = [v for v in v2s if not v in domain_list and cs[1] in v2s[v]]
+            if len(set(v1 + v2)) == 1:
+                remove_edge.add(l)
+    remove_edge = sorted(remove_edge)
+
+    merge_face0 = []
+    for l in remove_edge:
+        for f in merge_face0:
+            if np.intersect1d(list(f), l2s[l]).size != 0:
+                f.update(x for x in l2s[l] if not x in remove_surf)
+                break
+        else:
+            merge_face0.append(set(x for x in l2s[l] if not x in remove_surf))
+    merge_face = {s: k for k, f in enumerate(merge_face0) for s in f}
+    return sorted(set(int(x) for x in remove_surf)), remove_edge, merge_face
+
+
+def is_finer(p1, p2):
+    return all(p2[s] == p2[t] for s in p1 for t in p1 if p1[s] == p1[t])
+
+
+for name in ['beam-tet.mesh', 'waveguide_hex.mesh']:
+    mesh = mfem.Mesh(os.path.join(data_dir, name), 1, 1, True)
+    get_extended_connectivity(mesh)
+    v2s = mesh.extended_connectivity['vol2surf']
+    s2l = mesh.extended_connectivity['surf2line']
+
+    for n in range(2, len(v2s) + 1):
+        for domain_list in combinations(sorted(v2s), n):
+            domain_list = list(domain_list)
+            try:
+                t0 = time.perf_counter()
+                ret = find_merge_entities(v2s, s2l, domain_list)
+                t1 = time.perf_counter()
+            except AssertionError:
+                continue
+            ref = ref_find_merge_entities(v2s, s2l, domain_list)
+            ok = (sorted(ret[0]) == ref[0] and ret[1] == ref[1] and
+                  set(ret[2]) == set(ref[2]) and is_finer(ref[2], ret[2]))
+            print(name.ljust(20) + str(domain_list).ljust(20) +
+                  ("OK" if ok else "NG") + "  {:.3e}s".format(t1 - t0))
+
+            omesh = merge_domain_3d(mesh, domain_list)
+            print(" " * 20 + "merged mesh: NE={} NBE={} attrs={}".format(
+                omesh.GetNE(), omesh.GetNBE(),
+                sorted(set(omesh.GetAttributeArray()))))
@@ -0,0 +1,55 @@
+'''
+ compare mesh rebuilt from the binary mesh cache with mesh read from
+ the original file, and time both.
+
+   python mesh_cache_check.py
+'''
+import os
+import time
+import tempfile
+import numpy as np
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(False)
+
+from petram.mesh.mesh_cache import write_mesh_cache, read_mesh_cache
+from petram.mesh.mesh_arrays import element_vertices, vertex_coordinates
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+
+
+def summary(mesh):
+    ret = [mesh.GetNV(), mesh.GetNE(), mesh.GetNBE(), mesh.GetNEdges(),
+           mesh.GetNFaces()]
+    ret.append(np.round(vertex_coordinates(mesh), 12).tolist())
+    for bdr in (False, True):
+        ret.extend(x.tolist() for x in element_vertices(mesh, bdr=bdr))
+    ret.append(mesh.GetAttributeArray().tolist())
+    ret.append(mesh.GetBdrAttributeArray().tolist())
+    nodes = mesh.GetNodes()
+    if nodes is not None:
+        ret.append(np.round(nodes.GetDataArray(), 12).tolist())
+    return ret
+
+
+tmpdir = tempfile.mkdtemp()
+for name in ['beam-tet.mesh', 'beam-tri.mesh', 'star.mesh',
+             'waveguide_hex.mesh']:
+    path = os.path.join(data_dir, name)
+
+    t0 = time.perf_counter()
+    mesh1 = mfem.Mesh(path, 1, 1, True)
+    t1 = time.perf_counter()
+
+    filename = os.path.join(tmpdir, name + '.pmesh')
+    write_mesh_cache(filename, mesh1)
+
+    t2 = time.perf_counter()
+    mesh2 = read_mesh_cache(filename, 1, True)
+    t3 = time.perf_counter()
+
+    ok = summary(mesh1) == summary(mesh2)
+    print(name.ljust(20) + ("OK" if ok else "NG") +
+          "  file: {:.3e}s cache: {:.3e}s".format(t1 - t0, t3 - t2))
+    os.remove(filename)
+os.rmdir(tmpdir)
@@ -0,0 +1,72 @@
+'''
+ assembly and SpMV time before/after element reordering.
+
+   python mesh_reorder_bench.py [mesh file] [number of refinement]
+
+ the mesh is first shuffled randomly (to emulate a poorly ordered
+ mesh, such as NASTRAN conversion), then reordered by each method.
+'''
+import sys
+import os
+import time
+import numpy as np
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(False)
+
+from petram.mesh.mesh_reorder import methods, reorder_elements
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(data_dir,
+                                                          'beam-tet.mesh')
+nref = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+
+def bench(mesh, order=2, nmult=50):
+    fec = mfem.H1_FECollection(order, mesh.Dimension())
+    fes = mfem.FiniteElementSpace(mesh, fec)
+
+    one = mfem.ConstantCoefficient(1.0)
+    t0 = time.perf_counter()
+    bf = mfem.BilinearForm(fes)
+    bf.AddDomainIntegrator(mfem.DiffusionIntegrator(one))
+    bf.AddDomainIntegrator(mfem.MassIntegrator(one))
+    bf.Assemble()
+    bf.Finalize()
+    t1 = time.perf_counter()
+
+    mat = bf.SpMat()
+    x = mfem.Vector(fes.GetVSize())
+    x.Assign(1.0)
+    y = mfem.Vector(fes.GetVSize())
+    t2 = time.perf_counter()
+    for i in range(nmult):
+        mat.Mult(x, y)
+    t3 = time.perf_counter()
+
+    I = mat.GetIArray()
+    J = mat.GetJArray()
+    rows = np.repeat(np.arange(len(I) - 1), np.diff(I))
+    bandwidth = np.max(np.abs(rows - J))
+    return t1 - t0, (t3 - t2) / nmult, bandwidth, fes.GetVSize()
+
+
+def load_shuffled():
+    mesh = mfem.Mesh(path, 1, 1, True)
+    for i in range(nref):
+        mesh.UniformRefinement()
+    ordering = np.random.default_rng(0).permutation(mesh.GetNE())
+    mesh.ReorderElements(mfem.intArray(list(ordering)))
+    return mesh
+
+
+print("mesh: " + path + " (refined " + str(nref) + " times)")
+print("method".ljust(10) + "assembly(s)".rjust(14) + "SpMV(s)".rjust(14) +
+      "bandwidth".rjust(12) + "ndofs".rjust(10))
+for method in ['none'] + methods:
+    mesh = load_shuffled()
+    if method != 'none':
+        mesh = reorder_elements(mesh, method)
+    ta, tm, bw, ndofs = bench(mesh)
+    print(method.ljust(10) + "{:14.4e}{:14.4e}{:12d}{:10d}".format(ta, tm, bw,
+                                                                  ndofs))
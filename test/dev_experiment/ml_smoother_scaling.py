@@ -0,0 +1,98 @@
+'''
+ scaling of parallel multilevel smoother/prolongation
+
+ H1 Poisson problem on star.mesh, refined uniformly. smoothers are
+ made by make_block_smoother (HYPRE) and prolongations are taken
+ from ParFiniteElementSpaceHierarchy. CG is preconditioned by one
+ V-cycle.
+
+   mpirun -np 1 python ml_smoother_scaling.py
+   mpirun -np 4 python ml_smoother_scaling.py 5 l1gs
+       (number of refinements, smoother type)
+'''
+import sys
+import os
+import time
+
+nref = 4
+smoother_type = 'chebyshev'
+for param in sys.argv[1:]:
+    if param.isdigit():
+        nref = int(param)
+    else:
+        smoother_type = param
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(True)
+
+from petram.solver.ml_solver_model import make_block_smoother, generate_MG
+
+myid = MPI.COMM_WORLD.rank
+nprc = MPI.COMM_WORLD.size
+
+filename = os.path.join(os.path.dirname(__file__), '..', '..',
+                        'data', 'star.mesh')
+smesh = mfem.Mesh(filename)
+for i in range(2):
+    smesh.UniformRefinement()
+mesh = mfem.ParMesh(MPI.COMM_WORLD, smesh)
+
+fec = mfem.H1_FECollection(1, mesh.Dimension())
+fes = mfem.ParFiniteElementSpace(mesh, fec)
+hierarchy = mfem.ParFiniteElementSpaceHierarchy(mesh, fes, False, False)
+for i in range(nref):
+    hierarchy.AddUniformRefinement(1, mfem.Ordering.byNODES)
+
+one = mfem.ConstantCoefficient(1.0)
+keep = []
+
+t0 = time.perf_counter()
+operators = []
+smoothers = []
+for lvl in range(nref + 1):
+    f = hierarchy.GetFESpaceAtLevel(lvl)
+    ess_bdr = mfem.intArray([1]*f.GetMesh().bdr_attributes.Max())
+    ess_tdof = mfem.intArray()
+    f.GetEssentialTrueDofs(ess_bdr, ess_tdof)
+
+    a = mfem.ParBilinearForm(f)
+    a.AddDomainIntegrator(mfem.DiffusionIntegrator(one))
+    a.Assemble()
+    A = mfem.HypreParMatrix()
+    a.FormSystemMatrix(ess_tdof, A)
+    keep.extend([a, ess_tdof])
+
+    operators.append(A)
+    if lvl == 0:
+        s = mfem.HypreBoomerAMG(A)
+        s.SetPrintLevel(0)
+    else:
+        s = make_block_smoother(A, ess_tdof, fes=f,
+                                smoother_type=smoother_type)
+    smoothers.append(s)
+
+prolongations = [hierarchy.GetProlongationAtLevel(l) for l in range(nref)]
+mg = generate_MG(operators, smoothers, prolongations)
+t1 = time.perf_counter()
+
+A = operators[-1]
+b = mfem.Vector(A.Height())
+b.Assign(1.0)
+x = mfem.Vector(A.Width())
+x.Assign(0.0)
+
+cg = mfem.CGSolver(MPI.COMM_WORLD)
+cg.SetRelTol(1e-8)
+cg.SetMaxIter(200)
+cg.SetOperator(A)
+cg.SetPreconditioner(mg)
+cg.Mult(b, x)
+t2 = time.perf_counter()
+
+if myid == 0:
+    print("nproc = " + str(nprc) +
+          ", global size = " + str(A.GetGlobalNumRows()) +
+          ", smoother = " + smoother_type +
+          ", iterations = " + str(cg.GetNumIterations()) +
+          ", setup = " + str(t1 - t0) +
+          ", solve = " + str(t2 - t1))
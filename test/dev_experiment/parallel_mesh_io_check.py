@@ -0,0 +1,82 @@
+'''
+ compare ParMesh loaded by parallel_mesh_io with ParMesh made from
+ serial mesh replicated on all processes.
+
+   mpirun -np 4 python parallel_mesh_io_check.py
+   mpirun -np 4 python parallel_mesh_io_check.py split   (also check
+                                                         pre-split files)
+'''
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(True)
+
+from petram.mesh.parallel_mesh_io import load_parallel_mesh, split_mesh
+
+comm = MPI.COMM_WORLD
+myid = comm.rank
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+
+
+def summary(pmesh):
+    fec = mfem.ND_FECollection(1, pmesh.Dimension())
+    fes = mfem.ParFiniteElementSpace(pmesh, fec)
+
+    one = mfem.ConstantCoefficient(1.0)
+    fec0 = mfem.L2_FECollection(0, pmesh.Dimension())
+    fes0 = mfem.ParFiniteElementSpace(pmesh, fec0)
+    lf = mfem.ParLinearForm(fes0)
+    lf.AddDomainIntegrator(mfem.DomainLFIntegrator(one))
+    lf.Assemble()
+    vol = comm.allreduce(np.sum(lf.GetDataArray()))
+
+    attrs = np.bincount(pmesh.GetAttributeArray(), minlength=64)
+    battrs = np.bincount(pmesh.GetBdrAttributeArray(), minlength=256)
+    return (pmesh.GetGlobalNE(),
+            comm.allreduce(pmesh.GetNBE()),
+            pmesh.GetNE(),
+            fes.GlobalTrueVSize(),
+            tuple(comm.allreduce(attrs)),
+            tuple(comm.allreduce(battrs)),
+            np.round(vol, 10))
+
+
+for name in ['beam-tet.mesh', 'waveguide_hex.mesh']:
+    path = os.path.join(data_dir, name)
+
+    smesh = mfem.Mesh(path, 1, 1, True)
+    pmesh1 = mfem.ParMesh(comm, smesh)
+    del smesh
+    s1 = summary(pmesh1)
+
+    pmesh2 = load_parallel_mesh(comm, path)
+    if pmesh2 is None:
+        if myid == 0:
+            print(name + ": MeshPartitioner is not available")
+        continue
+    s2 = summary(pmesh2)
+
+    ok = comm.allreduce(int(s1 == s2), op=MPI.MIN)
+    if myid == 0:
+        print(name + " (root read/scatter): " + ("OK" if ok else "NG"))
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'split':
+        tmpdir = None
+        if myid == 0:
+            tmpdir = tempfile.mkdtemp()
+            shutil.copy(path, tmpdir)
+        tmpdir = comm.bcast(tmpdir)
+        path3 = os.path.join(tmpdir, name)
+        if myid == 0:
+            split_mesh(path3, comm.size)
+        comm.Barrier()
+        pmesh3 = load_parallel_mesh(comm, path3)
+        s3 = summary(pmesh3)
+        ok = comm.allreduce(int(s1 == s3), op=MPI.MIN)
+        if myid == 0:
+            print(name + " (pre-split files): " + ("OK" if ok else "NG"))
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,116 @@
+'''
+ time per PyMG cycle vs number of levels
+
+ H1 (order 1) Poisson problem on beam-tet.mesh. Finer levels are
+ made by uniform refinement.
+
+   python pymg_cycle_timing.py
+   python pymg_cycle_timing.py 4        (number of refinements)
+   mpirun -np 4 python pymg_cycle_timing.py -p
+'''
+import sys
+import os
+import time
+import numpy as np
+
+use_parallel = False
+nref = 3
+for param in sys.argv[1:]:
+    if param == '-p':
+        use_parallel = True
+    else:
+        nref = int(param)
+
+from petram.helper.load_mfem import load
+mfem, MPI = load(use_parallel)
+
+from petram.solver.ml_solver_model import PyMG
+
+myid = MPI.COMM_WORLD.rank if use_parallel else 0
+
+filename = os.path.join(os.path.dirname(__file__), '..', '..',
+                        'data', 'beam-tet.mesh')
+mesh = mfem.Mesh(filename)
+fec = mfem.H1_FECollection(1, mesh.Dimension())
+
+if use_parallel:
+    mesh = mfem.ParMesh(MPI.COMM_WORLD, mesh)
+    fes = mfem.ParFiniteElementSpace(mesh, fec)
+    hierarchy = mfem.ParFiniteElementSpaceHierarchy(mesh, fes, False, False)
+else:
+    fes = mfem.FiniteElementSpace(mesh, fec)
+    hierarchy = mfem.FiniteElementSpaceHierarchy(mesh, fes, False, False)
+
+for i in range(nref):
+    hierarchy.AddUniformRefinement(1, mfem.Ordering.byNODES)
+
+one = mfem.ConstantCoefficient(1.0)
+keep = []
+
+
+def level_system(lvl):
+    fes = hierarchy.GetFESpaceAtLevel(lvl)
+    m = fes.GetMesh()
+    ess_bdr = mfem.intArray([1]*m.bdr_attributes.Max())
+    ess_tdofs = mfem.intArray()
+    fes.GetEssentialTrueDofs(ess_bdr, ess_tdofs)
+
+    if use_parallel:
+        a = mfem.ParBilinearForm(fes)
+        A = mfem.HypreParMatrix()
+    else:
+        a = mfem.BilinearForm(fes)
+        A = mfem.SparseMatrix()
+    a.AddDomainIntegrator(mfem.DiffusionIntegrator(one))
+    a.Assemble()
+    a.FormSystemMatrix(ess_tdofs, A)
+    keep.append(a)
+    return A, np.array(ess_tdofs.ToList(), dtype=int)
+
+
+def smoother(A, coarse):
+    if coarse:
+        args = (MPI.COMM_WORLD,) if use_parallel else ()
+        s = mfem.CGSolver(*args)
+        s.SetRelTol(1e-12)
+        s.SetMaxIter(1000)
+        s.SetOperator(A)
+        return s
+    if use_parallel:
+        return mfem.HypreSmoother(A, mfem.HypreSmoother.l1GS)
+    return mfem.GSSmoother(A)
+
+
+systems = [level_system(l) for l in range(nref + 1)]
+
+for nlevels in range(2, nref + 2):
+    operators = [x[0] for x in systems[:nlevels]]
+    ess_tdofs = [x[1] for x in systems[:nlevels]]
+    smoothers = [smoother(A, l == 0) for l, A in enumerate(operators)]
+    prolongations = [hierarchy.GetProlongationAtLevel(l)
+                     for l in range(nlevels - 1)]
+    ones = {l: 1 for l in range(nlevels)}
+
+    mg = PyMG(operators, smoothers, prolongations,
+              ess_tdofs=ess_tdofs,
+              presmoother_count=ones,
+              postsmoother_count=ones,
+              cycle_max=ones)
+
+    n = operators[-1].Width()
+    b = mfem.Vector(n)
+    b.Assign(1.0)
+    b.GetDataArray()[ess_tdofs[-1]] = 0.0
+    x = mfem.Vector(n)
+
+    ncycle = 10
+    mg.Mult(b, x)   # warm up
+    t1 = time.perf_counter()
+    for i in range(ncycle):
+        mg.Mult(b, x)
+    t2 = time.perf_counter()
+
+    if myid == 0:
+        print("levels = " + str(nlevels) +
+              ", fine level size (local) = " + str(n) +
+              ", time per cycle = " + str((t2 - t1)/ncycle))